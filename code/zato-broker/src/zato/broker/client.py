@@ -12,9 +12,6 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import logging, time
 from traceback import format_exc
 
-# anyjson
-from anyjson import dumps, loads
-
 # Bunch
 from bunch import Bunch
 
@@ -32,6 +29,7 @@ from zato.common import BROKER, ZATO_NONE
 from zato.common.broker_message import KEYS, MESSAGE_TYPE, TOPICS
 from zato.common.kvdb import LuaContainer
 from zato.common.util import new_cid, spawn_greenlet
+from zato.common.util.json_ import dumps, loads
 
 logger = logging.getLogger(__name__)
 has_debug = logger.isEnabledFor(logging.DEBUG)
@@ -439,6 +439,9 @@ zato_services = {
     # Statistics
     'zato.stats.delete':'zato.server.service.internal.stats.Delete',
     'zato.stats.get-by-service':'zato.server.service.internal.stats.GetByService',
+    'zato.stats.latency.get-local':'zato.server.service.internal.stats.latency.GetLocal',
+    'zato.stats.latency.get-metrics':'zato.server.service.internal.stats.latency.GetMetrics',
+    'zato.stats.latency.get-summary':'zato.server.service.internal.stats.latency.GetSummary',
     'zato.stats.summary.get-summary-by-day':'zato.server.service.internal.stats.summary.GetSummaryByDay',
     'zato.stats.summary.get-summary-by-month':'zato.server.service.internal.stats.summary.GetSummaryByMonth',
     'zato.stats.summary.get-summary-by-range':'zato.server.service.internal.stats.summary.GetSummaryByRange',
@@ -597,6 +600,9 @@ class Create(ZatoCommand):
             elif name == 'zato.security.jwt.log-out':
                 self.add_jwt_log_out(session, cluster, service)
 
+            elif name == 'zato.stats.latency.get-metrics':
+                self.add_metrics(session, cluster, service, pubapi_sec)
+
             elif name == 'zato.ide-deploy.create':
                 self.add_rbac_channel(session, cluster, service, ide_pub_rbac_role, '/ide-deploy', permit_write=True,
                     data_format=DATA_FORMAT.JSON)
@@ -813,6 +819,15 @@ class Create(ZatoCommand):
         for perm in perms:
             session.add(RBACRolePermission(role=rbac_role, perm=perm, service=service, cluster=cluster))
 
+# ################################################################################################################################
+
+    def add_metrics(self, session, cluster, service, pubapi_sec):
+        """ Adds a channel through which monitoring tools can scrape live processing times of services.
+        """
+        channel = HTTPSOAP(None, 'zato.stats.metrics', True, True, 'channel', 'plain_http', None, '/zato/stats/metrics', None,
+            '', None, None, service=service, cluster=cluster, security=pubapi_sec)
+        session.add(channel)
+
 # ################################################################################################################################
 
     def add_check(self, session, cluster, service, pubapi_sec):
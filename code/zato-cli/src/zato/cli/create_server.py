@@ -130,15 +130,21 @@ return_tracebacks=True
 default_error_message="An error has occurred"
 startup_callable=
 return_json_schema_errors=False
+json_codec=stdlib # One of stdlib, rapidjson or orjson - the latter two are faster but optional
+service_instance_pool_size=16 # Per service, only for services that set recycle_instances to True
 
 [http]
 methods_allowed=GET, POST, DELETE, PUT, PATCH, HEAD, OPTIONS
+url_path_cache_size=10000
 
 [ibm_mq]
 ipc_tcp_start_port=34567
 
 [stats]
 expire_after=168 # In hours, 168 = 7 days = 1 week
+flush_interval=5 # In seconds, how often each server process writes out statistics it collected
+latency_window=60 # In seconds, how much of recent processing times live percentiles are computed from
+sample_buffer_size=1000 # How many sample requests/responses and slow responses each server process keeps until they are flushed
 
 [kvdb]
 host={{kvdb_host}}
@@ -270,6 +276,10 @@ allow_loopback=False
 [shmem]
 size=0.1 # In MB
 
+[cache]
+snapshot_enabled=False
+snapshot_dir=./cache/snapshot # Relative to hot_deploy.work_dir
+
 [os_environ]
 sample_key=sample_value
 
@@ -512,6 +512,7 @@ class CACHE:
         DELETE_NOT_CONTAINS = 'DELETE_NOT_CONTAINS'
         DELETE_CONTAINS_ALL = 'DELETE_CONTAINS_ALL'
         DELETE_CONTAINS_ANY = 'DELETE_CONTAINS_ANY'
+        DELETE_MANY = 'DELETE_MANY'
 
         EXPIRE = 'EXPIRE'
         EXPIRE_BY_PREFIX = 'EXPIRE_BY_PREFIX'
@@ -532,11 +533,14 @@ class CACHE:
         SET_NOT_CONTAINS = 'SET_NOT_CONTAINS'
         SET_CONTAINS_ALL = 'SET_CONTAINS_ALL'
         SET_CONTAINS_ANY = 'SET_CONTAINS_ANY'
+        SET_MANY = 'SET_MANY'
 
 
     class DEFAULT:
         MAX_SIZE = 10000
         MAX_ITEM_SIZE = 1000 # In characters for string/unicode, bytes otherwise
+        SYNC_BATCH_INTERVAL = 0.5 # In seconds
+        SYNC_BATCH_SIZE = 1000 # How many operations at most to publish in a single batch
 
     class PERSISTENT_STORAGE:
         NO_PERSISTENT_STORAGE = NameId('No persistent storage', 'no-persistent-storage')
@@ -548,9 +552,18 @@ class CACHE:
     class SYNC_METHOD:
         NO_SYNC = NameId('No synchronization', 'no-sync')
         IN_BACKGROUND = NameId('In background', 'in-background')
+        IN_BACKGROUND_BATCHED = NameId('In background, batched', 'in-background-batched')
+        INVALIDATE = NameId('Invalidate only', 'invalidate')
 
         def __iter__(self):
-            return iter((self.NO_SYNC, self.IN_BACKGROUND))
+            return iter((self.NO_SYNC, self.IN_BACKGROUND, self.IN_BACKGROUND_BATCHED, self.INVALIDATE))
+
+    class EVICTION_POLICY:
+        LRU = NameId('LRU', 'lru')
+        TINY_LFU = NameId('TinyLFU', 'tiny-lfu')
+
+        def __iter__(self):
+            return iter((self.LRU, self.TINY_LFU))
 
 # ################################################################################################################################
 # ################################################################################################################################
@@ -589,6 +602,8 @@ class KVDB(Attrs):
     SERVICE_TIME_BASIC = 'zato:stats:service:time:basic:'
     SERVICE_TIME_RAW = 'zato:stats:service:time:raw:'
     SERVICE_TIME_RAW_BY_MINUTE = 'zato:stats:service:time:raw-by-minute:'
+    SERVICE_TIME_HIST = 'zato:stats:service:time:hist:'
+    SERVICE_TIME_HIST_BY_MINUTE = 'zato:stats:service:time:hist-by-minute:'
     SERVICE_TIME_AGGREGATED_BY_MINUTE = 'zato:stats:service:time:aggr-by-minute:'
     SERVICE_TIME_AGGREGATED_BY_HOUR = 'zato:stats:service:time:aggr-by-hour:'
     SERVICE_TIME_AGGREGATED_BY_DAY = 'zato:stats:service:time:aggr-by-day:'
@@ -1917,6 +1932,7 @@ default_internal_modules = {
     'zato.server.service.internal.sso.user': True,
     'zato.server.service.internal.sso.user_attr': True,
     'zato.server.service.internal.stats': True,
+    'zato.server.service.internal.stats.latency': True,
     'zato.server.service.internal.stats.summary': True,
     'zato.server.service.internal.stats.trends': True,
     'zato.server.service.internal.updates': True,
@@ -484,6 +484,10 @@ class CACHE(Constants):
     MEMCACHED_EDIT = ValueConstant('')
     MEMCACHED_DELETE = ValueConstant('')
 
+    BUILTIN_STATE_CHANGED_BATCH = ValueConstant('')
+    BUILTIN_STATE_CHANGED_DELETE_MANY = ValueConstant('')
+    BUILTIN_STATE_CHANGED_SET_MANY = ValueConstant('')
+
 class SERVER_STATUS(Constants):
     code_start = 106800
 
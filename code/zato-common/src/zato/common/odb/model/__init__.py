@@ -915,6 +915,7 @@ class Cache(Base):
 
     def __init__(self):
         self.current_size = 0 # Not used by the DB
+        self.current_size_bytes = 0 # Not used by the DB
 
 # ################################################################################################################################
 
@@ -52,7 +52,7 @@ from traceback import format_exc
 from alembic import op
 
 # anyjson
-from anyjson import dumps, loads
+from anyjson import dumps
 
 # Bunch
 from bunch import Bunch, bunchify
@@ -119,6 +119,7 @@ from zato.common import CHANNEL, CLI_ARG_SEP, DATA_FORMAT, engine_def, engine_de
 from zato.common.broker_message import SERVICE
 from zato.common.crypto import CryptoManager
 from zato.common.odb.model import Cluster, HTTPBasicAuth, HTTPSOAP, IntervalBasedJob, Job, Server, Service
+from zato.common.util.json_ import loads as json_loads
 from zato.common.util.tcp import get_free_port, is_port_taken, wait_until_port_free, wait_until_port_taken
 
 # ################################################################################################################################
@@ -479,7 +480,7 @@ def get_body_payload(body):
 
 # ################################################################################################################################
 
-def payload_from_request(cid, request, data_format, transport):
+def payload_from_request(cid, request, data_format, transport, _json_loads=json_loads):
     """ Converts a raw request to a payload suitable for usage with SimpleIO.
     """
     if request is not None:
@@ -506,7 +507,7 @@ def payload_from_request(cid, request, data_format, transport):
             if isinstance(request, basestring) and data_format == DATA_FORMAT.JSON:
                 try:
                     request = request.decode('utf8') if isinstance(request, bytes) else request
-                    payload = loads(request)
+                    payload = _json_loads(request)
                 except ValueError:
                     logger.warn('Could not parse request as JSON:`{}`, e:`{}`'.format(request, format_exc()))
                     raise
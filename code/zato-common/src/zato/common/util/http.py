@@ -29,3 +29,45 @@ def get_proxy_config(config):
         return proxy_config
 
 # ################################################################################################################################
+
+# What an incoming request's cache key is built of unless a channel says otherwise
+default_cache_key_components = 'method, path, query, body'
+
+def parse_cache_key_components(spec, _default=default_cache_key_components):
+    """ Parses a comma-separated list of components that an HTTP channel's cache key is built of into a tuple
+    of (type, name) pairs. Each component is one of:
+      * method        - request's HTTP method
+      * path          - request's path
+      * query         - all of query string and path parameters
+      * query.<name>  - a single query string or path parameter
+      * header.<name> - a single HTTP header
+      * body          - request's body
+    An empty spec means the default components. Raises ValueError if spec contains anything else.
+    """
+    out = []
+
+    for component in (spec or _default).split(','):
+        component = component.strip()
+        if not component:
+            continue
+
+        component_type, _, name = component.partition('.')
+
+        if component_type in ('method', 'path', 'query', 'body') and not name:
+            out.append((component_type, None))
+
+        elif component_type == 'query' and name:
+            out.append((component_type, name))
+
+        elif component_type == 'header' and name:
+            out.append((component_type, 'HTTP_{}'.format(name.upper().replace('-', '_'))))
+
+        else:
+            raise ValueError('Invalid cache key component `{}`'.format(component))
+
+    if not out:
+        raise ValueError('No cache key components in `{}`'.format(spec))
+
+    return tuple(out)
+
+# ################################################################################################################################
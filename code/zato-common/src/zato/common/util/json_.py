@@ -10,13 +10,20 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 from datetime import datetime
-from json import dumps as json_dumps
+from json import dumps as json_dumps, loads as json_loads
+from logging import getLogger
+from math import isinf, isnan
+from traceback import format_exc
 
 # Python 2/3 compatibility
 from builtins import bytes
 
 # ################################################################################################################################
 
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+
 def default_json_handler(value):
     if isinstance(value, datetime):
         return value.isoformat()
@@ -26,7 +33,195 @@ def default_json_handler(value):
 
 # ################################################################################################################################
 
+# Integers that fast libraries can represent, i.e. signed 64-bit ones
+_int_min = -2 ** 63
+_int_max = 2 ** 63 - 1
+
+# Input is translated with this table so that all digits become 0 and everything else a space - if the result
+# contains a run of as many zeros as there are digits in the largest 64-bit integer, the input may contain
+# integers outside of the range above. Much faster than a regular expression looking for such runs.
+_digits_table = bytes(bytearray(48 if 48 <= idx <= 57 else 32 for idx in range(256)))
+_long_digits = b'0' * len(str(_int_max))
+
+_text_type = type('')
+_int_type = type(1)
+_float_type = type(1.0)
+_bool_type = type(True)
+
+def is_fast_path_safe(value):
+    """ Returns True if value contains only types that fast JSON libraries serialize exactly as the stdlib does,
+    i.e. dicts with string keys, lists, tuples, strings, booleans, None, finite floats and 64-bit integers.
+    Containers seen more than once, including ones that contain themselves, are left to the stdlib as well.
+    """
+    to_visit = [value]
+    visited = set()
+
+    while to_visit:
+        value = to_visit.pop()
+        value_type = type(value)
+
+        if value_type is _text_type or value_type is _bool_type or value is None:
+            continue
+
+        elif value_type is _int_type:
+            if not _int_min <= value <= _int_max:
+                return False
+
+        elif value_type is _float_type:
+            if isnan(value) or isinf(value):
+                return False
+
+        elif isinstance(value, (dict, list, tuple)) and id(value) in visited:
+            return False
+
+        elif isinstance(value, dict):
+            visited.add(id(value))
+            for key in value:
+                if type(key) is not _text_type:
+                    return False
+            to_visit.extend(value.values())
+
+        elif isinstance(value, (list, tuple)):
+            visited.add(id(value))
+            to_visit.extend(value)
+
+        else:
+            return False
+
+    return True
+
+# ################################################################################################################################
+
+class JSONCodec(object):
+    """ Serializes values to JSON and deserializes them using the stdlib's json module. Subclasses use faster libraries
+    but only for values that is_fast_path_safe accepts and for input without integers that may be larger than 64 bits,
+    falling back to the stdlib for everything else, including any error that their libraries raise.
+    Regardless of the library, dumps returns text rather than bytes and loads accepts both.
+    """
+    name = 'stdlib'
+
+    def dumps(self, value, _dumps=json_dumps, _default=default_json_handler):
+        return _dumps(value, default=_default)
+
+    def loads(self, value, _loads=json_loads, _bytes=bytes):
+        return _loads(value.decode('utf8') if isinstance(value, _bytes) else value)
+
+# ################################################################################################################################
+
+class _FastJSONCodec(JSONCodec):
+    """ A base class for codecs using libraries other than the stdlib. Libraries differ from the stdlib, and from each other,
+    in how they handle datetime objects, bytes, non-string keys, NaN or integers outside of the 64-bit range,
+    sometimes raising unexpected exceptions or returning invalid output, which is why such values never reach them.
+    """
+    def _fast_dumps(self, value):
+        raise NotImplementedError('Must be implemented by subclasses')
+
+    def _fast_loads(self, value):
+        raise NotImplementedError('Must be implemented by subclasses')
+
+    def dumps(self, value, _is_fast_path_safe=is_fast_path_safe):
+        if _is_fast_path_safe(value):
+            try:
+                return self._fast_dumps(value)
+            except Exception:
+                pass
+
+        return JSONCodec.dumps(self, value)
+
+    def loads(self, value, _bytes=bytes, _digits_table=_digits_table, _long_digits=_long_digits):
+
+        if isinstance(value, _bytes):
+            encoded = value
+            value = value.decode('utf8')
+        else:
+            encoded = value.encode('utf8', 'replace')
+
+        if _long_digits not in encoded.translate(_digits_table):
+            try:
+                return self._fast_loads(value)
+            except Exception:
+                pass
+
+        return JSONCodec.loads(self, value)
+
+# ################################################################################################################################
+
+class RapidJSONCodec(_FastJSONCodec):
+    """ Uses pyrapidjson.
+    """
+    name = 'rapidjson'
+
+    def __init__(self):
+
+        # pyrapidjson
+        from rapidjson import dumps, loads
+
+        self._fast_dumps = dumps
+        self._fast_loads = loads
+
+# ################################################################################################################################
+
+class ORJSONCodec(_FastJSONCodec):
+    """ Uses orjson, whose dumps returns bytes rather than text.
+    """
+    name = 'orjson'
+
+    def __init__(self):
+
+        # orjson
+        import orjson
+
+        self._orjson_dumps = orjson.dumps
+        self._fast_loads = orjson.loads
+
+    def _fast_dumps(self, value):
+        return self._orjson_dumps(value).decode('utf8')
+
+# ################################################################################################################################
+
+# All the codecs that the json_codec option in server.conf may point to
+json_codecs = {
+    JSONCodec.name: JSONCodec,
+    RapidJSONCodec.name: RapidJSONCodec,
+    ORJSONCodec.name: ORJSONCodec,
+}
+
+# ################################################################################################################################
+
+def get_json_codec(name):
+    """ Returns a new codec by its name, or the stdlib one if the library that the codec needs is not installed.
+    """
+    codec_class = json_codecs.get(name)
+
+    if not codec_class:
+        raise ValueError('Unknown JSON codec `{}`, expected one of {}'.format(name, sorted(json_codecs)))
+
+    try:
+        return codec_class()
+    except ImportError:
+        logger.warn('JSON codec `%s` could not be loaded, using `%s` instead, e:`%s`', name, JSONCodec.name, format_exc())
+        return JSONCodec()
+
+# ################################################################################################################################
+
+# The codec that dumps and loads use, replaced by servers when they start, depending on their configuration
+json_codec = JSONCodec()
+
+def set_json_codec(name):
+    """ Makes dumps and loads use the codec of that name and returns it.
+    """
+    global json_codec
+    json_codec = get_json_codec(name)
+    return json_codec
+
+# ################################################################################################################################
+
 def dumps(value):
-    return json_dumps(value, default=default_json_handler)
+    return json_codec.dumps(value)
+
+# ################################################################################################################################
+
+def loads(value):
+    return json_codec.loads(value)
 
 # ################################################################################################################################
@@ -16,6 +16,9 @@ import logging
 # Arrow
 import arrow
 
+# pytz
+from pytz import UTC
+
 # tzlocal
 from tzlocal import get_localzone
 
@@ -160,3 +163,51 @@ class TimeUtil(object):
             raise
 
 # ################################################################################################################################
+
+class LocalTimeCache(object):
+    """ Converts naive UTC datetime objects to local ones and formats both of them, computing the local UTC offset
+    and formatted strings once a second only. A local UTC offset cannot change in the middle of a second and the format
+    has no sub-second fields, so each datetime object within a second gives the same results as the first one did.
+    """
+    __slots__ = ('local_tz', 'dt_format', '_current')
+
+    def __init__(self, local_tz=local_tz, dt_format='%d/%b/%Y:%H:%M:%S %z'):
+        self.local_tz = local_tz
+        self.dt_format = dt_format
+
+        # A (second, UTC offset, local tzinfo, formatted) tuple, replaced as a whole so that it is never seen half-updated
+        self._current = (None, None, None, None)
+
+    def _get_current(self, utc_dt, _UTC=UTC):
+        current = self._current
+        second = utc_dt.replace(microsecond=0)
+
+        if second != current[0]:
+            local_dt = second.replace(tzinfo=_UTC).astimezone(self.local_tz)
+            current = self._current = (second, local_dt.utcoffset(), local_dt.tzinfo, None)
+
+        return current
+
+    def to_local(self, utc_dt):
+        """ Returns a timezone-aware local datetime object for a naive UTC one.
+        """
+        _, offset, tzinfo, _ = self._get_current(utc_dt)
+        return (utc_dt + offset).replace(tzinfo=tzinfo)
+
+    def format(self, utc_dt):
+        """ Returns a naive UTC datetime object and its local counterpart, both formatted using self.dt_format.
+        """
+        current = self._get_current(utc_dt)
+        formatted = current[3]
+
+        if formatted is None:
+            second, offset, tzinfo, _ = current
+            formatted = (second.strftime(self.dt_format), (second + offset).replace(tzinfo=tzinfo).strftime(self.dt_format))
+
+            # Another datetime object may have started a new second in the meantime
+            if self._current is current:
+                self._current = (second, offset, tzinfo, formatted)
+
+        return formatted
+
+# ################################################################################################################################
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from datetime import datetime, timedelta
+from timeit import default_timer
+
+# Zato
+from zato.common.util.json_ import get_json_codec, json_codecs
+
+# ################################################################################################################################
+
+# How many times to serialize and deserialize each payload
+total_ops = 10000
+
+# ################################################################################################################################
+
+def get_payloads():
+    """ Returns payloads similar to what servers serialize and deserialize, by name.
+    """
+    now = datetime(2019, 10, 27, 1, 2, 3, 456789)
+
+    # A request that a REST channel receives
+    request = {
+        'customer_id': 123456,
+        'name': 'Jane Doe',
+        'email': 'jane.doe@example.com',
+        'is_active': True,
+        'address': {'street': 'Main Street 1', 'city': 'Prague', 'country': 'CZ', 'postcode': '110 00'},
+        'tags': ['vip', 'newsletter', 'b2b'],
+    }
+
+    # A response with a list of elements produced by a service with SimpleIO
+    response = {'response': [{
+        'id': idx,
+        'name': 'item.{}'.format(idx),
+        'is_active': idx % 2 == 0,
+        'price': idx * 1.25,
+        'description': None,
+    } for idx in range(100)]}
+
+    # A publish/subscribe message, with datetime objects and bytes that default_json_handler serializes
+    pubsub = {
+        'pub_msg_id': 'zpsm7b5c2e1f0a9d8c7b6a5f4e3d2c1b0a',
+        'pub_correl_id': None,
+        'topic_name': '/customer/new',
+        'pub_time': now,
+        'expiration_time': now + timedelta(days=1),
+        'priority': 5,
+        'mime_type': 'application/json',
+        'data': b'{"customer_id": 123456, "name": "Jane Doe"}',
+        'has_gd': True,
+        'size': 43,
+    }
+
+    # A message that servers publish to each other through the broker
+    broker = {
+        'action': '100200',
+        'id': 123,
+        'name': 'crm.customer',
+        'is_active': True,
+        'url_path': '/api/customer/{id}',
+        'service_name': 'crm.customer.get',
+        'data_format': 'json',
+        'cid': 'zcd5a7b9c1e3f5a7b9c1e3f5a7',
+        'msg_type': '0001',
+    }
+
+    return {
+        'request': request,
+        'response': response,
+        'pubsub': pubsub,
+        'broker': broker,
+    }
+
+# ################################################################################################################################
+
+def run_bench(total_ops=total_ops):
+    """ Serializes and deserializes each payload total_ops times with each codec whose library is installed
+    and returns the number of operations a second, keyed by codec name, payload name and operation.
+    """
+    out = {}
+    payloads = get_payloads()
+
+    for name in sorted(json_codecs):
+        codec = get_json_codec(name)
+
+        # The library this codec needs is not installed
+        if codec.name != name:
+            continue
+
+        for payload_name, payload in sorted(payloads.items()):
+            serialized = codec.dumps(payload)
+
+            start = default_timer()
+            for _ in range(total_ops):
+                codec.dumps(payload)
+            out[name, payload_name, 'dumps'] = total_ops / (default_timer() - start)
+
+            start = default_timer()
+            for _ in range(total_ops):
+                codec.loads(serialized)
+            out[name, payload_name, 'loads'] = total_ops / (default_timer() - start)
+
+    return out
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+
+    for (name, payload_name, op), ops_per_second in sorted(run_bench().items()):
+        print('{:<10} {:<10} {:<6} ops/s:{:>10.0f}'.format(name, payload_name, op, ops_per_second))
+
+# ################################################################################################################################
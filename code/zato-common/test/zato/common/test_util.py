@@ -9,6 +9,7 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # stdlib
+from datetime import datetime, timedelta
 from unittest import TestCase
 from uuid import uuid4
 
@@ -18,11 +19,17 @@ from bunch import Bunch
 # lxml
 from lxml import etree
 
+# pytz
+from pytz import timezone, UTC
+
 # Zato
 from zato.common import ParsingException, soap_body_xpath, zato_path
 from zato.common import util
 from zato.common.py23_ import maxint
 from zato.common.test.tls_material import ca_cert
+from zato.common.util.http import parse_cache_key_components
+from zato.common.util.json_ import get_json_codec, is_fast_path_safe, json_codecs, JSONCodec
+from zato.common.util.time_ import LocalTimeCache
 
 # ################################################################################################################################
 
@@ -129,3 +136,117 @@ class TestAPIKeyUsername(TestCase):
         config = Bunch(username='x-aaa')
         util.update_apikey_username_to_channel(config)
         self.assertEquals(config.username, 'HTTP_X_AAA')
+
+# ################################################################################################################################
+
+class TestParseCacheKeyComponents(TestCase):
+
+    def test_default(self):
+        expected = (('method', None), ('path', None), ('query', None), ('body', None))
+        self.assertEqual(parse_cache_key_components(''), expected)
+        self.assertEqual(parse_cache_key_components(None), expected)
+
+    def test_selected(self):
+        self.assertEqual(parse_cache_key_components('method,path, query.customer_id ,header.X-Tenant-ID'), (
+            ('method', None), ('path', None), ('query', 'customer_id'), ('header', 'HTTP_X_TENANT_ID')))
+
+    def test_invalid(self):
+        for spec in 'body.abc', 'header', 'headers.X-A', ', ,':
+            self.assertRaises(ValueError, parse_cache_key_components, spec)
+
+# ################################################################################################################################
+
+class TestLocalTimeCache(TestCase):
+
+    def test_same_as_astimezone(self):
+        local_tz = timezone('Europe/Prague')
+        cache = LocalTimeCache(local_tz)
+
+        # Local time changes from CEST to CET at 01:00 UTC on that day
+        start = datetime(2019, 10, 27, 0, 59, 58)
+
+        for idx in range(40):
+            utc_dt = start + timedelta(milliseconds=idx * 101)
+            expected = utc_dt.replace(tzinfo=UTC).astimezone(local_tz)
+
+            local_dt = cache.to_local(utc_dt)
+            self.assertEqual(local_dt, expected)
+            self.assertEqual(local_dt.utcoffset(), expected.utcoffset())
+
+            self.assertEqual(cache.format(utc_dt), (utc_dt.strftime(cache.dt_format), expected.strftime(cache.dt_format)))
+
+# ################################################################################################################################
+
+class TestJSONCodec(TestCase):
+
+    def test_stdlib(self):
+        codec = get_json_codec('stdlib')
+        value = {'ts': datetime(2019, 10, 27, 1, 2, 3, 456), 'data': b'abc'}
+
+        self.assertEqual(codec.loads(codec.dumps(value)), {'ts': '2019-10-27T01:02:03.000456', 'data': 'abc'})
+        self.assertEqual(codec.loads(b'{"a": [1, 2.5, null, true]}'), {'a': [1, 2.5, None, True]})
+        self.assertRaises(TypeError, codec.dumps, object())
+        self.assertRaises(ValueError, codec.loads, '{"a":')
+
+    def test_same_as_stdlib(self):
+        stdlib = JSONCodec()
+        nan, inf = float('nan'), float('inf')
+
+        values = [
+            {'ts': datetime(2019, 10, 27, 1, 2, 3), 'data': b'abc', 1: 2 ** 70, 'text': 'zażółć', 'list': [None, 1.5]},
+            {True: 1, None: 2, 1.5: 3, 'min': -2 ** 63, 'max': 2 ** 63 - 1, 'over': 2 ** 64, 'under': -2 ** 63 - 1},
+            [nan, {'x': inf}, (1, 2), {'y': [-inf]}],
+            {'nested': [{'a': [1, {'b': 'zażółć', 'c': 0.1}]}], 'empty': [{}, [], '']},
+        ]
+
+        texts = [
+            '18446744073709551615',
+            '9223372036854775809',
+            '123456789012345678901',
+            '[9223372036854775807, -9223372036854775808, -9223372036854775809]',
+            '{"a": NaN, "b": Infinity, "c": 1e400}',
+            '{"id": "12345678901234567890", "price": 0.1}',
+        ]
+
+        for name in json_codecs:
+            codec = get_json_codec(name)
+
+            for value in values:
+                serialized = stdlib.dumps(value)
+
+                # Serialized again with the stdlib to compare NaN values, which are never equal to each other
+                expected = stdlib.dumps(stdlib.loads(serialized))
+                self.assertEqual(stdlib.dumps(codec.loads(codec.dumps(value))), expected, name)
+                self.assertEqual(stdlib.dumps(codec.loads(serialized.encode('utf8'))), expected, name)
+
+            for text in texts:
+                self.assertEqual(repr(codec.loads(text)), repr(stdlib.loads(text)), (name, text))
+
+            self.assertRaises(TypeError, codec.dumps, {'a': set([1, 2])})
+            self.assertRaises(TypeError, codec.dumps, [object()])
+            self.assertRaises(ValueError, codec.loads, '{"a":')
+
+    def test_is_fast_path_safe(self):
+        self.assertTrue(is_fast_path_safe({'a': [1, 2.5, None, True, 'b', (-2 ** 63, 2 ** 63 - 1)], 'c': {'d': {}}}))
+
+        for value in (datetime.utcnow(), b'abc', 2 ** 63, -2 ** 63 - 1, float('nan'), float('-inf'), {1: 2}, {None: 2},
+                set([1]), object()):
+            self.assertFalse(is_fast_path_safe({'a': [{'b': value}]}), value)
+
+    def test_circular_reference(self):
+        value = [1, 2]
+        value.append(value)
+        self.assertFalse(is_fast_path_safe(value))
+
+        value = {'a': {}}
+        value['a']['b'] = value
+        self.assertFalse(is_fast_path_safe(value))
+
+        # The same error as with the stdlib, whichever codec is used
+        for name in json_codecs:
+            self.assertRaises(ValueError, get_json_codec(name).dumps, value)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, get_json_codec, 'abc')
+
+# ################################################################################################################################
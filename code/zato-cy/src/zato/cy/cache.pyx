@@ -9,12 +9,18 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 # stdlib
 import inspect
 from base64 import b64decode
+from collections import OrderedDict
 from datetime import datetime
 from decimal import Decimal
 from email.utils import formatdate as stdlib_format_date
 from hashlib import sha256
+from heapq import heapify, heappop, heappush
 from json import dumps as json_dumps, JSONEncoder
 from logging import getLogger
+from mmap import ACCESS_READ, mmap
+from os import getpid, makedirs, rename
+from os.path import dirname, exists, getsize
+from struct import Struct
 from sys import getsizeof
 
 # Arrow
@@ -24,19 +30,22 @@ from arrow import Arrow
 from cpython.dict cimport PyDict_Contains, PyDict_DelItem, PyDict_GetItem, PyDict_Items, PyDict_Keys, PyDict_SetItem, \
     PyDict_Values
 from cpython.int cimport PyInt_AS_LONG,  PyInt_FromLong, PyInt_GetMax
-from cpython.list cimport PyList_GET_SIZE, PyList_Insert, PyList_SetSlice
+from cpython.mem cimport PyMem_Free, PyMem_Malloc
 from cpython.object cimport Py_EQ, PyObject, PyObject_RichCompareBool
-from cpython.sequence cimport PySequence_ITEM
 from libc.stdint cimport uint64_t
+from libc.string cimport memset
 from posix.time cimport timeval, timezone, gettimeofday
 
 # regex
 from regex import compile as re_compile
 
+# sortedcontainers
+from sortedcontainers import SortedList
+
 # Python 2/3 compatibility
-from builtins import bytes
+from builtins import bytes, chr
 from six import binary_type, integer_types, string_types, text_type
-from zato.common.py23_ import maxint
+from zato.common.py23_ import maxint, pickle_dumps, pickle_loads
 
 # Zato
 from zato.common import CACHE as _COMMON_CACHE
@@ -54,11 +63,39 @@ str_types = string_types + (text_type,)
 len_values = (binary_type,) + str_types
 key_types = len_values + integer_types
 
+# A default value for _get through which .get_many tells missing keys apart from ones with values that are None
+_missing = object()
+
+# A snapshot of a cache begins with a header of magic bytes and the number of entries that follow. Each entry is a header
+# of its expires_at, expiry and length of the pickled (key, value) tuple that follows it.
+snapshot_header = Struct(b'<8sQ')
+snapshot_entry_header = Struct(b'<ddI')
+
 # ################################################################################################################################
 
 class CACHE:
     DEFAULT_SIZE = _COMMON_CACHE.DEFAULT.MAX_SIZE
     MAX_ITEM_SIZE = _COMMON_CACHE.DEFAULT.MAX_ITEM_SIZE
+    MIN_RANKS_SIZE = 1024
+    MIN_EXPIRY_HEAP_SIZE = 1024
+    SNAPSHOT_MAGIC = b'ZATOCS01'
+    SNAPSHOT_BATCH_SIZE = 1000
+
+# ################################################################################################################################
+
+# Length of n-grams that keys are split into by KeyIndex to find keys containing substrings
+cdef int key_index_gram_size = 3
+
+# ################################################################################################################################
+
+cdef object get_canonical_value(object value):
+    """ Returns a canonical, serialized, representation of a value, e.g. if it is a dictionary then we want
+    the same representation of this dictionary no matter in which order internally the keys are stored
+    seeing as from our perspective there is no intrinsic order.
+    """
+    if not isinstance(value, str_types):
+        value = json_dumps(value, sort_keys=True, cls=_JSONEncoder)
+    return value if isinstance(value, bytes) else value.encode('utf8')
 
 # ################################################################################################################################
 
@@ -113,6 +150,9 @@ cdef class Entry:
         # Hashed in SHA256
         public str hash
 
+        # Approximate size of this entry in bytes - length of its serialized value plus the size of its key
+        public Py_ssize_t size
+
         # Non-float timestamps
         public object last_read_iso
         public object prev_read_iso
@@ -124,11 +164,22 @@ cdef class Entry:
         public object last_write_http
         public object prev_write_http
 
+        # Neighbours of this entry in the LRU list - towards the most and least recently used entries, respectively
+        Entry _prev
+        Entry _next
+
+        # Logical time of this entry's latest move to the head of the LRU list, used to compute its position in O(log n)
+        Py_ssize_t _stamp
+
+        # The expires_at value under which this entry was last pushed onto the expiry heap, 0.0 if it is not in the heap
+        double _heap_expires_at
+
     cpdef dict to_dict(self):
         return {
             'key': self.key,
             'value': self.value,
             'hash': self.hash,
+            'size': self.size,
 
             'expiry': self.expiry,
             'expires_at': self.expires_at,
@@ -153,24 +204,19 @@ cdef class Entry:
 
         }
 
-    cpdef set_metadata(self, bint log_details=False):
-        """ Configures metadata after set* operations.
+    cpdef set_metadata(self, bint log_details=False, object canonical_value=None):
+        """ Configures metadata after set* operations. If the caller already has a canonical representation
+        of the value, it can be given on input so as not to compute it again.
         """
         # Will contain the computed hash value
         h = sha256()
 
-        # Make sure that we hash a canonical representation of the object,
-        # e.g. if it is a dictionary then we want to hash the same representation
-        # of this dictionary no matter in which order internally the keys are stored
-        # seeing as from our perspective there is no intrinsic order.
-        if isinstance(self.value, str_types):
-            value = self.value
-        else:
-            value = json_dumps(self.value, sort_keys=True, cls=_JSONEncoder)
-        value = value if isinstance(value, bytes) else value.encode('utf8')
+        if canonical_value is None:
+            canonical_value = get_canonical_value(self.value)
 
-        h.update(value)
+        h.update(canonical_value)
         self.hash = h.hexdigest()
+        self.size = len(canonical_value) + getsizeof(self.key)
 
         # Timestamps in formats other than seconds since epoch
 
@@ -195,18 +241,326 @@ cdef class Entry:
 
 # ################################################################################################################################
 
+cdef class KeyIndex:
+    """ An optional index of string keys of a cache that lets bulk operations find keys by their prefixes, suffixes
+    or substrings without visiting all the keys in the cache. Must be accessed only with the cache's lock held.
+    """
+    cdef:
+
+        # All keys, sorted, so that keys with a common prefix are next to each other
+        object _keys
+
+        # All keys, each reversed, which lets suffixes be looked up the same way prefixes are
+        object _reversed_keys
+
+        # N-gram -> set of keys containing it
+        dict _grams
+
+    def __cinit__(self):
+        self._keys = SortedList()
+        self._reversed_keys = SortedList()
+        self._grams = {}
+
+# ################################################################################################################################
+
+    cdef inline set _get_key_grams(self, object key):
+        cdef Py_ssize_t idx
+        return set([key[idx:idx+key_index_gram_size] for idx in range(len(key) - key_index_gram_size + 1)])
+
+# ################################################################################################################################
+
+    cpdef add(self, object key):
+        """ Adds a new key to the index - non-string-like keys are ignored.
+        """
+        cdef object gram
+        cdef set gram_keys
+
+        if not isinstance(key, str_types):
+            return
+
+        self._keys.add(key)
+        self._reversed_keys.add(key[::-1])
+
+        for gram in self._get_key_grams(key):
+            gram_keys = self._grams.get(gram)
+            if gram_keys is None:
+                gram_keys = self._grams[gram] = set()
+            gram_keys.add(key)
+
+# ################################################################################################################################
+
+    cpdef remove(self, object key):
+        """ Removes a key from the index - non-string-like keys are ignored.
+        """
+        cdef object gram
+        cdef set gram_keys
+
+        if not isinstance(key, str_types):
+            return
+
+        self._keys.discard(key)
+        self._reversed_keys.discard(key[::-1])
+
+        for gram in self._get_key_grams(key):
+            gram_keys = self._grams[gram]
+            gram_keys.discard(key)
+            if not gram_keys:
+                del self._grams[gram]
+
+# ################################################################################################################################
+
+    cpdef clear(self):
+        self._keys.clear()
+        self._reversed_keys.clear()
+        self._grams.clear()
+
+# ################################################################################################################################
+
+    cdef list _find_by_prefix(self, object keys, object data, int limit):
+        """ Returns up to limit keys from a sorted list of keys that start with data. With limit equal to 0, all such keys
+        are returned.
+        """
+        cdef Py_ssize_t start = keys.bisect_left(data)
+        cdef Py_ssize_t stop
+        cdef object upper = data
+
+        # The first string greater than all the strings starting with data is data with its last character incremented,
+        # unless it's the maximum character already, in which case it's dropped and the previous one is looked at.
+        while upper and ord(upper[-1]) == 0x10ffff:
+            upper = upper[:-1]
+
+        if upper:
+            stop = keys.bisect_left(upper[:-1] + chr(ord(upper[-1]) + 1))
+        else:
+            stop = len(keys)
+
+        if limit and stop - start > limit:
+            stop = start + limit
+
+        return keys[start:stop]
+
+# ################################################################################################################################
+
+    cpdef list by_prefix(self, object data, int limit):
+        """ Returns up to limit keys starting with data, or all of such keys if limit is 0.
+        """
+        return self._find_by_prefix(self._keys, data, limit)
+
+# ################################################################################################################################
+
+    cpdef list by_suffix(self, object data, int limit):
+        """ Returns up to limit keys ending with data, or all of such keys if limit is 0.
+        """
+        return [key[::-1] for key in self._find_by_prefix(self._reversed_keys, data[::-1], limit)]
+
+# ################################################################################################################################
+
+    cdef set _get_candidates(self, object data):
+        """ Returns keys that may contain data, based on n-grams that data consists of, or None if data is too short
+        to be looked up by its n-grams.
+        """
+        cdef set out = None
+        cdef set gram_keys
+        cdef list grams_keys = []
+
+        if len(data) < key_index_gram_size:
+            return None
+
+        for gram in self._get_key_grams(data):
+            gram_keys = self._grams.get(gram)
+
+            # If no key contains this n-gram, no key can contain data either
+            if gram_keys is None:
+                return set()
+
+            grams_keys.append(gram_keys)
+
+        # Start from the smallest set to keep the intersection as cheap as possible
+        grams_keys.sort(key=len)
+
+        for gram_keys in grams_keys:
+            out = gram_keys.copy() if out is None else out.intersection(gram_keys)
+            if not out:
+                break
+
+        return out
+
+# ################################################################################################################################
+
+    cpdef list contains(self, object data, int limit):
+        """ Returns up to limit keys containing data, or all of such keys if limit is 0. Returns None if data
+        is too short for the index to be used, in which case callers need to visit all keys on their own.
+        """
+        return self.contains_all([data], limit)
+
+# ################################################################################################################################
+
+    cpdef list contains_all(self, object data, int limit):
+        """ Returns up to limit keys containing all elements of data, or all of such keys if limit is 0. Returns None
+        if none of elements is long enough for the index to be used.
+        """
+        cdef list out = []
+        cdef set candidates = None
+        cdef set elem_candidates
+
+        for elem in data:
+            elem_candidates = self._get_candidates(elem)
+            if elem_candidates is not None:
+                candidates = elem_candidates if candidates is None else candidates.intersection(elem_candidates)
+
+        if candidates is None:
+            return None
+
+        for key in sorted(candidates):
+            for elem in data:
+                if elem not in key:
+                    break
+            else:
+                out.append(key)
+                if len(out) == limit:
+                    break
+
+        return out
+
+# ################################################################################################################################
+
+    cpdef list contains_any(self, object data, int limit):
+        """ Returns up to limit keys containing at least one of elements of data, or all of such keys if limit is 0.
+        Returns None if any of elements is too short for the index to be used.
+        """
+        cdef list out = []
+        cdef set candidates = set()
+        cdef set elem_candidates
+
+        for elem in data:
+            elem_candidates = self._get_candidates(elem)
+            if elem_candidates is None:
+                return None
+            candidates.update(elem_candidates)
+
+        for key in sorted(candidates):
+            for elem in data:
+                if elem in key:
+                    out.append(key)
+                    break
+
+            if len(out) == limit:
+                break
+
+        return out
+
+# ################################################################################################################################
+
+# How many rows of counters a frequency sketch has, how many counters there are at least in each row
+# and how many more counters there are in each row than entries in cache.
+cdef int sketch_depth = 4
+cdef Py_ssize_t sketch_min_width = 16
+cdef Py_ssize_t sketch_width_factor = 2
+
+# Counters saturate at this value
+cdef int sketch_max_count = 15
+
+# All counters are halved after this many times the sketch's capacity accesses were recorded
+cdef Py_ssize_t sketch_sample_factor = 10
+
+# Seeds for each row of a frequency sketch, odd 64-bit constants with bits well mixed
+cdef uint64_t sketch_seeds[4]
+sketch_seeds[:] = [0x9E3779B97F4A7C15ULL, 0xC2B2AE3D27D4EB4FULL, 0x165667B19E3779F9ULL, 0xD6E8FEB86659FD93ULL]
+
+cdef class FrequencySketch:
+    """ A count-min sketch which approximates how often each key was accessed recently. Counters saturate at a small value
+    and all of them are halved periodically so that keys that were popular long ago give way to ones that are popular now.
+    """
+    cdef:
+        unsigned char *_table
+        Py_ssize_t _width
+        uint64_t _mask
+        public Py_ssize_t sample_size
+        public Py_ssize_t additions
+
+    def __cinit__(self, Py_ssize_t capacity):
+        cdef Py_ssize_t width = sketch_min_width
+
+        while width < capacity * sketch_width_factor:
+            width <<= 1
+
+        self._width = width
+        self._mask = width - 1
+        self.sample_size = max(capacity, 1) * sketch_sample_factor
+        self.additions = 0
+
+        self._table = <unsigned char *>PyMem_Malloc(width * sketch_depth)
+        if not self._table:
+            raise MemoryError()
+        memset(self._table, 0, width * sketch_depth)
+
+    def __dealloc__(self):
+        PyMem_Free(self._table)
+
+    cdef inline Py_ssize_t _index(self, uint64_t key_hash, int row):
+        cdef uint64_t idx = key_hash * sketch_seeds[row]
+        idx ^= idx >> 32
+        return row * self._width + <Py_ssize_t>(idx & self._mask)
+
+    cpdef int frequency(self, object key):
+        """ Returns the estimated number of times a given key was accessed recently.
+        """
+        cdef uint64_t key_hash = <uint64_t><Py_ssize_t>hash(key)
+        cdef int out = sketch_max_count
+        cdef int row
+
+        for row in range(sketch_depth):
+            out = min(out, self._table[self._index(key_hash, row)])
+
+        return out
+
+    cpdef increment(self, object key):
+        """ Records an access to a given key, halving all counters once enough of them have been recorded.
+        """
+        cdef uint64_t key_hash = <uint64_t><Py_ssize_t>hash(key)
+        cdef bint added = False
+        cdef Py_ssize_t idx
+        cdef int row
+
+        for row in range(sketch_depth):
+            idx = self._index(key_hash, row)
+            if self._table[idx] < sketch_max_count:
+                self._table[idx] += 1
+                added = True
+
+        if added:
+            self.additions += 1
+            if self.additions >= self.sample_size:
+                self._reset()
+
+    cdef _reset(self):
+        cdef Py_ssize_t idx
+
+        for idx in range(self._width * sketch_depth):
+            self._table[idx] >>= 1
+
+        self.additions //= 2
+
+    cpdef clear(self):
+        memset(self._table, 0, self._width * sketch_depth)
+        self.additions = 0
+
+# ################################################################################################################################
+
 cdef class Cache(object):
     """ An LRU cache that optionally rejects entries bigger than N bytes. Entries can have a TTL assigned - periodic processes
-    will clean up entries older than allowed.
+    will clean up entries older than allowed. Optionally, new keys are admitted to a full cache using TinyLFU.
     """
     cdef:
         public long max_size
         public long max_item_size
         public bint has_max_item_size
+        public long max_bytes           # Total size of all entries, in bytes, or 0 if there is no such limit
+        public bint has_max_bytes
+        public Py_ssize_t current_bytes # Current total size of all entries, in bytes
         public bint extend_expiry_on_get
         public bint extend_expiry_on_set
         public dict _data
-        public list _index
         public uint64_t misses
         public uint64_t hits
         public uint64_t set_ops
@@ -217,9 +571,40 @@ cdef class Cache(object):
         public object default_get # A singleton indicating that no default value was given for self.get
         public dict _regex_cache
 
+        # An optional index of keys used by bulk operations, None unless needs_key_index is True
+        public bint needs_key_index
+        public KeyIndex _key_index
+
+        # With the TinyLFU eviction policy, a new key is admitted to a full cache only if it was accessed more often
+        # than the least recently used entry that would have to be evicted to make room for it.
+        public object eviction_policy
+        public bint use_tinylfu
+        public FrequencySketch _sketch
+        public uint64_t rejected
+
+        # Keys that a plain LRU cache of the same size would have, along with its hits and misses, kept for comparison
+        # with TinyLFU only.
+        public object _lru_keys
+        public uint64_t lru_hits
+        public uint64_t lru_misses
+
+        # Head (most recently used) and tail (least recently used) of the LRU list of entries
+        Entry _head
+        Entry _tail
+
+        # A Fenwick tree over entry stamps, each live entry contributes 1 under its own stamp. This lets us compute
+        # the position of any entry in the LRU list without walking the list itself.
+        Py_ssize_t *_ranks
+        Py_ssize_t _ranks_size
+        Py_ssize_t _last_stamp
+
+        # A min-heap of (expires_at, sequence, entry) tuples for entries that have an expiry set. Entries whose expires_at
+        # was extended after they had been pushed are rescheduled lazily, when they reach the top of the heap.
+        list _expiry_heap
+        uint64_t _expiry_seq
+
     def __cinit__(self):
         self._data = {}
-        self._index = []
         self.hits_per_position = {}
         self._expired_on_op = []
         self.hits = 0
@@ -227,24 +612,87 @@ cdef class Cache(object):
         self.set_ops = 0
         self.get_ops = 0
         self._regex_cache = {}
-
-    def __init__(self, max_size=None, max_item_size=None, extend_expiry_on_get=True, extend_expiry_on_set=True, lock=None):
+        self._key_index = None
+        self._sketch = None
+        self._lru_keys = None
+        self.rejected = 0
+        self.lru_hits = 0
+        self.lru_misses = 0
+        self._head = None
+        self._tail = None
+        self._ranks = NULL
+        self._ranks_size = 0
+        self._last_stamp = 0
+        self._resize_ranks(CACHE.MIN_RANKS_SIZE)
+        self._expiry_heap = []
+        self._expiry_seq = 0
+        self.current_bytes = 0
+
+    def __dealloc__(self):
+        PyMem_Free(self._ranks)
+
+    def __init__(self, max_size=None, max_item_size=None, extend_expiry_on_get=True, extend_expiry_on_set=True, lock=None,
+        needs_key_index=False, max_bytes=0, eviction_policy=None):
         self._lock = lock or RLock()
         self.default_get = object()
         with self._lock:
-            self._update_config(max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set)
+            self._update_config(max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set, needs_key_index,
+                max_bytes, eviction_policy)
 
-    def _update_config(self, max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set):
+    def _update_config(self, max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set, needs_key_index,
+        max_bytes, eviction_policy=None):
         self.max_size = max_size or CACHE.DEFAULT_SIZE
         self.max_item_size = max_item_size or CACHE.MAX_ITEM_SIZE
         self.has_max_item_size = self.max_item_size > 0
+        self.max_bytes = max_bytes or 0
+        self.has_max_bytes = self.max_bytes > 0
         self.extend_expiry_on_get = extend_expiry_on_get
         self.extend_expiry_on_set = extend_expiry_on_set
         self.hits_per_position.update(dict((key, 0) for key in xrange(self.max_size)))
+        self._set_key_index(needs_key_index)
+        self._set_eviction_policy(eviction_policy)
+
+        # The budget may have been just lowered
+        if self.has_max_bytes:
+            self._evict_to_max_bytes(None)
 
     def update_config(self, config):
         with self._lock:
-            self._update_config(config.max_size, config.max_item_size, config.extend_expiry_on_get, config.extend_expiry_on_set)
+            self._update_config(config.max_size, config.max_item_size, config.extend_expiry_on_get, config.extend_expiry_on_set,
+                config.get('needs_key_index', False), config.get('max_bytes', 0), config.get('eviction_policy'))
+
+    cdef _set_key_index(self, bint needs_key_index):
+        """ Builds or drops the index of keys, depending on whether it is needed or not. Must be called with self._lock held.
+        """
+        self.needs_key_index = needs_key_index
+
+        if needs_key_index:
+            if self._key_index is None:
+                self._key_index = KeyIndex()
+                for key in self._data:
+                    self._key_index.add(key)
+        else:
+            self._key_index = None
+
+    cdef _set_eviction_policy(self, object eviction_policy):
+        """ Sets up structures needed by the eviction policy given on input, or by the default one if it is None.
+        Must be called with self._lock held.
+        """
+        self.eviction_policy = eviction_policy or _COMMON_CACHE.EVICTION_POLICY.LRU.id
+        self.use_tinylfu = self.eviction_policy == _COMMON_CACHE.EVICTION_POLICY.TINY_LFU.id
+
+        if self.use_tinylfu:
+
+            # Frequencies are kept for more keys than there are in cache, including the ones that are not admitted,
+            # which is why the sketch is only rebuilt if it turns out to be too small.
+            if self._sketch is None or self._sketch.sample_size < self.max_size * sketch_sample_factor:
+                self._sketch = FrequencySketch(self.max_size)
+                self._lru_keys = OrderedDict((key, None) for key in self._keys_by_position()[::-1])
+                self.lru_hits = self.hits
+                self.lru_misses = self.misses
+        else:
+            self._sketch = None
+            self._lru_keys = None
 
 # ################################################################################################################################
 
@@ -273,7 +721,7 @@ cdef class Cache(object):
 
     def __len__(self):
         with self._lock:
-            return PyList_GET_SIZE(self._index)
+            return len(self._data)
 
 # ################################################################################################################################
 
@@ -291,7 +739,7 @@ cdef class Cache(object):
 
     cpdef list keys_by_position(self):
         with self._lock:
-            return list(self._index)
+            return self._keys_by_position()
 
 # ################################################################################################################################
 
@@ -321,7 +769,7 @@ cdef class Cache(object):
 
     def get_slice(self, start, stop, step):
         with self._lock:
-            for key in self._index[start:stop:step]:
+            for key in self._keys_by_position()[start:stop:step]:
                 entry = self._data[key]
                 as_dict = entry.to_dict()
                 as_dict['position'] = self._get_index(key)
@@ -332,16 +780,46 @@ cdef class Cache(object):
     cpdef list clear(self):
         """ Clears the cache - removes all entries and associated metadata.
         """
+        cdef Entry entry
+        cdef Entry next_entry
+
         # The attributes cleared below must be kept in sync with the ones from __cinit__.
         with self._lock:
+
+            # Break links between entries so they can be released immediately, without waiting for the cyclic GC
+            entry = self._head
+            while entry is not None:
+                next_entry = entry._next
+                entry._prev = None
+                entry._next = None
+                entry = next_entry
+
+            self._head = None
+            self._tail = None
+            self._last_stamp = 0
+            memset(self._ranks, 0, (self._ranks_size + 1) * sizeof(Py_ssize_t))
+
+            self._expiry_heap[:] = []
+            self._expiry_seq = 0
+            self.current_bytes = 0
+
             self._data.clear()
-            self._index[:] = []
             self.hits_per_position.clear()
+
+            if self._key_index is not None:
+                self._key_index.clear()
             self._expired_on_op[:] = []
             self.hits = 0
             self.misses = 0
             self.set_ops = 0
             self.get_ops = 0
+            self.rejected = 0
+            self.lru_hits = 0
+            self.lru_misses = 0
+
+            if self.use_tinylfu:
+                self._sketch.clear()
+                self._lru_keys.clear()
 
 # ################################################################################################################################
 
@@ -353,10 +831,17 @@ cdef class Cache(object):
             return
         else:
             # We run under self.lock so at this point we know that the key was valid
-            # and _remove_from_index_by_idx is safe to call.
+            # and _lru_unlink is safe to call.
             out = entry.value
             del self._data[key]
-            self._remove_from_index_by_idx(self._get_index(key))
+            self._lru_unlink(entry)
+            self.current_bytes -= entry.size
+
+            if self._key_index is not None:
+                self._key_index.remove(key)
+
+            if self.use_tinylfu:
+                self._lru_keys.pop(key, None)
 
             return out
 
@@ -368,6 +853,30 @@ cdef class Cache(object):
 
     __del__ = delete
 
+# ################################################################################################################################
+
+    cpdef dict delete_many(self, object keys, bint return_found, dict meta_ref=None):
+        """ Deletes all of the input keys under a single acquisition of the lock. Optionally, returns a dict of keys
+        that were found along with their previous values. If meta_ref is given, its 'keys' list will contain
+        all the keys that were actually deleted.
+        """
+        cdef object key
+        cdef dict out = {}
+        cdef list deleted = []
+
+        with self._lock:
+            for key in keys:
+                if PyDict_Contains(self._data, key):
+                    if return_found:
+                        out[key] = (<Entry>self._data[key]).value
+                    self._delete(key)
+                    deleted.append(key)
+
+        if meta_ref is not None:
+            meta_ref['keys'] = deleted
+
+        return out
+
 # ################################################################################################################################
 
     cpdef dict delete_by_prefix(self, object data, bint return_found, int limit):
@@ -381,15 +890,10 @@ cdef class Cache(object):
         cdef list to_delete = []
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-                if idx == limit:
-                    break
+            for key in self._find_by_prefix(data, limit):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                to_delete.append(key)
 
         # We could not do in the loop above because that would have changed self._data
         # and result in 'RuntimeError: dictionary changed size during iteration'.
@@ -411,15 +915,10 @@ cdef class Cache(object):
         cdef list to_delete = []
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-                if idx == limit:
-                    break
+            for key in self._find_by_suffix(data, limit):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                to_delete.append(key)
 
         # We could not do in the loop above because that would have changed self._data
         # and result in 'RuntimeError: dictionary changed size during iteration'.
@@ -472,15 +971,10 @@ cdef class Cache(object):
         cdef list to_delete = []
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if data in key:
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-                if idx == limit:
-                    break
+            for key in self._find_contains(data, limit):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                to_delete.append(key)
 
         # We could not do in the loop above because that would have changed self._data
         # and result in 'RuntimeError: dictionary changed size during iteration'.
@@ -530,26 +1024,12 @@ cdef class Cache(object):
         cdef dict out = {}
         cdef object value = None
         cdef list to_delete = []
-        cdef bint add_key
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-
-                use_key = True
-                for elem in data:
-                    if elem not in key:
-                        use_key = False
-                        break
-
-                if use_key:
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-
-                if idx == limit:
-                    break
+            for key in self._find_contains_all(data, limit):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                to_delete.append(key)
 
         # We could not do in the loop above because that would have changed self._data
         # and result in 'RuntimeError: dictionary changed size during iteration'.
@@ -570,26 +1050,12 @@ cdef class Cache(object):
         cdef dict out = {}
         cdef object value = None
         cdef list to_delete = []
-        cdef bint use_key
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-
-                use_key = False
-                for elem in data:
-                    if elem in key:
-                        use_key = True
-                        break
-
-                if use_key:
-                    if return_found:
-                        out[key] = <Entry>self._data[key].value
-                    to_delete.append(key)
-
-                if idx == limit:
-                    break
+            for key in self._find_contains_any(data, limit):
+                if return_found:
+                    out[key] = <Entry>self._data[key].value
+                to_delete.append(key)
 
         # We could not do in the loop above because that would have changed self._data
         # and result in 'RuntimeError: dictionary changed size during iteration'.
@@ -600,77 +1066,381 @@ cdef class Cache(object):
 
 # ################################################################################################################################
 
-    cdef inline long _get_index(self, object key):
-        """ C-only version of self.get_position that will always return a long - must be called only
-        if key is known to be in self._index or self._data and only with self._lock held.
+    cdef list _find_by_prefix(self, object data, int limit):
+        """ Returns keys starting with data. Must be called with self._lock held.
         """
-        cdef Py_ssize_t index_idx = 0
-        cdef Py_ssize_t cache_size = PyList_GET_SIZE(self._index)
-        cdef bint index_key_eq
+        cdef list out = []
 
-        while index_idx < cache_size:
-            if PyObject_RichCompareBool(PySequence_ITEM(self._index, index_idx), <object>key, Py_EQ):
-                return index_idx
-            index_idx += 1
+        if self._key_index is not None:
+            return self._key_index.by_prefix(data, limit)
 
-# ################################################################################################################################
+        for idx, key in enumerate(self._data.iterkeys(), 1):
+            if not isinstance(key, str_types):
+                continue
+            if key.startswith(data):
+                out.append(key)
+            if idx == limit:
+                break
 
-    cpdef object index(self, object key):
-        """ Returns position the key given on input currently holds or None if key is not found.
-        """
-        with self._lock:
-            if PyDict_Contains(self._data, key):
-                return self._get_index(key)
+        return out
 
 # ################################################################################################################################
 
-    cdef inline object _remove_from_index_by_idx(self, long idx):
-        """ Remove object from from index by its position - this is what listremove in Objects/listobject.c does
-        and we use the same technique because there is no public PyList_Remove function. Returns the removed key.
+    cdef list _find_by_suffix(self, object data, int limit):
+        """ Returns keys ending with data. Must be called with self._lock held.
         """
-        cdef object index_key = PySequence_ITEM(self._index, idx)
-        PyList_SetSlice(self._index, idx, idx+1, <object>NULL)
+        cdef list out = []
+
+        if self._key_index is not None:
+            return self._key_index.by_suffix(data, limit)
 
-        return index_key
+        for idx, key in enumerate(self._data.iterkeys(), 1):
+            if not isinstance(key, str_types):
+                continue
+            if key.endswith(data):
+                out.append(key)
+            if idx == limit:
+                break
+
+        return out
 
 # ################################################################################################################################
 
-    cdef inline double _get_timestamp(self):
-        """ Uses gettimeofday(2) to return current timestamp as double with microseconds precision.
+    cdef list _find_contains(self, object data, int limit):
+        """ Returns keys containing data. Must be called with self._lock held.
         """
-        cdef timeval tv
-        cdef timezone tz
+        cdef list out = None
 
-        gettimeofday(&tv, &tz)
-        return tv.tv_sec + tv.tv_usec / 1.0e6
+        if self._key_index is not None:
+            out = self._key_index.contains(data, limit)
 
-# ################################################################################################################################
+        # Either there is no index or data was too short for it to be used
+        if out is None:
+            out = []
+            for idx, key in enumerate(self._data.iterkeys(), 1):
+                if not isinstance(key, str_types):
+                    continue
+                if data in key:
+                    out.append(key)
+                if idx == limit:
+                    break
 
-    cpdef double get_timestamp(self):
-        return self._get_timestamp()
+        return out
 
 # ################################################################################################################################
 
-    cdef object _set(self, object key, value, expiry, bint details, dict meta_ref, object orig_now=None,
-        _getsizeof=getsizeof, _key_types=key_types, _len_values=len_values):
+    cdef list _find_contains_all(self, object data, int limit):
+        """ Returns keys containing all elements of data. Must be called with self._lock held.
+        """
+        cdef list out = None
+        cdef bint use_key
 
-        cdef object out = None
-        cdef Entry entry
-        cdef double _now
-        cdef double _orig_now = 0.0
-        cdef Py_ssize_t cache_size = PyList_GET_SIZE(self._index)
-        cdef Py_ssize_t index_idx
-        cdef bint old_key_eq
-        cdef long hits_per_position
-        cdef long len_value
+        if self._key_index is not None:
+            out = self._key_index.contains_all(data, limit)
 
-        # If multiple processes synchronize contents of their caches, the one that originally added the keys
-        # will dictate what the actual, original key addition timestamp was. Otherwise, we are this first
-        # process so we generate the timestamp ourselves.
-        if orig_now:
-            _now = orig_now
+        # Either there is no index or all elements of data were too short for it to be used
+        if out is None:
+            out = []
+            for idx, key in enumerate(self._data.iterkeys(), 1):
+                if not isinstance(key, str_types):
+                    continue
+
+                use_key = True
+                for elem in data:
+                    if elem not in key:
+                        use_key = False
+                        break
+
+                if use_key:
+                    out.append(key)
+
+                if idx == limit:
+                    break
+
+        return out
+
+# ################################################################################################################################
+
+    cdef list _find_contains_any(self, object data, int limit):
+        """ Returns keys containing at least one of elements of data. Must be called with self._lock held.
+        """
+        cdef list out = None
+        cdef bint use_key
+
+        if self._key_index is not None:
+            out = self._key_index.contains_any(data, limit)
+
+        # Either there is no index or at least one of elements of data was too short for it to be used
+        if out is None:
+            out = []
+            for idx, key in enumerate(self._data.iterkeys(), 1):
+                if not isinstance(key, str_types):
+                    continue
+
+                use_key = False
+                for elem in data:
+                    if elem in key:
+                        use_key = True
+                        break
+
+                if use_key:
+                    out.append(key)
+
+                if idx == limit:
+                    break
+
+        return out
+
+# ################################################################################################################################
+
+    cdef inline long _get_index(self, object key):
+        """ C-only version of self.get_position that will always return a long - must be called only
+        if key is known to be in self._data and only with self._lock held.
+        """
+        return self._lru_position(<Entry>PyDict_GetItem(self._data, key))
+
+# ################################################################################################################################
+
+    cpdef object index(self, object key):
+        """ Returns position the key given on input currently holds or None if key is not found.
+        """
+        with self._lock:
+            if PyDict_Contains(self._data, key):
+                return self._get_index(key)
+
+# ################################################################################################################################
+
+    cdef list _keys_by_position(self):
+        """ Returns all keys ordered from the most to the least recently used one. Must be called with self._lock held.
+        """
+        cdef list out = []
+        cdef Entry entry = self._head
+
+        while entry is not None:
+            out.append(entry.key)
+            entry = entry._next
+
+        return out
+
+# ################################################################################################################################
+
+    cdef _resize_ranks(self, Py_ssize_t ranks_size):
+        """ Allocates a new, empty, Fenwick tree big enough to hold ranks_size stamps. Callers are responsible
+        for populating it again.
+        """
+        cdef Py_ssize_t *ranks = <Py_ssize_t *>PyMem_Malloc((ranks_size + 1) * sizeof(Py_ssize_t))
+
+        if not ranks:
+            raise MemoryError()
+
+        memset(ranks, 0, (ranks_size + 1) * sizeof(Py_ssize_t))
+
+        PyMem_Free(self._ranks)
+        self._ranks = ranks
+        self._ranks_size = ranks_size
+
+# ################################################################################################################################
+
+    cdef inline void _ranks_add(self, Py_ssize_t stamp, Py_ssize_t delta):
+        """ Adds delta to the Fenwick tree under a given stamp.
+        """
+        while stamp <= self._ranks_size:
+            self._ranks[stamp] += delta
+            stamp += stamp & -stamp
+
+# ################################################################################################################################
+
+    cdef inline Py_ssize_t _ranks_sum(self, Py_ssize_t stamp):
+        """ Returns the number of live entries whose stamps are lower than or equal to the one given on input.
+        """
+        cdef Py_ssize_t out = 0
+
+        while stamp > 0:
+            out += self._ranks[stamp]
+            stamp -= stamp & -stamp
+
+        return out
+
+# ################################################################################################################################
+
+    cdef _compact_stamps(self):
+        """ Renumbers stamps of all entries, from the least to the most recently used one, so that they are again
+        contiguous, and rebuilds the Fenwick tree accordingly, growing it if needed. Each call is O(n) but it is
+        needed only after at least n other operations, which keeps the amortized cost of each operation constant.
+        """
+        cdef Entry entry
+        cdef Py_ssize_t stamp
+        cdef Py_ssize_t parent
+        cdef Py_ssize_t linked = 0
+
+        # Always leave at least as much room for new stamps as there are entries already
+        if len(self._data) * 2 > self._ranks_size:
+            self._resize_ranks(len(self._data) * 2)
         else:
-            _orig_now = _now = self._get_timestamp()
+            memset(self._ranks, 0, (self._ranks_size + 1) * sizeof(Py_ssize_t))
+
+        # Note that we cannot rely on len(self._data) below because the entry that our caller is about to link
+        # may already be in self._data without being in the LRU list yet.
+        entry = self._tail
+        while entry is not None:
+            linked += 1
+            entry._stamp = linked
+            entry = entry._prev
+
+        # Build the tree in linear time - each node contributes its own count to its parent
+        for stamp in range(1, linked + 1):
+            self._ranks[stamp] += 1
+            parent = stamp + (stamp & -stamp)
+            if parent <= self._ranks_size:
+                self._ranks[parent] += self._ranks[stamp]
+
+        self._last_stamp = linked
+
+# ################################################################################################################################
+
+    cdef inline void _lru_link_head(self, Entry entry):
+        """ Makes a given entry the most recently used one. The entry must not be linked already.
+        """
+        if self._last_stamp == self._ranks_size:
+            self._compact_stamps()
+
+        self._last_stamp += 1
+        entry._stamp = self._last_stamp
+        self._ranks_add(entry._stamp, 1)
+
+        entry._prev = None
+        entry._next = self._head
+
+        if self._head is not None:
+            self._head._prev = entry
+        else:
+            self._tail = entry
+
+        self._head = entry
+
+# ################################################################################################################################
+
+    cdef inline void _lru_unlink(self, Entry entry):
+        """ Removes a given entry from the LRU list.
+        """
+        self._ranks_add(entry._stamp, -1)
+
+        if entry._prev is not None:
+            entry._prev._next = entry._next
+        else:
+            self._head = entry._next
+
+        if entry._next is not None:
+            entry._next._prev = entry._prev
+        else:
+            self._tail = entry._prev
+
+        entry._prev = None
+        entry._next = None
+
+# ################################################################################################################################
+
+    cdef inline Py_ssize_t _lru_position(self, Entry entry):
+        """ Returns the position of an entry in the LRU list, i.e. how many entries were used more recently than it was.
+        """
+        return self._ranks_sum(self._last_stamp) - self._ranks_sum(entry._stamp)
+
+# ################################################################################################################################
+
+    cdef _evict(self, Entry lru_entry):
+        """ Removes an entry from cache to make room for new ones. Must be called with self._lock held.
+        """
+        self._lru_unlink(lru_entry)
+        PyDict_DelItem(self._data, lru_entry.key)
+        self.current_bytes -= lru_entry.size
+
+        if self._key_index is not None:
+            self._key_index.remove(lru_entry.key)
+
+# ################################################################################################################################
+
+    cdef _lru_access(self, object key, bint is_get):
+        """ Records an access to a key in the list of keys that a plain LRU cache would have, along with its hits
+        and misses if it is a .get. A key missing in a .get is added as well, as though the caller set it right after,
+        which is what a plain LRU cache would see if it were used instead. Must be called with self._lock held.
+        """
+        if key in self._lru_keys:
+            del self._lru_keys[key]
+            self._lru_keys[key] = None
+            if is_get:
+                self.lru_hits += 1
+
+        else:
+            if is_get:
+                self.lru_misses += 1
+
+            self._lru_keys[key] = None
+            if len(self._lru_keys) > self.max_size:
+                self._lru_keys.popitem(False)
+
+# ################################################################################################################################
+
+    cpdef dict get_hit_ratios(self):
+        """ Returns the percentage of .get operations that found their keys in cache. With TinyLFU, also returns
+        the percentage that a plain LRU cache of the same size would have achieved.
+        """
+        cdef double hit_ratio
+        cdef double lru_hit_ratio
+
+        with self._lock:
+            hit_ratio = 100.0 * self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+            if self.use_tinylfu:
+                lru_hit_ratio = 100.0 * self.lru_hits / (self.lru_hits + self.lru_misses) \
+                    if self.lru_hits + self.lru_misses else 0.0
+            else:
+                lru_hit_ratio = hit_ratio
+
+        return {
+            'hit_ratio': hit_ratio,
+            'lru_hit_ratio': lru_hit_ratio,
+        }
+
+# ################################################################################################################################
+
+    cdef _evict_to_max_bytes(self, Entry keep):
+        """ Evicts least recently used entries, except for the one in keep, until the total size of entries is within
+        self.max_bytes. Must be called with self._lock held.
+        """
+        cdef Entry lru_entry = self._tail
+        cdef Entry prev_entry
+
+        while lru_entry is not None and self.current_bytes > self.max_bytes:
+            prev_entry = lru_entry._prev
+            if lru_entry is not keep:
+                self._evict(lru_entry)
+            lru_entry = prev_entry
+
+# ################################################################################################################################
+
+    cdef inline double _get_timestamp(self):
+        """ Uses gettimeofday(2) to return current timestamp as double with microseconds precision.
+        """
+        cdef timeval tv
+        cdef timezone tz
+
+        gettimeofday(&tv, &tz)
+        return tv.tv_sec + tv.tv_usec / 1.0e6
+
+# ################################################################################################################################
+
+    cpdef double get_timestamp(self):
+        return self._get_timestamp()
+
+# ################################################################################################################################
+
+    cdef object _check_entry(self, object key, value, _getsizeof=getsizeof, _key_types=key_types, _len_values=len_values):
+        """ Raises ValueError if key and value cannot be set in cache. Otherwise, returns the canonical value,
+        if it is needed to compute the entry's size, or None.
+        """
+        cdef long len_value
+        cdef Py_ssize_t size
+        cdef object canonical_value = None
 
         if not isinstance(key, _key_types):
             raise ValueError('Key must be an instance of one of {}'.format(key_types))
@@ -681,9 +1451,44 @@ cdef class Cache(object):
                 if len_value > self.max_item_size:
                     raise ValueError('Value too long {} > {}'.format(len_value, self.max_item_size))
 
+        # Compute the entry's size upfront to reject it before anything in cache is changed.
+        # The value computed is reused when setting metadata of the entry.
+        if self.has_max_bytes:
+            canonical_value = get_canonical_value(value)
+            size = len(canonical_value) + _getsizeof(key)
+            if size > self.max_bytes:
+                raise ValueError('Entry too big {} > {}'.format(size, self.max_bytes))
+
+        return canonical_value
+
+# ################################################################################################################################
+
+    cdef object _set(self, object key, value, expiry, bint details, dict meta_ref, object orig_now=None,
+        bint needs_admission=True, bint is_checked=False, object canonical_value=None):
+
+        cdef object out = None
+        cdef Entry entry
+        cdef double _now
+        cdef double _orig_now = 0.0
+
+        # If multiple processes synchronize contents of their caches, the one that originally added the keys
+        # will dictate what the actual, original key addition timestamp was. Otherwise, we are this first
+        # process so we generate the timestamp ourselves.
+        if orig_now:
+            _now = orig_now
+        else:
+            _orig_now = _now = self._get_timestamp()
+
+        if not is_checked:
+            canonical_value = self._check_entry(key, value)
+
         # Update total # of .set operations
         self.set_ops += 1
 
+        if self.use_tinylfu:
+            self._sketch.increment(key)
+            self._lru_access(key, False)
+
         # Ok, we have this key in cache
         if PyDict_Contains(self._data, key):
             entry = <Entry>PyDict_GetItem(self._data, key)
@@ -693,6 +1498,7 @@ cdef class Cache(object):
                 if expiry:
                     entry.expiry = expiry
                     entry.expires_at = _now + expiry
+                    self._schedule_expiry(entry)
             else:
                 # Mark as deleted an entry that has already expired
                 if _now >= entry.expires_at:
@@ -715,14 +1521,30 @@ cdef class Cache(object):
             entry.last_write = _now
             out = entry.value
             entry.value = value
-            entry.set_metadata()
+
+            self.current_bytes -= entry.size
+            entry.set_metadata(False, canonical_value)
+            self.current_bytes += entry.size
 
         # No such key in cache - let's add it.
         else:
 
+            # With TinyLFU, a new key is rejected if it would evict a key that is accessed at least as often,
+            # unless another process admitted it already and this one only synchronizes its contents.
+            if needs_admission and self.use_tinylfu and len(self._data) >= self.max_size and self._tail is not None:
+                if self._sketch.frequency(key) <= self._sketch.frequency(self._tail.key):
+                    self.rejected += 1
+
+                    if meta_ref is not None:
+                        meta_ref['expires_at'] = 0.0 if not expiry else _now + expiry
+                        meta_ref['orig_now'] = _orig_now
+                        meta_ref['rejected'] = True
+
+                    return None
+
             # Make sure there is room for the new key
-            if cache_size == self.max_size:
-                PyDict_DelItem(self._data, self._index.pop())
+            while len(self._data) >= self.max_size and self._tail is not None:
+                self._evict(self._tail)
 
             # Actually insert entry
             entry = Entry()
@@ -735,10 +1557,22 @@ cdef class Cache(object):
             entry.hits = 0
             entry.expiry = expiry
             entry.expires_at = 0.0 if not expiry else _now + expiry
-            entry.set_metadata()
+            entry.set_metadata(False, canonical_value)
 
             PyDict_SetItem(self._data, key, entry)
-            PyList_Insert(self._index, 0, key)
+            self._lru_link_head(entry)
+
+            if expiry:
+                self._schedule_expiry(entry)
+
+            if self._key_index is not None:
+                self._key_index.add(key)
+
+            self.current_bytes += entry.size
+
+        # Make sure the total size of entries is within budget, without evicting the one that was just set
+        if self.has_max_bytes and self.current_bytes > self.max_bytes:
+            self._evict_to_max_bytes(entry)
 
         # If any output dict for metadata was passed in by reference, set its requires items.
         if meta_ref is not None:
@@ -749,9 +1583,49 @@ cdef class Cache(object):
 
 # ################################################################################################################################
 
-    cpdef object set(self, object key, value, double expiry, bint details, dict meta_ref=None, object orig_now=None):
+    cpdef object set(self, object key, value, double expiry, bint details, dict meta_ref=None, object orig_now=None,
+        bint needs_admission=True):
+        """ Sets a key to a given value. With TinyLFU, a new key may be rejected, in which case meta_ref, if given,
+        has its 'rejected' key set to True. Caches synchronizing a key that another process has already set
+        do not run admission again, so that all of them have the same contents.
+        """
+        with self._lock:
+            return self._set(key, value, expiry, details, meta_ref, orig_now, needs_admission)
+
+# ################################################################################################################################
+
+    cpdef dict set_many(self, dict data, double expiry, bint details, dict meta_ref=None, object orig_now=None,
+        bint needs_admission=True):
+        """ Sets all of the key:value pairs from the input dict under a single acquisition of the lock and with the same
+        timestamp for all of them. Returns a dict of keys along with their previous values. With TinyLFU, keys
+        that were rejected are listed in meta_ref['rejected'], if meta_ref is given.
+        """
+        cdef dict out = {}
+        cdef dict entry_meta = {}
+        cdef list rejected = []
+        cdef list entries
+        cdef object key
+        cdef double _now = orig_now if orig_now else self._get_timestamp()
+
+        # All of the entries are checked before any is set so that either all of them are set or none is
+        entries = [(key, value, self._check_entry(key, value)) for key, value in data.items()]
+
         with self._lock:
-            return self._set(key, value, expiry, details, meta_ref, orig_now)
+            for key, value, canonical_value in entries:
+                try:
+                    out[key] = self._set(key, value, expiry, details, entry_meta, _now, needs_admission, True, canonical_value)
+                except KeyExpiredError:
+                    # The previous entry has been just deleted so this time it will be a new one
+                    out[key] = self._set(key, value, expiry, details, entry_meta, _now, needs_admission, True, canonical_value)
+
+                if entry_meta.pop('rejected', False):
+                    rejected.append(key)
+
+        if meta_ref is not None:
+            meta_ref['_now'] = _now
+            meta_ref['rejected'] = rejected
+
+        return out
 
 # ################################################################################################################################
 
@@ -767,27 +1641,24 @@ cdef class Cache(object):
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
+            for key in self._find_by_prefix(data, limit):
 
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
+                # With max_bytes, setting an earlier key in this loop may have evicted this one
+                if not PyDict_Contains(self._data, key):
+                    continue
 
-                    self._set(key, value, expiry, False, None, _now)
+                # Set it before the update which would overwrite it, this is why we can return
+                # value alone, without any metadata.
+                if return_found:
+                    entry = <Entry>self._data[key]
+                    out[key] = entry if details else entry.value
 
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
+                self._set(key, value, expiry, False, None, _now)
 
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+                # Indicate to our caller that there was at least one matching key
+                if _needs_any_found_report:
+                    meta_ref['_any_found'] = True
+                    _needs_any_found_report = False
 
         if meta_ref:
             meta_ref['_now'] = _now
@@ -808,29 +1679,24 @@ cdef class Cache(object):
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
+            for key in self._find_by_suffix(data, limit):
 
-                if not isinstance(key, str_types):
+                # With max_bytes, setting an earlier key in this loop may have evicted this one
+                if not PyDict_Contains(self._data, key):
                     continue
 
-                if key.endswith(data):
-
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
-
-                    self._set(key, value, expiry, False, None, _now)
+                # Set it before the update which would overwrite it, this is why we can return
+                # value alone, without any metadata.
+                if return_found:
+                    entry = <Entry>self._data[key]
+                    out[key] = entry if details else entry.value
 
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
+                self._set(key, value, expiry, False, None, _now)
 
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+                # Indicate to our caller that there was at least one matching key
+                if _needs_any_found_report:
+                    meta_ref['_any_found'] = True
+                    _needs_any_found_report = False
 
         if meta_ref:
             meta_ref['_now'] = _now
@@ -852,12 +1718,14 @@ cdef class Cache(object):
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
+            # Iterate over a copy of keys because updates may evict entries from self._data
+            for idx, key in enumerate(PyDict_Keys(self._data), 1):
 
                 if not isinstance(key, str_types):
                     continue
 
-                if regex.match(key):
+                # With max_bytes, setting an earlier key in this loop may have evicted this one
+                if regex.match(key) and PyDict_Contains(self._data, key):
 
                     # Set it before the update which would overwrite it, this is why we can return
                     # value alone, without any metadata.
@@ -896,29 +1764,24 @@ cdef class Cache(object):
 
         with self._lock:
 
-            for idx, key in enumerate(self._data.iterkeys(), 1):
+            for key in self._find_contains(data, limit):
 
-                if not isinstance(key, str_types):
+                # With max_bytes, setting an earlier key in this loop may have evicted this one
+                if not PyDict_Contains(self._data, key):
                     continue
 
-                if data in key:
+                # Set it before the update which would overwrite it, this is why we can return
+                # value alone, without any metadata.
+                if return_found:
+                    entry = <Entry>self._data[key]
+                    out[key] = entry if details else entry.value
 
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
+                self._set(key, value, expiry, False, None, _now)
 
-                    self._set(key, value, expiry, False, None, _now)
-
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
-
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+                # Indicate to our caller that there was at least one matching key
+                if _needs_any_found_report:
+                    meta_ref['_any_found'] = True
+                    _needs_any_found_report = False
 
         if meta_ref:
             meta_ref['_now'] = _now
@@ -939,12 +1802,14 @@ cdef class Cache(object):
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
+            # Iterate over a copy of keys because updates may evict entries from self._data
+            for idx, key in enumerate(PyDict_Keys(self._data), 1):
 
                 if not isinstance(key, str_types):
                     continue
 
-                if data not in key:
+                # With max_bytes, setting an earlier key in this loop may have evicted this one
+                if data not in key and PyDict_Contains(self._data, key):
 
                     # Set it before the update which would overwrite it, this is why we can return
                     # value alone, without any metadata.
@@ -975,40 +1840,28 @@ cdef class Cache(object):
         """
         cdef dict out = {}
         cdef Entry entry
-        cdef bint use_key
         cdef bint _needs_any_found_report = True if meta_ref else False
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
+            for key in self._find_contains_all(data, limit):
 
-                if not isinstance(key, str_types):
+                # With max_bytes, setting an earlier key in this loop may have evicted this one
+                if not PyDict_Contains(self._data, key):
                     continue
 
-                use_key = True
-                for elem in data:
-                    if elem not in key:
-                        use_key = False
-                        break
-
-                if use_key:
-
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
-
-                    self._set(key, value, expiry, False, None, _now)
+                # Set it before the update which would overwrite it, this is why we can return
+                # value alone, without any metadata.
+                if return_found:
+                    entry = <Entry>self._data[key]
+                    out[key] = entry if details else entry.value
 
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
+                self._set(key, value, expiry, False, None, _now)
 
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+                # Indicate to our caller that there was at least one matching key
+                if _needs_any_found_report:
+                    meta_ref['_any_found'] = True
+                    _needs_any_found_report = False
 
         if meta_ref:
             meta_ref['_now'] = _now
@@ -1025,40 +1878,28 @@ cdef class Cache(object):
         """
         cdef dict out = {}
         cdef Entry entry
-        cdef bint use_key
         cdef bint _needs_any_found_report = True if meta_ref else False
         cdef double _now = orig_now if orig_now else self._get_timestamp()
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
+            for key in self._find_contains_any(data, limit):
 
-                if not isinstance(key, str_types):
+                # With max_bytes, setting an earlier key in this loop may have evicted this one
+                if not PyDict_Contains(self._data, key):
                     continue
 
-                use_key = False
-                for elem in data:
-                    if elem in key:
-                        use_key = True
-                        break
-
-                if use_key:
-
-                    # Set it before the update which would overwrite it, this is why we can return
-                    # value alone, without any metadata.
-                    if return_found:
-                        entry = <Entry>self._data[key]
-                        out[key] = entry if details else entry.value
-
-                    self._set(key, value, expiry, False, None, _now)
+                # Set it before the update which would overwrite it, this is why we can return
+                # value alone, without any metadata.
+                if return_found:
+                    entry = <Entry>self._data[key]
+                    out[key] = entry if details else entry.value
 
-                    # Indicate to our caller that there was at least one matching key
-                    if _needs_any_found_report:
-                        meta_ref['_any_found'] = True
-                        _needs_any_found_report = False
+                self._set(key, value, expiry, False, None, _now)
 
-                # Our caller knows how many keys to look up at most
-                if idx == limit:
-                    break
+                # Indicate to our caller that there was at least one matching key
+                if _needs_any_found_report:
+                    meta_ref['_any_found'] = True
+                    _needs_any_found_report = False
 
         if meta_ref:
             meta_ref['_now'] = _now
@@ -1074,10 +1915,13 @@ cdef class Cache(object):
         cdef object _item
         cdef Entry entry
         cdef Py_ssize_t index_idx
-        cdef Py_ssize_t cache_size
-        cdef object index_key
+        cdef PyObject *hits_per_position
         cdef double _now = self._get_timestamp()
 
+        if self.use_tinylfu:
+            self._sketch.increment(key)
+            self._lru_access(key, True)
+
         try:
             entry = <Entry>self._data[key]
         except KeyError:
@@ -1104,19 +1948,18 @@ cdef class Cache(object):
             self.hits += 1
 
             # Current position of that key in index
-            index_idx = self._get_index(key)
+            index_idx = self._lru_position(entry)
 
             # We have the key's position so we can now update per-position counter
             # to be able to offer statistics on how often a key is found at a given position.
-            hits_per_position = PyInt_AS_LONG(<object>PyDict_GetItem(self.hits_per_position, index_idx))
-            hits_per_position += 1
-            PyDict_SetItem(self.hits_per_position, index_idx, PyInt_FromLong(hits_per_position))
-
-            # Remove key from index
-            index_key = self._remove_from_index_by_idx(index_idx)
+            hits_per_position = PyDict_GetItem(self.hits_per_position, index_idx)
+            PyDict_SetItem(self.hits_per_position, index_idx,
+                PyInt_FromLong(PyInt_AS_LONG(<object>hits_per_position) + 1 if hits_per_position else 1))
 
-            # Now insert the key back at the head position.
-            PyList_Insert(self._index, 0, index_key)
+            # Now move the key to the head position unless it already is there.
+            if index_idx:
+                self._lru_unlink(entry)
+                self._lru_link_head(entry)
 
             # Update last/prev access information + hits
             entry.prev_read = entry.last_read
@@ -1145,6 +1988,27 @@ cdef class Cache(object):
         with self._lock:
             return self._get(key, default, details)
 
+# ################################################################################################################################
+
+    cpdef dict get_many(self, object keys, bint details):
+        """ Returns a dict of key:value mappings for all of the input keys that exist in cache and have not expired,
+        looking all of them up under a single acquisition of the lock.
+        """
+        cdef dict out = {}
+        cdef object key
+        cdef object value
+
+        with self._lock:
+            for key in keys:
+                try:
+                    value = self._get(key, _missing, details)
+                except KeyExpiredError:
+                    continue
+                if value is not _missing:
+                    out[key] = value
+
+        return out
+
 # ################################################################################################################################
 
     cpdef object get_by_prefix(self, object data, bint details, int limit):
@@ -1155,13 +2019,8 @@ cdef class Cache(object):
         cdef dict out = {}
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    out[key] = self._get(key, self.default_get, details)
-                if idx == limit:
-                    break
+            for key in self._find_by_prefix(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1175,13 +2034,8 @@ cdef class Cache(object):
         cdef dict out = {}
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    out[key] = self._get(key, self.default_get, details)
-                if idx == limit:
-                    break
+            for key in self._find_by_suffix(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1217,13 +2071,8 @@ cdef class Cache(object):
         cdef dict out = {}
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if data in key:
-                    out[key] = self._get(key, self.default_get, details)
-                if idx == limit:
-                    break
+            for key in self._find_contains(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1255,25 +2104,10 @@ cdef class Cache(object):
         it's a separate one to reduce code branching/CPU mispredictions.
         """
         cdef dict out = {}
-        cdef bint use_key
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-
-                if not isinstance(key, str_types):
-                    continue
-
-                use_key = True
-                for elem in data:
-                    if elem not in key:
-                        use_key = False
-                        break
-
-                if use_key:
-                    out[key] = self._get(key, self.default_get, details)
-
-                if idx == limit:
-                    break
+            for key in self._find_contains_all(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1285,25 +2119,10 @@ cdef class Cache(object):
         it's a separate one to reduce code branching/CPU mispredictions.
         """
         cdef dict out = {}
-        cdef bint use_key
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-
-                if not isinstance(key, str_types):
-                    continue
-
-                use_key = False
-                for elem in data:
-                    if elem in key:
-                        use_key = True
-                        break
-
-                if use_key:
-                    out[key] = self._get(key, self.default_get, details)
-
-                if idx == limit:
-                    break
+            for key in self._find_contains_any(data, limit):
+                out[key] = self._get(key, self.default_get, details)
 
         return out
 
@@ -1337,14 +2156,9 @@ cdef class Cache(object):
         cpdef bint found_any = False
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.startswith(data):
-                    self._expire(key, expiry, None)
-                    found_any = True
-                if idx == limit:
-                    break
+            for key in self._find_by_prefix(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1357,14 +2171,9 @@ cdef class Cache(object):
         cpdef bint found_any = False
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if key.endswith(data):
-                    self._expire(key, expiry, None)
-                    found_any = True
-                if idx == limit:
-                    break
+            for key in self._find_by_suffix(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1398,14 +2207,9 @@ cdef class Cache(object):
         cpdef bint found_any = False
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-                if data in key:
-                    self._expire(key, expiry, None)
-                    found_any = True
-                if idx == limit:
-                    break
+            for key in self._find_contains(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1436,25 +2240,11 @@ cdef class Cache(object):
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
         cpdef bint found_any = False
-        cdef bint use_key
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
-
-                use_key = True
-                for elem in data:
-                    if elem not in key:
-                        use_key = False
-                        break
-
-                if use_key:
-                    self._expire(key, expiry, None)
-                    found_any = True
-
-                if idx == limit:
-                    break
+            for key in self._find_contains_all(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
         return found_any
 
@@ -1465,27 +2255,146 @@ cdef class Cache(object):
         Similarly to other self.get/set/expire/delete methods, it's a separate one to reduce code branching/CPU mispredictions.
         """
         cpdef bint found_any = False
-        cdef bint use_key
 
         with self._lock:
-            for idx, key in enumerate(self._data.iterkeys(), 1):
-                if not isinstance(key, str_types):
-                    continue
+            for key in self._find_contains_any(data, limit):
+                self._expire(key, expiry, None)
+                found_any = True
 
-                use_key = False
-                for elem in data:
-                    if elem in key:
-                        use_key = True
-                        break
+        return found_any
 
-                if use_key:
-                    self._expire(key, expiry, None)
-                    found_any = True
+# ################################################################################################################################
 
-                if idx == limit:
-                    break
+    cpdef Py_ssize_t dump_snapshot(self, object path):
+        """ Saves all entries that have not expired yet to a snapshot file, from the least to the most recently used one,
+        and returns the number of entries saved. Entries whose keys or values cannot be pickled are skipped.
+        The file is first written under a temporary name so that a snapshot being saved is never loaded.
+        """
+        cdef Entry entry
+        cdef double _now = self._get_timestamp()
+        cdef Py_ssize_t count = 0
+        cdef Py_ssize_t skipped = 0
+        cdef object tmp_path = '{}.{}.tmp'.format(path, getpid())
+        cdef object payload
 
-        return found_any
+        if not exists(dirname(path)):
+            makedirs(dirname(path))
+
+        with open(tmp_path, 'wb') as f:
+
+            # The number of entries is not known yet, it will be written once all of them are
+            f.write(snapshot_header.pack(CACHE.SNAPSHOT_MAGIC, 0))
+
+            with self._lock:
+                entry = self._tail
+                while entry is not None:
+                    if not (entry.expires_at and _now >= entry.expires_at):
+                        try:
+                            payload = pickle_dumps((entry.key, entry.value), -1)
+                        except Exception:
+                            skipped += 1
+                        else:
+                            f.write(snapshot_entry_header.pack(entry.expires_at, entry.expiry, len(payload)))
+                            f.write(payload)
+                            count += 1
+                    entry = entry._prev
+
+            f.seek(0)
+            f.write(snapshot_header.pack(CACHE.SNAPSHOT_MAGIC, count))
+
+        rename(tmp_path, path)
+
+        if skipped:
+            logger.warn('Skipped %d entries that could not be pickled when saving snapshot to `%s`', skipped, path)
+
+        return count
+
+# ################################################################################################################################
+
+    def load_snapshot(self, object path, Py_ssize_t batch_size=CACHE.SNAPSHOT_BATCH_SIZE, object yield_func=None):
+        """ Loads entries from a snapshot file previously saved by self.dump_snapshot and returns the number of entries
+        loaded. The file is mapped into memory rather than read so only the entries that are loaded are ever copied,
+        entries that have already expired are skipped without unpickling them. Keys that are already in cache are not
+        overwritten because their values are newer than the ones from the snapshot. The lock is released after each batch
+        of entries and, if given, yield_func is called to let other tasks run in the meantime.
+        """
+        cdef Py_ssize_t loaded = 0
+        cdef Py_ssize_t idx
+        cdef Py_ssize_t count
+        cdef Py_ssize_t offset
+        cdef Py_ssize_t payload_len
+        cdef double expires_at
+        cdef double expiry
+        cdef double _now = self._get_timestamp()
+        cdef object magic
+        cdef object data
+
+        if not exists(path) or getsize(path) < snapshot_header.size:
+            return 0
+
+        with open(path, 'rb') as f:
+            data = mmap(f.fileno(), 0, access=ACCESS_READ)
+
+        try:
+            magic, count = snapshot_header.unpack_from(data, 0)
+            if magic != CACHE.SNAPSHOT_MAGIC:
+                logger.warn('Ignoring snapshot `%s` with unrecognized magic bytes `%r`', path, magic)
+                return 0
+
+            offset = snapshot_header.size
+            idx = 0
+
+            while idx < count:
+                self._lock.acquire()
+                try:
+                    for idx in range(idx, min(idx + batch_size, count)):
+                        expires_at, expiry, payload_len = snapshot_entry_header.unpack_from(data, offset)
+                        offset += snapshot_entry_header.size
+
+                        if not (expires_at and _now >= expires_at):
+                            if self._load_entry(data[offset:offset + payload_len], expiry, expires_at):
+                                loaded += 1
+
+                        offset += payload_len
+                    idx += 1
+                finally:
+                    self._lock.release()
+
+                if yield_func:
+                    yield_func()
+
+        finally:
+            data.close()
+
+        return loaded
+
+    cdef bint _load_entry(self, object payload, double expiry, double expires_at):
+        """ Adds to cache a single entry from a snapshot unless its key already exists or the entry is rejected.
+        Returns True if the entry was added. Must be called with self._lock held.
+        """
+        cdef Entry entry
+
+        key, value = pickle_loads(payload)
+
+        if PyDict_Contains(self._data, key):
+            return False
+
+        try:
+            self._set(key, value, 0.0, False, None)
+        except ValueError:
+            return False
+
+        entry = self._data.get(key)
+        if entry is None:
+            return False
+
+        # The entry is to expire when it would have originally, not after its expiry counting from now
+        if expiry:
+            entry.expiry = expiry
+            entry.expires_at = expires_at
+            self._schedule_expiry(entry)
+
+        return True
 
 # ################################################################################################################################
 
@@ -1512,29 +2421,91 @@ cdef class Cache(object):
                 if expires_at > entry.expires_at:
                     entry.expiry = expiry
                     entry.expires_at = expires_at
+                    self._schedule_expiry(entry)
+
+# ################################################################################################################################
+
+    cdef inline void _schedule_expiry(self, Entry entry):
+        """ Pushes an entry onto the expiry heap unless it already is there under an earlier or the same expiration time,
+        in which case it will be rescheduled when it reaches the top of the heap. Must be called with self._lock held.
+        """
+        if entry.expires_at and (not entry._heap_expires_at or entry.expires_at < entry._heap_expires_at):
+            self._expiry_seq += 1
+            entry._heap_expires_at = entry.expires_at
+            heappush(self._expiry_heap, (entry.expires_at, self._expiry_seq, entry))
+
+# ################################################################################################################################
+
+    cdef _compact_expiry_heap(self):
+        """ Rebuilds the expiry heap out of live entries only, dropping items that no longer point to anything in cache.
+        Must be called with self._lock held.
+        """
+        cdef Entry entry
+        cdef list heap = []
+
+        self._expiry_seq = 0
+
+        for entry in self._data.itervalues():
+            if entry.expires_at:
+                self._expiry_seq += 1
+                entry._heap_expires_at = entry.expires_at
+                heap.append((entry.expires_at, self._expiry_seq, entry))
+            else:
+                entry._heap_expires_at = 0.0
+
+        heapify(heap)
+        self._expiry_heap = heap
+
+# ################################################################################################################################
+
+    cpdef double get_next_expires_at(self):
+        """ Returns the earliest time any entry may expire at, or 0.0 if there are no entries with expiry set. The value
+        may be earlier than the actual one if expiration of the earliest entry was extended in the meantime.
+        """
+        with self._lock:
+            return self._expiry_heap[0][0] if self._expiry_heap else 0.0
 
 # ################################################################################################################################
 
     cpdef list delete_expired(self):
         """ Deletes all entries expired as of now. Also, deletes all entries possibly found to have expired by .get or .set calls.
+        Only entries that are due are visited, in the order of their expiration time, using the expiry heap.
         """
         cdef list deleted
+        cdef list heap
         cdef double _now = self._get_timestamp()
-        cdef double expires_at
-
-        # Collects all keys to be deleted and in another pass, delete them all.
-        # It's performed it two steps so as to be able to hold self._lock only once.
+        cdef double heap_expires_at
+        cdef Entry entry
 
         with self._lock:
 
             deleted = self._expired_on_op[:]
+            heap = self._expiry_heap
 
-            # Collect keys still in cache
-            for key, value in PyDict_Items(self._data):
-                expires_at = value.expires_at
-                if expires_at and _now > expires_at:
-                    self._delete(key)
-                    deleted.append(key)
+            while heap and heap[0][0] < _now:
+                heap_expires_at, _, entry = heappop(heap)
+
+                # This item is stale - the entry has been deleted or it was pushed again under a different time
+                if self._data.get(entry.key) is not entry or entry._heap_expires_at != heap_expires_at:
+                    continue
+
+                entry._heap_expires_at = 0.0
+
+                # Expiry was reset after the entry had been pushed onto the heap
+                if not entry.expires_at:
+                    continue
+
+                # Expiry was extended, e.g. by .get or .set, so we need to reschedule the entry
+                if entry.expires_at >= _now:
+                    self._schedule_expiry(entry)
+                    continue
+
+                self._delete(entry.key)
+                deleted.append(entry.key)
+
+            # Stale items accumulate if entries are deleted before they expire, rebuild the heap if there are too many of them
+            if len(heap) > 2 * len(self._data) + CACHE.MIN_EXPIRY_HEAP_SIZE:
+                self._compact_expiry_heap()
 
             # Collect keys deleted by .get operations
             self._expired_on_op[:] = []
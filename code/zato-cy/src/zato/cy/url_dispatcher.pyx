@@ -10,6 +10,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import re as stdlib_re
+from collections import OrderedDict
 from datetime import datetime
 from logging import getLogger
 from operator import itemgetter
@@ -19,7 +20,6 @@ from uuid import uuid4
 from regex import compile as re_compile
 
 # Zato
-from zato.bunch import bunchify
 from zato.common import HTTP_SOAP, MISC, TRACE1
 
 http_any_internal = HTTP_SOAP.ACCEPT.ANY_INTERNAL
@@ -39,6 +39,21 @@ unused_marker = 'unused'
 
 _internal_url_path_indicator = '{}/zato/'.format(target_separator)
 
+# Regex metacharacters - parts of patterns that have none of them are literal strings that must be matched exactly
+_regex_meta_chars = set('.^$*+?{}[]\\|()')
+
+# A pattern's HTTP method is a single method or an alternation of them, e.g. (GET|POST) for channels that accept any method
+_method_re = stdlib_re.compile(r'(\w+)\Z|\(((?:\w+\|)*\w+)\)\Z', stdlib_re.UNICODE)
+
+# A URL path segment that consists of a single parameter only, e.g. {customer_id}
+_param_segment_re = stdlib_re.compile(r'\{[\w \$.\-|=~^\/]+\}\Z', stdlib_re.UNICODE)
+
+# What HTTP Accept of */* is turned into in match targets
+_accept_any_internal = '{}HTTP_SEP{}'.format(http_any_internal, http_any_internal)
+
+# How many matched targets, static or with path parameters, to keep in the cache of URL paths by default
+default_url_path_cache_size = 10000
+
 # ################################################################################################################################
 # ################################################################################################################################
 
@@ -52,7 +67,7 @@ cdef class Matcher(object):
         public unicode pattern
         public object matcher
         object match_func
-        public bint is_static, is_internal
+        public bint is_static, is_internal, match_slash
         object _brace_pattern
         object _elem_re_template
 
@@ -64,6 +79,7 @@ cdef class Matcher(object):
 
         self.group_names = []
         self.pattern = pattern
+        self.match_slash = match_slash
         self.matcher = None
         self.is_static = True
         self._brace_pattern = re_compile('\{[\w \$.\-|=~^\/]+\}', stdlib_re.UNICODE)
@@ -116,48 +132,444 @@ cdef class Matcher(object):
 # ################################################################################################################################
 # ################################################################################################################################
 
+cdef class ChannelItem(object):
+    """ An immutable, precompiled view of a channel's configuration that CyURLData.match returns for each request
+    matched. Keys used by each request are C-level attributes, all the other ones can be accessed by name too,
+    e.g. item.cache_name, item['cache_name'] and item.get('cache_name') are the same thing, as it was with Bunch objects.
+    """
+    cdef:
+        readonly object id
+        readonly object name
+        readonly object is_active
+        readonly object is_internal
+        readonly object match_target
+        readonly object url_path
+        readonly object data_format
+        readonly object transport
+        readonly object content_encoding
+        readonly object merge_url_params_req
+        readonly object url_params_pri
+        readonly object params_pri
+        readonly object service_id
+        readonly object service_impl_name
+        readonly object soap_version
+        readonly object cache_type
+        readonly object cache_name
+        dict _config
+
+    def __init__(self, dict config):
+        self._config = dict(config)
+        self.id = config.get('id')
+        self.name = config.get('name')
+        self.is_active = config.get('is_active')
+        self.is_internal = config.get('is_internal')
+        self.match_target = config.get('match_target')
+        self.url_path = config.get('url_path')
+        self.data_format = config.get('data_format')
+        self.transport = config.get('transport')
+        self.content_encoding = config.get('content_encoding')
+        self.merge_url_params_req = config.get('merge_url_params_req')
+        self.url_params_pri = config.get('url_params_pri')
+        self.params_pri = config.get('params_pri')
+        self.service_id = config.get('service_id')
+        self.service_impl_name = config.get('service_impl_name')
+        self.soap_version = config.get('soap_version')
+        self.cache_type = config.get('cache_type')
+        self.cache_name = config.get('cache_name')
+
+    def __getattr__(self, name):
+        try:
+            return self._config[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, name):
+        return self._config[name]
+
+    def __contains__(self, name):
+        return name in self._config
+
+    def __iter__(self):
+        return iter(self._config)
+
+    def __len__(self):
+        return len(self._config)
+
+    def __repr__(self):
+        return '<{} at {} name:`{}`, match_target:`{}`>'.format(
+            self.__class__.__name__, hex(id(self)), self.name, self.match_target)
+
+    cpdef get(self, name, default=None):
+        return self._config.get(name, default)
+
+    cpdef list keys(self):
+        return list(self._config.keys())
+
+    cpdef list values(self):
+        return list(self._config.values())
+
+    cpdef list items(self):
+        return list(self._config.items())
+
+    cpdef dict to_dict(self):
+        """ Returns a new dict with the channel's configuration.
+        """
+        return dict(self._config)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
+cdef inline bint _is_literal(unicode value, bint allow_colons, set _regex_meta_chars=_regex_meta_chars):
+    """ Returns True if value has no regex metacharacters, i.e. if as a regex it matches itself only.
+    Unless allow_colons is True, values with colons are not considered literal either.
+    """
+    cdef unicode char
+    for char in value:
+        if (char == ':' and not allow_colons) or char in _regex_meta_chars:
+            return False
+    return True
+
+# ################################################################################################################################
+
+cdef class _RouterNode(object):
+    """ A node of Router's tree, corresponding to a single segment of URL path patterns.
+    """
+    cdef:
+        dict children            # Literal segments -> nodes they lead to
+        _RouterNode param        # Parameters that match a single segment
+        _RouterNode param_multi  # Parameters that match one or more segments, i.e. ones that match slashes too
+        list exact               # Positions in channel_data of patterns that end at this node
+        list prefix              # Positions of patterns that cannot be followed past this node, each of them is a candidate
+
+    def __init__(self):
+        self.children = {}
+        self.param = None
+        self.param_multi = None
+        self.exact = []
+        self.prefix = []
+
+# ################################################################################################################################
+
+cdef inline tuple _get_first_segments(unicode url_path):
+    """ Returns up to three first segments of a URL path, i.e. an empty one before the leading slash and two more.
+    """
+    return tuple(url_path.split('/', 3)[:3])
+
+# ################################################################################################################################
+
+cdef tuple _split_pattern(Matcher matcher, unicode sep=target_separator):
+    """ Returns a (soap_action, http_methods, url_path) tuple that Router indexes a pattern by or None if the pattern
+    cannot be indexed, in which case it may match any target.
+    """
+    cdef list parts = matcher.pattern.split(sep)
+    cdef unicode soap_action, http_method, url_path
+
+    if len(parts) != 4:
+        return None
+
+    soap_action, http_method, _, url_path = parts
+    method_match = _method_re.match(http_method)
+
+    # Parts other than HTTP Accept must be ones that a regex matches exactly
+    if _accept_any_internal in soap_action or _accept_any_internal in url_path \
+        or not _is_literal(soap_action, True) or not method_match:
+        return None
+
+    return soap_action, (method_match.group(1) or method_match.group(2)).split('|'), url_path
+
+# ################################################################################################################################
+
+cdef class Router(object):
+    """ Finds channels whose patterns may match a given target without running each channel's regex. Patterns are split
+    into their SOAP action, HTTP method and URL path. SOAP actions and methods are keys of dicts pointing to trees
+    of URL path segments, in which literal segments are looked up directly and parameters are nodes of their own.
+
+    The router returns candidates only, in the order they have in channel_data, and it is still Matcher objects
+    that decide which of them matches - this is why parts of patterns that the tree cannot represent, such as regex
+    metacharacters in URL paths, end a pattern's path in the tree and make it a candidate for all URL paths beginning
+    with the segments that preceded it. Patterns that cannot be split at all are always candidates.
+
+    A target may be looked up only if it passes self.can_route. Otherwise, e.g. if its URL path contains colons,
+    a regex could match it in a way that is not related to its parts and callers need to check all the channels.
+    """
+    cdef:
+        dict roots
+        list always
+
+    def __init__(self, list channel_data):
+        cdef Py_ssize_t idx
+        cdef dict item
+
+        self.roots = {}
+        self.always = []
+
+        for idx, item in enumerate(channel_data or []):
+            self._add(idx, item['match_target_compiled'])
+
+# ################################################################################################################################
+
+    cdef _add(self, Py_ssize_t idx, Matcher matcher):
+        cdef tuple split = _split_pattern(matcher)
+        cdef unicode soap_action, http_method, url_path, segment
+        cdef _RouterNode node
+        cdef bint is_prefix = False
+
+        if split is None:
+            self.always.append(idx)
+            return
+
+        soap_action, http_methods, url_path = split
+
+        for http_method in http_methods:
+            node = self.roots.get((soap_action, http_method))
+            if node is None:
+                node = self.roots[(soap_action, http_method)] = _RouterNode()
+
+            is_prefix = False
+
+            for segment in url_path.split('/'):
+                if _param_segment_re.match(segment):
+                    if matcher.match_slash:
+                        if node.param_multi is None:
+                            node.param_multi = _RouterNode()
+                        node = node.param_multi
+                    else:
+                        if node.param is None:
+                            node.param = _RouterNode()
+                        node = node.param
+
+                elif _is_literal(segment, False):
+                    node = node.children.setdefault(segment, _RouterNode())
+
+                else:
+                    is_prefix = True
+                    break
+
+            if is_prefix:
+                node.prefix.append(idx)
+            else:
+                node.exact.append(idx)
+
+# ################################################################################################################################
+
+    cpdef bint can_route(self, unicode soap_action, unicode http_method, unicode http_accept, unicode url_path):
+        """ Returns True if it is safe to look up a target made of input parts using this router.
+        """
+        return ':' not in url_path and ':' not in http_method and ':' not in http_accept and '\n' not in url_path \
+            and '::' not in soap_action and not soap_action.startswith(':') and not soap_action.endswith(':')
+
+# ################################################################################################################################
+
+    cpdef list get_candidates(self, unicode soap_action, unicode http_method, unicode url_path):
+        """ Returns positions in channel_data of channels whose patterns may match input, sorted in ascending order.
+        """
+        cdef set out = set(self.always)
+        cdef _RouterNode root = self.roots.get((soap_action, http_method))
+
+        if root is not None:
+            self._collect(root, url_path.split('/'), 0, out)
+
+        return sorted(out)
+
+# ################################################################################################################################
+
+    cdef _collect(self, _RouterNode node, list segments, Py_ssize_t idx, set out):
+        cdef _RouterNode child
+        cdef Py_ssize_t end
+        cdef Py_ssize_t len_segments = len(segments)
+
+        out.update(node.prefix)
+
+        if idx == len_segments:
+            out.update(node.exact)
+            return
+
+        child = node.children.get(segments[idx])
+        if child is not None:
+            self._collect(child, segments, idx + 1, out)
+
+        if node.param is not None:
+            self._collect(node.param, segments, idx + 1, out)
+
+        if node.param_multi is not None:
+            for end in range(idx + 1, len_segments + 1):
+                self._collect(node.param_multi, segments, end, out)
+
+# ################################################################################################################################
+# ################################################################################################################################
+
 cdef class CyURLData(object):
 
     cdef:
         public list channel_data
-        public dict url_path_cache
+        public object url_path_cache
+        public Py_ssize_t url_path_cache_size
+        public Py_ssize_t url_path_cache_hits
+        public Py_ssize_t url_path_cache_misses
+        readonly dict url_path_cache_by_channel
+        dict _url_path_cache_by_route
         bint has_trace1
+        Router _router
+        list _channel_items
 
-    def __init__(self, channel_data=None):
+    def __init__(self, channel_data=None, url_path_cache_size=default_url_path_cache_size):
         self.channel_data = channel_data
-        self.url_path_cache = {}
+
+        # Maps targets to (path parameters, channel item, route key) tuples, the least recently used ones come first
+        self.url_path_cache = OrderedDict()
+
+        # Channel IDs -> targets cached for each channel
+        self.url_path_cache_by_channel = {}
+
+        # (soap_action, http_method) or None for targets that Router cannot look up -> first segments of URL paths
+        # -> targets cached. Targets that a pattern may match can be found here the same way Router finds patterns.
+        self._url_path_cache_by_route = {}
+
+        self.url_path_cache_size = url_path_cache_size
+        self.url_path_cache_hits = 0
+        self.url_path_cache_misses = 0
+
         self.url_target_cache = {}
         self.has_trace1 = logger.isEnabledFor(TRACE1)
+        self._router = None
+        self._channel_items = None
+
+# ################################################################################################################################
+
+    cpdef clear_router(self):
+        """ Must be called each time channel_data changes, the router and channel items will be rebuilt
+        the next time they are needed.
+        """
+        self._router = None
+        self._channel_items = None
+
+    cdef Router _get_router(self):
+        if self._router is None:
+            self._router = Router(self.channel_data)
+            self._channel_items = [ChannelItem(item) for item in self.channel_data or []]
+        return self._router
+
+# ################################################################################################################################
+
+    cpdef dict get_url_path_cache_stats(self):
+        """ Returns current size and usage statistics of the cache of URL paths.
+        """
+        return {
+            'size': len(self.url_path_cache),
+            'max_size': self.url_path_cache_size,
+            'hits': self.url_path_cache_hits,
+            'misses': self.url_path_cache_misses,
+        }
+
+# ################################################################################################################################
+
+    cdef _add_to_cache(self, unicode target, dict match, ChannelItem channel_item, object route_key):
+        cdef tuple evicted
+
+        # A copy of path parameters is needed because callers add query string parameters to the ones they receive
+        self.url_path_cache[target] = (dict(match), channel_item, route_key)
+        self.url_path_cache_by_channel.setdefault(channel_item.id, set()).add(target)
+        self._url_path_cache_by_route.setdefault(route_key[0], {}).setdefault(route_key[1], set()).add(target)
+
+        if len(self.url_path_cache) > self.url_path_cache_size:
+            target, evicted = self.url_path_cache.popitem(last=False)
+            self._remove_from_index(target, evicted[1], evicted[2])
+
+# ################################################################################################################################
+
+    cdef _remove_from_index(self, unicode target, ChannelItem channel_item, tuple route_key):
+        cdef set targets
+        cdef dict by_segments
+
+        targets = self.url_path_cache_by_channel[channel_item.id]
+        targets.discard(target)
+        if not targets:
+            del self.url_path_cache_by_channel[channel_item.id]
+
+        by_segments = self._url_path_cache_by_route[route_key[0]]
+        targets = by_segments[route_key[1]]
+        targets.discard(target)
+        if not targets:
+            del by_segments[route_key[1]]
+            if not by_segments:
+                del self._url_path_cache_by_route[route_key[0]]
+
+# ################################################################################################################################
+
+    cdef _remove_target(self, unicode target):
+        cdef tuple value = self.url_path_cache.pop(target, None)
+        if value is not None:
+            self._remove_from_index(target, value[1], value[2])
 
 # ################################################################################################################################
 
     cpdef _remove_from_cache(self, unicode match_target):
+        """ Removes all the targets that were matched by the channel of that match target as well as the ones
+        that the channel would match now, e.g. because it has just been created and it shadows another one.
+        Only targets cached for that channel and ones that could be routed to it are looked at.
+        """
+        cdef Matcher matcher
+        cdef tuple split, first_segments, prefix, segments_key
+        cdef list targets
+        cdef dict by_segments
+        cdef unicode target, http_method, segment
+        cdef Py_ssize_t len_prefix
 
-        targets_to_remove = []
-        cached_targets = self.url_path_cache.keys()
+        for item in self.channel_data:
+            if item['match_target'] != match_target:
+                continue
 
-        for target in cached_targets:
-            for item in self.channel_data:
-                matcher = item['match_target_compiled']
-                if matcher.pattern == match_target:
-                    if matcher.match(target) is not None:
-                        targets_to_remove.append(target)
+            for target in list(self.url_path_cache_by_channel.get(item.get('id'), ())):
+                self._remove_target(target)
 
-        for target in targets_to_remove:
-            del self.url_path_cache[target]
+            matcher = item['match_target_compiled']
+            split = _split_pattern(matcher)
+
+            if split is None:
+                targets = list(self.url_path_cache)
+            else:
+                targets = []
+
+                # The pattern may match only targets whose URL paths begin with the same literal segments that it does.
+                # If all of its first segments are literal, these are exactly the first segments of such targets.
+                first_segments = _get_first_segments(split[2])
+                prefix = ()
+                for segment in first_segments:
+                    if _param_segment_re.match(segment) or not _is_literal(segment, False):
+                        break
+                    prefix += (segment,)
+                len_prefix = len(prefix)
+
+                for segment_targets in self._url_path_cache_by_route.get(None, {}).values():
+                    targets.extend(segment_targets)
+
+                for http_method in split[1]:
+                    by_segments = self._url_path_cache_by_route.get((split[0], http_method), {})
+                    if prefix == first_segments:
+                        targets.extend(by_segments.get(first_segments, ()))
+                    else:
+                        for segments_key, segment_targets in by_segments.items():
+                            if segments_key[:len_prefix] == prefix:
+                                targets.extend(segment_targets)
+
+            for target in targets:
+                if matcher.match(target) is not None:
+                    self._remove_target(target)
 
 # ################################################################################################################################
 
     cpdef tuple match(self, unicode url_path, unicode soap_action, unicode http_method, unicode http_accept,
-        bint has_soap_action, unicode sep=target_separator, _bunchify=bunchify, _log_trace1=logger.log,
-        _trace1=TRACE1):
+        bint has_soap_action, unicode sep=target_separator, _log_trace1=logger.log, _trace1=TRACE1):
         """ Attemps to match the combination of SOAPt Action and URL path against
         the list of HTTP channel targets.
         """
         cdef bint needs_user, has_target_in_cache=True
         cdef Matcher matcher
         cdef dict item
-        cdef object item_bunch
+        cdef ChannelItem channel_item
+        cdef object candidates
+        cdef Router router
+        cdef Py_ssize_t idx
 
         cdef unicode target = ''
         target += soap_action
@@ -173,15 +585,25 @@ cdef class CyURLData(object):
         except KeyError:
             has_target_in_cache = False
 
-        # Return from cache if already seen
+        # Return from cache if already seen, moving the target to the end of the cache as the most recently used one
         try:
-            ctx, channel_item = {}, self.url_path_cache[target]
-            return ctx, channel_item
+            match, channel_item, route_key = self.url_path_cache.pop(target)
         except KeyError:
+            self.url_path_cache_misses += 1
             needs_user = not url_path.startswith('/zato')
 
-            for item in self.channel_data:
+            # Check only the channels that the router returns, unless the target is one that it cannot tell anything about
+            router = self._get_router()
+            if router.can_route(soap_action, http_method, http_accept, url_path):
+                candidates = router.get_candidates(soap_action, http_method, url_path)
+                route_key = ((soap_action, http_method), _get_first_segments(url_path))
+            else:
+                candidates = range(len(self.channel_data))
+                route_key = (None, None)
+
+            for idx in candidates:
 
+                item = self.channel_data[idx]
                 matcher = item['match_target_compiled']
                 if needs_user and matcher.is_internal:
                     continue
@@ -192,15 +614,20 @@ cdef class CyURLData(object):
                     if self.has_trace1:
                         _log_trace1(_trace1, 'Matched target:`%s` with:`%r`', target, item)
 
-                    item_bunch = _bunchify(item)
+                    channel_item = self._channel_items[idx]
 
-                    # Cache that target but only if it's a static URL without dynamic variables
-                    if (not has_target_in_cache) and matcher.is_static:
-                        self.url_path_cache[target] = item_bunch
+                    # Cache that target, no matter if it's a static URL or one with dynamic variables
+                    if (not has_target_in_cache) and self.url_path_cache_size > 0:
+                        self._add_to_cache(target, match, channel_item, route_key)
 
-                    return match, item_bunch
+                    return match, channel_item
 
             return None, None
 
+        else:
+            self.url_path_cache[target] = (match, channel_item, route_key)
+            self.url_path_cache_hits += 1
+            return dict(match), channel_item
+
 # ################################################################################################################################
 # ################################################################################################################################
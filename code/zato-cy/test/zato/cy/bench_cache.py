@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+# stdlib
+from random import Random
+from timeit import default_timer
+
+# Zato
+from zato.cache import Cache
+
+# ################################################################################################################################
+
+# How many operations to run for each cache size, half of them are .set and half are .get calls
+total_ops = 1000000
+
+# Cache sizes to check
+cache_sizes = [1000, 10000, 100000, 1000000]
+
+# ################################################################################################################################
+
+def run_bench(max_size, total_ops=total_ops):
+    """ Runs total_ops set/get operations against a cache of max_size entries and returns the time it took, in seconds.
+    Keys are drawn from a range twice the cache's size so that both hits and evictions take place.
+    """
+    random = Random(max_size)
+    keys = ['key.{}'.format(random.randint(0, max_size * 2)) for x in range(total_ops // 2)]
+
+    c = Cache(max_size)
+
+    # Pre-fill the cache so that each .set is measured on a cache that is already full
+    for idx in range(max_size):
+        c.set('key.{}'.format(idx), idx, 0.0, None)
+
+    start = default_timer()
+
+    for key in keys:
+        c.set(key, key, 0.0, None)
+        c.get(key, None, False)
+
+    return default_timer() - start
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+
+    for max_size in cache_sizes:
+        taken = run_bench(max_size)
+        print('max_size:{:>8}, ops:{}, taken:{:.3f}s, ops/s:{:.0f}'.format(max_size, total_ops, taken, total_ops / taken))
+
+# ################################################################################################################################
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from random import Random
+from timeit import default_timer
+
+# Zato
+from zato.url_dispatcher import CyURLData, Matcher
+
+# ################################################################################################################################
+
+# How many channels to match URL paths against
+total_channels = 10000
+
+# How many URL paths to match with the router
+total_ops = 10000
+
+# How many URL paths to match without it - fewer because each of them takes thousands of regex calls
+total_linear_ops = 100
+
+# Channels accept any of these methods, which is what match targets of channels without a method contain
+methods_any = '(GET|POST|PUT|DELETE|PATCH)'
+
+# ################################################################################################################################
+
+class URLData(CyURLData):
+    """ CyURLData is always subclassed by servers, which among other things gives its instances their __dict__.
+    """
+
+# ################################################################################################################################
+
+def get_channel_data(total_channels):
+    """ Returns configuration of REST channels, each of them with a path parameter, sorted by name as servers do.
+    """
+    channel_data = []
+
+    for idx in range(total_channels):
+        match_target = ':::{}:::haanyHTTP_SEPhaany:::/api/resource{}/{{id}}/details'.format(methods_any, idx)
+        channel_data.append({
+            'name': 'channel.{:05}'.format(idx),
+            'match_target': match_target,
+            'match_target_compiled': Matcher(match_target, True),
+        })
+
+    return channel_data
+
+# ################################################################################################################################
+
+def match_linear(channel_data, target):
+    """ Matches a target the way CyURLData did before it had a router, i.e. by running each channel's regex in turn.
+    """
+    for item in channel_data:
+        match = item['match_target_compiled'].match(target)
+        if match is not None:
+            return match, item
+
+    return None, None
+
+# ################################################################################################################################
+
+def run_bench(total_channels=total_channels, total_ops=total_ops, total_linear_ops=total_linear_ops):
+    """ Matches URL paths against total_channels channels, with and without the router, and returns the time each
+    approach took, in seconds. Each URL path has a different path parameter so none of them is ever cached.
+    """
+    random = Random(total_channels)
+    channel_data = get_channel_data(total_channels)
+    url_data = URLData(channel_data)
+    url_paths = ['/api/resource{}/{}/details'.format(random.randrange(total_channels), idx) for idx in range(total_ops)]
+
+    # Build the router upfront so that it is not included in the results
+    url_data.match('/api/resource0/0/details', '', 'GET', '*/*', False)
+
+    start = default_timer()
+    for url_path in url_paths:
+        url_data.match(url_path, '', 'GET', '*/*', False)
+    taken_router = default_timer() - start
+
+    start = default_timer()
+    for url_path in url_paths[:total_linear_ops]:
+        match_linear(channel_data, ':::GET:::*/*:::{}'.format(url_path))
+    taken_linear = default_timer() - start
+
+    return taken_router, taken_linear
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+
+    taken_router, taken_linear = run_bench()
+    print('channels:{}'.format(total_channels))
+    print('router: ops:{:>6}, taken:{:.3f}s, ops/s:{:.0f}'.format(total_ops, taken_router, total_ops / taken_router))
+    print('linear: ops:{:>6}, taken:{:.3f}s, ops/s:{:.0f}'.format(total_linear_ops, taken_linear, total_linear_ops / taken_linear))
+
+# ################################################################################################################################
@@ -8,6 +8,9 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 
 # stdlib
 from decimal import Decimal
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
 from time import sleep
 from unittest import main as unittest_main, TestCase
 from uuid import uuid4
@@ -480,6 +483,358 @@ class CacheTestCace(TestCase):
         returned1 = c.get(key1, None, False)
         self.assertIs(returned1, expected1)
 
+# ################################################################################################################################
+
+    def test_lru_order_after_many_operations(self):
+
+        # Enough operations to make the cache renumber its internal stamps several times
+        max_size = 50
+        iters = 10000
+
+        c = Cache(max_size)
+        expected = [] # Keys from the most to the least recently used one, computed independently of the cache
+
+        for idx in range(iters):
+
+            key = 'key{}'.format((idx * 7) % (max_size * 2))
+
+            if idx % 3:
+                c.set(key, idx, 0.0, None)
+                if key not in expected:
+                    expected.insert(0, key)
+                    del expected[max_size:]
+            elif key in expected:
+                expected_position = expected.index(key)
+                self.assertEquals(c.index(key), expected_position)
+                self.assertEquals(c.get(key, None, True).position, expected_position)
+                expected.remove(key)
+                expected.insert(0, key)
+
+            if idx % 97 == 0 and expected:
+                c.delete(expected.pop())
+
+        self.assertEquals(len(c), len(expected))
+        self.assertListEqual(c.keys_by_position(), expected)
+
+        for position, key in enumerate(expected):
+            self.assertEquals(c.index(key), position)
+
+        self.assertListEqual([elem['position'] for elem in c.get_slice(None, None, None)], list(range(len(expected))))
+
+# ################################################################################################################################
+
+    def test_clear_resets_lru_order(self):
+
+        c = Cache()
+        c.set('key1', 'value1', 0.0, None)
+        c.set('key2', 'value2', 0.0, None)
+        c.clear()
+
+        self.assertListEqual(c.keys_by_position(), [])
+
+        c.set('key3', 'value3', 0.0, None)
+        c.set('key4', 'value4', 0.0, None)
+        c.get('key3', None, False)
+
+        self.assertListEqual(c.keys_by_position(), ['key3', 'key4'])
+        self.assertEquals(c.index('key4'), 1)
+
+# ################################################################################################################################
+
+    def _get_key_index_caches(self):
+
+        keys = ['customer.{}.{}'.format(idx, name) for idx in range(50) for name in ('address', 'orders', 'email')]
+        keys.append(123)
+        keys.append('abc')
+
+        c1 = Cache()
+        c2 = Cache(needs_key_index=True)
+
+        for c in c1, c2:
+            for key in keys:
+                c.set(key, 'value', 0.0, None)
+
+            # Deleted keys must not be returned by the index either
+            c.delete('customer.7.orders')
+
+        return c1, c2
+
+# ################################################################################################################################
+
+    def test_key_index_get(self):
+
+        c1, c2 = self._get_key_index_caches()
+
+        self.assertDictEqual(c1.get_by_prefix('customer.1', False, 0), c2.get_by_prefix('customer.1', False, 0))
+        self.assertDictEqual(c1.get_by_suffix('.orders', False, 0), c2.get_by_suffix('.orders', False, 0))
+        self.assertDictEqual(c1.get_contains('4.add', False, 0), c2.get_contains('4.add', False, 0))
+        self.assertDictEqual(c1.get_contains('ab', False, 0), c2.get_contains('ab', False, 0))
+        self.assertDictEqual(c1.get_contains('no.such.key', False, 0), c2.get_contains('no.such.key', False, 0))
+        self.assertDictEqual(
+            c1.get_contains_all(['1', 'email'], False, 0), c2.get_contains_all(['1', 'email'], False, 0))
+        self.assertDictEqual(
+            c1.get_contains_any(['33.', 'ord'], False, 0), c2.get_contains_any(['33.', 'ord'], False, 0))
+
+        self.assertEquals(len(c2.get_by_prefix('customer.', False, 0)), 149)
+        self.assertEquals(len(c2.get_by_prefix('customer.', False, 10)), 10)
+        self.assertEquals(len(c2.get_by_suffix('.orders', False, 5)), 5)
+        self.assertEquals(len(c2.get_contains('.1.', False, 2)), 2)
+
+# ################################################################################################################################
+
+    def test_key_index_delete_and_evict(self):
+
+        c1, c2 = self._get_key_index_caches()
+
+        self.assertDictEqual(c1.delete_by_prefix('customer.2', True, 0), c2.delete_by_prefix('customer.2', True, 0))
+        self.assertDictEqual(c1.get_by_prefix('customer.2', False, 0), {})
+        self.assertDictEqual(c2.get_by_prefix('customer.2', False, 0), {})
+        self.assertListEqual(sorted(c1.keys(), key=str), sorted(c2.keys(), key=str))
+
+        c = Cache(2, needs_key_index=True)
+        c.set('key1', 'value1', 0.0, None)
+        c.set('key2', 'value2', 0.0, None)
+        c.set('key3', 'value3', 0.0, None)
+
+        # key1 was evicted so it cannot be found through the index
+        self.assertDictEqual(c.get_by_prefix('key', False, 0), {'key2':'value2', 'key3':'value3'})
+
+        c.clear()
+        self.assertDictEqual(c.get_by_prefix('key', False, 0), {})
+
+# ################################################################################################################################
+
+    def test_delete_expired_heap(self):
+
+        c = Cache()
+        self.assertEquals(c.get_next_expires_at(), 0.0)
+
+        c.set('key1', 'value1', 0.03, None)
+        c.set('key2', 'value2', 0.0, None)
+        c.set('key3', 'value3', 10.0, None)
+        c.set('key4', 'value4', 0.03, None)
+        c.set('key5', 'value5', 0.03, None)
+
+        next_expires_at = c.get_next_expires_at()
+        self.assertTrue(c.get_timestamp() < next_expires_at < c.get_timestamp() + 0.03)
+
+        # Prolong expiry of key4 after it has been already scheduled, delete key5 and re-add it with no expiry
+        c.set_expiration_data('key4', 10.0, c.get_timestamp() + 10.0)
+        c.delete('key5')
+        c.set('key5', 'value5', 0.0, None)
+
+        sleep(0.05)
+
+        deleted = c.delete_expired()
+        self.assertListEqual(deleted, ['key1'])
+        self.assertEquals(sorted(c.keys()), ['key2', 'key3', 'key4', 'key5'])
+
+        # key3 and key4 are still in the heap, both to expire in about 10 seconds
+        self.assertTrue(c.get_timestamp() + 9 < c.get_next_expires_at())
+
+        c.clear()
+        self.assertEquals(c.get_next_expires_at(), 0.0)
+
+# ################################################################################################################################
+
+    def test_max_bytes(self):
+
+        value = 'a' * 100
+
+        c = Cache(max_bytes=1000)
+        c.set('key1', value, 0.0, None)
+
+        entry_size = c.current_bytes
+        self.assertTrue(entry_size > 100)
+
+        # Only as many entries as fit in the budget are kept, least recently used ones are evicted first
+        max_entries = 1000 // entry_size
+
+        for idx in range(2, max_entries + 3):
+            c.set('key{}'.format(idx), value, 0.0, None)
+
+        self.assertEquals(len(c), max_entries)
+        self.assertEquals(c.current_bytes, entry_size * max_entries)
+        self.assertNotIn('key1', c)
+        self.assertIn('key{}'.format(max_entries + 2), c)
+
+        # Updating a value keeps the total in sync
+        c.set('key{}'.format(max_entries + 2), '', 0.0, None)
+        self.assertEquals(c.current_bytes, entry_size * (max_entries - 1) + entry_size - 100)
+
+        c.delete('key{}'.format(max_entries + 2))
+        self.assertEquals(c.current_bytes, entry_size * (max_entries - 1))
+
+        # Entries bigger than the whole budget are rejected
+        self.assertRaises(ValueError, c.set, 'key_big', 'a' * 1000, 0.0, None)
+        self.assertEquals(len(c), max_entries - 1)
+
+        c.clear()
+        self.assertEquals(c.current_bytes, 0)
+
+# ################################################################################################################################
+
+    def test_max_bytes_set_by(self):
+
+        params = (
+            ('set_by_prefix', 'key.'),
+            ('set_by_suffix', ''),
+            ('set_by_regex', r'key\.\d'),
+            ('set_contains', '.'),
+            ('set_not_contains', 'abc'),
+            ('set_contains_all', ['key', '.']),
+            ('set_contains_any', ['key']),
+        )
+
+        for name, data in params:
+            for return_found in True, False:
+
+                c = Cache(max_bytes=1000)
+                for key in 'key.1', 'key.2', 'key.3':
+                    c.set(key, 'a', 0.0, None)
+
+                # The first key updated is so big that the other ones, still to be updated, are evicted to make room for it,
+                # after which they are neither returned nor added back.
+                out = getattr(c, name)(data, 'a' * 900, 0.0, False, None, return_found, 0)
+
+                self.assertEquals(c.keys(), ['key.1'], name)
+                self.assertDictEqual(out, {'key.1':'a'} if return_found else {}, name)
+                self.assertTrue(c.current_bytes <= 1000, name)
+
+# ################################################################################################################################
+
+    def test_get_set_delete_many(self):
+
+        c = Cache()
+        c.set('key0', 'value0', 0.0, None)
+
+        prev = c.set_many({'key0':'new0', 'key1':'value1', 'key2':None, 'key3':'value3'}, 0.0, False)
+        self.assertDictEqual(prev, {'key0':'value0', 'key1':None, 'key2':None, 'key3':None})
+        self.assertEquals(len(c), 4)
+
+        # Keys with None values are returned, missing keys are not
+        self.assertDictEqual(c.get_many(['key0', 'key2', 'key4'], False), {'key0':'new0', 'key2':None})
+
+        # All keys set in one call have the same last write time
+        entries = c.get_many(['key1', 'key3'], True)
+        self.assertEquals(entries['key1'].last_write, entries['key3'].last_write)
+
+        meta_ref = {}
+        deleted = c.delete_many(['key1', 'key3', 'key4'], True, meta_ref)
+        self.assertDictEqual(deleted, {'key1':'value1', 'key3':'value3'})
+        self.assertListEqual(meta_ref['keys'], ['key1', 'key3'])
+        self.assertEquals(sorted(c.keys()), ['key0', 'key2'])
+
+        # Expired keys are not returned
+        c.set_many({'key5':'value5', 'key6':'value6'}, 0.01, False)
+        sleep(0.02)
+        self.assertDictEqual(c.get_many(['key5', 'key6', 'key0'], False), {'key0':'new0'})
+
+# ################################################################################################################################
+
+    def test_set_many_invalid(self):
+
+        c = Cache(max_item_size=5)
+        c.set('key0', 'value', 0.0, None)
+
+        # Nothing is set if any of the entries is invalid, no matter which one it is
+        for data in ({'key0':'new', 'key1':'value1'}, {'key0':'new', 2.0:'value'}, {'key0':'new', 'key1':'a', 'key2':'a' * 6}):
+            self.assertRaises(ValueError, c.set_many, data, 0.0, False)
+            self.assertEquals(c.keys(), ['key0'])
+            self.assertEquals(c.get('key0', None, False), 'value')
+
+        c = Cache(max_bytes=1000)
+        self.assertRaises(ValueError, c.set_many, {'key0':'a', 'key1':'a' * 1000}, 0.0, False)
+        self.assertEquals(len(c), 0)
+        self.assertEquals(c.current_bytes, 0)
+
+# ################################################################################################################################
+
+    def test_tinylfu(self):
+
+        lru = Cache(100)
+        tinylfu = Cache(100, eviction_policy='tiny-lfu')
+
+        hot_keys = ['hot.{}'.format(idx) for idx in range(60)]
+        scan_keys = ['scan.{}'.format(idx) for idx in range(5000)]
+
+        for c in lru, tinylfu:
+            for key in hot_keys:
+                c.set(key, key, 0.0, None)
+
+            # A batch job reads a lot of keys, each of them once only, while hot keys are still in use
+            for idx, key in enumerate(scan_keys):
+                c.get(key, None, False)
+                c.set(key, key, 0.0, None)
+
+                hot_key = hot_keys[idx % len(hot_keys)]
+                if c.get(hot_key, None, False) is None:
+                    c.set(hot_key, hot_key, 0.0, None)
+
+        # With plain LRU the one-off keys push out the hot ones, TinyLFU keeps them and rejects the one-off keys instead
+        self.assertFalse(all(key in lru for key in hot_keys))
+        self.assertTrue(all(key in tinylfu for key in hot_keys))
+        self.assertEquals(len(tinylfu), 100)
+        self.assertTrue(tinylfu.rejected > 0)
+
+        lru_ratios = lru.get_hit_ratios()
+        tinylfu_ratios = tinylfu.get_hit_ratios()
+
+        # TinyLFU also reports what plain LRU would have achieved for the same operations
+        self.assertEquals(lru_ratios['hit_ratio'], lru_ratios['lru_hit_ratio'])
+        self.assertAlmostEqual(tinylfu_ratios['lru_hit_ratio'], lru_ratios['hit_ratio'])
+        self.assertTrue(tinylfu_ratios['hit_ratio'] > tinylfu_ratios['lru_hit_ratio'] + 40)
+
+        tinylfu.clear()
+        self.assertEquals(tinylfu.get_hit_ratios()['hit_ratio'], 0.0)
+
+# ################################################################################################################################
+
+    def test_snapshot(self):
+
+        tmp_dir = mkdtemp()
+        path = join(tmp_dir, 'snapshot', 'cache.snapshot')
+
+        try:
+            c1 = Cache(extend_expiry_on_get=False)
+
+            # Nothing to load yet
+            self.assertEquals(c1.load_snapshot(path), 0)
+
+            c1.set('key1', 'value1', 0.0, None)
+            c1.set('key2', {'a':1, 'b':[2, 3]}, 0.0, None)
+            c1.set(123, 'value3', 10.0, None)
+            c1.set('key4', 'value4', 0.01, None)
+            c1.set('key5', 'value5', 0.0, None)
+
+            # Make key1 the most recently used one
+            c1.get('key1', None, False)
+
+            sleep(0.02)
+
+            # key4 expired so it is not saved
+            self.assertEquals(c1.dump_snapshot(path), 4)
+
+            c2 = Cache(extend_expiry_on_get=False)
+            c2.set('key5', 'new5', 0.0, None)
+
+            yields = []
+            self.assertEquals(c2.load_snapshot(path, 2, lambda: yields.append(None)), 3)
+            self.assertEquals(len(yields), 2)
+
+            self.assertListEqual(c2.keys_by_position(), ['key1', 123, 'key2', 'key5'])
+            self.assertDictEqual(c2.get('key2', None, False), {'a':1, 'b':[2, 3]})
+
+            # A key that was set before the snapshot was loaded keeps its value
+            self.assertEquals(c2.get('key5', None, False), 'new5')
+
+            # Entries are to expire when they would have in the original cache
+            self.assertEquals(c2.get(123, None, True).expires_at, c1.get(123, None, True).expires_at)
+            self.assertEquals(c2.get_next_expires_at(), c1.get(123, None, True).expires_at)
+
+        finally:
+            rmtree(tmp_dir)
+
 # ################################################################################################################################
 
 if __name__ == '__main__':
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from operator import getitem, setitem
+from unittest import main as unittest_main, TestCase
+
+# Zato
+from zato.url_dispatcher import ChannelItem, CyURLData, Matcher, Router
+
+# ################################################################################################################################
+
+methods_any = '(GET|POST|PUT|DELETE)'
+
+# ################################################################################################################################
+
+class URLData(CyURLData):
+    pass
+
+# ################################################################################################################################
+
+def get_channel_data(*config):
+    """ Returns channel configuration out of (name, match_target, match_slash) tuples.
+    """
+    out = []
+    for name, match_target, match_slash in config:
+        out.append({
+            'id': name,
+            'name': name,
+            'match_target': match_target,
+            'match_target_compiled': Matcher(match_target, match_slash),
+        })
+    return out
+
+# ################################################################################################################################
+
+def match_linear(channel_data, target):
+    for item in channel_data:
+        match = item['match_target_compiled'].match(target)
+        if match is not None:
+            return match, item
+    return None, None
+
+# ################################################################################################################################
+
+class RouterTestCase(TestCase):
+
+    def setUp(self):
+        self.channel_data = get_channel_data(
+            ('static', ':::GET:::haanyHTTP_SEPhaany:::/api/customer', True),
+            ('param', ':::GET:::haanyHTTP_SEPhaany:::/api/customer/{id}', False),
+            ('param_slash', ':::{}:::haanyHTTP_SEPhaany:::/api/customer/{{id}}/orders'.format(methods_any), True),
+            ('regex', ':::POST:::haanyHTTP_SEPhaany:::/api/v1.0/customer', True),
+            ('soap', 'urn:get:::POST:::haanyHTTP_SEPhaany:::/soap', True),
+            ('soap_regex', 'urn:get.customer:::POST:::haanyHTTP_SEPhaany:::/soap', True),
+        )
+
+    def test_get_candidates(self):
+        router = Router(self.channel_data)
+
+        # The SOAP action with a regex metacharacter is always a candidate
+        self.assertListEqual(router.get_candidates('', 'GET', '/api/customer'), [0, 5])
+        self.assertListEqual(router.get_candidates('', 'GET', '/api/customer/123'), [1, 5])
+        self.assertListEqual(router.get_candidates('', 'PUT', '/api/customer/123'), [5])
+        self.assertListEqual(router.get_candidates('', 'PUT', '/api/customer/1/2/orders'), [2, 5])
+        self.assertListEqual(router.get_candidates('', 'POST', '/api/v1x0/customer'), [3, 5])
+        self.assertListEqual(router.get_candidates('urn:get', 'POST', '/soap'), [4, 5])
+        self.assertListEqual(router.get_candidates('', 'GET', '/other'), [5])
+
+    def test_can_route(self):
+        router = Router(self.channel_data)
+
+        self.assertTrue(router.can_route('', 'GET', '*/*', '/api/customer'))
+        self.assertTrue(router.can_route('urn:get', 'POST', '*/*', '/soap'))
+
+        self.assertFalse(router.can_route('', 'GET', '*/*', '/api/customer:batch'))
+        self.assertFalse(router.can_route('', 'GET', '*/*', '/api/customer\n'))
+        self.assertFalse(router.can_route('urn::get', 'POST', '*/*', '/soap'))
+        self.assertFalse(router.can_route('urn:get:', 'POST', '*/*', '/soap'))
+
+    def test_match_same_as_linear(self):
+        url_data = URLData(self.channel_data)
+
+        for soap_action, http_method, url_path in (
+            ('', 'GET', '/api/customer'),
+            ('', 'GET', '/api/customer/123'),
+            ('', 'GET', '/api/customer/1/2'),
+            ('', 'DELETE', '/api/customer/1/2/orders'),
+            ('', 'POST', '/api/v1x0/customer'),
+            ('', 'POST', '/api/customer:batch'),
+            ('urn:get', 'POST', '/soap'),
+            ('urn:getxcustomer', 'POST', '/soap'),
+            ('', 'GET', '/other'),
+            ):
+
+            target = ':::'.join((soap_action, http_method, '*/*', url_path))
+            expected_match, expected_item = match_linear(self.channel_data, target)
+            match, channel_item = url_data.match(url_path, soap_action, http_method, '*/*', bool(soap_action))
+
+            self.assertEqual(match, expected_match)
+            self.assertEqual(channel_item and channel_item.to_dict(), expected_item)
+
+    def test_clear_router(self):
+        url_data = URLData(self.channel_data)
+        self.assertEqual(url_data.match('/new', '', 'GET', '*/*', False), (None, None))
+
+        url_data.channel_data.extend(get_channel_data(('new', ':::GET:::haanyHTTP_SEPhaany:::/new', True)))
+
+        # The router still has the previous channels until it is cleared
+        self.assertEqual(url_data.match('/new', '', 'GET', '*/*', False), (None, None))
+
+        url_data.clear_router()
+        self.assertEqual(url_data.match('/new', '', 'GET', '*/*', False)[1]['name'], 'new')
+
+# ################################################################################################################################
+
+class ChannelItemTestCase(TestCase):
+
+    def test_access(self):
+        config = {'name': 'my.channel', 'cache_type': None, 'cache_single_flight': True}
+        channel_item = ChannelItem(config)
+
+        self.assertEqual(channel_item.name, 'my.channel')
+        self.assertEqual(channel_item['name'], 'my.channel')
+        self.assertIsNone(channel_item.cache_type)
+        self.assertIs(channel_item.cache_single_flight, True)
+        self.assertIs(channel_item['cache_single_flight'], True)
+        self.assertIs(channel_item.get('cache_single_flight'), True)
+        self.assertEqual(channel_item.get('sec_type', 'abc'), 'abc')
+        self.assertIn('cache_type', channel_item)
+        self.assertNotIn('sec_type', channel_item)
+        self.assertListEqual(sorted(channel_item.items()), sorted(config.items()))
+
+        self.assertRaises(AttributeError, getattr, channel_item, 'sec_type')
+        self.assertRaises(KeyError, getitem, channel_item, 'sec_type')
+
+    def test_immutable(self):
+        config = {'name': 'my.channel', 'cache_single_flight': True}
+        channel_item = ChannelItem(config)
+
+        self.assertRaises(AttributeError, setattr, channel_item, 'name', 'new.name')
+        self.assertRaises(AttributeError, setattr, channel_item, 'cache_single_flight', False)
+        self.assertRaises(TypeError, setitem, channel_item, 'name', 'new.name')
+
+        # Changes to the configuration it was created from are not reflected in the channel item
+        config['name'] = 'new.name'
+        self.assertEqual(channel_item.name, 'my.channel')
+
+    def test_match_returns_the_same_object(self):
+        url_data = URLData(get_channel_data(('static', ':::GET:::haanyHTTP_SEPhaany:::/api/customer', True)), 0)
+
+        _, channel_item1 = url_data.match('/api/customer', '', 'GET', '*/*', False)
+        _, channel_item2 = url_data.match('/api/customer', '', 'GET', '*/*', False)
+
+        self.assertIsInstance(channel_item1, ChannelItem)
+        self.assertIs(channel_item1, channel_item2)
+
+# ################################################################################################################################
+
+class URLPathCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.channel_data = get_channel_data(
+            ('static', ':::GET:::haanyHTTP_SEPhaany:::/api/customer', True),
+            ('param', ':::GET:::haanyHTTP_SEPhaany:::/api/customer/{id}', False),
+        )
+
+    def test_dynamic_match_cached(self):
+        url_data = URLData(self.channel_data)
+
+        match, item = url_data.match('/api/customer/123', '', 'GET', '*/*', False)
+        self.assertDictEqual(match, {'id': '123'})
+
+        # Callers add their own parameters to path parameters - this must not be reflected in the cache
+        match['from_query_string'] = 'abc'
+
+        match, cached_item = url_data.match('/api/customer/123', '', 'GET', '*/*', False)
+        self.assertDictEqual(match, {'id': '123'})
+        self.assertIs(cached_item, item)
+
+        self.assertDictEqual(url_data.get_url_path_cache_stats(), {
+            'size': 1,
+            'max_size': 10000,
+            'hits': 1,
+            'misses': 1,
+        })
+
+    def test_lru_eviction(self):
+        url_data = URLData(self.channel_data, 2)
+
+        url_data.match('/api/customer/1', '', 'GET', '*/*', False)
+        url_data.match('/api/customer/2', '', 'GET', '*/*', False)
+
+        # Reading it moves 1 to the end so that 2 is the least recently used one now
+        url_data.match('/api/customer/1', '', 'GET', '*/*', False)
+        url_data.match('/api/customer', '', 'GET', '*/*', False)
+
+        self.assertListEqual(list(url_data.url_path_cache), [
+            ':::GET:::*/*:::/api/customer/1',
+            ':::GET:::*/*:::/api/customer',
+        ])
+
+    def test_no_cache(self):
+        url_data = URLData(self.channel_data, 0)
+
+        url_data.match('/api/customer/1', '', 'GET', '*/*', False)
+        url_data.match('/api/customer/1', '', 'GET', '*/*', False)
+
+        self.assertEqual(len(url_data.url_path_cache), 0)
+        self.assertEqual(url_data.url_path_cache_misses, 2)
+
+    def test_remove_from_cache(self):
+        url_data = URLData(self.channel_data)
+
+        url_data.match('/api/customer', '', 'GET', '*/*', False)
+        url_data.match('/api/customer/1', '', 'GET', '*/*', False)
+        url_data.match('/api/customer/me', '', 'GET', '*/*', False)
+
+        # Targets matched by a channel are removed when it is edited or deleted
+        url_data._remove_from_cache(':::GET:::haanyHTTP_SEPhaany:::/api/customer/{id}')
+        self.assertListEqual(list(url_data.url_path_cache), [':::GET:::*/*:::/api/customer'])
+
+        url_data.match('/api/customer/1', '', 'GET', '*/*', False)
+        url_data.match('/api/customer/me', '', 'GET', '*/*', False)
+
+        # A new channel shadows the targets that it matches even if they were matched by another one
+        new_match_target = ':::GET:::haanyHTTP_SEPhaany:::/api/customer/me'
+        url_data.channel_data.insert(0, get_channel_data(('new', new_match_target, True))[0])
+        url_data.clear_router()
+        url_data._remove_from_cache(new_match_target)
+
+        self.assertListEqual(list(url_data.url_path_cache), [
+            ':::GET:::*/*:::/api/customer',
+            ':::GET:::*/*:::/api/customer/1',
+        ])
+        self.assertEqual(url_data.match('/api/customer/me', '', 'GET', '*/*', False)[1]['name'], 'new')
+
+    def test_reverse_index(self):
+        url_data = URLData(self.channel_data, 2)
+
+        url_data.match('/api/customer', '', 'GET', '*/*', False)
+        url_data.match('/api/customer/1', '', 'GET', '*/*', False)
+        url_data.match('/api/customer/2', '', 'GET', '*/*', False)
+
+        # The first target was evicted so it is not in the index either
+        self.assertDictEqual(url_data.url_path_cache_by_channel, {
+            'param': {':::GET:::*/*:::/api/customer/1', ':::GET:::*/*:::/api/customer/2'},
+        })
+
+        url_data._remove_from_cache(':::GET:::haanyHTTP_SEPhaany:::/api/customer/{id}')
+        self.assertDictEqual(url_data.url_path_cache_by_channel, {})
+        self.assertEqual(len(url_data.url_path_cache), 0)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    unittest_main()
+
+# ################################################################################################################################
@@ -59,6 +59,7 @@ from zato.server.base.parallel.http import HTTPHandler
 from zato.server.base.parallel.subprocess_.ibm_mq import IBMMQIPC
 from zato.server.base.parallel.subprocess_.sftp import SFTPIPC
 from zato.server.pickup import PickupManager
+from zato.server.stats import LatencyStats, SampleStore, ServiceStats
 
 # ################################################################################################################################
 
@@ -165,6 +166,9 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         self.startup_callable_tool = None
         self.default_internal_pubsub_endpoint_id = None
         self.rate_limiting = None # type: RateLimiting
+        self.service_stats = None # type: ServiceStats
+        self.latency_stats = None # type: LatencyStats
+        self.sample_store = None # type: SampleStore
         self.jwt_secret = None # type: bytes
         self._hash_secret_method = None
         self._hash_secret_rounds = None
@@ -386,6 +390,17 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         # TimeUtil needs self.kvdb so it can be set now
         self.time_util = TimeUtil(self.kvdb)
 
+        # Statistics of services invoked in this process, flushed to KVDB every flush_interval seconds ..
+        stats_config = self.fs_server_config.get('stats', {})
+        self.service_stats = ServiceStats(self.kvdb, float(stats_config.get('flush_interval', 5)))
+
+        # .. and their live processing times, never stored anywhere ..
+        self.latency_stats = LatencyStats(float(stats_config.get('latency_window', 60)))
+
+        # .. as well as sample requests/responses and slow responses, flushed to KVDB the same way as statistics.
+        self.sample_store = SampleStore(
+            self.kvdb, self.service_stats.flush_interval, int(stats_config.get('sample_buffer_size', 1000)))
+
         # Service sources
         self.service_sources = []
         for name in open(os.path.join(self.repo_location, self.fs_server_config.main.service_sources)):
@@ -523,6 +538,9 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         # Finally, assign it to ServiceStore
         self.service_store.max_batch_size = max_batch_size
 
+        # How many idle instances of each service that recycles its instances to keep, added in 3.1, hence optional
+        self.service_store.instance_pool_size = int(self.fs_server_config.misc.get('service_instance_pool_size', 16))
+
         # Rate limiting
         self.rate_limiting = RateLimiting()
         self.rate_limiting.cluster_id = self.cluster_id
@@ -650,6 +668,11 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
         self.ipc_api.on_message_callback = self.worker_store.on_ipc_message
         spawn_greenlet(self.ipc_api.run)
 
+        # Flush statistics periodically if they are collected at all, and samples always
+        if self.component_enabled.stats:
+            spawn_greenlet(self.service_stats.run)
+        spawn_greenlet(self.sample_store.run)
+
         self.startup_callable_tool.invoke(SERVER_STARTUP.PHASE.AFTER_STARTED, kwargs={
             'parallel_server': self,
         })
@@ -1007,6 +1030,20 @@ class ParallelServer(BrokerMessageReceiver, ConfigLoader, HTTPHandler):
             else:
                 self._is_process_closing = True
 
+            # Other workers are still to receive changes to caches made in this one
+            self.worker_store.cache_api.publish_sync_batch()
+
+            # Save builtin caches so that they can be loaded back after a restart
+            self.worker_store.cache_api.dump_snapshots()
+
+            # Caches in shared memory are removed by the last process using them
+            self.worker_store.cache_api.close_shmem()
+
+            # Write out statistics and samples not flushed yet
+            if self.component_enabled.stats:
+                self.service_stats.stop()
+            self.sample_store.stop()
+
             # Close SQL pools
             self.sql_pool_store.cleanup_on_stop()
 
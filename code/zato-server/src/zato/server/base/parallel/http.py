@@ -14,9 +14,6 @@ from http.client import INTERNAL_SERVER_ERROR, responses
 from logging import getLogger, INFO
 from traceback import format_exc
 
-# pytz
-from pytz import UTC
-
 # tzlocal
 from tzlocal import get_localzone
 
@@ -27,6 +24,8 @@ from past.builtins import unicode
 # Zato
 from zato.common import NO_REMOTE_ADDRESS
 from zato.common.util import new_cid
+from zato.common.util.time_ import LocalTimeCache
+from zato.server.service.reqresp import stream_payload
 
 # ################################################################################################################################
 
@@ -36,21 +35,24 @@ logger = getLogger(__name__)
 
 ACCESS_LOG_DT_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
 
+# Local timestamps of requests and their access log representation only change once a second
+local_time_cache = LocalTimeCache(get_localzone(), ACCESS_LOG_DT_FORMAT)
+
 # ################################################################################################################################
 
 class HTTPHandler(object):
     """ Handles incoming HTTP requests.
     """
-    def on_wsgi_request(self, wsgi_environ, start_response, _new_cid=new_cid, _local_zone=get_localzone(),
-        _utcnow=datetime.utcnow, _INFO=INFO, _UTC=UTC, _ACCESS_LOG_DT_FORMAT=ACCESS_LOG_DT_FORMAT,
-        _no_remote_address=NO_REMOTE_ADDRESS, **kwargs):
+    def on_wsgi_request(self, wsgi_environ, start_response, _new_cid=new_cid, _local_zone=local_time_cache.local_tz,
+        _utcnow=datetime.utcnow, _INFO=INFO, _to_local=local_time_cache.to_local, _format_ts=local_time_cache.format,
+        _no_remote_address=NO_REMOTE_ADDRESS, _stream_payload=stream_payload, **kwargs):
         """ Handles incoming HTTP requests.
         """
-        cid = kwargs.get('cid', _new_cid())
+        cid = kwargs['cid'] if 'cid' in kwargs else _new_cid()
         request_ts_utc = _utcnow()
         wsgi_environ['zato.local_tz'] = _local_zone
         wsgi_environ['zato.request_timestamp_utc'] = request_ts_utc
-        wsgi_environ['zato.request_timestamp'] = request_ts_local = request_ts_utc.replace(tzinfo=_UTC).astimezone(_local_zone)
+        wsgi_environ['zato.request_timestamp'] = _to_local(request_ts_utc)
 
         wsgi_environ['zato.http.response.headers'] = {'X-Zato-CID': cid}
 
@@ -86,23 +88,32 @@ class HTTPHandler(object):
 
         start_response(wsgi_environ['zato.http.response.status'], iteritems(wsgi_environ['zato.http.response.headers']))
 
-        if isinstance(payload, unicode):
-            payload = payload.encode('utf-8')
+        # Streamed responses are sent in chunks, with chunked transfer encoding, so their size is not known upfront
+        if isinstance(payload, _stream_payload):
+            response = payload
+            response_size = '-'
+        else:
+            if isinstance(payload, unicode):
+                payload = payload.encode('utf-8')
+            response = [payload]
+            response_size = len(payload)
 
         if self.needs_access_log:
 
+            req_timestamp_utc, req_timestamp = _format_ts(request_ts_utc)
+
             self.access_logger_log(_INFO, '', None, None, {
                 'remote_ip': remote_addr,
                 'cid_resp_time': '%s/%s' % (cid, (_utcnow() - request_ts_utc).total_seconds()),
                 'channel_name': channel_name,
-                'req_timestamp_utc': request_ts_utc.strftime(_ACCESS_LOG_DT_FORMAT),
-                'req_timestamp': request_ts_local.strftime(_ACCESS_LOG_DT_FORMAT),
+                'req_timestamp_utc': req_timestamp_utc,
+                'req_timestamp': req_timestamp,
                 'method': wsgi_environ['REQUEST_METHOD'],
                 'path': wsgi_environ['PATH_INFO'],
                 'http_version': wsgi_environ['SERVER_PROTOCOL'],
                 'status_code': wsgi_environ['zato.http.response.status'].split()[0],
-                'response_size': len(payload),
+                'response_size': response_size,
                 'user_agent': wsgi_environ.get('HTTP_USER_AGENT', '(None)'),
             })
 
-        return [payload]
+        return response
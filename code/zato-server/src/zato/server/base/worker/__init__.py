@@ -1561,8 +1561,11 @@ class WorkerStore(_WorkerStoreBase, BrokerMessageReceiver):
 
             self.broker_client.invoke_async(cb_msg)
 
+        response = service.response
+        self.server.service_store.release_instance(service)
+
         if kwargs.get('needs_response'):
-            return service.response.payload
+            return response.payload
 
 # ################################################################################################################################
 
@@ -11,8 +11,12 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 from base64 import b64decode
 
+# Bunch
+from bunch import bunchify
+
 # Zato
 from zato.common import CACHE
+from zato.common.broker_message import code_to_name
 from zato.server.base.worker.common import WorkerImpl
 
 # Python 2/3 compatibility
@@ -42,9 +46,39 @@ class CacheBuiltin(WorkerImpl):
 # ################################################################################################################################
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_GET(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             self.cache_api.sync_after_get(_BUILTIN, msg)
 
+# ################################################################################################################################
+
+    def _needs_sync(self, msg):
+        """ Returns True if a message was published by another worker process and this one needs to replay it.
+        Messages that are part of a batch have been already counted when the batch was received.
+        """
+        if msg.source_worker_id != self.server.worker_id:
+            if not msg.get('in_batch'):
+                self.cache_api.on_sync_received(msg.cache_name, 1, 1)
+            return True
+
+# ################################################################################################################################
+
+    def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_BATCH(self, msg, _code_to_name=code_to_name):
+        """ Replays, in order, all messages from a batch published by another worker process.
+        """
+        if msg.source_worker_id != self.server.worker_id:
+
+            ops_per_cache = {}
+            for item in msg['items']:
+                ops_per_cache[item['cache_name']] = ops_per_cache.get(item['cache_name'], 0) + 1
+
+            for cache_name, ops in ops_per_cache.items():
+                self.cache_api.on_sync_received(cache_name, 1, ops)
+
+            for item in msg['items']:
+                item = bunchify(item)
+                item.in_batch = True
+                getattr(self, 'on_broker_msg_{}'.format(_code_to_name[item.action]))(item)
+
 # ################################################################################################################################
 
     def _unpickle_msg(self, msg, _pickle_loads=pickle_loads):
@@ -55,151 +89,168 @@ class CacheBuiltin(WorkerImpl):
         if msg['is_value_pickled']:
             msg['value'] = _pickle_loads(b64decode(msg['value']))
 
+    def _unpickle_many_msg(self, msg, _pickle_loads=pickle_loads):
+
+        msg['keys'] = _pickle_loads(b64decode(msg['keys']))
+
+        if 'values' in msg:
+            msg['values'] = _pickle_loads(b64decode(msg['values']))
+
 # ################################################################################################################################
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_SET(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_set(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_SET_BY_PREFIX(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_set_by_prefix(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_SET_BY_SUFFIX(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_set_by_suffix(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_SET_BY_REGEX(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_set_by_regex(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_SET_CONTAINS(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_set_contains(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_SET_NOT_CONTAINS(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_set_not_contains(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_SET_CONTAINS_ALL(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_set_contains_all(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_SET_CONTAINS_ANY(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_set_contains_any(_BUILTIN, msg)
 
+    def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_SET_MANY(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
+        if self._needs_sync(msg):
+            self._unpickle_many_msg(msg)
+            self.cache_api.sync_after_set_many(_BUILTIN, msg)
+
 # ################################################################################################################################
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_DELETE(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_delete(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_DELETE_BY_PREFIX(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_delete_by_prefix(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_DELETE_BY_SUFFIX(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             self._unpickle_msg(msg)
             self.cache_api.sync_after_delete_by_suffix(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_DELETE_BY_REGEX(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_delete_by_regex(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_DELETE_CONTAINS(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_delete_contains(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_DELETE_NOT_CONTAINS(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_delete_not_contains(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_DELETE_CONTAINS_ALL(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_delete_contains_all(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_DELETE_CONTAINS_ANY(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_delete_contains_any(_BUILTIN, msg)
 
+    def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_DELETE_MANY(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
+        if self._needs_sync(msg):
+            self._unpickle_many_msg(msg)
+            self.cache_api.sync_after_delete_many(_BUILTIN, msg)
+
 # ################################################################################################################################
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_EXPIRE(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_expire(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_EXPIRE_BY_PREFIX(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_expire_by_prefix(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_EXPIRE_BY_SUFFIX(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_expire_by_suffix(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_EXPIRE_BY_REGEX(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_expire_by_regex(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_EXPIRE_CONTAINS(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_expire_contains(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_EXPIRE_NOT_CONTAINS(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_expire_not_contains(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_EXPIRE_CONTAINS_ALL(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_expire_contains_all(_BUILTIN, msg)
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_EXPIRE_CONTAINS_ANY(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             if msg['is_value_pickled'] or msg['is_key_pickled']:
                 self._unpickle_msg(msg)
             self.cache_api.sync_after_expire_contains_any(_BUILTIN, msg)
@@ -207,7 +258,7 @@ class CacheBuiltin(WorkerImpl):
 # ################################################################################################################################
 
     def on_broker_msg_CACHE_BUILTIN_STATE_CHANGED_CLEAR(self, msg, _BUILTIN=CACHE.TYPE.BUILTIN):
-        if msg.source_worker_id != self.server.worker_id:
+        if self._needs_sync(msg):
             self.cache_api.sync_after_clear(_BUILTIN, msg)
 
 # ################################################################################################################################
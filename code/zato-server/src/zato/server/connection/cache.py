@@ -10,7 +10,10 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 from base64 import b64encode
+from collections import deque
 from logging import getLogger
+from os.path import join as path_join, normpath
+from time import time
 from traceback import format_exc
 
 # gevent
@@ -28,6 +31,7 @@ from zato.cache import Cache as _CyCache
 from zato.common import CACHE, ZATO_NOT_GIVEN
 from zato.common.broker_message import CACHE as CACHE_BROKER_MSG
 from zato.common.util import parse_extra_into_dict
+from zato.server.connection.cache_shmem import SharedMemoryCache
 
 # Python 2/3 compatibility
 from future.utils import iteritems, itervalues
@@ -47,6 +51,7 @@ builtin_ops = [
     'DELETE_BY_REGEX',
     'DELETE_CONTAINS', 'DELETE_NOT_CONTAINS',
     'DELETE_CONTAINS_ALL', 'DELETE_CONTAINS_ANY',
+    'DELETE_MANY',
     'EXPIRE',
     'EXPIRE_BY_PREFIX', 'EXPIRE_BY_SUFFIX',
     'EXPIRE_BY_REGEX',
@@ -57,6 +62,7 @@ builtin_ops = [
     'SET_BY_REGEX',
     'SET_CONTAINS', 'SET_NOT_CONTAINS',
     'SET_CONTAINS_ALL', 'SET_CONTAINS_ANY',
+    'SET_MANY',
 ]
 
 builtin_op_to_broker_msg = {}
@@ -67,12 +73,73 @@ for builtin_op in builtin_ops:
 
     builtin_op_to_broker_msg[common_key] = broker_msg_value
 
+# With invalidate-only synchronization, other workers delete entries instead of replaying operations that changed them
+builtin_op_to_invalidate_op = {}
+
+for builtin_op in builtin_ops:
+    for prefix in 'SET', 'EXPIRE':
+        if builtin_op.startswith(prefix):
+            invalidate_op = 'DELETE' + builtin_op[len(prefix):]
+            builtin_op_to_invalidate_op[getattr(CACHE.STATE_CHANGED, builtin_op)] = getattr(CACHE.STATE_CHANGED, invalidate_op)
+
 # ################################################################################################################################
 
 default_get = ZATO_NOT_GIVEN # A singleton to indicate that no default for Cache.get was given on input
 
 # ################################################################################################################################
 
+class SyncStats(object):
+    """ Counts broker messages, and cache operations in them, that a cache published or received to synchronize its state
+    with other worker processes. Rates per second are computed over the last few seconds.
+    """
+    def __init__(self, window=10):
+        self.window = window
+        self.published = 0
+        self.published_ops = 0
+        self.received = 0
+        self.received_ops = 0
+
+        # Totals as they were at the first event in each of the recent seconds
+        self._history = deque(maxlen=window + 1)
+
+    def _add_history(self, _time=time):
+        now = int(_time())
+        if not self._history or self._history[-1][0] != now:
+            self._history.append((now, self.published, self.received))
+
+    def on_published(self, msgs, ops):
+        self._add_history()
+        self.published += msgs
+        self.published_ops += ops
+
+    def on_received(self, msgs, ops):
+        self._add_history()
+        self.received += msgs
+        self.received_ops += ops
+
+    def to_dict(self, _time=time):
+        now = _time()
+        published_per_sec = 0.0
+        received_per_sec = 0.0
+
+        for second, published, received in self._history:
+            if second >= now - self.window:
+                elapsed = max(now - second, 1.0)
+                published_per_sec = (self.published - published) / elapsed
+                received_per_sec = (self.received - received) / elapsed
+                break
+
+        return {
+            'sync_published': self.published,
+            'sync_published_ops': self.published_ops,
+            'sync_published_per_sec': published_per_sec,
+            'sync_received': self.received,
+            'sync_received_ops': self.received_ops,
+            'sync_received_per_sec': received_per_sec,
+        }
+
+# ################################################################################################################################
+
 class Cache(object):
     """ The cache API through which services access the built-in self.cache objects.
     Attribute self.impl is the actual Cython-based cache implementation.
@@ -80,9 +147,22 @@ class Cache(object):
     def __init__(self, config):
         self.config = config
         self.after_state_changed_callback = self.config.after_state_changed_callback
-        self.needs_sync = self.config.sync_method != CACHE.SYNC_METHOD.NO_SYNC.id
-        self.impl = _CyCache(self.config.max_size, self.config.max_item_size, self.config.extend_expiry_on_get,
-            self.config.extend_expiry_on_set)
+        self.use_shmem = bool(self.config.get('use_shmem'))
+        self.keep_running = True
+        self.sync_stats = SyncStats()
+
+        # Caches in shared memory are seen by all worker processes as they are so there is nothing to synchronize
+        if self.use_shmem:
+            self.needs_sync = False
+            self.impl = SharedMemoryCache(self.config.shmem_name, self.config.deployment_key, self.config.max_size,
+                self.config.max_item_size, self.config.extend_expiry_on_get, self.config.extend_expiry_on_set,
+                self.config.get('max_bytes', 0))
+        else:
+            self.needs_sync = self.config.sync_method != CACHE.SYNC_METHOD.NO_SYNC.id
+            self.impl = _CyCache(self.config.max_size, self.config.max_item_size, self.config.extend_expiry_on_get,
+                self.config.extend_expiry_on_set, needs_key_index=self.config.get('needs_key_index', False),
+                max_bytes=self.config.get('max_bytes', 0), eviction_policy=self.config.get('eviction_policy'))
+
         spawn(self._delete_expired)
 
 # ################################################################################################################################
@@ -120,6 +200,14 @@ class Cache(object):
         """
         return self.impl.get(key, default if default != default_get else self.impl.default_get, details)
 
+# ################################################################################################################################
+
+    def get_many(self, keys, details=False):
+        """ Returns a dictionary of key:value items for all of the input keys that exist in cache. Keys that do not exist,
+        or have already expired, are not returned.
+        """
+        return self.impl.get_many(keys, details)
+
 # ################################################################################################################################
 
     def get_by_prefix(self, key, details=False, limit=0):
@@ -177,11 +265,41 @@ class Cache(object):
         """
         meta_ref = {'key':key, 'value':value, 'expiry':expiry} if self.needs_sync else None
         value = self.impl.set(key, value, expiry, details, meta_ref)
-        if self.needs_sync:
+
+        # Other worker processes are not told about keys that were not admitted to this one's cache
+        if self.needs_sync and not meta_ref.pop('rejected', False):
             spawn(self.after_state_changed_callback, _OP, self.config.name, meta_ref)
 
         return value
 
+# ################################################################################################################################
+
+    def set_many(self, data, expiry=0.0, details=False, _OP=CACHE.STATE_CHANGED.SET_MANY):
+        """ Sets all of the key:value items from the input dictionary, each with the same expiry. Other worker processes,
+        if they are to be synchronized, receive a single message about all of the items. Returns a dictionary of keys
+        and their previous values.
+        """
+        meta_ref = {'_now': None} if self.needs_sync else None
+        out = self.impl.set_many(data, expiry, details, meta_ref)
+
+        if data and self.needs_sync:
+
+            # Other worker processes are not told about keys that were not admitted to this one's cache
+            rejected = meta_ref.get('rejected')
+            if rejected:
+                rejected = set(rejected)
+                data = {key: value for key, value in data.items() if key not in rejected}
+
+            if data:
+                spawn(self.after_state_changed_callback, _OP, self.config.name, {
+                    'keys':list(data.keys()),
+                    'values':list(data.values()),
+                    'expiry':expiry,
+                    'orig_now':meta_ref['_now']
+                })
+
+        return out
+
 # ################################################################################################################################
 
     def set_by_prefix(self, key, value, expiry=0.0, return_found=False, details=False, limit=0,
@@ -352,6 +470,21 @@ class Cache(object):
 
             return value
 
+# ################################################################################################################################
+
+    def delete_many(self, keys, return_found=False, _OP=CACHE.STATE_CHANGED.DELETE_MANY):
+        """ Deletes all of the input keys, ignoring ones that do not exist. Other worker processes, if they are
+        to be synchronized, receive a single message about all of the keys deleted. Optionally, returns all of the keys
+        found along with their previous values.
+        """
+        meta_ref = {'keys': None} if self.needs_sync else None
+        out = self.impl.delete_many(keys, return_found, meta_ref)
+
+        if self.needs_sync and meta_ref['keys']:
+            spawn(self.after_state_changed_callback, _OP, self.config.name, {'keys':meta_ref['keys']})
+
+        return out
+
 # ################################################################################################################################
 
     def delete_by_prefix(self, key, return_found=False, limit=0, _OP=CACHE.STATE_CHANGED.DELETE_BY_PREFIX):
@@ -475,7 +608,7 @@ class Cache(object):
     def expire_by_prefix(self, key, expiry=0.0, limit=0, _OP=CACHE.STATE_CHANGED.EXPIRE_BY_PREFIX):
         """ Sets expiry in seconds (or a fraction of) for all keys matching the input prefix.
         """
-        out = self.impl.expire_by_prefix(key, expiry)
+        out = self.impl.expire_by_prefix(key, expiry, limit)
         if out and self.needs_sync:
             spawn(self.after_state_changed_callback, _OP, self.config.name, {
                 'key':key,
@@ -490,7 +623,7 @@ class Cache(object):
     def expire_by_suffix(self, key, expiry=0.0, limit=0, _OP=CACHE.STATE_CHANGED.EXPIRE_BY_SUFFIX):
         """ Sets expiry in seconds (or a fraction of) for all keys matching the input suffix.
         """
-        out = self.impl.expire_by_suffix(key, expiry)
+        out = self.impl.expire_by_suffix(key, expiry, limit)
         if out and self.needs_sync:
             spawn(self.after_state_changed_callback, _OP, self.config.name, {
                 'key':key,
@@ -505,7 +638,7 @@ class Cache(object):
     def expire_by_regex(self, key, expiry=0.0, limit=0, _OP=CACHE.STATE_CHANGED.EXPIRE_BY_REGEX):
         """ Sets expiry in seconds (or a fraction of) for all keys matching the input regular expression.
         """
-        out = self.impl.expire_by_regex(key, expiry)
+        out = self.impl.expire_by_regex(key, expiry, limit)
         if out and self.needs_sync:
             spawn(self.after_state_changed_callback, _OP, self.config.name, {
                 'key':key,
@@ -520,7 +653,7 @@ class Cache(object):
     def expire_contains(self, key, expiry=0.0, limit=0, _OP=CACHE.STATE_CHANGED.EXPIRE_CONTAINS):
         """ Sets expiry in seconds (or a fraction of) for all keys containing the input string.
         """
-        out = self.impl.expire_contains(key, expiry)
+        out = self.impl.expire_contains(key, expiry, limit)
         if out and self.needs_sync:
             spawn(self.after_state_changed_callback, _OP, self.config.name, {
                 'key':key,
@@ -535,7 +668,7 @@ class Cache(object):
     def expire_not_contains(self, key, expiry=0.0, limit=0, _OP=CACHE.STATE_CHANGED.EXPIRE_NOT_CONTAINS):
         """ Sets expiry in seconds (or a fraction of) for all keys that don't contain the input string.
         """
-        out = self.impl.expire_not_contains(key, expiry)
+        out = self.impl.expire_not_contains(key, expiry, limit)
         if out and self.needs_sync:
             spawn(self.after_state_changed_callback, _OP, self.config.name, {
                 'key':key,
@@ -550,7 +683,7 @@ class Cache(object):
     def expire_contains_all(self, key, expiry=0.0, limit=0, _OP=CACHE.STATE_CHANGED.EXPIRE_CONTAINS_ALL):
         """ Sets expiry in seconds (or a fraction of) for keys that contain all of input elements.
         """
-        out = self.impl.expire_contains_all(key, expiry)
+        out = self.impl.expire_contains_all(key, expiry, limit)
         if out and self.needs_sync:
             spawn(self.after_state_changed_callback, _OP, self.config.name, {
                 'key':key,
@@ -565,7 +698,7 @@ class Cache(object):
     def expire_contains_any(self, key, expiry=0.0, limit=0, _OP=CACHE.STATE_CHANGED.EXPIRE_CONTAINS_ALL):
         """ Sets expiry in seconds (or a fraction of) for keys that contain at least one of input elements.
         """
-        out = self.impl.expire_contains_any(key, expiry)
+        out = self.impl.expire_contains_any(key, expiry, limit)
         if out and self.needs_sync:
             spawn(self.after_state_changed_callback, _OP, self.config.name, {
                 'key':key,
@@ -630,25 +763,71 @@ class Cache(object):
 # ################################################################################################################################
 
     def update_config(self, config):
-        self.needs_sync = self.config.sync_method != CACHE.SYNC_METHOD.NO_SYNC.id
+        self.needs_sync = False if self.use_shmem else self.config.sync_method != CACHE.SYNC_METHOD.NO_SYNC.id
         self.impl.update_config(config)
 
 # ################################################################################################################################
 
-    def _delete_expired(self, interval=5, _sleep=sleep):
+    def close(self):
+        """ Stops background tasks of this cache and releases shared memory, if the cache uses any.
+        """
+        self.keep_running = False
+
+        if self.use_shmem:
+            self.impl.close()
+
+# ################################################################################################################################
+
+    def dump_snapshot(self, path):
+        """ Saves entries of this cache to a snapshot file from which they can be loaded after a restart.
+        """
+        count = self.impl.dump_snapshot(path)
+        logger.info('Saved %d entries of cache `%s` to `%s`', count, self.config.name, path)
+
+# ################################################################################################################################
+
+    def load_snapshot(self, path, _sleep=sleep):
+        """ Loads entries from a snapshot file, letting other greenlets run between batches of entries.
+        """
+        count = self.impl.load_snapshot(path, yield_func=_sleep)
+        if count:
+            logger.info('Loaded %d entries of cache `%s` from `%s`', count, self.config.name, path)
+
+# ################################################################################################################################
+
+    def _get_delete_expired_interval(self, min_interval, max_interval):
+        """ Returns for how long to sleep until the next run of self._delete_expired - it is the time left until the nearest
+        expiration time of any entry, though no shorter than min_interval and no longer than max_interval.
+        """
+        next_expires_at = self.impl.get_next_expires_at()
+
+        if not next_expires_at:
+            return max_interval
+
+        return min(max(next_expires_at - self.impl.get_timestamp(), min_interval), max_interval)
+
+# ################################################################################################################################
+
+    def _delete_expired(self, min_interval=0.5, max_interval=5, _sleep=sleep):
         """ Invokes in its own greenlet in background to delete expired cache entries.
         """
         try:
-            while True:
+            while self.keep_running:
                 try:
+                    interval = self._get_delete_expired_interval(min_interval, max_interval)
                     _sleep(interval)
+
+                    # The cache may have been closed while we were sleeping
+                    if not self.keep_running:
+                        break
+
                     deleted = self.impl.delete_expired()
                 except Exception:
                     logger.warn('Exception while deleting expired keys %s', format_exc())
                     _sleep(2)
                 else:
                     if deleted:
-                        logger.info('Cache `%s` deleted keys expired in the last %ss - %s', self.config.name, interval, deleted)
+                        logger.info('Cache `%s` deleted keys expired in the last %.3fs - %s', self.config.name, interval, deleted)
         except Exception:
             logger.warn('Exception in _delete_expired loop %s', format_exc())
 
@@ -657,45 +836,51 @@ class Cache(object):
     def sync_after_set(self, data):
         """ Invoked by Cache API to synchronizes this worker's cache after a .set operation in another worker process.
         """
-        self.impl.set(data.key, data.value, data.expiry, False, None, data.orig_now)
+        self.impl.set(data.key, data.value, data.expiry, False, None, data.orig_now, needs_admission=False)
 
     def sync_after_set_by_prefix(self, data):
         """ Invoked by Cache API to synchronizes this worker's cache after a .set_by_prefix operation in another worker process.
         """
-        self.impl.set_by_prefix(data.key, data.value, data.expiry, False, None, data.limit, data.orig_now)
+        self.impl.set_by_prefix(data.key, data.value, data.expiry, False, None, False, data.limit, data.orig_now)
 
     def sync_after_set_by_suffix(self, data):
         """ Invoked by Cache API to synchronizes this worker's cache after a .set_by_suffix operation in another worker process.
         """
-        self.impl.set_by_suffix(data.key, data.value, data.expiry, False, None, data.limit, data.orig_now)
+        self.impl.set_by_suffix(data.key, data.value, data.expiry, False, None, False, data.limit, data.orig_now)
 
     def sync_after_set_by_regex(self, data):
         """ Invoked by Cache API to synchronizes this worker's cache after a .set_by_regex operation in another worker process.
         """
-        self.impl.set_by_regex(data.key, data.value, data.expiry, False, None, data.limit, data.orig_now)
+        self.impl.set_by_regex(data.key, data.value, data.expiry, False, None, False, data.limit, data.orig_now)
 
     def sync_after_set_contains(self, data):
         """ Invoked by Cache API to synchronizes this worker's cache after a .set_contains operation in another worker process.
         """
-        self.impl.set_contains(data.key, data.value, data.expiry, False, None, data.limit, data.orig_now)
+        self.impl.set_contains(data.key, data.value, data.expiry, False, None, False, data.limit, data.orig_now)
 
     def sync_after_set_not_contains(self, data):
         """ Invoked by Cache API to synchronizes this worker's cache after a .set_not_contains operation
         in another worker process.
         """
-        self.impl.set_not_contains(data.key, data.value, data.expiry, False, None, data.limit, data.orig_now)
+        self.impl.set_not_contains(data.key, data.value, data.expiry, False, None, False, data.limit, data.orig_now)
 
     def sync_after_set_contains_all(self, data):
         """ Invoked by Cache API to synchronizes this worker's cache after a .set_contains_all operation
         in another worker process.
         """
-        self.impl.set_contains_all(data.key, data.value, data.expiry, False, None, data.limit, data.orig_now)
+        self.impl.set_contains_all(data.key, data.value, data.expiry, False, None, False, data.limit, data.orig_now)
 
     def sync_after_set_contains_any(self, data):
         """ Invoked by Cache API to synchronizes this worker's cache after a .set_contains_any operation
         in another worker process.
         """
-        self.impl.set_contains_any(data.key, data.value, data.expiry, False, None, data.limit, data.orig_now)
+        self.impl.set_contains_any(data.key, data.value, data.expiry, False, None, False, data.limit, data.orig_now)
+
+    def sync_after_set_many(self, data):
+        """ Invoked by Cache API to synchronizes this worker's cache after a .set_many operation in another worker process.
+        """
+        self.impl.set_many(dict(zip(data['keys'], data['values'])), data.expiry, False, None, data.orig_now,
+            needs_admission=False)
 
 # ################################################################################################################################
 
@@ -746,6 +931,11 @@ class Cache(object):
         """
         self.impl.delete_contains_any(data.key, False, data.limit)
 
+    def sync_after_delete_many(self, data):
+        """ Invoked by Cache API to synchronizes this worker's cache after a .delete_many operation in another worker process.
+        """
+        self.impl.delete_many(data['keys'], False)
+
 # ################################################################################################################################
 
     def sync_after_expire(self, data):
@@ -826,52 +1016,248 @@ class CacheAPI(object):
         self.builtin = self.caches[CACHE.TYPE.BUILTIN]
         self.memcached = self.caches[CACHE.TYPE.MEMCACHED]
 
+        # Messages waiting to be published by caches using batched synchronization
+        self.sync_batch = []
+
+        # Maps (cache name, key) to the index in self.sync_batch of the latest .set of that key, if it can be replaced
+        self.sync_batch_index = {}
+
+        # Publishes batches in background, started only if any cache uses batched synchronization
+        self._sync_batch_greenlet = None
+
     def _maybe_set_default(self, config, cache):
         if config.is_default:
             self.default = cache
 
 # ################################################################################################################################
 
-    def after_state_changed(self, op, cache_name, data, _broker_msg=builtin_op_to_broker_msg, _pickle_dumps=pickle_dumps):
-        """ Callback method invoked by each cache if it requires synchronization with other worker processes.
+    def _get_sync_msg(self, op, cache_name, data, _broker_msg=builtin_op_to_broker_msg, _pickle_dumps=pickle_dumps):
+        """ Turns data about an operation on a cache into a message that other worker processes can replay.
         """
-        try:
+        data['action'] = _broker_msg[op]
+        data['cache_name'] = cache_name
+        data['source_worker_id'] = self.server.worker_id
 
-            data['action'] = _broker_msg[op]
-            data['cache_name'] = cache_name
-            data['source_worker_id'] = self.server.worker_id
+        # Bulk operations carry lists of keys and, optionally, values which are always pickled as a whole
+        if 'keys' in data:
+            data['keys'] = b64encode(_pickle_dumps(data['keys']))
+            if 'values' in data:
+                data['values'] = b64encode(_pickle_dumps(data['values']))
+            return data
 
-            key = data.get('key')
-            value = data.get('value')
+        key = data.get('key')
+        value = data.get('value')
 
-            if isinstance(key, basestring):
-                data['is_key_pickled'] = False
+        if isinstance(key, basestring):
+            data['is_key_pickled'] = False
+        else:
+            data['is_key_pickled'] = True
+            data['key'] = _pickle_dumps(key)
+
+        if value:
+            if isinstance(value, basestring):
+                data['is_value_pickled'] = False
             else:
-                data['is_key_pickled'] = True
-                data['key'] = _pickle_dumps(key)
+                data['is_value_pickled'] = True
+                value = _pickle_dumps(value)
+                data['value'] = b64encode(value)
+        else:
+            data['is_value_pickled'] = False
 
-            if value:
-                if isinstance(value, basestring):
-                    data['is_value_pickled'] = False
-                else:
-                    data['is_value_pickled'] = True
-                    value = _pickle_dumps(key)
-                    data['value'] = b64encode(value)
+        return data
+
+# ################################################################################################################################
+
+    def after_state_changed(self, op, cache_name, data, _invalidate_op=builtin_op_to_invalidate_op,
+        _SYNC_METHOD=CACHE.SYNC_METHOD):
+        """ Callback method invoked by each cache if it requires synchronization with other worker processes.
+        """
+        try:
+            cache = self.builtin.get(cache_name)
+            sync_method = cache.config.sync_method if cache else None
+
+            # Other workers are to drop entries by their keys, there is no need to send them values
+            if sync_method == _SYNC_METHOD.INVALIDATE.id:
+                op = _invalidate_op.get(op, op)
+                data = dict((name, data[name]) for name in ('key', 'keys', 'limit') if name in data)
+
+            msg = self._get_sync_msg(op, cache_name, data)
+
+            if sync_method == _SYNC_METHOD.IN_BACKGROUND_BATCHED.id:
+                self._add_to_sync_batch(msg)
             else:
-                data['is_value_pickled'] = False
+                self.server.broker_client.publish(msg)
+                if cache:
+                    cache.sync_stats.on_published(1, 1)
 
-            self.server.broker_client.publish(data)
         except Exception:
             logger.warn('Could not run `%s` after_state_changed in cache `%s`, data:`%s`, e:`%s`',
                 op, cache_name, data, format_exc())
 
+# ################################################################################################################################
+
+    def _add_to_sync_batch(self, msg, _SET=builtin_op_to_broker_msg[CACHE.STATE_CHANGED.SET]):
+        """ Adds a message to the batch of ones to be published in background. A .set of a key replaces an earlier .set
+        of the same key with the same expiry if there were no other operations on that cache in between.
+        """
+        if msg['action'] == _SET:
+            index_key = (msg['cache_name'], msg['key'])
+            idx = self.sync_batch_index.get(index_key)
+
+            if idx is not None and self.sync_batch[idx].get('expiry') == msg.get('expiry'):
+                self.sync_batch[idx] = msg
+            else:
+                self.sync_batch_index[index_key] = len(self.sync_batch)
+                self.sync_batch.append(msg)
+
+        # Any other operation may depend on what was set before so nothing before it can be replaced anymore
+        else:
+            self.sync_batch_index.clear()
+            self.sync_batch.append(msg)
+
+        if len(self.sync_batch) >= CACHE.DEFAULT.SYNC_BATCH_SIZE:
+            self._publish_sync_batch()
+
+# ################################################################################################################################
+
+    def _publish_sync_batch(self, _action=CACHE_BROKER_MSG.BUILTIN_STATE_CHANGED_BATCH.value):
+        """ Publishes all messages from the current batch, if there are any, in one broker message.
+        """
+        batch = self.sync_batch
+        if not batch:
+            return
+
+        self.sync_batch = []
+        self.sync_batch_index = {}
+
+        self.server.broker_client.publish({
+            'action': _action,
+            'source_worker_id': self.server.worker_id,
+            'items': batch,
+        })
+
+        ops_per_cache = {}
+        for msg in batch:
+            ops_per_cache[msg['cache_name']] = ops_per_cache.get(msg['cache_name'], 0) + 1
+
+        for cache_name, ops in iteritems(ops_per_cache):
+            cache = self.builtin.get(cache_name)
+            if cache:
+                cache.sync_stats.on_published(1, ops)
+
+# ################################################################################################################################
+
+    def _publish_sync_batches(self, interval=CACHE.DEFAULT.SYNC_BATCH_INTERVAL, _sleep=sleep):
+        """ Invoked in its own greenlet in background to publish batches of synchronization messages.
+        """
+        try:
+            while True:
+                try:
+                    _sleep(interval)
+                    self._publish_sync_batch()
+                except Exception:
+                    logger.warn('Exception while publishing cache synchronization batch %s', format_exc())
+                    _sleep(2)
+        except Exception:
+            logger.warn('Exception in _publish_sync_batches loop %s', format_exc())
+
+# ################################################################################################################################
+
+    def publish_sync_batch(self):
+        """ Publishes synchronization messages that are still waiting for the next batch. Invoked when a worker process stops.
+        """
+        try:
+            self._publish_sync_batch()
+        except Exception:
+            logger.warn('Could not publish cache synchronization batch, e:`%s`', format_exc())
+
+# ################################################################################################################################
+
+    def on_sync_received(self, cache_name, msgs, ops):
+        """ Invoked each time a synchronization message from another worker process is received.
+        """
+        cache = self.builtin.get(cache_name)
+        if cache:
+            cache.sync_stats.on_received(msgs, ops)
+
 # ################################################################################################################################
 
     def _create_builtin(self, config):
         """ A low-level method building a bCache object for built-in caches. Must be called with self.lock held.
         """
         config.after_state_changed_callback = self.after_state_changed
-        return Cache(config)
+
+        # Each cache in shared memory is tied to the server and its ID, which does not change even if the cache is renamed
+        if config.get('use_shmem'):
+            config.shmem_name = 'cache-{}-{}'.format(self.server.fs_server_config.main.token, config.id)
+            config.deployment_key = self.server.deployment_key
+
+        cache = Cache(config)
+
+        # Caches in shared memory are not kept in this process so they are never saved to snapshots
+        snapshot_path = None if cache.use_shmem else self._get_snapshot_path(config)
+        if snapshot_path:
+            spawn(self._load_snapshot, cache, snapshot_path)
+
+        return cache
+
+# ################################################################################################################################
+
+    def _get_snapshot_path(self, config):
+        """ Returns a path to the file with a snapshot of a given built-in cache or None if snapshots are not enabled.
+        Snapshots are named after IDs of caches so that they still apply if a cache is renamed.
+        """
+        snapshot_config = self.server.fs_server_config.get('cache', {})
+
+        if not asbool(snapshot_config.get('snapshot_enabled', False)):
+            return
+
+        snapshot_dir = normpath(path_join(self.server.hot_deploy_config.work_dir,
+            snapshot_config.get('snapshot_dir', './cache/snapshot')))
+
+        return path_join(snapshot_dir, '{}.snapshot'.format(config.id))
+
+# ################################################################################################################################
+
+    def _load_snapshot(self, cache, path):
+        try:
+            cache.load_snapshot(path)
+        except Exception:
+            logger.warn('Could not load snapshot of cache `%s` from `%s`, e:`%s`', cache.config.name, path, format_exc())
+
+# ################################################################################################################################
+
+    def dump_snapshots(self):
+        """ Saves all built-in caches, other than ones in shared memory, to snapshots, if snapshots are enabled.
+        Invoked when a worker process stops.
+        """
+        with self.lock:
+            for cache in itervalues(self.builtin):
+                if cache.use_shmem:
+                    continue
+
+                path = self._get_snapshot_path(cache.config)
+                if not path:
+                    return
+
+                try:
+                    cache.dump_snapshot(path)
+                except Exception:
+                    logger.warn('Could not save snapshot of cache `%s` to `%s`, e:`%s`', cache.config.name, path, format_exc())
+
+# ################################################################################################################################
+
+    def close_shmem(self):
+        """ Closes all built-in caches in shared memory so that the last process using each of them removes it.
+        Invoked when a worker process stops.
+        """
+        with self.lock:
+            for cache in itervalues(self.builtin):
+                if cache.use_shmem:
+                    try:
+                        cache.close()
+                    except Exception:
+                        logger.warn('Could not close cache `%s`, e:`%s`', cache.config.name, format_exc())
 
 # ################################################################################################################################
 
@@ -898,6 +1284,9 @@ class CacheAPI(object):
         # If told to be configuration, make this cache the default one
         self._maybe_set_default(config, cache)
 
+        if self._sync_batch_greenlet is None and config.get('sync_method') == CACHE.SYNC_METHOD.IN_BACKGROUND_BATCHED.id:
+            self._sync_batch_greenlet = spawn(self._publish_sync_batches)
+
 # ################################################################################################################################
 
     def _create(self, config):
@@ -926,7 +1315,14 @@ class CacheAPI(object):
         """
         if config.cache_type == CACHE.TYPE.BUILTIN:
             cache = self.caches[config.cache_type].pop(config.old_name)
-            cache.update_config(config)
+
+            # Moving a cache into or out of shared memory requires a new implementation object, its contents are not kept
+            if cache.use_shmem != bool(config.get('use_shmem')):
+                cache.close()
+                cache = self._create_builtin(config)
+            else:
+                cache.update_config(config)
+
             self._add_cache(config, cache)
         else:
             cache = self.caches[config.cache_type][config.old_name]
@@ -951,6 +1347,7 @@ class CacheAPI(object):
 
         if cache_type == CACHE.TYPE.BUILTIN:
             self._clear(cache_type, name)
+            cache.close()
         else:
             cache.disconnect_all()
 
@@ -994,6 +1391,28 @@ class CacheAPI(object):
         """
         return len(self.caches[cache_type][name])
 
+# ################################################################################################################################
+
+    def get_size_bytes(self, cache_type, name):
+        """ Returns current size, the approximate total number of bytes of all entries, in a given built-in cache.
+        """
+        return self.caches[cache_type][name].impl.current_bytes
+
+# ################################################################################################################################
+
+    def get_hit_ratios(self, cache_type, name):
+        """ Returns the percentage of .get operations that found their keys in a given built-in cache in current worker
+        process, along with the percentage that a plain LRU cache would have achieved.
+        """
+        return self.caches[cache_type][name].impl.get_hit_ratios()
+
+# ################################################################################################################################
+
+    def get_sync_stats(self, cache_type, name):
+        """ Returns statistics of synchronization messages of a given built-in cache in current worker process.
+        """
+        return self.caches[cache_type][name].sync_stats.to_dict()
+
 # ################################################################################################################################
 
     def sync_after_set(self, cache_type, data):
@@ -1036,6 +1455,11 @@ class CacheAPI(object):
         """
         self.caches[cache_type][data.cache_name].sync_after_set_contains_any(data)
 
+    def sync_after_set_many(self, cache_type, data):
+        """ Synchronizes the state of this worker's cache after a .set_many operation in another worker process.
+        """
+        self.caches[cache_type][data.cache_name].sync_after_set_many(data)
+
 # ################################################################################################################################
 
     def sync_after_delete(self, cache_type, data):
@@ -1078,6 +1502,11 @@ class CacheAPI(object):
         """
         self.caches[cache_type][data.cache_name].sync_after_delete_contains_any(data)
 
+    def sync_after_delete_many(self, cache_type, data):
+        """ Synchronizes the state of this worker's cache after a .delete_many operation in another worker process.
+        """
+        self.caches[cache_type][data.cache_name].sync_after_delete_many(data)
+
 # ################################################################################################################################
 
     def sync_after_expire(self, cache_type, data):
@@ -0,0 +1,1017 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from errno import ESRCH
+from hashlib import sha256
+from logging import getLogger
+from os import getpid, kill
+from random import randrange
+from struct import Struct
+from time import time
+from zlib import crc32
+
+# gevent
+from gevent import sleep
+
+# posix-ipc
+import posix_ipc as ipc
+
+# regex
+from regex import compile as re_compile
+
+# Zato
+from zato.cache import Entry, KeyExpiredError
+from zato.common import CACHE
+from zato.common.util.posix_ipc_ import SharedMemoryIPC
+
+# Python 2/3 compatibility
+from six import binary_type, integer_types, string_types, text_type
+from zato.common.py23_ import pickle_dumps, pickle_loads
+
+# ################################################################################################################################
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+
+str_types = string_types + (text_type,)
+len_values = (binary_type,) + str_types
+key_types = len_values + integer_types
+
+# ################################################################################################################################
+
+# Identifies memory segments laid out as expected by this module
+_magic = b'ZATOCCH3'
+
+# Magic, digest of the deployment key, number of slots, size of each slot, number of entries,
+# total size of entries in bytes and the earliest time any entry may expire at.
+_header = Struct(b'<8s16sIIQQd')
+
+# Follows the header - PID of the process holding the lock, or 0 if none does, how many processes use the segment
+# and how many times the lock's holder changed, which tells waiting processes if the lock is still being used.
+_lock_header = Struct(b'<III')
+_lock_header_offset = _header.size
+
+# Whether the slot is used, hash of the key, length of the key and value, expiry, expires_at,
+# last_read, prev_read, last_write, prev_write and hits.
+_slot_header = Struct(b'<BxxxIIIddddddQ')
+
+_header_size = _header.size + _lock_header.size
+_slot_header_size = _slot_header.size
+
+# Each slot has room for the pickled key and value, this much in addition to max_item_size
+_slot_key_overhead = 512
+
+# The number of slots is larger than max_size by that much so that lookups do not need to probe too many slots
+_load_factor = 1.5
+
+# How many randomly selected entries to consider when evicting one of them
+_eviction_sample_size = 5
+
+# How often, in seconds, a process waiting for the lock checks if its holder is still running
+_lock_timeout = 5
+
+# How long, in seconds, to sleep between attempts to acquire the lock, at first and at most
+_lock_min_delay = 0.0005
+_lock_max_delay = 0.05
+
+# A default value for _get through which .get_many tells missing keys apart from ones with values that are None
+_missing = object()
+
+# ################################################################################################################################
+
+def _dumps(data, _pickle_dumps=pickle_dumps):
+    return _pickle_dumps(data, -1)
+
+# ################################################################################################################################
+
+def _get_key_hash(key_bytes, _crc32=crc32):
+    # Python's own hash() cannot be used because it is randomized in each process
+    return _crc32(key_bytes) & 0xffffffff
+
+# ################################################################################################################################
+
+def _is_process_alive(pid):
+    try:
+        kill(pid, 0)
+    except OSError as e:
+        return e.errno != ESRCH
+    else:
+        return True
+
+# ################################################################################################################################
+
+class _SemaphoreLock(object):
+    """ A cross-process lock built on a POSIX named semaphore. The PID of the process holding it is kept in shared memory
+    so that processes waiting for the lock can take it over if that process exits without releasing it. Waiting does not
+    block other greenlets of the waiting process.
+
+    A process may also exit right after acquiring the semaphore but before storing its PID, or right after clearing its PID
+    but before releasing the semaphore. The lock is then held with no owner, and if it stays this way, without any other
+    change, for _lock_timeout, it is taken over as well.
+    """
+    def __init__(self, name, cache):
+        self.name = name
+        self.cache = cache
+        self.sem = ipc.Semaphore(name, ipc.O_CREAT, initial_value=1)
+
+        # Held only while a process checks if it may take over the main lock, so that two processes never do it at once
+        self.recovery_sem = ipc.Semaphore(name + '-recovery', ipc.O_CREAT, initial_value=1)
+
+    def _get_lock_header(self):
+        return _lock_header.unpack_from(self.cache._mmap, _lock_header_offset)
+
+    def get_owner(self):
+        return self._get_lock_header()[0]
+
+    def set_owner(self, pid):
+        _, attached, changes = self._get_lock_header()
+        _lock_header.pack_into(self.cache._mmap, _lock_header_offset, pid, attached, (changes + 1) & 0xffffffff)
+
+    def get_attached(self):
+        return self._get_lock_header()[1]
+
+    def set_attached(self, attached):
+        owner, _, changes = self._get_lock_header()
+        _lock_header.pack_into(self.cache._mmap, _lock_header_offset, owner, attached, changes)
+
+    def _take_over(self, owner, changes):
+        """ Makes the current process the holder of the lock if nothing changed since its owner was last checked.
+        """
+        try:
+            self.recovery_sem.acquire(_lock_timeout)
+        except ipc.BusyError:
+            logger.warn('Could not check if lock `%s` can be taken over from PID %s', self.name, owner)
+            return False
+
+        try:
+            current_owner, _, current_changes = self._get_lock_header()
+            if current_owner != owner or current_changes != changes:
+                return False
+
+            if owner:
+                logger.warn('Taking over lock `%s` from PID %s which exited without releasing it', self.name, owner)
+            else:
+                logger.warn('Taking over lock `%s` held by no process for %ss', self.name, _lock_timeout)
+
+            self.set_owner(getpid())
+            return True
+
+        finally:
+            self.recovery_sem.release()
+
+    def _wait(self):
+        delay = _lock_min_delay
+        next_check = time() + _lock_timeout
+
+        # Owner of the lock and how many times it changed, as of the previous check
+        last_seen = None
+
+        while True:
+            sleep(delay)
+            delay = min(delay * 2, _lock_max_delay)
+
+            try:
+                self.sem.acquire(0)
+            except ipc.BusyError:
+                pass
+            else:
+                self.set_owner(getpid())
+                return
+
+            now = time()
+
+            if now >= next_check:
+                next_check = now + _lock_timeout
+                owner, _, changes = self._get_lock_header()
+
+                if owner:
+                    is_abandoned = not _is_process_alive(owner)
+                else:
+                    # No owner may only be seen for a moment, while the lock is being acquired or released
+                    is_abandoned = last_seen == (owner, changes)
+
+                if is_abandoned:
+                    if self._take_over(owner, changes):
+                        return
+                else:
+                    # The holder is running - it is never forced to give the lock up
+                    logger.warn('Still waiting for lock `%s` held by PID %s', self.name, owner)
+
+                last_seen = (owner, changes)
+
+    def __enter__(self):
+        try:
+            self.sem.acquire(0)
+        except ipc.BusyError:
+            self._wait()
+        else:
+            self.set_owner(getpid())
+
+    def __exit__(self, *ignored):
+        self.set_owner(0)
+        self.sem.release()
+
+    def close(self, needs_unlink):
+        for sem in self.sem, self.recovery_sem:
+            if needs_unlink:
+                try:
+                    sem.unlink()
+                except ipc.ExistentialError:
+                    pass
+            sem.close()
+
+# ################################################################################################################################
+
+class SharedMemoryCache(SharedMemoryIPC):
+    """ A built-in cache whose entries are kept in a segment of shared memory that all worker processes of a server
+    read from and write to, i.e. there is only one copy of the cache's data on a given host, no matter how many processes
+    there are, and there is no need to synchronize the processes through the broker.
+
+    Entries are stored in a hash table of fixed-size slots, with open addressing and linear probing. Keys and values
+    are pickled. When the cache is full, the least recently used of a few randomly chosen entries is evicted.
+
+    Offers the same API as zato.cache.Cache, except for synchronization and key index methods that are not needed,
+    and eviction policies other than LRU.
+    Because slots have a fixed size, max_item_size is always enforced - if it is 0, the default one is used.
+    """
+    key_name = '/cache'
+
+    def __init__(self, shmem_name, deployment_key, max_size, max_item_size=None, extend_expiry_on_get=True,
+        extend_expiry_on_set=True, max_bytes=0):
+        super(SharedMemoryCache, self).__init__()
+
+        self.default_get = object()
+        self.deployment_digest = sha256(deployment_key.encode('utf8')).digest()[:16]
+
+        self.hits = 0
+        self.misses = 0
+        self.set_ops = 0
+        self.get_ops = 0
+        self._expired_on_op = []
+        self._regex_cache = {}
+
+        self._update_config(max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set, max_bytes)
+
+        # The layout is established when the cache is created and does not change until the next restart
+        self.capacity = self.max_size
+        self.num_slots = int(self.max_size * _load_factor) + 1
+        self.slot_size = _slot_header_size + _slot_key_overhead + self.max_item_size
+        self.slot_data_size = self.slot_size - _slot_header_size
+
+        self._lock = _SemaphoreLock('/zato-shmem-{}'.format(shmem_name), self)
+        self.create(shmem_name, _header_size + self.num_slots * self.slot_size, True)
+
+# ################################################################################################################################
+
+    def _update_config(self, max_size, max_item_size, extend_expiry_on_get, extend_expiry_on_set, max_bytes):
+        self.max_size = max_size or CACHE.DEFAULT.MAX_SIZE
+        self.max_item_size = max_item_size or CACHE.DEFAULT.MAX_ITEM_SIZE
+        self.has_max_item_size = self.max_item_size > 0
+        self.extend_expiry_on_get = extend_expiry_on_get
+        self.extend_expiry_on_set = extend_expiry_on_set
+        self.max_bytes = max_bytes or 0
+        self.has_max_bytes = self.max_bytes > 0
+
+    def update_config(self, config):
+        max_size = config.max_size or CACHE.DEFAULT.MAX_SIZE
+        max_item_size = config.max_item_size or CACHE.DEFAULT.MAX_ITEM_SIZE
+
+        # Slots have already been allocated so their number and size can be changed only by a restart
+        if max_size > self.capacity or max_item_size + _slot_key_overhead > self.slot_data_size:
+            logger.warn('Cache `%s` uses shared memory, max_size and max_item_size will be changed after a restart',
+                config.name)
+            max_size = self.max_size
+            max_item_size = self.max_item_size
+
+        with self._lock:
+            self._update_config(max_size, max_item_size, config.extend_expiry_on_get, config.extend_expiry_on_set,
+                config.get('max_bytes', 0))
+
+# ################################################################################################################################
+
+    def store_initial(self):
+        """ Lays out the segment unless it already is what another process of the current deployment created.
+        Contents left over by a previous deployment are discarded. Either way, counts the current process
+        among the ones using the segment.
+        """
+        with self._lock:
+            magic, deployment_digest, num_slots, slot_size, _, _, _ = _header.unpack_from(self._mmap, 0)
+            if magic == _magic and deployment_digest == self.deployment_digest and num_slots == self.num_slots \
+               and slot_size == self.slot_size:
+                self._lock.set_attached(self._lock.get_attached() + 1)
+                return
+
+            self._mmap.seek(0)
+            self._mmap.write(b'\x00' * self.size)
+            _header.pack_into(self._mmap, 0, _magic, self.deployment_digest, self.num_slots, self.slot_size, 0, 0, 0.0)
+            _lock_header.pack_into(self._mmap, _lock_header_offset, getpid(), 1, 0)
+
+    def close(self):
+        """ Closes the segment. The last process using it also removes it along with its lock.
+        """
+        if not self.running:
+            return
+
+        with self._lock:
+            attached = self._lock.get_attached() - 1
+            self._lock.set_attached(attached)
+
+        needs_unlink = attached <= 0
+        logger.info('Closing cache segment `%s`%s', self.shmem_name, ' and removing it' if needs_unlink else '')
+
+        self.running = False
+        self._mmap.close()
+        self._mem.close_fd()
+
+        if needs_unlink:
+            try:
+                self._mem.unlink()
+            except ipc.ExistentialError:
+                pass
+
+        self._lock.close(needs_unlink)
+
+# ################################################################################################################################
+
+    def _get_header(self):
+        return _header.unpack_from(self._mmap, 0)
+
+    def _set_counters(self, count, current_bytes, next_expires_at):
+        _header.pack_into(self._mmap, 0, _magic, self.deployment_digest, self.num_slots, self.slot_size,
+            count, current_bytes, next_expires_at)
+
+    def _update_counters(self, count_delta, bytes_delta, expires_at=0.0):
+        _, _, _, _, count, current_bytes, next_expires_at = self._get_header()
+
+        # The header keeps the earliest time any entry may expire at, used to skip sweeps when nothing is due
+        if expires_at and (not next_expires_at or expires_at < next_expires_at):
+            next_expires_at = expires_at
+
+        self._set_counters(count + count_delta, current_bytes + bytes_delta, next_expires_at)
+
+    @property
+    def current_bytes(self):
+        return self._get_header()[5]
+
+    def get_timestamp(self):
+        return time()
+
+    def get_next_expires_at(self):
+        return self._get_header()[6]
+
+    def get_hit_ratios(self):
+        hit_ratio = 100.0 * self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+        return {
+            'hit_ratio': hit_ratio,
+            'lru_hit_ratio': hit_ratio,
+        }
+
+# ################################################################################################################################
+
+    def _get_offset(self, idx):
+        return _header_size + idx * self.slot_size
+
+    def _read_slot_header(self, idx):
+        return _slot_header.unpack_from(self._mmap, self._get_offset(idx))
+
+    def _read_key(self, idx, key_len):
+        offset = self._get_offset(idx) + _slot_header_size
+        return pickle_loads(self._mmap[offset:offset+key_len])
+
+    def _read_value(self, idx, key_len, value_len):
+        offset = self._get_offset(idx) + _slot_header_size + key_len
+        return pickle_loads(self._mmap[offset:offset+value_len])
+
+    def _write_slot(self, idx, key_hash, key_bytes, value_bytes, expiry, expires_at, last_read, prev_read,
+        last_write, prev_write, hits):
+        offset = self._get_offset(idx)
+        _slot_header.pack_into(self._mmap, offset, 1, key_hash, len(key_bytes), len(value_bytes), expiry, expires_at,
+            last_read, prev_read, last_write, prev_write, hits)
+
+        offset += _slot_header_size
+        self._mmap[offset:offset+len(key_bytes)] = key_bytes
+
+        offset += len(key_bytes)
+        self._mmap[offset:offset+len(value_bytes)] = value_bytes
+
+    def _get_entry(self, idx, key=None):
+        """ Returns an Entry object with data and metadata of a slot.
+        """
+        _, _, key_len, value_len, expiry, expires_at, last_read, prev_read, last_write, prev_write, hits = \
+            self._read_slot_header(idx)
+
+        entry = Entry()
+        entry.key = key if key is not None else self._read_key(idx, key_len)
+        entry.value = self._read_value(idx, key_len, value_len)
+        entry.expiry = expiry
+        entry.expires_at = expires_at
+        entry.last_read = last_read
+        entry.prev_read = prev_read
+        entry.last_write = last_write
+        entry.prev_write = prev_write
+        entry.hits = hits
+        entry.set_metadata()
+
+        return entry
+
+# ################################################################################################################################
+
+    def _find_slot(self, key_bytes, key_hash):
+        """ Returns a tuple of the slot the key is in, or -1 if it is not in cache, and the first free slot found.
+        """
+        mmap = self._mmap
+        num_slots = self.num_slots
+        idx = key_hash % num_slots
+
+        for _ in range(num_slots):
+            offset = self._get_offset(idx)
+            is_used, slot_key_hash, key_len = _slot_header.unpack_from(mmap, offset)[:3]
+
+            if not is_used:
+                return -1, idx
+
+            if slot_key_hash == key_hash:
+                offset += _slot_header_size
+                if mmap[offset:offset+key_len] == key_bytes:
+                    return idx, -1
+
+            idx = (idx + 1) % num_slots
+
+        return -1, -1
+
+    def _delete_slot(self, idx):
+        """ Deletes an entry from a slot and moves entries from the following slots back into the hole, if needed,
+        so that no lookup stops at it before reaching what it looks for.
+        """
+        _, _, key_len, value_len = self._read_slot_header(idx)[:4]
+        self._update_counters(-1, -(key_len + value_len))
+
+        mmap = self._mmap
+        num_slots = self.num_slots
+        hole = idx
+
+        while True:
+            idx = (idx + 1) % num_slots
+            is_used, key_hash, key_len, value_len = self._read_slot_header(idx)[:4]
+
+            if not is_used:
+                break
+
+            # Move the entry unless its home slot is cyclically between the hole and the entry's current slot
+            home = key_hash % num_slots
+            if (hole <= idx and (home <= hole or home > idx)) or (hole > idx and home <= hole and home > idx):
+                source = self._get_offset(idx)
+                target = self._get_offset(hole)
+                length = _slot_header_size + key_len + value_len
+                mmap[target:target+length] = mmap[source:source+length]
+                hole = idx
+
+        _slot_header.pack_into(mmap, self._get_offset(hole), 0, 0, 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0)
+
+    def _evict(self, keep_idx=-1):
+        """ Evicts the least recently used of a few randomly chosen entries, other than the one in keep_idx.
+        Returns True if any entry was evicted.
+        """
+        num_slots = self.num_slots
+        idx = randrange(num_slots)
+        lru_idx = -1
+        lru_access = None
+        found = 0
+
+        for _ in range(num_slots):
+            is_used, _, _, _, _, _, last_read, _, last_write = self._read_slot_header(idx)[:9]
+
+            if is_used and idx != keep_idx:
+                last_access = max(last_read, last_write)
+                if lru_access is None or last_access < lru_access:
+                    lru_idx = idx
+                    lru_access = last_access
+
+                found += 1
+                if found == _eviction_sample_size:
+                    break
+
+            idx = (idx + 1) % num_slots
+
+        if lru_idx == -1:
+            return False
+
+        self._delete_slot(lru_idx)
+        return True
+
+    def _iter_slots(self):
+        """ Yields indexes of all used slots along with lengths of their keys.
+        """
+        mmap = self._mmap
+
+        for idx in range(self.num_slots):
+            is_used, _, key_len = _slot_header.unpack_from(mmap, self._get_offset(idx))[:3]
+            if is_used:
+                yield idx, key_len
+
+# ################################################################################################################################
+
+    def __len__(self):
+        return self._get_header()[4]
+
+    def __contains__(self, key):
+        key_bytes = _dumps(key)
+        with self._lock:
+            return self._find_slot(key_bytes, _get_key_hash(key_bytes))[0] != -1
+
+# ################################################################################################################################
+
+    def _set(self, key, value, expiry, details, meta_ref, orig_now=None, _key_types=key_types, _len_values=len_values):
+
+        if orig_now:
+            _now = orig_now
+            _orig_now = 0.0
+        else:
+            _orig_now = _now = time()
+
+        if not isinstance(key, _key_types):
+            raise ValueError('Key must be an instance of one of {}'.format(key_types))
+
+        if self.has_max_item_size:
+            if isinstance(value, _len_values):
+                len_value = len(value)
+                if len_value > self.max_item_size:
+                    raise ValueError('Value too long {} > {}'.format(len_value, self.max_item_size))
+
+        key_bytes = _dumps(key)
+        value_bytes = _dumps(value)
+        size = len(key_bytes) + len(value_bytes)
+
+        if size > self.slot_data_size:
+            raise ValueError('Entry too big {} > {}'.format(size, self.slot_data_size))
+
+        if self.has_max_bytes and size > self.max_bytes:
+            raise ValueError('Entry too big {} > {}'.format(size, self.max_bytes))
+
+        key_hash = _get_key_hash(key_bytes)
+        idx, free_idx = self._find_slot(key_bytes, key_hash)
+
+        # Update total # of .set operations
+        self.set_ops += 1
+
+        # Ok, we have this key in cache
+        if idx != -1:
+            _, _, key_len, value_len, entry_expiry, expires_at, last_read, prev_read, last_write, _, hits = \
+                self._read_slot_header(idx)
+
+            # If we have a key that previously was not using expiry, we must set it now if expiry is given on input.
+            if not expires_at:
+                if expiry:
+                    entry_expiry = expiry
+                    expires_at = _now + expiry
+            else:
+                # Mark as deleted an entry that has already expired
+                if _now >= expires_at:
+                    self._delete_slot(idx)
+                    self._expired_on_op.append(key)
+                    raise KeyExpiredError(key)
+                else:
+                    # If expiry == 0.0 it means that we are resetting an already existing expiry time
+                    if expiry == 0.0:
+                        expires_at = 0.0
+                        entry_expiry = 0.0
+                    else:
+                        # The entry exists and has not expired so now, if we are configured to, prolong its expiration time
+                        if self.extend_expiry_on_set and entry_expiry:
+                            expires_at = _now + entry_expiry
+
+            out = self._read_value(idx, key_len, value_len)
+            self._write_slot(idx, key_hash, key_bytes, value_bytes, entry_expiry, expires_at, last_read, prev_read,
+                _now, last_write, hits)
+            self._update_counters(0, size - (key_len + value_len), expires_at)
+
+        # No such key in cache - let's add it.
+        else:
+            out = None
+
+            # Make sure there is room for the new key. Evicting an entry may move others so we need to look up the key again.
+            if len(self) >= self.max_size or free_idx == -1:
+                while len(self) >= self.max_size and self._evict():
+                    pass
+                idx, free_idx = self._find_slot(key_bytes, key_hash)
+
+            idx = free_idx
+            expires_at = 0.0 if not expiry else _now + expiry
+            self._write_slot(idx, key_hash, key_bytes, value_bytes, expiry, expires_at, 0.0, 0.0, _now, 0.0, 0)
+            self._update_counters(1, size, expires_at)
+
+        # Make sure the total size of entries is within budget, without evicting the one that was just set.
+        # Evicting an entry may move others so we need to look up the key again.
+        if self.has_max_bytes:
+            while self.current_bytes > self.max_bytes and self._evict(idx):
+                idx = self._find_slot(key_bytes, key_hash)[0]
+
+        # If any output dict for metadata was passed in by reference, set its requires items.
+        if meta_ref is not None:
+            meta_ref['expires_at'] = expires_at
+            meta_ref['orig_now'] = _orig_now
+
+        return self._get_entry(idx, key) if details else out
+
+    def set(self, key, value, expiry, details, meta_ref=None, orig_now=None):
+        with self._lock:
+            return self._set(key, value, expiry, details, meta_ref, orig_now)
+
+    def set_many(self, data, expiry, details, meta_ref=None, orig_now=None):
+        out = {}
+        _now = orig_now or time()
+
+        with self._lock:
+            for key, value in data.items():
+                try:
+                    out[key] = self._set(key, value, expiry, details, None, _now)
+                except KeyExpiredError:
+                    out[key] = self._set(key, value, expiry, details, None, _now)
+
+        if meta_ref is not None:
+            meta_ref['_now'] = _now
+
+        return out
+
+# ################################################################################################################################
+
+    def _get(self, key, default, details):
+
+        _now = time()
+        key_bytes = _dumps(key)
+        key_hash = _get_key_hash(key_bytes)
+        idx = self._find_slot(key_bytes, key_hash)[0]
+
+        if idx == -1:
+            # Add information that there was a cache miss
+            self.misses += 1
+
+            # Return the default value, if any was given.
+            if default is self.default_get:
+                return None
+            else:
+                return default
+
+        is_used, key_hash, key_len, value_len, expiry, expires_at, last_read, _, last_write, prev_write, hits = \
+            self._read_slot_header(idx)
+
+        # We have the key but we must first ensure that it's not expired already
+        if expires_at and _now >= expires_at:
+            self._delete_slot(idx)
+            self._expired_on_op.append(key)
+            raise KeyExpiredError(key)
+
+        # Update total # of .get operations
+        self.get_ops += 1
+
+        # Update total hits counter
+        self.hits += 1
+
+        # The entry exists and has not expired so now, if we are configured to, prolong its expiration time
+        if self.extend_expiry_on_get and expiry:
+            expires_at = _now + expiry
+
+        # Update last/prev access information + hits
+        _slot_header.pack_into(self._mmap, self._get_offset(idx), is_used, key_hash, key_len, value_len, expiry, expires_at,
+            _now, last_read, last_write, prev_write, hits + 1)
+
+        if details:
+            return self._get_entry(idx, key)
+        else:
+            return self._read_value(idx, key_len, value_len)
+
+    def get(self, key, default, details):
+        with self._lock:
+            return self._get(key, default, details)
+
+    def get_many(self, keys, details, _missing=_missing):
+        out = {}
+
+        with self._lock:
+            for key in keys:
+                try:
+                    value = self._get(key, _missing, details)
+                except KeyExpiredError:
+                    continue
+                if value is not _missing:
+                    out[key] = value
+
+        return out
+
+# ################################################################################################################################
+
+    def _delete(self, key):
+        key_bytes = _dumps(key)
+        idx = self._find_slot(key_bytes, _get_key_hash(key_bytes))[0]
+
+        if idx != -1:
+            _, _, key_len, value_len = self._read_slot_header(idx)[:4]
+            out = self._read_value(idx, key_len, value_len)
+            self._delete_slot(idx)
+            return out
+
+    def delete(self, key):
+        with self._lock:
+            return self._delete(key)
+
+    def delete_many(self, keys, return_found, meta_ref=None):
+        out = {}
+        deleted = []
+
+        with self._lock:
+            for key in keys:
+                key_bytes = _dumps(key)
+                idx = self._find_slot(key_bytes, _get_key_hash(key_bytes))[0]
+
+                if idx != -1:
+                    if return_found:
+                        _, _, key_len, value_len = self._read_slot_header(idx)[:4]
+                        out[key] = self._read_value(idx, key_len, value_len)
+                    self._delete_slot(idx)
+                    deleted.append(key)
+
+        if meta_ref is not None:
+            meta_ref['keys'] = deleted
+
+        return out
+
+# ################################################################################################################################
+
+    def _expire(self, key, expiry, meta_ref):
+        self._set(key, self._get(key, self.default_get, False), expiry, False, meta_ref)
+
+    def expire(self, key, expiry, meta_ref):
+        with self._lock:
+            key_bytes = _dumps(key)
+            if self._find_slot(key_bytes, _get_key_hash(key_bytes))[0] != -1:
+                self._expire(key, expiry, meta_ref)
+                return True
+
+        return False
+
+# ################################################################################################################################
+
+    def _find(self, predicate, limit):
+        """ Returns string keys matching the predicate, visiting at most limit keys, or all of them if limit is 0.
+        Must be called with self._lock held.
+        """
+        out = []
+
+        for idx, (slot_idx, key_len) in enumerate(self._iter_slots(), 1):
+            key = self._read_key(slot_idx, key_len)
+            if isinstance(key, str_types) and predicate(key):
+                out.append(key)
+            if idx == limit:
+                break
+
+        return out
+
+    def _get_by(self, predicate, details, limit):
+        out = {}
+
+        with self._lock:
+            for key in self._find(predicate, limit):
+                out[key] = self._get(key, self.default_get, details)
+
+        return out
+
+    def _set_by(self, predicate, value, expiry, details, meta_ref, return_found, limit, orig_now):
+        out = {}
+        _now = orig_now if orig_now else time()
+
+        with self._lock:
+            for key in self._find(predicate, limit):
+                previous = self._set(key, value, expiry, False, None, _now)
+
+                if return_found:
+                    out[key] = previous
+
+                # Indicate to our caller that there was at least one matching key
+                if meta_ref:
+                    meta_ref['_any_found'] = True
+
+        if meta_ref:
+            meta_ref['_now'] = _now
+
+        return out
+
+    def _delete_by(self, predicate, return_found, limit):
+        out = {}
+
+        with self._lock:
+            for key in self._find(predicate, limit):
+                value = self._delete(key)
+                if return_found:
+                    out[key] = value
+
+        return out
+
+    def _expire_by(self, predicate, expiry, limit):
+        found_any = False
+
+        with self._lock:
+            for key in self._find(predicate, limit):
+                self._expire(key, expiry, None)
+                found_any = True
+
+        return found_any
+
+    def _get_regex_predicate(self, data):
+        regex = self._regex_cache.setdefault(data, re_compile(data))
+        return regex.match
+
+# ################################################################################################################################
+
+    def get_by_prefix(self, data, details, limit):
+        return self._get_by(lambda key: key.startswith(data), details, limit)
+
+    def get_by_suffix(self, data, details, limit):
+        return self._get_by(lambda key: key.endswith(data), details, limit)
+
+    def get_by_regex(self, data, details, limit):
+        return self._get_by(self._get_regex_predicate(data), details, limit)
+
+    def get_contains(self, data, details, limit):
+        return self._get_by(lambda key: data in key, details, limit)
+
+    def get_not_contains(self, data, details, limit):
+        return self._get_by(lambda key: data not in key, details, limit)
+
+    def get_contains_all(self, data, details, limit):
+        return self._get_by(lambda key: all(elem in key for elem in data), details, limit)
+
+    def get_contains_any(self, data, details, limit):
+        return self._get_by(lambda key: any(elem in key for elem in data), details, limit)
+
+# ################################################################################################################################
+
+    def set_by_prefix(self, data, value, expiry, details, meta_ref, return_found, limit, orig_now=None):
+        return self._set_by(lambda key: key.startswith(data), value, expiry, details, meta_ref, return_found, limit, orig_now)
+
+    def set_by_suffix(self, data, value, expiry, details, meta_ref, return_found, limit, orig_now=None):
+        return self._set_by(lambda key: key.endswith(data), value, expiry, details, meta_ref, return_found, limit, orig_now)
+
+    def set_by_regex(self, data, value, expiry, details, meta_ref, return_found, limit, orig_now=None):
+        return self._set_by(self._get_regex_predicate(data), value, expiry, details, meta_ref, return_found, limit, orig_now)
+
+    def set_contains(self, data, value, expiry, details, meta_ref, return_found, limit, orig_now=None):
+        return self._set_by(lambda key: data in key, value, expiry, details, meta_ref, return_found, limit, orig_now)
+
+    def set_not_contains(self, data, value, expiry, details, meta_ref, return_found, limit, orig_now=None):
+        return self._set_by(lambda key: data not in key, value, expiry, details, meta_ref, return_found, limit, orig_now)
+
+    def set_contains_all(self, data, value, expiry, details, meta_ref, return_found, limit, orig_now=None):
+        return self._set_by(lambda key: all(elem in key for elem in data), value, expiry, details, meta_ref,
+            return_found, limit, orig_now)
+
+    def set_contains_any(self, data, value, expiry, details, meta_ref, return_found, limit, orig_now=None):
+        return self._set_by(lambda key: any(elem in key for elem in data), value, expiry, details, meta_ref,
+            return_found, limit, orig_now)
+
+# ################################################################################################################################
+
+    def delete_by_prefix(self, data, return_found, limit):
+        return self._delete_by(lambda key: key.startswith(data), return_found, limit)
+
+    def delete_by_suffix(self, data, return_found, limit):
+        return self._delete_by(lambda key: key.endswith(data), return_found, limit)
+
+    def delete_by_regex(self, data, return_found, limit):
+        return self._delete_by(self._get_regex_predicate(data), return_found, limit)
+
+    def delete_contains(self, data, return_found, limit):
+        return self._delete_by(lambda key: data in key, return_found, limit)
+
+    def delete_not_contains(self, data, return_found, limit):
+        return self._delete_by(lambda key: data not in key, return_found, limit)
+
+    def delete_contains_all(self, data, return_found, limit):
+        return self._delete_by(lambda key: all(elem in key for elem in data), return_found, limit)
+
+    def delete_contains_any(self, data, return_found, limit):
+        return self._delete_by(lambda key: any(elem in key for elem in data), return_found, limit)
+
+# ################################################################################################################################
+
+    def expire_by_prefix(self, data, expiry, limit):
+        return self._expire_by(lambda key: key.startswith(data), expiry, limit)
+
+    def expire_by_suffix(self, data, expiry, limit):
+        return self._expire_by(lambda key: key.endswith(data), expiry, limit)
+
+    def expire_by_regex(self, data, expiry, limit):
+        return self._expire_by(self._get_regex_predicate(data), expiry, limit)
+
+    def expire_contains(self, data, expiry, limit):
+        return self._expire_by(lambda key: data in key, expiry, limit)
+
+    def expire_not_contains(self, data, expiry, limit):
+        return self._expire_by(lambda key: data not in key, expiry, limit)
+
+    def expire_contains_all(self, data, expiry, limit):
+        return self._expire_by(lambda key: all(elem in key for elem in data), expiry, limit)
+
+    def expire_contains_any(self, data, expiry, limit):
+        return self._expire_by(lambda key: any(elem in key for elem in data), expiry, limit)
+
+# ################################################################################################################################
+
+    def delete_expired(self):
+        """ Deletes all entries expired as of now. Also, deletes all entries possibly found to have expired by .get or .set calls
+        in this process. Entries are visited only if the earliest expiration time of any of them is already in the past.
+        """
+        _now = time()
+        deleted = self._expired_on_op[:]
+        self._expired_on_op[:] = []
+
+        with self._lock:
+
+            next_expires_at = self.get_next_expires_at()
+            if not next_expires_at or next_expires_at >= _now:
+                return deleted
+
+            next_expires_at = 0.0
+            idx = 0
+
+            while idx < self.num_slots:
+                is_used, _, key_len, _, _, expires_at = self._read_slot_header(idx)[:6]
+
+                if is_used and expires_at:
+                    if _now > expires_at:
+                        deleted.append(self._read_key(idx, key_len))
+                        self._delete_slot(idx)
+
+                        # Another entry may have been moved into this slot, check it again
+                        continue
+
+                    if not next_expires_at or expires_at < next_expires_at:
+                        next_expires_at = expires_at
+
+                idx += 1
+
+            _, _, _, _, count, current_bytes, _ = self._get_header()
+            self._set_counters(count, current_bytes, next_expires_at)
+
+        return deleted
+
+# ################################################################################################################################
+
+    def clear(self):
+        with self._lock:
+            for idx, _ in self._iter_slots():
+                _slot_header.pack_into(self._mmap, self._get_offset(idx), 0, 0, 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0)
+
+            self._set_counters(0, 0, 0.0)
+            self._expired_on_op[:] = []
+            self.hits = 0
+            self.misses = 0
+            self.set_ops = 0
+            self.get_ops = 0
+
+# ################################################################################################################################
+
+    def _get_entries(self):
+        with self._lock:
+            return [self._get_entry(idx) for idx, _ in self._iter_slots()]
+
+    def keys(self):
+        with self._lock:
+            return [self._read_key(idx, key_len) for idx, key_len in self._iter_slots()]
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def values(self):
+        return [entry.value for entry in self._get_entries()]
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def items(self):
+        return [(entry.key, entry.value) for entry in self._get_entries()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def get_slice(self, start, stop, step):
+        """ Yields entries ordered from the most recently used one. Unlike with zato.cache.Cache, the order is that of
+        the latest access time, which is what positions of entries are based on in this cache.
+        """
+        entries = sorted(self._get_entries(), key=lambda entry: max(entry.last_read, entry.last_write), reverse=True)
+
+        for position, entry in enumerate(entries):
+            entry.position = position
+
+        for entry in entries[start:stop:step]:
+            yield entry.to_dict()
+
+# ################################################################################################################################
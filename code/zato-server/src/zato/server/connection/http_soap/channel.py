@@ -11,39 +11,55 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 import logging
 from gzip import GzipFile
-from hashlib import sha256
-from http.client import BAD_REQUEST, FORBIDDEN, INTERNAL_SERVER_ERROR, METHOD_NOT_ALLOWED, NOT_FOUND, UNAUTHORIZED
-from io import StringIO
+from hashlib import sha1
+from http.client import BAD_REQUEST, FORBIDDEN, INTERNAL_SERVER_ERROR, METHOD_NOT_ALLOWED, NOT_FOUND, NOT_MODIFIED, OK, \
+     UNAUTHORIZED
+from functools import partial
+from io import StringIO, UnsupportedOperation
+from struct import error as StructError, Struct
+from tempfile import SpooledTemporaryFile
+from time import time
 from traceback import format_exc
-
-# anyjson
-from anyjson import dumps, loads
+from zlib import compressobj, DEFLATED, MAX_WBITS
 
 # Django
 from django.http import QueryDict
 
+# gevent
+from gevent import spawn, Timeout
+from gevent.event import AsyncResult
+
 # Paste
 from paste.util.converters import asbool
 
-# regex
-from regex import compile as regex_compile
-
 # Python 2/3 compatibility
 from six import PY3
 from past.builtins import basestring, unicode
 
 # Zato
-from zato.common import CHANNEL, DATA_FORMAT, JSON_RPC, HTTP_RESPONSES, HTTP_SOAP, RATE_LIMIT, SEC_DEF_TYPE, SIMPLE_IO, TRACE1, \
-     URL_PARAMS_PRIORITY, URL_TYPE, zato_namespace, ZATO_ERROR, ZATO_NONE, ZATO_OK
+from zato.common import CHANNEL, DATA_FORMAT, JSON_RPC, HTTP_RESPONSES, HTTP_SOAP, MISC, RATE_LIMIT, SEC_DEF_TYPE, SIMPLE_IO, \
+     TRACE1, URL_PARAMS_PRIORITY, URL_TYPE, zato_namespace, ZATO_ERROR, ZATO_NONE, ZATO_OK
 from zato.common.json_schema import DictError as JSONSchemaDictError, ValidationException as JSONSchemaValidationException
 from zato.common.rate_limiting.common import AddressNotAllowed, BaseException as RateLimitingException, RateLimitReached
-from zato.common.util import payload_from_request
+from zato.common.util import new_cid, payload_from_request
+from zato.common.util.http import parse_cache_key_components
+from zato.common.util.json_ import dumps, loads
 from zato.server.connection.http_soap import BadRequest, ClientHTTPError, Forbidden, MethodNotAllowed, NotFound, \
      TooManyRequests, Unauthorized
 from zato.server.service.internal import AdminService
+from zato.server.service.reqresp import stream_payload
 
 stack_format = None
 
+# BLAKE2 is available in Python 3 only
+try:
+    from hashlib import blake2b
+except ImportError:
+    from hashlib import sha1 as _sha1
+
+    def blake2b(digest_size=None):
+        return _sha1()
+
 # ################################################################################################################################
 
 # Type checking
@@ -84,6 +100,9 @@ _status_too_many_requests = '{} {}'.format(TOO_MANY_REQUESTS, HTTP_RESPONSES[TOO
 # Definitions of these security types may be linked to SSO users and their rate limiting definitions
 _sec_def_sso_rate_limit = SEC_DEF_TYPE.BASIC_AUTH, SEC_DEF_TYPE.JWT
 
+# Credentials of these security types are in request bodies, which is why channels that stream requests cannot use them
+_sec_def_body = SEC_DEF_TYPE.OAUTH, SEC_DEF_TYPE.WSS, SEC_DEF_TYPE.XPATH_SEC
+
 # ################################################################################################################################
 
 status_response = {}
@@ -94,6 +113,9 @@ for code, response in HTTP_RESPONSES.items():
 
 soap_doc = """<?xml version='1.0' encoding='UTF-8'?><soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" xmlns="https://zato.io/ns/20130518"><soap:Body>{body}</soap:Body></soap:Envelope>""" # noqa
 
+# Streamed responses are sent in the same envelope, with its opening and closing parts added to their chunks by _soap_stream
+soap_doc_stream_start, soap_doc_stream_end = [elem.encode('utf8') for elem in soap_doc.split('{body}')]
+
 # ################################################################################################################################
 
 zato_message_soap = """<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" xmlns="https://zato.io/ns/20130518">
@@ -173,6 +195,218 @@ class _CachedResponse(object):
 
 # ################################################################################################################################
 
+# Responses are cached as a header followed by their content type, headers and payload, all of them already serialized
+# to bytes. The header starts with a marker of this format, followed by the status code, the time until which a response
+# is fresh (0.0 if it never becomes stale) and the lengths of the content type and headers. Headers are a JSON object.
+_cache_envelope_header = Struct(b'<4sHdHI')
+_cache_envelope_marker = b'ZCR1'
+
+def _encode_cached_response(payload, content_type, headers, status_code, fresh_until, _header=_cache_envelope_header,
+        _marker=_cache_envelope_marker):
+    """ Returns a response, whose payload is already in bytes, serialized in a format that _decode_cached_response can read.
+    """
+    content_type = (content_type or '').encode('utf8')
+    headers = dumps(headers).encode('utf8')
+
+    return b''.join((_header.pack(_marker, status_code, fresh_until, len(content_type), len(headers)), content_type, headers,
+        payload))
+
+def _decode_cached_response(value, _header=_cache_envelope_header, _header_size=_cache_envelope_header.size,
+        _marker=_cache_envelope_marker):
+    """ Returns a _CachedResponse out of bytes from _encode_cached_response along with the time until which it is fresh.
+    The payload is returned as bytes that can be sent to the client as they are. Values in any other format, e.g. ones
+    cached by previous versions, are returned as (None, 0.0) which callers treat in the same way as a cache miss.
+    """
+    try:
+        marker, status_code, fresh_until, content_type_len, headers_len = _header.unpack_from(value)
+        offset = _header_size + content_type_len
+
+        if marker != _marker or len(value) < offset + headers_len:
+            return None, 0.0
+
+        content_type = value[_header_size:offset].decode('utf8')
+        headers = loads(value[offset:offset + headers_len].decode('utf8'))
+
+        if not isinstance(headers, dict):
+            return None, 0.0
+
+    except (StructError, TypeError, ValueError):
+        return None, 0.0
+
+    return _CachedResponse(value[offset + headers_len:], content_type, headers, status_code), fresh_until
+
+# ################################################################################################################################
+
+# RFC 7232 lets only these methods be answered with a 304, If-None-Match sent with other ones is ignored
+_not_modified_methods = frozenset(('GET', 'HEAD'))
+
+def _etag_matches(if_none_match, etag):
+    """ Returns True if the value of an If-None-Match header matches an ETag, using the weak comparison that
+    RFC 7232 requires for this header.
+    """
+    if if_none_match.strip() == '*':
+        return True
+
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+
+    return False
+
+# ################################################################################################################################
+
+# Each of the functions below wraps a streamed response in a generator. WSGI servers close the outermost one once the response
+# has been sent or the client disconnected. Each generator then closes the payload it wraps in turn, so that the close
+# reaches the service's own generator or iterator. None of them returns anything before it starts to iterate over its payload,
+# because a generator that has not started yet cannot run its finally block when it is closed.
+
+def _close_payload(payload):
+    """ Closes a streamed response's payload if it can be closed at all, e.g. if it is a generator.
+    """
+    close = getattr(payload, 'close', None)
+    if close:
+        close()
+
+# ################################################################################################################################
+
+def _encode_stream(payload, _unicode=unicode):
+    """ Returns chunks of a streamed response as bytes, one by one, as they are produced by a service.
+    """
+    try:
+        for chunk in payload:
+            yield chunk.encode('utf8') if isinstance(chunk, _unicode) else chunk
+    finally:
+        _close_payload(payload)
+
+# ################################################################################################################################
+
+def _soap_stream(payload, _start=soap_doc_stream_start, _end=soap_doc_stream_end):
+    """ Returns chunks of a streamed response in a SOAP envelope. Its opening part is sent along with the first chunk,
+    which means that the payload is already being iterated over, and can be closed, once anything is sent to the client.
+    """
+    try:
+        chunk = next(payload, None)
+        yield _start if chunk is None else _start + chunk
+
+        for chunk in payload:
+            yield chunk
+
+        yield _end
+
+    finally:
+        _close_payload(payload)
+
+# ################################################################################################################################
+
+def _close_after(payload, resource):
+    """ Returns chunks of a streamed response and closes a resource that they may depend on once there are no more of them.
+    """
+    try:
+        for chunk in payload:
+            yield chunk
+    finally:
+        try:
+            _close_payload(payload)
+        finally:
+            resource.close()
+
+# ################################################################################################################################
+
+def _gzip_stream(payload, _wbits=16 + MAX_WBITS):
+    """ Compresses chunks of a streamed response with gzip as they are produced rather than all of them at once.
+    """
+    compressor = compressobj(9, DEFLATED, _wbits) # 16 + MAX_WBITS means gzip headers, 9 is what GzipFile uses by default
+
+    try:
+        for chunk in payload:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+
+        yield compressor.flush()
+
+    finally:
+        _close_payload(payload)
+
+# ################################################################################################################################
+
+class RequestStream(object):
+    """ A read-only, file-like body of a request sent to a channel with streaming enabled. Services access it through
+    self.request.http.stream. By default, data is read from the client only when a service asks for it, without seeking.
+    With a spool_threshold of more than 0, the first read copies the whole body to a temporary file which keeps up to
+    that many bytes in memory and is written to disk past that point. A spooled body can be seeked in.
+    """
+    __slots__ = ('chunk_size', '_input', '_remaining', '_spool_threshold', '_file')
+
+    def __init__(self, wsgi_input, content_length=None, spool_threshold=0, chunk_size=65536):
+        self.chunk_size = chunk_size
+        self._input = wsgi_input
+        self._remaining = int(content_length) if content_length else None # None = read until the client sends no more data
+        self._spool_threshold = spool_threshold
+        self._file = None
+
+    def _read_input(self, size, read_func):
+        """ Reads up to size bytes, or all of them if size is negative, from the client using read_func.
+        """
+        if self._remaining is not None:
+            if size < 0 or size > self._remaining:
+                size = self._remaining
+            if not size:
+                return b''
+
+        data = read_func(size)
+
+        if self._remaining is not None:
+            self._remaining -= len(data)
+
+        return data
+
+    def _get_file(self):
+        if self._file is None:
+            self._file = SpooledTemporaryFile(max_size=self._spool_threshold)
+            for data in iter(partial(self._read_input, self.chunk_size, self._input.read), b''):
+                self._file.write(data)
+            self._file.seek(0)
+
+        return self._file
+
+    def read(self, size=-1):
+        if self._spool_threshold:
+            return self._get_file().read(size)
+        return self._read_input(size, self._input.read)
+
+    def readline(self, size=-1):
+        if self._spool_threshold:
+            return self._get_file().readline(size)
+        return self._read_input(size, self._input.readline)
+
+    def __iter__(self):
+        """ Iterates over the body in chunks of self.chunk_size bytes.
+        """
+        return iter(partial(self.read, self.chunk_size), b'')
+
+    def seekable(self):
+        return bool(self._spool_threshold)
+
+    def seek(self, offset, whence=0):
+        if not self._spool_threshold:
+            raise UnsupportedOperation('Request bodies can be seeked in only if they are spooled')
+        return self._get_file().seek(offset, whence)
+
+    def tell(self):
+        if not self._spool_threshold:
+            raise UnsupportedOperation('Request bodies can be seeked in only if they are spooled')
+        return self._get_file().tell()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+# ################################################################################################################################
+
 class _HashCtx(object):
     """ Encapsulates information needed to compute a hash value of an incoming request.
     """
@@ -237,7 +471,8 @@ class RequestDispatcher(object):
         _http_soap_action='HTTP_SOAPACTION', _stringio=StringIO, _gzipfile=GzipFile, _accept_any_http=accept_any_http,
         _accept_any_internal=accept_any_internal, _rate_limit_type_http=RATE_LIMIT.OBJECT_TYPE.HTTP_SOAP,
         _rate_limit_type_sso_user=RATE_LIMIT.OBJECT_TYPE.SSO_USER, _stack_format=stack_format,
-        _exc_sep='*' * 80, _sec_def_sso_rate_limit=_sec_def_sso_rate_limit, _basic_auth=SEC_DEF_TYPE.BASIC_AUTH):
+        _exc_sep='*' * 80, _sec_def_sso_rate_limit=_sec_def_sso_rate_limit, _basic_auth=SEC_DEF_TYPE.BASIC_AUTH,
+        _NOT_MODIFIED=NOT_MODIFIED, _stream_payload=stream_payload):
 
         # Needed as one of the first steps
         http_method = wsgi_environ['REQUEST_METHOD']
@@ -273,7 +508,13 @@ class RequestDispatcher(object):
         # This is needed in parallel.py's on_wsgi_request
         wsgi_environ['zato.channel_item'] = channel_item
 
-        payload = wsgi_environ['wsgi.input'].read()
+        # Channels with streaming enabled give services a file-like object rather than a request body read upfront
+        if channel_item and channel_item.get('request_streaming'):
+            payload = None
+            wsgi_environ['zato.request.stream'] = RequestStream(wsgi_environ['wsgi.input'],
+                wsgi_environ.get('CONTENT_LENGTH'), (channel_item.get('request_spool_threshold') or 0) * 1024)
+        else:
+            payload = wsgi_environ['wsgi.input'].read()
 
         # OK, we can possibly handle it
         if url_match not in no_url_match:
@@ -297,6 +538,11 @@ class RequestDispatcher(object):
 
                     if sec.sec_def != ZATO_NONE:
 
+                        if payload is None and sec.sec_def.sec_type in _sec_def_body:
+                            logger.warn('Channel `%s` streams requests and cannot use security definition `%s` (%s), cid:`%s`',
+                                channel_item['name'], sec.sec_def.name, sec.sec_def.sec_type, cid)
+                            raise Forbidden(cid, 'You are not allowed to access this URL')
+
                         if sec.sec_def.sec_type == SEC_DEF_TYPE.OAUTH:
                             post_data.update(QueryDict(payload, encoding='utf-8'))
 
@@ -374,13 +620,17 @@ class RequestDispatcher(object):
                 wsgi_environ['zato.http.response.headers'].update(response.headers)
                 wsgi_environ['zato.http.response.status'] = _status_response[response.status_code]
 
-                if channel_item['content_encoding'] == 'gzip':
+                if channel_item['content_encoding'] == 'gzip' and response.status_code != _NOT_MODIFIED:
 
-                    s = _stringio()
-                    with _gzipfile(fileobj=s, mode='w') as f:
-                        f.write(response.payload)
-                    response.payload = s.getvalue()
-                    s.close()
+                    # Streamed responses are compressed chunk by chunk, others as a whole
+                    if isinstance(response.payload, _stream_payload):
+                        response.payload = _gzip_stream(response.payload)
+                    else:
+                        s = _stringio()
+                        with _gzipfile(fileobj=s, mode='w') as f:
+                            f.write(response.payload)
+                        response.payload = s.getvalue()
+                        s.close()
 
                     wsgi_environ['zato.http.response.headers']['Content-Encoding'] = 'gzip'
 
@@ -493,6 +743,12 @@ class RequestHandler(object):
         self.server = server # A ParallelServer instance
         self.use_soap_envelope = asbool(self.server.fs_server_config.misc.use_soap_envelope)
 
+        # Cache keys of responses currently being computed, each mapped to an AsyncResult set once a response is cached
+        self.cache_in_flight = {}
+
+        # Maps channels' specifications of what their cache keys are built of to the parsed form of these specifications
+        self.cache_key_components = {}
+
 # ################################################################################################################################
 
     def _set_response_data(self, service, **kwargs):
@@ -561,10 +817,12 @@ class RequestHandler(object):
 
 # ################################################################################################################################
 
-    def get_response_from_cache(self, service, raw_request, channel_item, channel_params, wsgi_environ, _loads=loads,
-        _CachedResponse=_CachedResponse, _HashCtx=_HashCtx, _sha256=sha256, split_re=regex_compile('........?').findall):
-        """ Returns a cached response for incoming request or None if there is nothing cached for it.
-        By default, an incoming request's hash is calculated by sha256 over a concatenation of:
+    def get_response_from_cache(self, service, raw_request, channel_item, channel_params, wsgi_environ,
+        _decode=_decode_cached_response, _HashCtx=_HashCtx, _time=time):
+        """ Returns a cached response for incoming request or None if there is nothing cached for it, along with a flag
+        indicating whether the response is stale, i.e. whether it is served only because the channel's stale-while-revalidate
+        window has not passed yet. Unless a service computes its own hash of a request, the hash is calculated by BLAKE2b
+        over the components listed in the channel's cache_key_components. By default, these are:
           * WSGI REQUEST_METHOD   # E.g. GET or POST
           * WSGI PATH_INFO        # E.g. /my/api
           * sorted(zato.http.GET) # E.g. ?foo=123&bar=456 (query string aka channel_params)
@@ -575,41 +833,188 @@ class RequestHandler(object):
         if service.get_request_hash:
             hash_value = service.get_request_hash(_HashCtx(raw_request, channel_item, channel_params, wsgi_environ))
         else:
-            query_string = str(sorted(channel_params.items()))
-            data = '%s%s%s%s' % (wsgi_environ['REQUEST_METHOD'], wsgi_environ['PATH_INFO'], query_string, raw_request)
-            hash_value = _sha256(data).hexdigest()
-            hash_value = '-'.join(split_re(hash_value))
+            spec = channel_item.get('cache_key_components')
+            components = self.cache_key_components.get(spec)
+
+            if components is None:
+                components = self.cache_key_components[spec] = parse_cache_key_components(spec)
+
+            hash_value = self._get_request_hash(components, raw_request, channel_params, wsgi_environ)
 
         # No matter if hash value is default or from service, always prefix it with channel's type and ID
         cache_key = 'http-channel-%s-%s' % (channel_item['id'], hash_value)
 
         # We have the key so now we can check if there is any matching response already stored in cache
         response = self.server.get_from_cache(channel_item['cache_type'], channel_item['cache_name'], cache_key)
+        is_stale = False
 
         # If there is any response, we can now load into a format that our callers expect
         if response:
-            response = _loads(response)
-            response = _CachedResponse(response['payload'], response['content_type'], response['headers'],
-                response['status_code'])
+            response, fresh_until = _decode(response)
+
+            # A value that cannot be decoded is a cache miss - invoking the service will overwrite it
+            if response is None:
+                logger.info('Ignoring cached response in an unrecognised format, channel:`%s`, key:`%s`',
+                    channel_item['name'], cache_key)
+            else:
+                is_stale = bool(fresh_until and _time() >= fresh_until)
 
-        return cache_key, response
+        return cache_key, response, is_stale
 
 # ################################################################################################################################
 
-    def set_response_in_cache(self, channel_item, key, response, _dumps=dumps):
+    def _get_request_hash(self, components, raw_request, channel_params, wsgi_environ, _blake2b=blake2b, _sep=b'\0'):
+        """ Returns a hash of the selected components of an incoming request. Each of them is hashed separately,
+        which means that a request's body is never copied only to compute its hash.
+        """
+        # Without merging URL parameters there are no channel_params so query string needs to be parsed here
+        if channel_params is None:
+            channel_params = self._get_flattened(wsgi_environ.get('QUERY_STRING'))
+
+        request_hash = _blake2b(digest_size=16)
+
+        for component_type, name in components:
+
+            if component_type == 'body':
+                value = raw_request
+            elif component_type == 'method':
+                value = wsgi_environ['REQUEST_METHOD']
+            elif component_type == 'path':
+                value = wsgi_environ['PATH_INFO']
+            elif component_type == 'header':
+                value = wsgi_environ.get(name)
+            elif name:
+                value = channel_params.get(name)
+            else:
+                value = sorted(channel_params.items())
+
+            if not isinstance(value, bytes):
+                value = '{}'.format(value).encode('utf8')
+
+            request_hash.update(value)
+            request_hash.update(_sep)
+
+        return request_hash.hexdigest()
+
+# ################################################################################################################################
+
+    def set_response_in_cache(self, channel_item, key, response, _encode=_encode_cached_response, _sha1=sha1, _OK=OK,
+            _time=time, _stream_payload=stream_payload):
         """ Caches responses from this channel's invocation for as long as the cache is configured to keep it.
+        If the channel has a stale-while-revalidate window, responses are kept in cache for that much longer
+        than their expiry time and can still be served while they are being refreshed. Successful responses
+        are given a strong ETag computed over their payload. Returns the value cached, or None if the response
+        is streamed, in which case it cannot be cached because it is not known until it has been sent.
+        """
+        if isinstance(response.payload, _stream_payload):
+            return
+        expiry = (channel_item.get('cache_expiry') or 0) * 60 # Expiry is in minutes
+        stale_while_revalidate = channel_item.get('cache_stale_while_revalidate') or 0
+        fresh_until = 0.0
+
+        # Staleness applies only to responses that expire at all
+        if expiry and stale_while_revalidate:
+            fresh_until = _time() + expiry
+            expiry += stale_while_revalidate
+
+        payload = response.payload or b''
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf8')
+
+        if response.status_code == _OK:
+            response.headers['ETag'] = '"{}"'.format(_sha1(payload).hexdigest())
+
+        value = _encode(payload, response.content_type, response.headers, response.status_code, fresh_until)
+        self.server.get_cache(channel_item['cache_type'], channel_item['cache_name']).set(key, value, expiry)
+
+        return value
+
+# ################################################################################################################################
+
+    def _invoke_service(self, service, cid, url_match, channel_item, wsgi_environ, raw_request, worker_store,
+            simple_io_config, channel_params, channel_type):
+        """ Invokes a service on behalf of a channel and returns its response.
+        """
+        # Add any path params matched to WSGI environment so it can be easily accessible later on
+        wsgi_environ['zato.http.path_params'] = url_match
+
+        response = service.update_handle(self._set_response_data, service, raw_request,
+            channel_type, channel_item.data_format, channel_item.transport, self.server, worker_store.broker_client,
+            worker_store, cid, simple_io_config, wsgi_environ=wsgi_environ,
+            url_match=url_match, channel_item=channel_item, channel_params=channel_params,
+            merge_channel_params=channel_item.merge_url_params_req,
+            params_priority=channel_item.params_pri)
+
+        # The response object is not reused along with the service instance so it can be still returned
+        self.server.service_store.release_instance(service)
+
+        return response
+
+# ################################################################################################################################
+
+    def _start_in_flight(self, cache_key):
+        """ Adds a cache key to self.cache_in_flight and returns an AsyncResult which will be given the value cached for that
+        key, or None if nothing is cached. Concurrent requests for the same key can wait for it rather than invoke
+        the service themselves.
+        """
+        in_flight = self.cache_in_flight[cache_key] = AsyncResult()
+        return in_flight
+
+    def _end_in_flight(self, cache_key, in_flight, value):
+        """ Lets requests waiting for a cache key know what value has been cached for it, or that none has been if it is None.
+        """
+        in_flight.set(value)
+
+        # A request that stopped waiting for us may have started its own invocation in the meantime
+        if self.cache_in_flight.get(cache_key) is in_flight:
+            del self.cache_in_flight[cache_key]
+
+# ################################################################################################################################
+
+    def _invoke_and_cache(self, in_flight, channel_item, cache_key, invoke_func, *invoke_args):
+        """ Invokes a service through invoke_func and caches its response. Until the response is cached, the cache key
+        is in self.cache_in_flight, mapped to in_flight from self._start_in_flight.
         """
-        self.server.set_in_cache(channel_item['cache_type'], channel_item['cache_name'], key, _dumps({
-            'payload': response.payload,
-            'content_type': response.content_type,
-            'headers': response.headers,
-            'status_code': response.status_code,
-        }))
+        value = None
+
+        try:
+            response = invoke_func(*invoke_args)
+            value = self.set_response_in_cache(channel_item, cache_key, response)
+        finally:
+            self._end_in_flight(cache_key, in_flight, value)
+
+        return response
+
+# ################################################################################################################################
+
+    def _revalidate(self, in_flight, cache_key, url_match, channel_item, wsgi_environ, raw_request, worker_store,
+            simple_io_config, channel_params, channel_type):
+        """ Invoked in a background greenlet to refresh a stale response in cache, using a new instance of the channel's
+        service and a copy of the original request's WSGI environment. The cache key is already in self.cache_in_flight,
+        which is how other requests know that it is being refreshed.
+        """
+        try:
+            service, is_active = self.server.service_store.new_instance(channel_item.service_impl_name)
+            if is_active:
+                wsgi_environ = dict(wsgi_environ)
+                wsgi_environ['zato.http.response.headers'] = {}
+
+                self._invoke_and_cache(in_flight, channel_item, cache_key, self._invoke_service, service, new_cid(), url_match,
+                    channel_item, wsgi_environ, raw_request, worker_store, simple_io_config, channel_params, channel_type)
+
+        except Exception:
+            logger.warn('Could not revalidate cached response of channel `%s`, key:`%s`, e:`%s`',
+                channel_item['name'], cache_key, format_exc())
+
+        finally:
+            if not in_flight.ready():
+                self._end_in_flight(cache_key, in_flight, None)
 
 # ################################################################################################################################
 
     def handle(self, cid, url_match, channel_item, wsgi_environ, raw_request, worker_store, simple_io_config, post_data,
-            path_info, soap_action, channel_type=CHANNEL.HTTP_SOAP, _response_404=response_404):
+            path_info, soap_action, channel_type=CHANNEL.HTTP_SOAP, _response_404=response_404, _NOT_MODIFIED=NOT_MODIFIED,
+            _stream_payload=stream_payload):
         """ Create a new instance of a service and invoke it.
         """
         service, is_active = self.server.service_store.new_instance(channel_item.service_impl_name)
@@ -623,30 +1028,90 @@ class RequestHandler(object):
         else:
             channel_params = None
 
-        # If caching is configured for this channel, we need to first check if there is no response already
-        if channel_item['cache_type']:
-            cache_key, response = self.get_response_from_cache(service, raw_request, channel_item, channel_params, wsgi_environ)
-            if response:
-                return response
+        invoke_args = (service, cid, url_match, channel_item, wsgi_environ, raw_request, worker_store, simple_io_config,
+            channel_params, channel_type)
 
-        # Add any path params matched to WSGI environment so it can be easily accessible later on
-        wsgi_environ['zato.http.path_params'] = url_match
+        # Requests that are streamed are never cached because their bodies are not known until services read them
+        if channel_item.get('request_streaming'):
+            request_stream = wsgi_environ['zato.request.stream']
+            try:
+                response = self._invoke_service(*invoke_args)
+            except Exception:
+                request_stream.close()
+                raise
+
+            # A streamed response may still be reading the request so it can be closed only after the last chunk
+            if isinstance(response.payload, _stream_payload):
+                response.payload = _close_after(response.payload, request_stream)
+            else:
+                request_stream.close()
 
-        # No cache for this channel or no cached response, invoke the service then.
-        response = service.update_handle(self._set_response_data, service, raw_request,
-            channel_type, channel_item.data_format, channel_item.transport, self.server, worker_store.broker_client,
-            worker_store, cid, simple_io_config, wsgi_environ=wsgi_environ,
-            url_match=url_match, channel_item=channel_item, channel_params=channel_params,
-            merge_channel_params=channel_item.merge_url_params_req,
-            params_priority=channel_item.params_pri)
+            return response
 
-        # Cache the response if needed (cache_key was already created on return from get_response_from_cache)
-        if channel_item['cache_type']:
-            self.set_response_in_cache(channel_item, cache_key, response)
+        # No cache for this channel so we can invoke the service directly
+        if not channel_item['cache_type']:
+            return self._invoke_service(*invoke_args)
+
+        # If caching is configured for this channel, the response may be already in cache
+        response = self._handle_cached(invoke_args)
+
+        # Clients that already have the same response as the one we would return receive a 304 without a body
+        if_none_match = wsgi_environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and wsgi_environ['REQUEST_METHOD'] in _not_modified_methods:
+            etag = response.headers.get('ETag')
+            if etag and _etag_matches(if_none_match, etag):
+                return _CachedResponse(b'', response.content_type, {'ETag': etag}, _NOT_MODIFIED)
 
-        # Having used the cache or not, we can return the response now
         return response
 
+# ################################################################################################################################
+
+    def _handle_cached(self, invoke_args, _decode=_decode_cached_response, _default_timeout=MISC.DEFAULT_HTTP_TIMEOUT):
+        """ Returns a response for a channel with caching enabled, either from cache or by invoking its service.
+        """
+        service, _, url_match, channel_item, wsgi_environ, raw_request, worker_store, simple_io_config, channel_params, \
+            channel_type = invoke_args
+
+        # We need to first check if there is no response already
+        cache_key, response, is_stale = self.get_response_from_cache(
+            service, raw_request, channel_item, channel_params, wsgi_environ)
+
+        if response:
+
+            # A stale response is returned as is but it is also refreshed in background, unless this is already in progress
+            if is_stale and cache_key not in self.cache_in_flight:
+                spawn(self._revalidate, self._start_in_flight(cache_key), cache_key, url_match, channel_item, wsgi_environ,
+                    raw_request, worker_store, simple_io_config, channel_params, channel_type)
+
+            # The service is not invoked at all in this case
+            self.server.service_store.release_instance(service)
+
+            return response
+
+        # With single-flight enabled, only one request at a time invokes the service for a given key,
+        # others wait until it produces a response and they return that response. They wait for no longer
+        # than the channel's timeout, after which they invoke the service themselves.
+        if channel_item.get('cache_single_flight'):
+            in_flight = self.cache_in_flight.get(cache_key)
+            if in_flight:
+                timeout = channel_item.get('timeout') or _default_timeout
+                try:
+                    value = in_flight.get(timeout=timeout)
+                except Timeout:
+                    logger.info('Invoking service after waiting %ss for a response to cache, channel:`%s`, key:`%s`',
+                        timeout, channel_item['name'], cache_key)
+                    value = None
+
+                # If it is None, the invocation we were waiting for failed or is taking too long
+                # so we invoke the service ourselves below.
+                if value:
+                    self.server.service_store.release_instance(service)
+                    return _decode(value)[0]
+
+        # No cached response, invoke the service and cache its response
+        return self._invoke_and_cache(self._start_in_flight(cache_key), channel_item, cache_key, self._invoke_service,
+            *invoke_args)
+
 # ################################################################################################################################
 
     def _get_xml_admin_payload(self, service_instance, zato_message_template, payload):
@@ -668,10 +1133,12 @@ class RequestHandler(object):
 
 # ################################################################################################################################
 
-    def set_payload(self, response, data_format, transport, service_instance):
+    def set_payload(self, response, data_format, transport, service_instance, _stream_payload=stream_payload):
         """ Sets the actual payload to represent the service's response out of
         whatever the service produced. This includes converting dictionaries into
         JSON, adding Zato metadata and wrapping the mesasge in SOAP if need be.
+        Generators and other iterators are not serialized here - their chunks will be
+        sent to the client one by one as they are produced.
         """
         if isinstance(service_instance, AdminService):
             if data_format == SIMPLE_IO.FORMAT.JSON:
@@ -696,6 +1163,14 @@ class RequestHandler(object):
                 else:
                     response.payload = self._get_xml_admin_payload(service_instance, zato_message_template, None)
         else:
+            if isinstance(response.payload, _stream_payload):
+                response.payload = _encode_stream(response.payload)
+
+                if transport == URL_TYPE.SOAP and self.use_soap_envelope:
+                    response.payload = _soap_stream(response.payload)
+
+                return
+
             if not isinstance(response.payload, basestring):
                 if isinstance(response.payload, dict) and data_format in (DATA_FORMAT.JSON, DATA_FORMAT.DICT):
                     response.payload = dumps(response.payload)
@@ -30,7 +30,7 @@ from zato.common.util.auth import on_basic_auth, on_wsse_pwd, WSSE
 from zato.common.util.url_dispatcher import get_match_target
 from zato.server.connection.http_soap import Forbidden, Unauthorized
 from zato.server.jwt import JWT
-from zato.url_dispatcher import CyURLData, Matcher
+from zato.url_dispatcher import CyURLData, default_url_path_cache_size, Matcher
 
 # ################################################################################################################################
 
@@ -87,7 +87,8 @@ class URLData(CyURLData, OAuthDataStore):
                  openstack_config=None, xpath_sec_config=None, tls_channel_sec_config=None, tls_key_cert_config=None, \
                  vault_conn_sec_config=None, kvdb=None, broker_client=None, odb=None, json_pointer_store=None, xpath_store=None,
                  jwt_secret=None, vault_conn_api=None):
-        super(URLData, self).__init__(channel_data)
+        super(URLData, self).__init__(channel_data, int(
+            worker.server.fs_server_config.http.get('url_path_cache_size', default_url_path_cache_size)))
         self.worker = worker # type: WorkerStore
         self.url_sec = url_sec
         self.basic_auth_config = basic_auth_config
@@ -683,7 +684,9 @@ class URLData(CyURLData, OAuthDataStore):
 
         # No error, let's delete channel info
         if match_idx != ZATO_NONE:
+            self._remove_from_cache(self.channel_data[match_idx]['match_target'])
             self.channel_data.pop(match_idx)
+            self.clear_router()
 
 # ################################################################################################################################
 
@@ -1208,6 +1211,9 @@ class URLData(CyURLData, OAuthDataStore):
 
         self.channel_data[:] = channel_data
 
+        # Positions of channels have changed so the router needs to be rebuilt
+        self.clear_router()
+
 # ################################################################################################################################
 
     def _channel_item_from_msg(self, msg, match_target, old_data={}):
@@ -1237,6 +1243,14 @@ class URLData(CyURLData, OAuthDataStore):
         for name in('is_rate_limit_active', 'rate_limit_def', 'rate_limit_type', 'rate_limit_check_parent_def'):
             channel_item[name] = msg.get(name)
 
+        # For response caching - timeout is how long to wait for another request to cache a response with single-flight
+        for name in('cache_single_flight', 'cache_stale_while_revalidate', 'cache_key_components', 'timeout'):
+            channel_item[name] = msg.get(name)
+
+        # For streaming of request bodies
+        for name in('request_streaming', 'request_spool_threshold'):
+            channel_item[name] = msg.get(name)
+
         return channel_item
 
 # ################################################################################################################################
@@ -9,16 +9,14 @@ Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
 # stdlib
 import logging
 
-# anyjson
-from anyjson import dumps
-
 # Zato
 from zato.common import KVDB, TRACE1
+from zato.common.util.json_ import dumps
 
 logger = logging.getLogger(__name__)
 
-def store(kvdb, name, **data):
-    """ Stores information regarding an invocation that came later than it was allowed.
+def add(pipe, name, data):
+    """ Adds to a KVDB pipeline commands storing information regarding an invocation that came later than it was allowed.
     """
     key = '{}{}'.format(KVDB.RESP_SLOW, name)
     data = dumps(data)
@@ -27,5 +25,12 @@ def store(kvdb, name, **data):
         msg = 'key:[{}], name:[{}], data:[{}]'.format(key, name, data)
         logger.log(TRACE1, msg)
 
-    kvdb.conn.lpush(key, data)
-    kvdb.conn.ltrim(key, 0, 99) # TODO: This should be configurable
+    pipe.lpush(key, data)
+    pipe.ltrim(key, 0, 99) # TODO: This should be configurable
+
+def store(kvdb, name, **data):
+    """ Stores information regarding an invocation that came later than it was allowed.
+    """
+    with kvdb.conn.pipeline() as pipe:
+        add(pipe, name, data)
+        pipe.execute()
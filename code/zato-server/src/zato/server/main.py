@@ -62,6 +62,7 @@ from zato.common.repo import RepoManager
 from zato.common.util import absjoin, asbool, clear_locks, get_config, get_kvdb_config_for_log, parse_cmd_line_options, \
      register_diag_handlers, store_pidfile
 from zato.common.util.cli import read_stdin_data
+from zato.common.util.json_ import set_json_codec
 from zato.server.base.parallel import ParallelServer
 from zato.server.ext import zunicorn
 from zato.server.ext.zunicorn.app.base import Application
@@ -212,6 +213,10 @@ def run(base_dir, start_gunicorn_app=True, options=None):
 
     zunicorn.SERVER_SOFTWARE = server_config.misc.get('http_server_header', 'Zato')
 
+    # New in 3.1 hence optional - the codec needs to be set before any JSON is produced or consumed
+    json_codec = set_json_codec(server_config.misc.get('json_codec', 'stdlib'))
+    logger.info('JSON codec `%s`', json_codec.name)
+
     # Store KVDB config in logs, possibly replacing its password if told to
     kvdb_config = get_kvdb_config_for_log(server_config.kvdb)
     kvdb_logger.info('Main process config `%s`', kvdb_config)
@@ -34,14 +34,13 @@ from zato.common.py23_ import maxint
 
 # Zato
 from zato.bunch import Bunch
-from zato.common import BROKER, CHANNEL, DATA_FORMAT, Inactive, KVDB, NO_DEFAULT_VALUE, PARAMS_PRIORITY, PUBSUB, WEB_SOCKET, \
+from zato.common import BROKER, CHANNEL, DATA_FORMAT, Inactive, NO_DEFAULT_VALUE, PARAMS_PRIORITY, PUBSUB, WEB_SOCKET, \
      ZatoException, zato_no_op_marker
 from zato.common.broker_message import SERVICE
 from zato.common.exception import Reportable
 from zato.common.json_schema import ValidationException as JSONSchemaValidationException
 from zato.common.nav import DictNav, ListNav
-from zato.common.util import get_response_value, make_repr, new_cid, payload_from_request, service_name_from_impl, uncamelify
-from zato.server.connection import slow_response
+from zato.common.util import make_repr, new_cid, payload_from_request, service_name_from_impl, uncamelify
 from zato.server.connection.email import EMailAPI
 from zato.server.connection.jms_wmq.outgoing import WMQFacade
 from zato.server.connection.search import SearchAPI
@@ -53,7 +52,7 @@ from zato.server.pattern.invoke_retry import InvokeRetry
 from zato.server.pattern.parallel import ParallelExec
 from zato.server.pubsub import PubSub
 from zato.server.service.reqresp import AMQPRequestData, Cloud, Definition, IBMMQRequestData, InstantMessaging, Outgoing, \
-     Request, Response
+     Request, Response, stream_payload
 
 # Not used here in this module but it's convenient for callers to be able to import everything from a single namespace
 from zato.server.service.reqresp.sio import AsIs, CSV, Boolean, Date, DateTime, Dict, Float, ForceType, Integer, List, \
@@ -90,18 +89,22 @@ if typing.TYPE_CHECKING:
     from zato.broker.client import BrokerClient
     from zato.common.audit import AuditPII
     from zato.common.crypto import ServerCryptoManager
+    from zato.common.kvdb import KVDB
     from zato.common.json_schema import Validator as JSONSchemaValidator
     from zato.common.odb.api import ODBManager
     from zato.server.base.worker import WorkerStore
     from zato.server.base.parallel import ParallelServer
     from zato.server.connection.server import Servers
+    from zato.server.service.reqresp.sio_compiler import CompiledSIO
     from zato.sso.api import SSOAPI
 
     # For pyflakes
     AuditPII = AuditPII
     BrokerClient = BrokerClient
     Callable = Callable
+    CompiledSIO = CompiledSIO
     JSONSchemaValidator = JSONSchemaValidator
+    KVDB = KVDB
     ODBManager = ODBManager
     ParallelServer = ParallelServer
     ServerCryptoManager = ServerCryptoManager
@@ -247,6 +250,7 @@ class Service(object):
     _out_plain_http = None
 
     _req_resp_freq = 0
+    _sio_compiled = None # type: CompiledSIO
     _has_before_job_hooks = None
     _has_after_job_hooks = None
     _before_job_hooks = []
@@ -273,6 +277,11 @@ class Service(object):
     # JSON Schema validator attached only if service declares a schema to use
     _json_schema_validator = None # type: JSONSchemaValidator
 
+    # If True, instances of this service are not created for each invocation - ServiceStore keeps idle ones
+    # and calls their .reset method before they are reused. Services that spawn greenlets which access self
+    # after .handle returns must not set it.
+    recycle_instances = False
+
     def __init__(self, _get_logger=logging.getLogger, _Bunch=Bunch, _Request=Request, _Response=Response,
             _DictNav=DictNav, _ListNav=ListNav, _Outgoing=Outgoing, _WMQFacade=WMQFacade, _ZMQFacade=ZMQFacade,
             *ignored_args, **ignored_kwargs):
@@ -295,7 +304,7 @@ class Service(object):
         self.handle_return_time = None # When did its 'handle' method finished processing the request
         self.processing_time_raw = None # A timedelta object with the processing time up to microseconds
         self.processing_time = None # Processing time in milliseconds
-        self.usage = 0 # How many times the service has been invoked
+        self.usage = 0 # How many times the service has been invoked in this process, if stats are enabled
         self.slow_threshold = maxint # After how many ms to consider the response came too late
         self.msg = None
         self.time = None
@@ -412,14 +421,23 @@ class Service(object):
 
         # self.is_sio attribute is set by ServiceStore during deployment
         if self.has_sio:
-            self.request.init(True, self.cid, self.SimpleIO, self.data_format, self.transport, self.wsgi_environ,
-                self.server.encrypt)
-            self.response.init(self.cid, self.SimpleIO, self.data_format)
+
+            # SimpleIO compiled during deployment can be used only with the configuration it was compiled for,
+            # which is always the case with requests from channels but not necessarily when services are invoked directly.
+            sio_compiled = self._sio_compiled
+            if sio_compiled and sio_compiled.simple_io_config is not self.request.simple_io_config:
+                sio_compiled = None
+
+            # Streamed requests are read by services themselves so there is no input to parse here
+            self.request.init(not self.request.http.stream, self.cid, self.SimpleIO, self.data_format, self.transport,
+                self.wsgi_environ, self.server.encrypt, sio_compiled)
+            self.response.init(self.cid, self.SimpleIO, self.data_format, sio_compiled)
 
         # Cache is always enabled
         self.cache = self._worker_store.cache_api
 
-    def set_response_data(self, service, _raw_types=(basestring, dict, list, tuple, EtreeElement, ObjectifiedElement), **kwargs):
+    def set_response_data(self, service, _raw_types=(basestring, dict, list, tuple, EtreeElement, ObjectifiedElement) + \
+        stream_payload, **kwargs):
         response = service.response.payload
         if not isinstance(response, _raw_types):
             response = response.getvalue(serialize=kwargs['serialize'])
@@ -535,7 +553,7 @@ class Service(object):
                         self.wsgi_environ['zato.http.remote_addr'])
 
                 if service.server.component_enabled.stats:
-                    service.usage = service.kvdb.conn.incr('{}{}'.format(KVDB.SERVICE_USAGE, service.name))
+                    service.usage = service.server.service_stats.incr_usage(service.name)
                 service.invocation_time = _utcnow()
 
                 # Check if there is a JSON Schema validator attached to the service and if so,
@@ -669,7 +687,9 @@ class Service(object):
             if timeout:
                 try:
                     g = spawn(self.update_handle, *invoke_args, **kwargs)
-                    return g.get(block=True, timeout=timeout)
+                    out = g.get(block=True, timeout=timeout)
+                    self.server.service_store.release_instance(service)
+                    return out
                 except Timeout:
                     g.kill()
                     logger.warn('Service `%s` timed out (%s)', service.name, self.cid)
@@ -677,6 +697,7 @@ class Service(object):
                         raise
             else:
                 out = self.update_handle(*invoke_args, **kwargs)
+                self.server.service_store.release_instance(service)
                 if kwargs.get('skip_response_elem') and hasattr(out, 'keys'):
                     keys = list(iterkeys(out))
                     response_elem = keys[0]
@@ -767,9 +788,7 @@ class Service(object):
 
         return cid
 
-    def post_handle(self, _get_response_value=get_response_value, _utcnow=datetime.utcnow,
-        _service_time_basic=KVDB.SERVICE_TIME_BASIC, _service_time_raw=KVDB.SERVICE_TIME_RAW,
-        _service_time_raw_by_minute=KVDB.SERVICE_TIME_RAW_BY_MINUTE):
+    def post_handle(self, _utcnow=datetime.utcnow):
         """ An internal method executed after the service has completed and has
         a response ready to return. Updates its statistics and, optionally, stores
         a sample request/response pair.
@@ -782,6 +801,10 @@ class Service(object):
         self.handle_return_time = _utcnow()
         self.processing_time_raw = self.handle_return_time - self.invocation_time
 
+        # Live processing times are kept in memory only so they are always collected
+        self.server.latency_stats.record(self.name, self.channel.type, self.channel.name,
+            int(round(self.processing_time_raw.total_seconds() * 1000.0)))
+
         if self.server.component_enabled.stats:
 
             proc_time = self.processing_time_raw.total_seconds() * 1000.0
@@ -789,70 +812,52 @@ class Service(object):
 
             self.processing_time = int(round(proc_time))
 
-            with self.kvdb.conn.pipeline() as pipe:
-
-                pipe.hset('%s%s' % (_service_time_basic, self.name), 'last', self.processing_time)
-                pipe.rpush('%s%s' % (_service_time_raw, self.name), self.processing_time)
-
-                key = '%s%s:%s' % (_service_time_raw_by_minute,
-                    self.name, self.handle_return_time.strftime('%Y:%m:%d:%H:%M'))
-                pipe.rpush(key, self.processing_time)
-
-                # .. we'll have 5 minutes (5 * 60 seconds = 300 seconds)
-                # to aggregate processing times for a given minute and then it will expire
-
-                # Note that we need Redis 2.1.3+ otherwise the key has just been overwritten
-                pipe.expire(key, 300)
-                pipe.execute()
+            # Stored in this process and flushed to KVDB in aggregate every few seconds
+            self.server.service_stats.record(self.name, self.processing_time, self.handle_return_time)
 
         #
         # Sample requests/responses
         #
 
-        slow_response_enabled = self.server.component_enabled.slow_response
-        needs_usage = self._req_resp_freq and self.usage % self._req_resp_freq == 0
-
-        if slow_response_enabled or needs_usage:
-            raw_request = self.request.raw_request
-            if not raw_request:
-                req = ''
-            else:
-                req = raw_request if isinstance(raw_request, basestring) else repr(raw_request)
-
-        if needs_usage:
+        # Both samples and slow responses are only appended to a buffer here, they are turned into strings
+        # and stored in KVDB in background.
+        sample_store = self.server.sample_store
 
-            data = {
-                'cid': self.cid,
-                'req_ts': self.invocation_time.isoformat(),
-                'resp_ts': self.handle_return_time.isoformat(),
-                'req': req,
-                'resp':_get_response_value(self.response), # TODO: Don't parse it here and a moment later below
-            }
-            self.kvdb.conn.hmset(key, data)
+        if self._req_resp_freq and sample_store.needs_sample(self.name, self._req_resp_freq):
+            sample_store.add_sample(self.name, self.cid, self.request.raw_request, self.response.payload,
+                self.invocation_time, self.handle_return_time)
 
         #
         # Slow responses
         #
-        if slow_response_enabled and self.slow_threshold:
+        if self.server.component_enabled.slow_response and self.slow_threshold:
 
             if self.processing_time > self.slow_threshold:
+                sample_store.add_slow_response(self.name, self.cid, self.request.raw_request, self.response.payload,
+                    self.invocation_time, self.handle_return_time, self.processing_time, self.slow_threshold)
 
-                raw_request = self.request.raw_request
-                if not raw_request:
-                    req = ''
-                else:
-                    req = raw_request if isinstance(raw_request, basestring) else repr(raw_request)
-
-                data = {
-                    'cid': self.cid,
-                    'proc_time': self.processing_time,
-                    'slow_threshold': self.slow_threshold,
-                    'req_ts': self.invocation_time.isoformat(),
-                    'resp_ts': self.handle_return_time.isoformat(),
-                    'req': req,
-                    'resp':_get_response_value(self.response), # TODO: Don't parse it here and a moment earlier above
-                }
-                slow_response.store(self.kvdb, self.name, **data)
+    def reset(self, _Bunch=Bunch, _Request=Request, _Response=Response):
+        """ Prepares an instance of a service that recycles its instances for its next invocation. Request and response
+        objects are always new because callers may still hold references to previous ones. Services that keep other
+        invocation-specific data in self should override this method and call it from their own implementation.
+        """
+        self.channel = self.chan = None
+        self.cid = None
+        self.in_reply_to = None
+        self.data_format = None
+        self.transport = None
+        self.wsgi_environ = None
+        self.job_type = None
+        self.environ = _Bunch()
+        self.request = _Request(self.logger)
+        self.response = _Response(self.logger)
+        self.invocation_time = None
+        self.handle_return_time = None
+        self.processing_time_raw = None
+        self.processing_time = None
+        self.usage = 0
+        self.msg = None
+        self.patterns = None
 
     def translate(self, *args, **kwargs):
         raise NotImplementedError('An initializer should override this method')
@@ -19,7 +19,8 @@ from zato.common import CACHE as _COMMON_CACHE
 from zato.common.broker_message import CACHE
 from zato.common.odb.model import CacheBuiltin
 from zato.common.odb.query import cache_builtin_list
-from zato.server.service import Bool, Int
+from zato.common.util.sql import parse_instance_opaque_attr
+from zato.server.service import Bool, Float, Int
 from zato.server.service.internal import AdminService, AdminSIO
 from zato.server.service.internal.cache import common_instance_hook
 from zato.server.service.meta import CreateEditMeta, DeleteMeta, GetListMeta
@@ -31,7 +32,11 @@ get_list_docs = 'built-in cache definitions'
 broker_message = CACHE
 broker_message_prefix = 'BUILTIN_'
 list_func = cache_builtin_list
-output_optional_extra = ['current_size', 'cache_id']
+input_optional_extra = [Bool('needs_key_index'), Int('max_bytes'), Bool('use_shmem'), 'eviction_policy']
+output_optional_extra = ['current_size', 'cache_id', Bool('needs_key_index'), Int('max_bytes'),
+    Int('current_size_bytes'), Bool('use_shmem'), Int('sync_published'), Int('sync_published_ops'),
+    Float('sync_published_per_sec'), Int('sync_received'), Int('sync_received_ops'), Float('sync_received_per_sec'),
+    'eviction_policy', Float('hit_ratio'), Float('lru_hit_ratio')]
 
 # ################################################################################################################################
 
@@ -47,6 +52,13 @@ def response_hook(self, input, _ignored, attrs, service_type):
     elif service_type == 'get_list':
         for item in self.response.payload:
             item.current_size = self.cache.get_size(_COMMON_CACHE.TYPE.BUILTIN, item.name)
+            item.current_size_bytes = self.cache.get_size_bytes(_COMMON_CACHE.TYPE.BUILTIN, item.name)
+
+            for key, value in self.cache.get_sync_stats(_COMMON_CACHE.TYPE.BUILTIN, item.name).items():
+                setattr(item, key, value)
+
+            for key, value in self.cache.get_hit_ratios(_COMMON_CACHE.TYPE.BUILTIN, item.name).items():
+                setattr(item, key, value)
 
 # ################################################################################################################################
 
@@ -64,10 +76,20 @@ class Get(AdminService):
         output_required = ('name', 'is_active', 'is_default', 'cache_type', Int('max_size'), Int('max_item_size'),
             Bool('extend_expiry_on_get'), Bool('extend_expiry_on_set'), 'sync_method', 'persistent_storage',
             Int('current_size'))
+        output_optional = (Bool('needs_key_index'), Int('max_bytes'), Int('current_size_bytes'), Bool('use_shmem'),
+            Int('sync_published'), Int('sync_published_ops'), Float('sync_published_per_sec'), Int('sync_received'),
+            Int('sync_received_ops'), Float('sync_received_per_sec'), 'eviction_policy', Float('hit_ratio'),
+            Float('lru_hit_ratio'))
 
     def handle(self):
-        response = asdict(self.server.odb.get_cache_builtin(self.server.cluster_id, self.request.input.cache_id))
+        instance = self.server.odb.get_cache_builtin(self.server.cluster_id, self.request.input.cache_id)
+
+        response = asdict(instance)
+        response.update(parse_instance_opaque_attr(instance))
         response['current_size'] = self.cache.get_size(_COMMON_CACHE.TYPE.BUILTIN, response['name'])
+        response['current_size_bytes'] = self.cache.get_size_bytes(_COMMON_CACHE.TYPE.BUILTIN, response['name'])
+        response.update(self.cache.get_sync_stats(_COMMON_CACHE.TYPE.BUILTIN, response['name']))
+        response.update(self.cache.get_hit_ratios(_COMMON_CACHE.TYPE.BUILTIN, response['name']))
 
         self.response.payload = response
 
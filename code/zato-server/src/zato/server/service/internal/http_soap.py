@@ -23,6 +23,7 @@ from zato.common.broker_message import CHANNEL, OUTGOING
 from zato.common.odb.model import Cluster, HTTPSOAP, SecurityBase, Service, TLSCACert, to_json
 from zato.common.odb.query import cache_by_id, http_soap, http_soap_list
 from zato.common.rate_limiting import DefinitionParser
+from zato.common.util.http import parse_cache_key_components
 from zato.common.util.json_ import dumps
 from zato.common.util.sql import elems_with_opaque, get_dict_with_opaque, get_security_by_id, parse_instance_opaque_attr, \
      set_instance_opaque_attrs
@@ -88,7 +89,9 @@ class _BaseGet(AdminService):
             'url_params_pri', 'params_pri', 'serialization_type', 'timeout', 'sec_tls_ca_cert_id', Boolean('has_rbac'), \
             'content_type', Boolean('sec_use_rbac'), 'cache_id', 'cache_name', Integer('cache_expiry'), 'cache_type', \
             'content_encoding', Boolean('match_slash'), 'http_accept', List('service_whitelist'), 'is_rate_limit_active', \
-                'rate_limit_type', 'rate_limit_def', Boolean('rate_limit_check_parent_def')
+                'rate_limit_type', 'rate_limit_def', Boolean('rate_limit_check_parent_def'), Boolean('cache_single_flight'), \
+                Integer('cache_stale_while_revalidate'), 'cache_key_components', Boolean('request_streaming'), \
+                Integer('request_spool_threshold')
 
 # ################################################################################################################################
 
@@ -193,7 +196,8 @@ class Create(_CreateEdit):
             'serialization_type', 'timeout', 'sec_tls_ca_cert_id', Boolean('has_rbac'), 'content_type', \
             'cache_id', Integer('cache_expiry'), 'content_encoding', Boolean('match_slash'), 'http_accept', \
             List('service_whitelist'), 'is_rate_limit_active', 'rate_limit_type', 'rate_limit_def', \
-            Boolean('rate_limit_check_parent_def')
+            Boolean('rate_limit_check_parent_def'), Boolean('cache_single_flight'), Integer('cache_stale_while_revalidate'), \
+            'cache_key_components', Boolean('request_streaming'), Integer('request_spool_threshold')
         output_required = ('id', 'name')
 
     def handle(self):
@@ -201,6 +205,10 @@ class Create(_CreateEdit):
         # If we have a rate limiting definition, let's check it upfront
         DefinitionParser.check_definition_from_input(self.request.input)
 
+        # The same goes for components of cache keys
+        if self.request.input.get('cache_key_components'):
+            parse_cache_key_components(self.request.input.cache_key_components)
+
         input = self.request.input
         input.sec_use_rbac = input.security_id == ZATO_SEC_USE_RBAC
         input.security_id = input.security_id if input.security_id not in (ZATO_NONE, ZATO_SEC_USE_RBAC) else None
@@ -333,7 +341,8 @@ class Edit(_CreateEdit):
             'serialization_type', 'timeout', 'sec_tls_ca_cert_id', Boolean('has_rbac'), 'content_type', \
             'cache_id', Integer('cache_expiry'), 'content_encoding', Boolean('match_slash'), 'http_accept', \
             List('service_whitelist'), 'is_rate_limit_active', 'rate_limit_type', 'rate_limit_def', \
-            Boolean('rate_limit_check_parent_def')
+            Boolean('rate_limit_check_parent_def'), Boolean('cache_single_flight'), Integer('cache_stale_while_revalidate'), \
+            'cache_key_components', Boolean('request_streaming'), Integer('request_spool_threshold')
         output_required = 'id', 'name'
 
     def handle(self):
@@ -341,6 +350,10 @@ class Edit(_CreateEdit):
         # If we have a rate limiting definition, let's check it upfront
         DefinitionParser.check_definition_from_input(self.request.input)
 
+        # The same goes for components of cache keys
+        if self.request.input.get('cache_key_components'):
+            parse_cache_key_components(self.request.input.cache_key_components)
+
         input = self.request.input
         input.sec_use_rbac = input.security_id == ZATO_SEC_USE_RBAC
         input.security_id = input.security_id if input.security_id not in (ZATO_NONE, ZATO_SEC_USE_RBAC) else None
@@ -11,9 +11,6 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 # stdlib
 from traceback import format_exc
 
-# rapidjson
-from rapidjson import dumps
-
 # Python 2/3 compatibility
 from future.utils import itervalues
 
@@ -21,6 +18,7 @@ from future.utils import itervalues
 from zato.common import CHANNEL, CONTENT_TYPE, PUBSUB
 from zato.common.exception import BadRequest, Forbidden, PubSubSubscriptionExists
 from zato.common.util.auth import parse_basic_auth
+from zato.common.util.json_ import dumps
 from zato.server.service import AsIs, Int, Service
 from zato.server.service.internal.pubsub.subscription import CreateWSXSubscription
 
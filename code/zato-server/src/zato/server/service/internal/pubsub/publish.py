@@ -10,7 +10,6 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 from contextlib import closing
-from json import loads
 from logging import DEBUG, getLogger
 from operator import itemgetter
 from traceback import format_exc
@@ -30,7 +29,7 @@ from zato.common.odb.query.pubsub.publish import sql_publish_with_retry
 from zato.common.odb.query.pubsub.topic import get_gd_depth_topic
 from zato.common.pubsub import PubSubMessage
 from zato.common.pubsub import new_msg_id
-from zato.common.util.json_ import dumps
+from zato.common.util.json_ import dumps, loads
 from zato.common.util.sql import set_instance_opaque_attrs
 from zato.common.util.time_ import datetime_to_ms, utcnow_as_ms
 from zato.server.pubsub import get_expiration, get_priority, PubSub, Topic
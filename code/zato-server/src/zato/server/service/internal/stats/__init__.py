@@ -37,6 +37,7 @@ from zato.common.broker_message import STATS
 from zato.common.odb.model import Service
 from zato.server.service import Integer, UTC
 from zato.server.service.internal import AdminService, AdminSIO
+from zato.server.stats import TimeHistogram
 
 STATS_KEYS = ('usage', 'max', 'rate', 'mean', 'min')
 
@@ -69,29 +70,20 @@ class BaseAggregatingService(AdminService):
     def stats_enabled(self):
         return self.server.component_enabled.stats
 
-    def aggregate_raw_times(self, key, service_name, max_batch_size=None):
-        """ Aggregates values from a list living under a given key. Returns its
-        min, max, mean and an overall usage count. 'max_batch_size' controls how
-        many items will be fetched from the list so it's possible to fetch less
-        items than its LLEN returns.
+    def aggregate_histogram(self, key, service_name):
+        """ Atomically reads and deletes a histogram of processing times that servers flush to a given key. Returns its
+        min, max, mean and an overall usage count.
         """
-        key_len = self.server.kvdb.conn.llen(key)
-        if max_batch_size:
-            batch_size = min(key_len, max_batch_size)
-            if batch_size < key_len:
-                msg = 'batch_size:`%s` < key_len:`%s`, max_batch_size:`%s`, key:`%s`, ' \
-                'consider decreasing the job interval or increasing max_batch_size'
-                self.logger.warn(msg, batch_size, key_len, max_batch_size, key)
-        else:
-            batch_size = key_len
+        with self.server.kvdb.conn.pipeline() as pipe:
+            pipe.hgetall(key)
+            pipe.delete(key)
+            buckets, _ = pipe.execute()
 
-        times = [int(elem) for elem in self.server.kvdb.conn.lrange(key, 0, batch_size)]
+        histogram = TimeHistogram(buckets)
 
-        if times:
+        if histogram.count:
             mean_percentile = int(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_percentile') or 0)
-            max_score = int(sp_stats.scoreatpercentile(times, mean_percentile))
-
-            return min(times), max(times), (sp_stats.tmean(times, (None, max_score)) or 0), len(times)
+            return histogram.get_stats(mean_percentile)
         else:
             return 0, 0, 0, 0
 
@@ -189,33 +181,48 @@ class BaseAggregatingService(AdminService):
 class ProcessRawTimes(BaseAggregatingService):
     """ A low-level services that periodically process raw data collected for statistics.
     """
+    def drain_raw_times(self):
+        """ Moves processing times from lists that servers used to RPUSH them to, before they started to flush histograms
+        instead, into these histograms. Nothing writes to such lists anymore and they have no expiry so, without it,
+        they would be left behind after an upgrade. Per-minute lists expire by themselves.
+        """
+        conn = self.server.kvdb.conn
+
+        for key in conn.keys(KVDB.SERVICE_TIME_RAW + '*'):
+
+            service_name = key.replace(KVDB.SERVICE_TIME_RAW, '')
+
+            with conn.pipeline() as pipe:
+                pipe.lrange(key, 0, -1)
+                pipe.delete(key)
+                values, _ = pipe.execute()
+
+            histogram = TimeHistogram()
+            for value in values:
+                histogram.record(int(value))
+
+            with conn.pipeline() as pipe:
+                for value, count in iteritems(histogram.buckets):
+                    pipe.hincrby(KVDB.SERVICE_TIME_HIST + service_name, value, count)
+                pipe.execute()
+
     def handle(self):
 
         if not self.stats_enabled():
             return
 
-        #
-        # Sample config values
-        #
-        # global_slow_threshold=120
-        # max_batch_size=99999
-        #
-        config = Bunch()
-        for item in self.request.payload.splitlines():
-            key, value = item.split('=')
-            config[key] = int(value)
+        self.drain_raw_times()
 
-        for key in self.server.kvdb.conn.keys(KVDB.SERVICE_TIME_RAW + '*'):
+        for key in self.server.kvdb.conn.keys(KVDB.SERVICE_TIME_HIST + '*'):
 
-            service_name = key.replace(KVDB.SERVICE_TIME_RAW, '')
+            service_name = key.replace(KVDB.SERVICE_TIME_HIST, '')
 
             current_mean = float(
                 self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time') or 0)
             current_min = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'min_all_time') or 0)
             current_max = float(self.server.kvdb.conn.hget(KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time') or 0)
 
-            batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(
-                key, service_name, config.max_batch_size)
+            batch_min, batch_max, batch_mean, batch_total = self.aggregate_histogram(key, service_name)
 
             self.server.kvdb.conn.hset(
                KVDB.SERVICE_TIME_BASIC + service_name, 'mean_all_time', sp_stats.tmean((batch_mean, current_mean)))
@@ -224,10 +231,6 @@ class ProcessRawTimes(BaseAggregatingService):
             self.server.kvdb.conn.hset(
                 KVDB.SERVICE_TIME_BASIC + service_name, 'max_all_time', max(current_max, batch_max))
 
-            # Services use RPUSH for storing raw times so we are safe to use LTRIM
-            # in order to do away with the already processed ones
-            self.server.kvdb.conn.ltrim(key, batch_total, -1)
-
 # ##############################################################################
 
 class AggregateByMinute(BaseAggregatingService):
@@ -241,17 +244,17 @@ class AggregateByMinute(BaseAggregatingService):
         # Get all keys from a minute that is sure to have passed, for instance,
         # say it's 13:19 right now (regardless of the seconds part), we'll process everything
         # that happened in 13:17. Hence it's also important that any changes in the minutes
-        # to be picked up here below be kept in sync with the EXPIRE command Service._post_handle uses.
+        # to be picked up here below be kept in sync with the EXPIRE command ServiceStats.flush uses.
 
         now = datetime.utcnow()
         key_suffix = (now - timedelta(minutes=2)).strftime('%Y:%m:%d:%H:%M')
 
-        for key in self.server.kvdb.conn.keys('{}*:{}'.format(KVDB.SERVICE_TIME_RAW_BY_MINUTE, key_suffix)):
+        for key in self.server.kvdb.conn.keys('{}*:{}'.format(KVDB.SERVICE_TIME_HIST_BY_MINUTE, key_suffix)):
 
-            service_name = key.replace(KVDB.SERVICE_TIME_RAW_BY_MINUTE, '').replace(':' + key_suffix, '')
+            service_name = key.replace(KVDB.SERVICE_TIME_HIST_BY_MINUTE, '').replace(':' + key_suffix, '')
             aggr_key = '{}{}:{}'.format(KVDB.SERVICE_TIME_AGGREGATED_BY_MINUTE, service_name, key_suffix)
 
-            batch_min, batch_max, batch_mean, batch_total = self.aggregate_raw_times(key, service_name)
+            batch_min, batch_max, batch_mean, batch_total = self.aggregate_histogram(key, service_name)
 
             self.hset_aggr_key(aggr_key, 'min', batch_min)
             self.hset_aggr_key(aggr_key, 'max', batch_max)
@@ -259,8 +262,7 @@ class AggregateByMinute(BaseAggregatingService):
             self.hset_aggr_key(aggr_key, 'usage', batch_total)
             self.hset_aggr_key(aggr_key, 'rate', batch_total / 60.0) # I.e. req/s
 
-            # Raw per-minute statistics keys will expire by themselves, we don't need
-            # to delete them manually.
+            # Per-minute histograms are deleted once read, and the ones that never are will expire by themselves.
 
 class AggregateByHour(BaseAggregatingService):
     """ Creates per-hour stats.
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Python 2/3 compatibility
+from future.utils import iteritems
+
+# Zato
+from zato.common.util.json_ import dumps, loads
+from zato.server.service import Float, Integer
+from zato.server.service.internal import AdminService, AdminSIO
+from zato.server.stats import format_latency_metrics, merge_latency_stats
+
+# ################################################################################################################################
+
+class _OBJECT_TYPE:
+    SERVICE = 'service'
+    CHANNEL = 'channel'
+
+# ################################################################################################################################
+
+class GetLocal(AdminService):
+    """ Returns live processing times of services and channels collected in the current server process.
+    """
+    def handle(self):
+        self.response.content_type = 'application/json'
+        self.response.payload = dumps(self.server.latency_stats.to_dict())
+
+# ################################################################################################################################
+
+class _GetMerged(AdminService):
+    """ A base class for services returning live processing times merged across all processes of a server.
+    """
+    def get_merged(self):
+        data_list = []
+
+        for pid, response in iteritems(self.server.invoke_all_pids('zato.stats.latency.get-local', '')):
+            if response['is_ok']:
+                data_list.append(loads(response['pid_data']))
+            else:
+                self.logger.warn('Could not get latency statistics from PID %s, e:`%s`', pid, response['error_info'])
+
+        return merge_latency_stats(data_list)
+
+# ################################################################################################################################
+
+class GetSummary(_GetMerged):
+    """ Returns live p50, p95 and p99 processing times, in milliseconds, of each service and channel invoked recently,
+    merged across all processes of a server. Usage is counted since each process started while percentiles
+    and window_usage cover the last one or two windows, as configured through stats.latency_window.
+    """
+    class SimpleIO(AdminSIO):
+        request_elem = 'zato_stats_latency_get_summary_request'
+        response_elem = 'zato_stats_latency_get_summary_response'
+        input_optional = ('object_type', 'name')
+        output_required = ('object_type', 'name', Integer('usage'), Integer('window_usage'), Float('p50'), Float('p95'),
+            Float('p99'), Integer('max'))
+        output_optional = ('channel_type',)
+        output_repeated = True
+
+    def handle(self):
+        input = self.request.input
+        merged = self.get_merged()
+        out = []
+
+        for object_type, items in ((_OBJECT_TYPE.SERVICE, merged['services']), (_OBJECT_TYPE.CHANNEL, merged['channels'])):
+
+            if input.object_type and input.object_type != object_type:
+                continue
+
+            for item in items:
+
+                if input.name and input.name != item['name']:
+                    continue
+
+                item['object_type'] = object_type
+                item['channel_type'] = item.pop('type', None)
+                out.append(item)
+
+        self.response.payload[:] = out
+
+# ################################################################################################################################
+
+class GetMetrics(_GetMerged):
+    """ Returns live processing times of services and channels in the Prometheus text format, for monitoring tools to scrape.
+    """
+    def handle(self):
+        self.response.content_type = 'text/plain; version=0.0.4'
+        self.response.payload = format_latency_metrics(self.get_merged())
+
+# ################################################################################################################################
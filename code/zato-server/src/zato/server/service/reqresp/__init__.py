@@ -14,9 +14,12 @@ from copy import deepcopy
 from http.client import OK
 from itertools import chain
 from traceback import format_exc
+from types import GeneratorType
 
-# anyjson
-from anyjson import dumps, loads
+try:
+    from collections.abc import Iterator
+except ImportError: # Python 2
+    from collections import Iterator
 
 # Bunch
 from bunch import Bunch, bunchify
@@ -35,11 +38,12 @@ from future.utils import iteritems
 from past.builtins import basestring
 
 # Zato
-from zato.common import NO_DEFAULT_VALUE, PARAMS_PRIORITY, ParsingException, SIMPLE_IO, simple_types, TRACE1, ZatoException, \
+from zato.common import NO_DEFAULT_VALUE, PARAMS_PRIORITY, ParsingException, SIMPLE_IO, simple_types, ZatoException, \
      ZATO_OK
 from zato.common.odb.api import WritableKeyedTuple
 from zato.common.util import make_repr
-from zato.server.service.reqresp.sio import AsIs, convert_param, ForceType, ServiceInput, SIOConverter
+from zato.common.util.json_ import dumps, loads
+from zato.server.service.reqresp.sio import convert_param, ForceType, ServiceInput, SIOConverter, SIOOutputElem
 
 # ################################################################################################################################
 
@@ -53,17 +57,24 @@ NOT_GIVEN = 'ZATO_NOT_GIVEN'
 
 direct_payload = simple_types + (EtreeElement, ObjectifiedElement)
 
+# Payloads of these types are generators or other iterators which produce responses in chunks,
+# e.g. rows of a large export, so that they can be sent to HTTP clients as they are produced.
+stream_payload = (Iterator,)
+
 # ################################################################################################################################
 
 class HTTPRequestData(object):
     """ Data regarding an HTTP request.
     """
+    __slots__ = ('method', 'GET', 'POST', 'path', 'params', 'stream')
+
     def __init__(self, _Bunch=Bunch):
         self.method = None
         self.GET = _Bunch()
         self.POST = _Bunch()
         self.path = None
         self.params = _Bunch()
+        self.stream = None
 
     def init(self, wsgi_environ=None):
         wsgi_environ = wsgi_environ or {}
@@ -72,6 +83,7 @@ class HTTPRequestData(object):
         self.POST.update(wsgi_environ.get('zato.http.POST', {}))
         self.path = wsgi_environ.get('PATH_INFO')
         self.params.update(wsgi_environ.get('zato.http.path_params', {}))
+        self.stream = wsgi_environ.get('zato.request.stream')
 
     def __repr__(self):
         return make_repr(self)
@@ -117,7 +129,8 @@ class Request(SIOConverter):
     __slots__ = ('logger', 'payload', 'raw_request', 'input', 'cid', 'has_simple_io_config',
         'simple_io_config', 'bool_parameter_prefixes', 'int_parameters',
         'int_parameter_suffixes', 'is_xml', 'data_format', 'transport',
-        '_wsgi_environ', 'channel_params', 'merge_channel_params', 'http', 'amqp', 'wmq', 'ibm_mq', 'enforce_string_encoding')
+        '_wsgi_environ', 'channel_params', 'merge_channel_params', 'params_priority', 'http', 'amqp', 'wmq', 'ibm_mq',
+        'enforce_string_encoding', 'encrypt_func', 'encrypt_secrets', 'bytes_to_str_encoding')
 
     def __init__(self, logger, simple_io_config=None, data_format=None, transport=None):
         self.logger = logger
@@ -146,13 +159,17 @@ class Request(SIOConverter):
 
 # ################################################################################################################################
 
-    def init(self, is_sio, cid, sio, data_format, transport, wsgi_environ, encrypt_func):
+    def init(self, is_sio, cid, sio, data_format, transport, wsgi_environ, encrypt_func, sio_compiled=None):
         """ Initializes the object with an invocation-specific data.
         """
         self.input = ServiceInput()
         self.encrypt_func = encrypt_func
 
-        if is_sio:
+        # The SimpleIO definition was compiled when its service was deployed
+        if is_sio and sio_compiled:
+            sio_compiled.init_request(self, cid, data_format, transport, wsgi_environ)
+
+        elif is_sio:
             required_list = getattr(sio, 'input_required', [])
             required_list = [required_list] if isinstance(required_list, basestring) else required_list
             self.init_flat_sio(cid, sio, data_format, transport, wsgi_environ, required_list)
@@ -314,6 +331,23 @@ class SimpleIOPayload(SIOConverter):
             self.zato_all_attrs.add(name)
 
         self.set_expected_attrs(required_list, optional_list)
+        self.zato_sio_compiled = None
+
+    @classmethod
+    def from_compiled(cls, zato_cid, data_format, sio_compiled):
+        """ Returns a new payload out of a SimpleIO definition compiled when its service was deployed,
+        with the same attributes that __init__ would set.
+        """
+        self = cls.__new__(cls)
+        self.zato_cid = zato_cid
+        self.zato_data_format = data_format
+        self.zato_is_xml = data_format == SIMPLE_IO.FORMAT.XML
+        self.zato_output = []
+        self.zato_meta = {}
+        self.__dict__.update(sio_compiled.payload_attrs)
+        self.zato_sio_compiled = sio_compiled
+
+        return self
 
     def __setslice__(self, i, j, seq):
         """ Assigns a list of output elements to self.zato_output, so that they
@@ -373,31 +407,20 @@ class SimpleIOPayload(SIOConverter):
         self.zato_output.append(item)
         self.zato_output_repeated = True
 
-    def _getvalue(self, name, item, is_sa_namedtuple, is_required, leave_as_is, _DEBUG=logging.DEBUG, _TRACE1=TRACE1):
-        """ Returns an element's value if any has been provided while taking
-        into account the differences between dictionaries and other formats
-        as well as the type conversions.
+    def get_output_elems(self, _ForceType=ForceType, _SIOOutputElem=SIOOutputElem):
+        """ Returns the payload's SimpleIO output elements, either from the definition compiled when its service
+        was deployed or created anew out of the definition itself.
         """
-        lookup_name = name.name if isinstance(name, ForceType) else name
+        if self.zato_sio_compiled:
+            return self.zato_sio_compiled.output
 
-        if is_sa_namedtuple or self._is_sqlalchemy(item):
-            elem_value = getattr(item, lookup_name, '')
-        else:
-            elem_value = item.get(lookup_name, '')
-
-        if isinstance(elem_value, basestring) and not elem_value:
-            if elem_value == '' and self.zato_allow_empty_required:
-                return ''
-            msg = self._missing_value_log_msg(name, item, is_sa_namedtuple, is_required)
-            if is_required:
-                raise ZatoException(self.zato_cid, msg)
-
-        if leave_as_is:
-            return elem_value
-        else:
-            return self.convert(self.zato_cid, name, lookup_name, elem_value, True, self.zato_is_xml,
+        out = []
+        for is_required, param in chain(self.zato_required, self.zato_optional):
+            out.append(_SIOOutputElem(param, param.name if isinstance(param, _ForceType) else param, is_required,
                 self.bool_parameter_prefixes, self.int_parameters, self.int_parameter_suffixes, self.zato_skip_empty_keys,
-                None, None, None, self.zato_data_format, True)
+                self.zato_force_empty_keys))
+
+        return out
 
     def _missing_value_log_msg(self, name, item, is_sa_namedtuple, is_required):
         """ Returns a log message indicating that an element was missing.
@@ -409,9 +432,15 @@ class SimpleIOPayload(SIOConverter):
         return '{} elem:`{}` not found in item:`{!r}`'.format(
             'Expected' if is_required else 'Optional', name, msg_item)
 
-    def getvalue(self, serialize=True, _keyed_tuple=(WritableKeyedTuple, KeyedTuple)):
+    def getvalue(self, serialize=True, _keyed_tuple=(WritableKeyedTuple, KeyedTuple), _basestring=basestring, _bytes=bytes):
         """ Gets the actual payload's value converted to a string representing either XML or JSON.
         """
+        cid = self.zato_cid
+        data_format = self.zato_data_format
+        bytes_to_str_encoding = self.zato_bytes_to_str_encoding
+        allow_empty_required = self.zato_allow_empty_required
+        elems = self.get_output_elems()
+
         if self.zato_is_xml:
             if self.zato_output_repeated:
                 value = Element('item_list')
@@ -426,8 +455,7 @@ class SimpleIOPayload(SIOConverter):
         if self.zato_output_repeated:
             output = self.zato_output
         else:
-            output = set(dir(self)) & self.zato_all_attrs
-            output = [dict((name, getattr(self, name)) for name in output)]
+            output = [dict((elem.name, getattr(self, elem.name, '')) for elem in elems)]
 
         if output:
 
@@ -440,19 +468,34 @@ class SimpleIOPayload(SIOConverter):
                     out_item = Element('item')
                 else:
                     out_item = {}
-                for is_required, name in chain(self.zato_required, self.zato_optional):
-                    leave_as_is = isinstance(name, AsIs)
-                    elem_value = self._getvalue(name, item, is_sa_namedtuple, is_required, leave_as_is)
 
-                    if not elem_value and elem_value != 0:
-                        if self.zato_skip_empty_keys:
-                            if name not in self.zato_force_empty_keys:
-                                continue
+                use_getattr = is_sa_namedtuple or self._is_sqlalchemy(item)
 
-                    if isinstance(name, ForceType):
-                        name = name.name
+                for elem in elems:
+                    name = elem.name
+                    elem_value = getattr(item, name, '') if use_getattr else item.get(name, '')
 
-                    if isinstance(elem_value, bytes):
+                    if isinstance(elem_value, _basestring) and not elem_value:
+                        if elem_value == '' and allow_empty_required:
+                            needs_convert = False
+                        else:
+                            needs_convert = not elem.leave_as_is
+                            if elem.is_required:
+                                raise ZatoException(cid, self._missing_value_log_msg(
+                                    elem.param, item, is_sa_namedtuple, True))
+                    else:
+                        needs_convert = not elem.leave_as_is
+
+                    if needs_convert:
+                        elem_value = elem.convert(cid, elem_value, data_format, None)
+                        if bytes_to_str_encoding and isinstance(elem_value, _bytes):
+                            elem_value = elem_value.decode(bytes_to_str_encoding)
+
+                    if not elem_value and elem_value != 0:
+                        if elem.skip_if_empty:
+                            continue
+
+                    if isinstance(elem_value, _bytes):
                         elem_value = elem_value.decode('utf-8')
 
                     if self.zato_is_xml:
@@ -522,6 +565,8 @@ class Outgoing(object):
 # ################################################################################################################################
 
 class AWS(object):
+    __slots__ = 's3',
+
     def __init__(self, s3=None):
         self.s3 = s3
 
@@ -529,6 +574,8 @@ class AWS(object):
 # ################################################################################################################################
 
 class OpenStack(object):
+    __slots__ = 'swift',
+
     def __init__(self, swift=None):
         self.swift = swift
 
@@ -614,10 +661,15 @@ class Response(object):
 
     def _set_payload(self, value):
         """ Strings, lists and tuples are assigned as-is. Dicts as well if SIO is not used. However, if SIO is used
-        the dicts are matched and transformed according to the SIO definition.
+        the dicts are matched and transformed according to the SIO definition. Generators are assigned as-is too
+        and they are sent in chunks, without SIO, to HTTP clients. The same goes for other iterators, unless SIO is used,
+        in which case they are still given to it, e.g. to make it possible to assign SQL results directly.
         """
 
-        if isinstance(value, dict):
+        if isinstance(value, GeneratorType) or (isinstance(value, stream_payload) and not self.outgoing_declared):
+            self._payload = value
+
+        elif isinstance(value, dict):
             if self.outgoing_declared:
                 self._payload.set_payload_attrs(value)
             else:
@@ -632,9 +684,16 @@ class Response(object):
 
     payload = property(_get_payload, _set_payload)
 
-    def init(self, cid, io, data_format, _not_given=NOT_GIVEN):
+    def init(self, cid, io, data_format, sio_compiled=None, _not_given=NOT_GIVEN):
         self.data_format = data_format
 
+        # The SimpleIO definition was compiled when its service was deployed
+        if sio_compiled:
+            self.outgoing_declared = sio_compiled.output_declared
+            if self.outgoing_declared:
+                self._payload = SimpleIOPayload.from_compiled(cid, data_format, sio_compiled)
+            return
+
         required_list = getattr(io, 'output_required', [])
         required_list = [required_list] if isinstance(required_list, basestring) else required_list
 
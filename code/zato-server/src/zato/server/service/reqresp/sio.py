@@ -419,64 +419,180 @@ def resolve_default_value(param, default_value):
 
 # ################################################################################################################################
 
-def _resolve_output_value(param, force_empty_keys):
-    return None if force_empty_keys else resolve_default_value(param, '')
+class SIOElem(object):
+    """ A SimpleIO element along with the rules of converting its values which do not depend on a particular value,
+    e.g. whether it is a bool or an int or what to use if the value is empty. The generic SimpleIO code creates one
+    for each value that it converts whereas compiled SimpleIO definitions create them once, when services are deployed.
+    """
+    __slots__ = ('param', 'name', 'is_force_type', 'is_bool', 'is_int', 'needs_encrypt', 'has_simple_io_config', 'empty_value',
+        'from_sio_to_external')
+
+    def __init__(self, param, param_name, has_simple_io_config, bool_parameter_prefixes, int_parameters,
+            int_parameter_suffixes, force_empty_keys, encrypt_secrets, from_sio_to_external, _ForceType=ForceType,
+            _is_bool=is_bool, _is_int=is_int, _is_secret=is_secret):
+        self.param = param
+        self.name = param_name
+        self.is_force_type = isinstance(param, _ForceType)
+        self.is_bool = _is_bool(param, param_name, bool_parameter_prefixes)
+        self.is_int = bool(_is_int(param_name, int_parameters, int_parameter_suffixes))
+        self.needs_encrypt = bool(encrypt_secrets and _is_secret(param_name))
+        self.has_simple_io_config = has_simple_io_config
+        self.empty_value = None if force_empty_keys else resolve_default_value(param, '')
+        self.from_sio_to_external = from_sio_to_external
+
+    def convert(self, cid, value, data_format, encrypt_func, _special_values=(str(ZATO_NONE), str(ZATO_SEC_USE_RBAC)),
+            _asbool=asbool):
+        try:
 
-# ################################################################################################################################
+            if self.is_bool:
+                if value == '':
+                    value = self.empty_value
+                else:
+                    value = _asbool(value or None) # value can be an empty string and asbool chokes on that
+                return value
+
+            if value is not None:
+                if self.is_force_type:
+                    if value == '':
+                        value = self.empty_value
+                    else:
+                        value = self.param.convert(value, self.name, data_format, self.from_sio_to_external)
+                else:
+                    # Empty string sent in lieu of integers are equivalent to None,
+                    # as though they were never sent - this is needed for internal metaclasses
+                    if value == b'' and self.is_int:
+                        value = None
 
-def convert_sio(cid, param, param_name, value, has_simple_io_config, is_xml, bool_parameter_prefixes, int_parameters,
-    int_parameter_suffixes, force_empty_keys, encrypt_func, encrypt_secrets, date_time_format=None, data_format=ZATO_NONE,
-    from_sio_to_external=False, special_values=(str(ZATO_NONE), str(ZATO_SEC_USE_RBAC)), _is_bool=is_bool, _is_int=is_int,
-    _is_secret=is_secret):
-    try:
+                    if value:
+                        if (value not in _special_values) and self.has_simple_io_config:
+                            if self.is_int:
+                                value = int(value)
+                            elif self.needs_encrypt:
+                                # It will be None in SIO responses
+                                if encrypt_func:
+                                    value = encrypt_func(value)
 
-        if _is_bool(param, param_name, bool_parameter_prefixes):
-            if value == '':
-                value = _resolve_output_value(param, force_empty_keys)
-            else:
-                value = asbool(value or None) # value can be an empty string and asbool chokes on that
             return value
 
-        if value is not None:
-            if isinstance(param, ForceType):
-                if value == '':
-                    value = _resolve_output_value(param, force_empty_keys)
-                else:
-                    value = param.convert(value, param_name, data_format, from_sio_to_external)
+        except Exception as e:
+            if isinstance(e, Reportable):
+                e.cid = cid
+                raise
             else:
-                # Empty string sent in lieu of integers are equivalent to None,
-                # as though they were never sent - this is needed for internal metaclasses
-                if value == b'':
-                    if _is_int(param_name, int_parameters, int_parameter_suffixes):
-                        value = None
+                msg = 'Conversion error, param:`{}`, param_name:`{}`, repr:`{}`, type:`{}`, e:`{}`'.format(
+                    self.param, self.name, repr(value), type(value), format_exc(e))
+                logger.error(msg)
 
-                if value:
-                    if (value not in special_values) and has_simple_io_config:
-                        if _is_int(param_name, int_parameters, int_parameter_suffixes):
-                            value = int(value)
-                        elif encrypt_secrets and _is_secret(param_name):
-                            # It will be None in SIO responses
-                            if encrypt_func:
-                                value = encrypt_func(value)
+                raise ZatoException(msg=msg)
 
-        return value
+# ################################################################################################################################
 
-    except Exception as e:
-        if isinstance(e, Reportable):
-            e.cid = cid
-            raise
+class SIOInputElem(SIOElem):
+    """ A SimpleIO input element - knows how to find its value in a request and in channel parameters.
+    """
+    __slots__ = ('is_required', 'is_complex', 'is_as_is', 'default')
+
+    def __init__(self, param, param_name, is_required, has_simple_io_config, bool_parameter_prefixes, int_parameters,
+            int_parameter_suffixes, force_empty_keys, encrypt_secrets, default_value):
+        super(SIOInputElem, self).__init__(param, param_name, has_simple_io_config, bool_parameter_prefixes, int_parameters,
+            int_parameter_suffixes, force_empty_keys, encrypt_secrets, False)
+        self.is_required = is_required
+        self.is_complex = isinstance(param, COMPLEX_VALUE)
+        self.is_as_is = isinstance(param, (AsIs, Opaque))
+
+        # Used if the element is not required and it is not provided on input, neither in the message nor in channel params,
+        # with ForceType elements in particular, we want to use their optional default value so as not to assume anything
+        # about input data.
+        self.default = resolve_default_value(param, default_value)
+
+    def parse(self, cid, payload, data_format, channel_params, encrypt_func, params_priority, default_value, path_prefix,
+            use_text, _ZATO_NONE=ZATO_NONE, _NOT_GIVEN=NOT_GIVEN, _NO_DEFAULT_VALUE=NO_DEFAULT_VALUE,
+            _channel_first=PARAMS_PRIORITY.CHANNEL_PARAMS_OVER_MSG, _PubSubMessage=PubSubMessage, _bytes=bytes,
+            _unicode=unicode):
+        """ Converts the element's value from any data format supported into a Python object.
+        """
+        # First thing is to find out if we have parameters in channel_params. If so and they have priority
+        # over payload, we don't look further. If they don't have priority, whether the value from channel_params
+        # is used depends on whether the payload one exists at all.
+
+        # We've got a value from the channel, i.e. in GET parameters
+        channel_value = channel_params.get(self.name, _ZATO_NONE)
+
+        # Convert it to a native Python data type
+        if channel_value != _ZATO_NONE:
+            channel_value = self.convert(cid, channel_value, data_format, encrypt_func)
+
+        # Return the value immediately if we already know channel_params are of higer priority
+        if params_priority == _channel_first and channel_value != _ZATO_NONE:
+            return channel_value
+
+        # Ok, at that point we either don't have anything in channel_params or they don't have priority over payload.
+
+        if payload is not None:
+            value = convert_impl[data_format](payload, self.name, cid, self.is_required, self.is_complex, default_value,
+                path_prefix, use_text)
         else:
-            msg = 'Conversion error, param:`{}`, param_name:`{}`, repr:`{}`, type:`{}`, e:`{}`'.format(
-                param, param_name, repr(value), type(value), format_exc(e))
-            logger.error(msg)
+            value = _NOT_GIVEN
+
+        if (not isinstance(value, _PubSubMessage)) and value == _NOT_GIVEN:
+            if default_value != _NO_DEFAULT_VALUE:
+                return default_value
+
+            if self.is_required:
+
+                # Ok, we don't have anything in payload but it still may be in channel_params.
+                # We arrive here if params priority is not params over msg.
+                value = channel_value if (channel_value is not None and channel_value != _ZATO_NONE) else _ZATO_NONE
+
+                if value == _ZATO_NONE:
+                    msg = 'Required input element:`{}` not found, value:`{}`, data_format:`{}`, payload:`{}`'\
+                        ', channel_params:`{}`'.format(self.param, value, data_format, payload, channel_params)
+                    raise ParsingException(cid, msg)
+
+                return value
+
+            return self.default
+
+        if value is not None and not self.is_complex:
+            value = value.decode('utf-8') if isinstance(value, _bytes) else _unicode(value)
+
+        if self.is_as_is:
+            return value
+
+        return self.convert(cid, value, data_format, encrypt_func)
 
-            raise ZatoException(msg=msg)
+# ################################################################################################################################
+
+class SIOOutputElem(SIOElem):
+    """ A SimpleIO output element - knows whether its value is required and whether it can be skipped if it is empty.
+    """
+    __slots__ = ('is_required', 'leave_as_is', 'skip_if_empty')
+
+    def __init__(self, param, param_name, is_required, bool_parameter_prefixes, int_parameters, int_parameter_suffixes,
+            skip_empty_keys, force_empty_keys):
+        super(SIOOutputElem, self).__init__(param, param_name, True, bool_parameter_prefixes, int_parameters,
+            int_parameter_suffixes, skip_empty_keys, None, True)
+        self.is_required = is_required
+        self.leave_as_is = isinstance(param, AsIs)
+        self.skip_if_empty = skip_empty_keys and param not in force_empty_keys
+
+# ################################################################################################################################
+
+def convert_sio(cid, param, param_name, value, has_simple_io_config, is_xml, bool_parameter_prefixes, int_parameters,
+    int_parameter_suffixes, force_empty_keys, encrypt_func, encrypt_secrets, date_time_format=None, data_format=ZATO_NONE,
+    from_sio_to_external=False, _SIOElem=SIOElem):
+    elem = _SIOElem(param, param_name, has_simple_io_config, bool_parameter_prefixes, int_parameters, int_parameter_suffixes,
+        force_empty_keys, encrypt_secrets, from_sio_to_external)
+
+    return elem.convert(cid, value, data_format, encrypt_func)
 
 # ################################################################################################################################
 
 class SIOConverter(object):
     """ A class which knows how to convert values into the types defined in a service's SimpleIO config.
     """
+    __slots__ = ()
+
     def convert(self, *params):
         value = convert_sio(*params)
 
@@ -528,68 +644,16 @@ convert_impl = {
 
 def convert_param(cid, payload, param, data_format, is_required, default_value, path_prefix, use_text, channel_params,
     has_simple_io_config, bool_parameter_prefixes, int_parameters, int_parameter_suffixes, force_empty_keys, encrypt_func,
-    encrypt_secrets, params_priority):
+    encrypt_secrets, params_priority, _ForceType=ForceType, _SIOInputElem=SIOInputElem):
     """ Converts request parameters from any data format supported into Python objects.
     """
-    param_name = param.name if isinstance(param, ForceType) else param
-
-    # First thing is to find out if we have parameters in channel_params. If so and they have priority
-    # over payload, we don't look further. If they don't have priority, whether the value from channel_params
-    # is used depends on whether the payload one exists at all.
-
-    # We've got a value from the channel, i.e. in GET parameters
-    channel_value = channel_params.get(param_name, ZATO_NONE)
-
-    # Convert it to a native Python data type
-    if channel_value != ZATO_NONE:
-        channel_value = convert_sio(cid, param, param_name, channel_value, has_simple_io_config, False, bool_parameter_prefixes,
-            int_parameters, int_parameter_suffixes, force_empty_keys, encrypt_func, encrypt_secrets, None, data_format, False)
-
-    # Return the value immediately if we already know channel_params are of higer priority
-    if params_priority == PARAMS_PRIORITY.CHANNEL_PARAMS_OVER_MSG and channel_value != ZATO_NONE:
-        return param_name, channel_value
-
-    # Ok, at that point we either don't have anything in channel_params or they don't have priority over payload.
-
-    if payload is not None:
-        value = convert_impl[data_format](payload, param_name, cid, is_required, isinstance(param, COMPLEX_VALUE),
-            default_value, path_prefix, use_text)
-    else:
-        value = NOT_GIVEN
-
-    if (not isinstance(value, PubSubMessage)) and value == NOT_GIVEN:
-        if default_value != NO_DEFAULT_VALUE:
-            value = default_value
-        else:
-            if is_required:
-
-                # Ok, we don't have anything in payload but it still may be in channel_params.
-                # We arrive here if params priority is not params over msg.
-                value = channel_value if (channel_value is not None and channel_value != ZATO_NONE) else ZATO_NONE
-
-                if value == ZATO_NONE:
-                    msg = 'Required input element:`{}` not found, value:`{}`, data_format:`{}`, payload:`{}`'\
-                        ', channel_params:`{}`'.format(param, value, data_format, payload, channel_params)
-                    raise ParsingException(cid, msg)
-            else:
-                # Not required and not provided on input either in msg or channel params
-                # so we can use an empty string, but with ForceType elements in particular,
-                # we want to use their optional default value so as not to assume anything about input data.
-                value = resolve_default_value(param, default_value)
-
-    else:
-        if value is not None and not isinstance(param, COMPLEX_VALUE):
-            if isinstance(value, bytes):
-                value = value.decode('utf-8')
-            else:
-                value = unicode(value)
+    param_name = param.name if isinstance(param, _ForceType) else param
 
-        if not isinstance(param, (AsIs, Opaque)):
-            return param_name, convert_sio(cid, param, param_name, value, has_simple_io_config, data_format==DATA_FORMAT.XML,
-                bool_parameter_prefixes, int_parameters, int_parameter_suffixes, force_empty_keys, encrypt_func, encrypt_secrets,
-                None, data_format, False)
+    elem = _SIOInputElem(param, param_name, is_required, has_simple_io_config, bool_parameter_prefixes, int_parameters,
+        int_parameter_suffixes, force_empty_keys, encrypt_secrets, default_value)
 
-    return param_name, value
+    return param_name, elem.parse(cid, payload, data_format, channel_params, encrypt_func, params_priority, default_value,
+        path_prefix, use_text)
 
 # ################################################################################################################################
 
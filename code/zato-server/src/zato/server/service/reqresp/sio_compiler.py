@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from traceback import format_exc
+
+# Python 2/3 compatibility
+from builtins import bytes
+from future.utils import iteritems
+from past.builtins import basestring
+
+# Zato
+from zato.common import NO_DEFAULT_VALUE, ParsingException, SIMPLE_IO, ZatoException
+from zato.server.service.reqresp.sio import ForceType, NOT_GIVEN, SIOInputElem, SIOOutputElem
+
+# ################################################################################################################################
+
+_sio_container = (tuple, list)
+
+# ################################################################################################################################
+
+def _get_name(param, _ForceType=ForceType):
+    return param.name if isinstance(param, _ForceType) else param
+
+# ################################################################################################################################
+
+class CompiledSIO(object):
+    """ A service's SimpleIO definition compiled, when the service is deployed, into input and output elements that only
+    need to be applied to each request rather than having the definition interpreted by each request anew. The elements
+    are the same that Request and SimpleIOPayload create for each request if there is no compiled definition.
+    """
+    __slots__ = ('simple_io_config', 'has_simple_io_config', 'bool_parameter_prefixes', 'int_parameters',
+        'int_parameter_suffixes', 'bytes_to_str_encoding', 'input_required', 'input_optional', 'input_required_list',
+        'input_optional_list', 'path_prefix', 'default_value', 'use_text', 'use_channel_params_only', 'encrypt_secrets',
+        'output_declared', 'output', 'payload_attrs', 'allow_empty_required')
+
+    def __init__(self, sio, simple_io_config, _not_given=NOT_GIVEN):
+        self.simple_io_config = simple_io_config
+        self.has_simple_io_config = bool(simple_io_config)
+        self.bool_parameter_prefixes = tuple(simple_io_config.get('bool_parameter_prefixes', ()))
+        self.int_parameters = tuple(simple_io_config.get('int_parameters', ()))
+        self.int_parameter_suffixes = tuple(simple_io_config.get('int_parameter_suffixes', ()))
+        self.bytes_to_str_encoding = simple_io_config['bytes_to_str']['encoding'] if self.has_simple_io_config else None
+
+        self._set_up_input(sio)
+        self._set_up_output(sio, _not_given)
+
+# ################################################################################################################################
+
+    def _set_up_input(self, sio):
+
+        required_list = getattr(sio, 'input_required', [])
+        required_list = [required_list] if isinstance(required_list, basestring) else required_list
+        if required_list:
+            required_list = required_list if isinstance(required_list, _sio_container) else [required_list]
+
+        optional_list = getattr(sio, 'input_optional', [])
+        optional_list = optional_list if isinstance(optional_list, _sio_container) else [optional_list]
+
+        self.path_prefix = getattr(sio, 'request_elem', 'request')
+        self.default_value = getattr(sio, 'default_value', NO_DEFAULT_VALUE)
+        self.use_text = getattr(sio, 'use_text', True)
+        self.use_channel_params_only = getattr(sio, 'use_channel_params_only', False)
+        self.encrypt_secrets = getattr(sio, 'encrypt_secrets', True)
+
+        # Kept for exception messages
+        self.input_required_list = required_list
+        self.input_optional_list = optional_list
+
+        self.input_required = self._get_input_params(required_list, True) if required_list else None
+        self.input_optional = self._get_input_params(optional_list, False) if optional_list else None
+
+    def _get_input_params(self, params, is_required):
+        return [SIOInputElem(param, _get_name(param), is_required, self.has_simple_io_config, self.bool_parameter_prefixes,
+            self.int_parameters, self.int_parameter_suffixes, True, self.encrypt_secrets, self.default_value)
+                for param in params]
+
+# ################################################################################################################################
+
+    def _set_up_output(self, sio, _not_given):
+
+        required_list = getattr(sio, 'output_required', [])
+        required_list = [required_list] if isinstance(required_list, basestring) else required_list
+
+        optional_list = getattr(sio, 'output_optional', [])
+        optional_list = [optional_list] if isinstance(optional_list, basestring) else optional_list
+
+        self.output_declared = True if required_list or optional_list else False
+
+        if not self.output_declared:
+            self.output = self.payload_attrs = self.allow_empty_required = None
+            return
+
+        required_list = required_list if isinstance(required_list, _sio_container) else [required_list]
+        optional_list = optional_list if isinstance(optional_list, _sio_container) else [optional_list]
+
+        response_elem = getattr(sio, 'response_elem', _not_given)
+        response_elem = response_elem if response_elem != _not_given else 'response'
+        skip_empty_keys = getattr(sio, 'skip_empty_keys', False)
+        force_empty_keys = getattr(sio, 'force_empty_keys', [])
+        force_empty_keys = tuple(force_empty_keys) if isinstance(force_empty_keys, _sio_container) else force_empty_keys
+        self.allow_empty_required = getattr(sio, 'allow_empty_required', False)
+
+        self.output = []
+        for is_required, params in ((True, required_list), (False, optional_list)):
+            for param in params:
+                self.output.append(SIOOutputElem(param, _get_name(param), is_required, self.bool_parameter_prefixes,
+                    self.int_parameters, self.int_parameter_suffixes, skip_empty_keys, force_empty_keys))
+
+        # Attributes of each new SimpleIOPayload that are the same for each request, in the order
+        # in which its __init__ sets them, i.e. with expected attributes last so that they override any others.
+        # All payloads share these objects which is why none of them is mutable.
+        self.payload_attrs = {
+            'zato_required': tuple((True, name) for name in required_list),
+            'zato_optional': tuple((False, name) for name in optional_list),
+            'zato_output_repeated': getattr(sio, 'output_repeated', False),
+            'zato_skip_empty_keys': skip_empty_keys,
+            'zato_force_empty_keys': force_empty_keys,
+            'zato_allow_empty_required': self.allow_empty_required,
+            'zato_bytes_to_str_encoding': self.simple_io_config['bytes_to_str']['encoding'],
+            'bool_parameter_prefixes': self.bool_parameter_prefixes,
+            'int_parameters': self.int_parameters,
+            'int_parameter_suffixes': self.int_parameter_suffixes,
+            'date_time_format': self.simple_io_config.get('date_time_format', 'YYYY-MM-DDTHH:MM:SS.mmmmmm+HH:MM'),
+            'response_elem': response_elem,
+            'namespace': getattr(sio, 'namespace', ''),
+            'zato_all_attrs': frozenset(param.name for param in self.output),
+        }
+
+        for param in self.output:
+            self.payload_attrs[param.name] = ''
+
+# ################################################################################################################################
+
+    def init_request(self, request, cid, data_format, transport, wsgi_environ):
+        """ Parses input of a request, the same way Request.init_flat_sio does.
+        """
+        request.is_xml = data_format == SIMPLE_IO.FORMAT.XML
+        request.data_format = data_format
+        request.transport = transport
+        request._wsgi_environ = wsgi_environ
+        request.encrypt_secrets = self.encrypt_secrets
+
+        if self.has_simple_io_config:
+            request.has_simple_io_config = True
+            request.bool_parameter_prefixes = self.bool_parameter_prefixes
+            request.int_parameters = self.int_parameters
+            request.int_parameter_suffixes = self.int_parameter_suffixes
+            request.bytes_to_str_encoding = self.bytes_to_str_encoding
+        else:
+            request.payload = request.raw_request
+
+        channel_params = request.channel_params
+        out = request.input
+
+        if self.input_required:
+
+            # Needs to check for this exact default value to prevent a FutureWarning in 'if not request.payload'
+            if request.payload == '' and not channel_params:
+                raise ZatoException(cid, 'Missing input')
+
+            self._parse(request, cid, data_format, channel_params, self.input_required, self.input_required_list, out)
+
+        if self.input_optional:
+            self._parse(request, cid, data_format, channel_params, self.input_optional, self.input_optional_list, out)
+
+        for param, value in iteritems(channel_params):
+            if param not in out:
+                out[param] = value
+
+    def _parse(self, request, cid, data_format, channel_params, params, params_list, out, _bytes=bytes):
+
+        payload = '' if self.use_channel_params_only else request.payload
+        encrypt_func = request.encrypt_func
+        params_priority = request.params_priority
+        bytes_to_str_encoding = request.bytes_to_str_encoding
+        default_value = self.default_value
+        path_prefix = self.path_prefix
+        use_text = self.use_text
+
+        # Parameters are collected first and only then added to output, in case any of them cannot be parsed
+        parsed = {}
+
+        for param in params:
+            try:
+                value = param.parse(cid, payload, data_format, channel_params, encrypt_func, params_priority, default_value,
+                    path_prefix, use_text)
+
+                if bytes_to_str_encoding and isinstance(value, _bytes):
+                    value = value.decode(bytes_to_str_encoding)
+
+                parsed[param.name] = value
+
+            except Exception:
+                msg = 'Caught an exception, param:`{}`, params_to_visit:`{}`, has_simple_io_config:`{}`, e:`{}`'.format(
+                    param.param, params_list, request.has_simple_io_config, format_exc())
+                request.logger.error(msg)
+                raise ParsingException(msg)
+
+        out.update(parsed)
+
+# ################################################################################################################################
+
+# ################################################################################################################################
+
+def compile_sio(sio, simple_io_config):
+    """ Returns a SimpleIO definition compiled for use with a given SimpleIO configuration.
+    """
+    return CompiledSIO(sio, simple_io_config)
+
+# ################################################################################################################################
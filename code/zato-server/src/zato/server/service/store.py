@@ -51,6 +51,8 @@ from zato.common.util.json_ import dumps
 from zato.server.config import ConfigDict
 from zato.server.service import after_handle_hooks, after_job_hooks, before_handle_hooks, before_job_hooks, PubSubHook, Service
 from zato.server.service.internal import AdminService
+from zato.server.service.reqresp import stream_payload
+from zato.server.service.reqresp.sio_compiler import compile_sio
 
 # ################################################################################################################################
 
@@ -213,6 +215,7 @@ class ServiceStore(object):
         self.deployment_info = {}  # impl_name to deployment information
         self.update_lock = RLock()
         self.patterns_matcher = Matcher()
+        self.instance_pool_size = 16 # How many idle instances to keep for each service that recycles them
 
 # ################################################################################################################################
 
@@ -365,6 +368,15 @@ class ServiceStore(object):
             # Audit log
             class_.audit_pii = service_store.server.audit_pii
 
+            # SimpleIO definitions are compiled once, here, rather than interpreted by each request anew
+            class_._sio_compiled = None
+            if class_.has_sio:
+                try:
+                    class_._sio_compiled = compile_sio(class_.SimpleIO, service_store.server.worker_store.worker_config.simple_io)
+                except Exception:
+                    logger.warn('Could not compile SimpleIO of `%s`, it will be interpreted by each request, e:`%s`',
+                        name, format_exc())
+
         class_._before_job_hooks = []
         class_._after_job_hooks = []
 
@@ -444,10 +456,45 @@ class ServiceStore(object):
 # ################################################################################################################################
 
     def new_instance(self, impl_name):
-        """ Returns a new instance of a service of the given impl name.
+        """ Returns a new instance of a service of the given impl name, or an idle one if the service recycles its instances.
         """
         _info = self.services[impl_name]
-        return _info['service_class'](), _info['is_active']
+        service_class = _info['service_class']
+
+        if service_class.recycle_instances:
+            instance_pool = _info['instance_pool']
+            if instance_pool:
+                return instance_pool.pop(), _info['is_active']
+
+        return service_class(), _info['is_active']
+
+# ################################################################################################################################
+
+    def release_instance(self, service, _stream_payload=stream_payload):
+        """ Makes an instance of a service that recycles its instances available to new_instance again,
+        once its caller no longer needs it. Does nothing for other services.
+        """
+        if not service.recycle_instances:
+            return
+
+        # A streamed response is produced after the caller returns so the instance may still be in use
+        if isinstance(service.response.payload, _stream_payload):
+            return
+
+        # The service could have been deleted or redeployed in the meantime
+        _info = self.services.get(service.impl_name)
+        if not _info or _info['service_class'] is not service.__class__:
+            return
+
+        instance_pool = _info['instance_pool']
+
+        if len(instance_pool) < self.instance_pool_size:
+            try:
+                service.reset()
+            except Exception:
+                logger.warn('Could not reset an instance of `%s`, e:`%s`', service.name, format_exc())
+            else:
+                instance_pool.append(service)
 
 # ################################################################################################################################
 
@@ -610,6 +657,7 @@ class ServiceStore(object):
 
                 self.services[item.impl_name]['is_active'] = item.is_active
                 self.services[item.impl_name]['slow_threshold'] = item.slow_threshold
+                self.services[item.impl_name]['instance_pool'] = []
 
                 self.id_to_impl_name[service_id] = item.impl_name
                 self.impl_name_to_id[item.impl_name] = service_id
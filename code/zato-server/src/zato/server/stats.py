@@ -10,15 +10,46 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 # stdlib
 import logging
+from collections import deque
+from time import time
+from traceback import format_exc
+
+try:
+    from collections.abc import Iterator
+except ImportError: # Python 2
+    from collections import Iterator
 
 # dateutil
 from dateutil.rrule import MINUTELY, rrule
 
+# gevent
+from gevent import sleep
+
+# Python 2/3 compatibility
+from future.utils import iteritems
+from past.builtins import basestring
+
 # Zato
 from zato.common import KVDB
+from zato.server.connection import slow_response
 
 logger = logging.getLogger(__name__)
 
+# ################################################################################################################################
+
+# Processing times below 2 ** _precision_bits milliseconds are stored exactly and larger ones are stored
+# in buckets whose width grows with the value so that each is no wider than 1/128th of the values it holds.
+_precision_bits = 8
+
+# How long, in seconds, histograms for a given minute are kept in KVDB - AggregateByMinute processes each minute
+# two minutes after it is over so this gives it enough time even if it is delayed.
+_by_minute_expire = 300
+
+# Percentiles of processing times that live statistics are reported for
+latency_percentiles = (50, 95, 99)
+
+# ################################################################################################################################
+
 class MaintenanceTool(object):
     """ A tool for performing maintenance-related tasks, such as deleting the statistics.
     """
@@ -33,3 +64,537 @@ class MaintenanceTool(object):
                     p.delete(key)
 
             p.execute()
+
+# ################################################################################################################################
+
+class TimeHistogram(object):
+    """ An HDR-style histogram of processing times, in milliseconds. Each bucket is keyed by the lowest value it holds,
+    which lets histograms from different processes and servers be merged in KVDB with HINCRBY alone.
+    """
+    __slots__ = ('buckets', 'count')
+
+    def __init__(self, buckets=None):
+        self.buckets = {}
+        self.count = 0
+
+        if buckets:
+            for value, count in iteritems(buckets):
+                count = int(count)
+                self.buckets[int(value)] = count
+                self.count += count
+
+    def record(self, value, _precision_bits=_precision_bits):
+        shift = value.bit_length() - _precision_bits
+        if shift > 0:
+            value = (value >> shift) << shift
+
+        self.buckets[value] = self.buckets.get(value, 0) + 1
+        self.count += 1
+
+    def merge(self, other):
+        """ Adds values from another histogram to this one.
+        """
+        for value, count in iteritems(other.buckets):
+            self.buckets[value] = self.buckets.get(value, 0) + count
+        self.count += other.count
+
+    def _get_values(self, _precision_bits=_precision_bits):
+        """ Returns (value, count) tuples sorted by value, each value being the middle of its bucket.
+        """
+        out = []
+        for value, count in sorted(iteritems(self.buckets)):
+            shift = (value.bit_length() - _precision_bits)
+            if shift > 0:
+                value += (1 << shift) >> 1
+            out.append((value, count))
+
+        return out
+
+    def get_value_at_percentile(self, values, percentile):
+        """ Returns the value at a given percentile, interpolating between neighbouring values the same way
+        scipy.stats.scoreatpercentile does.
+        """
+        idx = (self.count - 1) * percentile / 100.0
+        low_idx = int(idx)
+        high_idx = low_idx + 1 if idx > low_idx else low_idx
+        low = high = None
+        seen = 0
+
+        for value, count in values:
+            seen += count
+            if low is None and seen > low_idx:
+                low = value
+            if seen > high_idx:
+                high = value
+                break
+
+        return low + (high - low) * (idx - low_idx)
+
+    def get_stats(self, mean_percentile=0):
+        """ Returns min, max, the mean of values not higher than the given percentile and the number of values,
+        the same as aggregating a list of all the raw values would.
+        """
+        if not self.count:
+            return 0, 0, 0, 0
+
+        values = self._get_values()
+        max_score = int(self.get_value_at_percentile(values, mean_percentile))
+
+        total = 0
+        total_count = 0
+
+        for value, count in values:
+            if value > max_score:
+                break
+            total += value * count
+            total_count += count
+
+        mean = total / total_count if total_count else 0
+
+        return values[0][0], values[-1][0], mean, self.count
+
+    def get_percentiles(self, percentiles):
+        """ Returns values at each of the given percentiles.
+        """
+        if not self.count:
+            return [0] * len(percentiles)
+
+        values = self._get_values()
+        return [self.get_value_at_percentile(values, percentile) for percentile in percentiles]
+
+# ################################################################################################################################
+
+class _PendingStats(object):
+    """ Statistics of a single service collected since the last flush.
+    """
+    __slots__ = ('usage', 'last', 'total', 'by_minute')
+
+    def __init__(self):
+        self.usage = 0
+        self.last = None
+        self.total = TimeHistogram()
+        self.by_minute = {}
+
+    def merge(self, newer):
+        """ Adds statistics collected after this object was created to it.
+        """
+        self.usage += newer.usage
+
+        if newer.last is not None:
+            self.last = newer.last
+
+        self.total.merge(newer.total)
+
+        for minute, histogram in iteritems(newer.by_minute):
+            by_minute = self.by_minute.get(minute)
+            if by_minute:
+                by_minute.merge(histogram)
+            else:
+                self.by_minute[minute] = histogram
+
+# ################################################################################################################################
+
+class _FlushingStore(object):
+    """ A base class for objects that collect data in the current process and periodically flush it to KVDB.
+    """
+    def __init__(self, kvdb=None, flush_interval=5):
+        self.kvdb = kvdb
+        self.flush_interval = flush_interval
+        self.keep_running = True
+
+    def flush(self):
+        raise NotImplementedError('Must be implemented by subclasses')
+
+    def _flush_no_raise(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.warn('Could not flush `%s`, e:`%s`', self.__class__.__name__, format_exc())
+
+    def run(self):
+        """ Flushes data every flush_interval seconds until stopped.
+        """
+        while self.keep_running:
+            sleep(self.flush_interval)
+            self._flush_no_raise()
+
+    def stop(self):
+        """ Stops the flushing loop and writes out whatever has not been flushed yet. Errors are only logged
+        so that they do not stop the rest of the process's shutdown.
+        """
+        self.keep_running = False
+        self._flush_no_raise()
+
+# ################################################################################################################################
+
+class ServiceStats(_FlushingStore):
+    """ Collects usage and processing times of services invoked in the current process and periodically flushes them
+    to KVDB in one pipeline. This replaces the INCR and the RPUSH-based pipeline that each invocation of a service
+    would otherwise run, which means that what AggregateByMinute and ProcessRawTimes read is no older than flush_interval.
+    """
+    def __init__(self, kvdb=None, flush_interval=5):
+        super(ServiceStats, self).__init__(kvdb, flush_interval)
+
+        # Service name -> how many times it has been invoked in this process
+        self.usage = {}
+
+        # Service name -> _PendingStats
+        self.pending = {}
+
+    def _get_pending(self, name):
+        pending = self.pending.get(name)
+        if not pending:
+            pending = self.pending[name] = _PendingStats()
+
+        return pending
+
+    def incr_usage(self, name):
+        """ Increases usage counter of a service and returns the number of times it has been invoked in this process.
+        Usage of a service in the whole cluster is what all processes flush to KVDB.SERVICE_USAGE, and unlike before,
+        it is not returned here because that would mean an INCR for each invocation.
+        """
+        self._get_pending(name).usage += 1
+        usage = self.usage[name] = self.usage.get(name, 0) + 1
+
+        return usage
+
+    def record(self, name, proc_time, now):
+        """ Stores processing time of a service, in milliseconds, that completed at a given time.
+        """
+        pending = self._get_pending(name)
+        pending.last = proc_time
+        pending.total.record(proc_time)
+
+        minute = (now.year, now.month, now.day, now.hour, now.minute)
+        by_minute = pending.by_minute.get(minute)
+        if not by_minute:
+            by_minute = pending.by_minute[minute] = TimeHistogram()
+
+        by_minute.record(proc_time)
+
+    def _hincrby(self, pipe, key, histogram):
+        for value, count in iteritems(histogram.buckets):
+            pipe.hincrby(key, value, count)
+
+    def _restore_pending(self, pending):
+        """ Puts back statistics that could not be flushed, merging them with ones collected in the meantime.
+        """
+        for name, item in iteritems(pending):
+            newer = self.pending.get(name)
+            if newer:
+                item.merge(newer)
+            self.pending[name] = item
+
+    def flush(self, _by_minute_expire=_by_minute_expire):
+        """ Writes out everything collected since the previous flush. If KVDB cannot be written to, the statistics
+        are kept until the next flush.
+        """
+        pending, self.pending = self.pending, {}
+
+        if not pending:
+            return
+
+        try:
+            self._flush(pending, _by_minute_expire)
+        except Exception:
+            self._restore_pending(pending)
+            raise
+
+    def _flush(self, pending, _by_minute_expire):
+        with self.kvdb.conn.pipeline() as pipe:
+            for name, item in iteritems(pending):
+
+                if item.usage:
+                    pipe.incrby('{}{}'.format(KVDB.SERVICE_USAGE, name), item.usage)
+
+                if item.last is not None:
+                    pipe.hset('{}{}'.format(KVDB.SERVICE_TIME_BASIC, name), 'last', item.last)
+                    self._hincrby(pipe, '{}{}'.format(KVDB.SERVICE_TIME_HIST, name), item.total)
+
+                for minute, histogram in iteritems(item.by_minute):
+                    key = '{}{}:{:04}:{:02}:{:02}:{:02}:{:02}'.format(KVDB.SERVICE_TIME_HIST_BY_MINUTE, name, *minute)
+                    self._hincrby(pipe, key, histogram)
+                    pipe.expire(key, _by_minute_expire)
+
+            pipe.execute()
+
+# ################################################################################################################################
+
+class SampleStore(_FlushingStore):
+    """ Keeps sample request/response pairs and slow responses of services invoked in the current process in a bounded
+    ring buffer that is periodically flushed to KVDB. Responses are turned into strings only when they are flushed
+    so that nothing except for appending to the buffer happens while the sampled request is still being processed.
+    If the buffer is full, the oldest entries are dropped.
+    """
+    def __init__(self, kvdb=None, flush_interval=5, max_size=1000):
+        super(SampleStore, self).__init__(kvdb, flush_interval)
+        self.buffer = deque(maxlen=max_size)
+        self.dropped = 0
+
+        # Service name -> how many times it has been invoked in this process, used to decide whether to take a sample
+        self.usage = {}
+
+        # How many samples and slow responses could not be written to KVDB since the process started
+        self.lost = 0
+
+    def needs_sample(self, name, freq):
+        """ Returns True for every freq-th invocation of a service in the current process. This used to be decided
+        by the usage counter that all processes shared in KVDB, which meant one sample per freq invocations cluster-wide,
+        now each process samples one per freq of its own invocations.
+        """
+        usage = self.usage[name] = self.usage.get(name, 0) + 1
+        return usage % freq == 0
+
+    def _append(self, item):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(item)
+
+    def add_sample(self, name, cid, raw_request, payload, req_ts, resp_ts):
+        """ Adds a sample request/response pair of a service. Only the latest one per service is kept in KVDB.
+        """
+        self._append((False, name, cid, raw_request, payload, req_ts, resp_ts, None, None))
+
+    def add_slow_response(self, name, cid, raw_request, payload, req_ts, resp_ts, proc_time, slow_threshold):
+        """ Adds a response that took longer than slow_threshold milliseconds to produce.
+        """
+        self._append((True, name, cid, raw_request, payload, req_ts, resp_ts, proc_time, slow_threshold))
+
+    def _get_value(self, value, _basestring=basestring, _iterator=Iterator):
+        """ Returns a string representation of a request or response, or a dict, which KVDB turns into a string itself.
+        """
+        if hasattr(value, 'getvalue'):
+            value = value.getvalue()
+
+        if not value:
+            return ''
+
+        # Streamed responses are not consumed here, only their representation is stored
+        if isinstance(value, _iterator) or not isinstance(value, (_basestring, dict)):
+            return repr(value)
+
+        return value
+
+    def flush(self, _req_resp_sample=KVDB.REQ_RESP_SAMPLE):
+        """ Writes out everything collected since the previous flush.
+        """
+        buffer = self.buffer
+        items = []
+
+        while buffer:
+            items.append(buffer.popleft())
+
+        if self.dropped:
+            logger.warn('Dropped %d sample or slow response(s), consider increasing stats.sample_buffer_size', self.dropped)
+            self.dropped = 0
+
+        if not items:
+            return
+
+        # Samples are not kept for another attempt, the ones collected until then will be newer anyway
+        try:
+            self._flush(items, _req_resp_sample)
+        except Exception:
+            self.lost += len(items)
+            logger.warn('Could not store %d sample or slow response(s), lost in total:%d, e:`%s`',
+                len(items), self.lost, format_exc())
+
+    def _flush(self, items, _req_resp_sample):
+        with self.kvdb.conn.pipeline() as pipe:
+            for is_slow, name, cid, raw_request, payload, req_ts, resp_ts, proc_time, slow_threshold in items:
+                try:
+                    data = {
+                        'cid': cid,
+                        'req_ts': req_ts.isoformat(),
+                        'resp_ts': resp_ts.isoformat(),
+                        'req': self._get_value(raw_request),
+                        'resp': self._get_value(payload),
+                    }
+
+                    if is_slow:
+                        data['proc_time'] = proc_time
+                        data['slow_threshold'] = slow_threshold
+                        slow_response.add(pipe, name, data)
+                    else:
+                        pipe.hmset('{}{}'.format(_req_resp_sample, name), data)
+
+                except Exception:
+                    logger.warn('Could not store sample of `%s` (%s), e:`%s`', name, cid, format_exc())
+
+            pipe.execute()
+
+# ################################################################################################################################
+
+class LatencySketch(object):
+    """ Processing times of a service or channel over the last window_size seconds, kept in two histograms that take turns
+    every window_size seconds, which means that percentiles always cover between one and two windows' worth of data.
+    Also keeps the number and sum of all processing times since the process started.
+    """
+    __slots__ = ('current', 'previous', 'rotated_at', 'count', 'sum')
+
+    def __init__(self, now):
+        self.current = TimeHistogram()
+        self.previous = TimeHistogram()
+        self.rotated_at = now
+        self.count = 0
+        self.sum = 0
+
+    def rotate(self, now, window_size):
+        elapsed = now - self.rotated_at
+        if elapsed >= window_size:
+            self.previous = self.current if elapsed < 2 * window_size else TimeHistogram()
+            self.current = TimeHistogram()
+            self.rotated_at = now
+
+    def record(self, proc_time, now, window_size):
+        self.rotate(now, window_size)
+        self.current.record(proc_time)
+        self.count += 1
+        self.sum += proc_time
+
+    def to_dict(self, now, window_size):
+        """ Returns a JSON-serializable representation of the sketch that merge_latency_stats accepts.
+        """
+        self.rotate(now, window_size)
+
+        histogram = TimeHistogram()
+        histogram.merge(self.previous)
+        histogram.merge(self.current)
+
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': histogram.buckets,
+        }
+
+# ################################################################################################################################
+
+class LatencyStats(object):
+    """ Keeps live processing times of services and channels invoked in the current process, in memory only, so that they
+    can be merged with those of other processes and returned without querying KVDB.
+    """
+    def __init__(self, window_size=60):
+        self.window_size = window_size
+
+        # Service name -> LatencySketch
+        self.services = {}
+
+        # (Channel type, channel name) -> LatencySketch
+        self.channels = {}
+
+    def record(self, service_name, channel_type, channel_name, proc_time, _time=time):
+        """ Stores processing time of a service, in milliseconds, along with that of the channel it was invoked through,
+        if the channel has a name.
+        """
+        now = _time()
+
+        sketch = self.services.get(service_name)
+        if not sketch:
+            sketch = self.services[service_name] = LatencySketch(now)
+        sketch.record(proc_time, now, self.window_size)
+
+        if channel_name:
+            key = (channel_type, channel_name)
+            sketch = self.channels.get(key)
+            if not sketch:
+                sketch = self.channels[key] = LatencySketch(now)
+            sketch.record(proc_time, now, self.window_size)
+
+    def to_dict(self, _time=time):
+        """ Returns a JSON-serializable representation of all the sketches.
+        """
+        now = _time()
+        services = []
+        channels = []
+
+        for name, sketch in iteritems(self.services):
+            item = sketch.to_dict(now, self.window_size)
+            item['name'] = name
+            services.append(item)
+
+        for (channel_type, name), sketch in iteritems(self.channels):
+            item = sketch.to_dict(now, self.window_size)
+            item['type'] = channel_type
+            item['name'] = name
+            channels.append(item)
+
+        return {
+            'services': services,
+            'channels': channels,
+        }
+
+# ################################################################################################################################
+
+def merge_latency_stats(data_list, percentiles=latency_percentiles):
+    """ Merges outputs of LatencyStats.to_dict from multiple processes. Returns a dictionary with services and channels,
+    each of them a list of dictionaries sorted by type and name, with usage, mean and max processing times
+    and values at each of the given percentiles.
+    """
+    out = {}
+
+    for object_type, key_names in (('services', ('name',)), ('channels', ('type', 'name'))):
+        merged = {}
+
+        for data in data_list:
+            for item in data[object_type]:
+                key = tuple(item[name] for name in key_names)
+                merged_item = merged.get(key)
+                if not merged_item:
+                    merged_item = merged[key] = {'count': 0, 'sum': 0, 'histogram': TimeHistogram()}
+
+                merged_item['count'] += item['count']
+                merged_item['sum'] += item['sum']
+                merged_item['histogram'].merge(TimeHistogram(item['buckets']))
+
+        items = out[object_type] = []
+
+        for key, merged_item in sorted(iteritems(merged)):
+            histogram = merged_item['histogram']
+            item = dict(zip(key_names, key))
+            item['usage'] = merged_item['count']
+            item['time'] = merged_item['sum']
+            item['window_usage'] = histogram.count
+            item['max'] = histogram.get_stats(100)[1]
+
+            for percentile, value in zip(percentiles, histogram.get_percentiles(percentiles)):
+                item['p{}'.format(percentile)] = value
+
+            items.append(item)
+
+    return out
+
+# ################################################################################################################################
+
+def _escape_label(value):
+    return '{}'.format(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_latency_metrics(merged, percentiles=latency_percentiles):
+    """ Turns output of merge_latency_stats into text in the Prometheus exposition format, with one summary
+    for services and one for channels. Quantiles are calculated over the last one or two windows while counts
+    and sums cover the whole time since each process started.
+    """
+    out = []
+
+    for object_type, metric, help_text, label_names in (
+        ('services', 'zato_service_latency_ms', 'Processing time of services, in milliseconds', ('name',)),
+        ('channels', 'zato_channel_latency_ms', 'Processing time of services per channel, in milliseconds', ('type', 'name')),
+        ):
+
+        out.append('# HELP {} {}'.format(metric, help_text))
+        out.append('# TYPE {} summary'.format(metric))
+
+        for item in merged[object_type]:
+            labels = ','.join('{}="{}"'.format(
+                'channel_type' if name == 'type' else object_type[:-1], _escape_label(item[name])) for name in label_names)
+
+            for percentile in percentiles:
+                out.append('{}{{{},quantile="{}"}} {}'.format(metric, labels, percentile / 100.0, item['p{}'.format(percentile)]))
+
+            out.append('{}_count{{{}}} {}'.format(metric, labels, item['usage']))
+            out.append('{}_sum{{{}}} {}'.format(metric, labels, item['time']))
+
+    out.append('')
+
+    return '\n'.join(out)
+
+# ################################################################################################################################
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from timeit import default_timer
+
+# pytz
+from pytz import UTC
+
+# Zato
+from zato.server.base.parallel.http import ACCESS_LOG_DT_FORMAT, HTTPHandler, local_time_cache
+
+# ################################################################################################################################
+
+# How many requests to handle with each approach
+total_ops = 50000
+
+# ################################################################################################################################
+
+class BenchHTTPHandler(HTTPHandler):
+    """ Has the attributes that HTTPHandler expects of ParallelServer, with a dispatcher that does nothing
+    and an access log that discards its entries, so that only HTTPHandler itself is measured.
+    """
+    client_address_headers = ['HTTP_X_FORWARDED_FOR', 'REMOTE_ADDR']
+    return_tracebacks = False
+    default_error_message = 'An error has occurred'
+    needs_access_log = True
+    worker_store = None
+
+    def request_dispatcher_dispatch(self, cid, req_timestamp, wsgi_environ, worker_store):
+        wsgi_environ['zato.http.response.status'] = '200 OK'
+        return b'{"response":{}}'
+
+    def access_logger_log(self, level, msg, args, exc_info, extra):
+        pass
+
+# ################################################################################################################################
+
+def to_local(utc_dt, _UTC=UTC, _local_zone=local_time_cache.local_tz):
+    """ Converts each timestamp on its own, which is what HTTPHandler did before LocalTimeCache was added.
+    """
+    return utc_dt.replace(tzinfo=_UTC).astimezone(_local_zone)
+
+def format_ts(utc_dt, _ACCESS_LOG_DT_FORMAT=ACCESS_LOG_DT_FORMAT):
+    return utc_dt.strftime(_ACCESS_LOG_DT_FORMAT), to_local(utc_dt).strftime(_ACCESS_LOG_DT_FORMAT)
+
+# ################################################################################################################################
+
+def get_wsgi_environ():
+    """ Returns a WSGI environment of a typical REST request.
+    """
+    return {
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': '/api/customer/get',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_USER_AGENT': 'curl/7.58.0',
+    }
+
+def start_response(status, headers):
+    pass
+
+# ################################################################################################################################
+
+def run_bench(total_ops=total_ops):
+    """ Handles total_ops requests with timestamps computed for each request and with those from LocalTimeCache,
+    and returns the time each approach took, in seconds.
+    """
+    handler = BenchHTTPHandler()
+
+    start = default_timer()
+    for _ in range(total_ops):
+        handler.on_wsgi_request(get_wsgi_environ(), start_response, _to_local=to_local, _format_ts=format_ts)
+    taken_per_request = default_timer() - start
+
+    start = default_timer()
+    for _ in range(total_ops):
+        handler.on_wsgi_request(get_wsgi_environ(), start_response)
+    taken_cached = default_timer() - start
+
+    return taken_per_request, taken_cached
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+
+    taken_per_request, taken_cached = run_bench()
+    print('per-request: reqs:{:>6}, taken:{:.3f}s, req/s:{:.0f}'.format(
+        total_ops, taken_per_request, total_ops / taken_per_request))
+    print('cached:      reqs:{:>6}, taken:{:.3f}s, req/s:{:.0f}'.format(
+        total_ops, taken_cached, total_ops / taken_cached))
+
+# ################################################################################################################################
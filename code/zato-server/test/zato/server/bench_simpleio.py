@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from logging import getLogger
+from timeit import default_timer
+
+# Zato
+from zato.common import DATA_FORMAT
+from zato.server.service.reqresp import Request, Response
+from zato.server.service.reqresp.sio import AsIs, Boolean, Integer
+from zato.server.service.reqresp.sio_compiler import compile_sio
+
+# ################################################################################################################################
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+
+# How many requests to parse and responses to serialize with each approach
+total_ops = 10000
+
+# The same as in server.conf, only shorter
+simple_io_config = {
+    'bool_parameter_prefixes': ['by_', 'has_', 'is_', 'may_', 'should_'],
+    'int_parameters': ['id'],
+    'int_parameter_suffixes': ['_count', '_id', '_size', '_timeout'],
+    'bytes_to_str': {'encoding': None},
+}
+
+# ################################################################################################################################
+
+class SimpleIO:
+    input_required = ('cust_id', 'name', Integer('age'), 'is_active')
+    input_optional = ('email', AsIs('ref_id'), Boolean('vip'), 'page_size', 'comment')
+    output_required = ('id', 'name', 'is_active')
+    output_optional = ('email', AsIs('ref_id'), 'order_count', 'comment')
+
+# ################################################################################################################################
+
+def get_payload():
+    """ Returns a JSON request that a REST channel could receive, already deserialized.
+    """
+    return {
+        'cust_id': '123456',
+        'name': 'Jane Doe',
+        'age': '42',
+        'is_active': 'true',
+        'email': 'jane.doe@example.com',
+        'ref_id': '000123',
+        'vip': 'false',
+        'page_size': '50',
+    }
+
+# ################################################################################################################################
+
+def handle(payload, sio_compiled):
+    """ Does what a service does with its request and response, i.e. reads the input and produces the output.
+    """
+    request = Request(logger, simple_io_config, DATA_FORMAT.JSON, 'plain_http')
+    request.payload = payload
+    request.init(True, 'cid', SimpleIO, DATA_FORMAT.JSON, 'plain_http', {}, None, sio_compiled)
+
+    response = Response(logger, simple_io_config=simple_io_config)
+    response.init('cid', SimpleIO, DATA_FORMAT.JSON, sio_compiled)
+
+    input = request.input
+    response.payload.id = input.cust_id
+    response.payload.name = input.name
+    response.payload.is_active = input.is_active
+    response.payload.email = input.email
+    response.payload.ref_id = input.ref_id
+    response.payload.order_count = 10
+
+    return request.input, response.payload.getvalue(False)
+
+# ################################################################################################################################
+
+def run_bench(total_ops=total_ops):
+    """ Handles total_ops requests with and without a compiled SimpleIO definition and returns the time each approach took,
+    in seconds. Raises an exception if the two approaches do not produce the same input and output.
+    """
+    payload = get_payload()
+    sio_compiled = compile_sio(SimpleIO, simple_io_config)
+
+    expected_input, expected_output = handle(payload, None)
+    compiled_input, compiled_output = handle(payload, sio_compiled)
+
+    if dict(expected_input) != dict(compiled_input):
+        raise Exception('Input differs, expected:`{}`, compiled:`{}`'.format(expected_input, compiled_input))
+
+    if expected_output != compiled_output:
+        raise Exception('Output differs, expected:`{}`, compiled:`{}`'.format(expected_output, compiled_output))
+
+    start = default_timer()
+    for _ in range(total_ops):
+        handle(payload, None)
+    taken_generic = default_timer() - start
+
+    start = default_timer()
+    for _ in range(total_ops):
+        handle(payload, sio_compiled)
+    taken_compiled = default_timer() - start
+
+    return taken_generic, taken_compiled
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+
+    taken_generic, taken_compiled = run_bench()
+    print('generic:  ops:{:>6}, taken:{:.3f}s, ops/s:{:.0f}'.format(total_ops, taken_generic, total_ops / taken_generic))
+    print('compiled: ops:{:>6}, taken:{:.3f}s, ops/s:{:.0f}'.format(total_ops, taken_compiled, total_ops / taken_compiled))
+
+# ################################################################################################################################
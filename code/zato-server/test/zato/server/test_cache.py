@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import main as unittest_main, TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import sleep
+
+# Zato
+from zato.common import CACHE
+from zato.server.connection.cache import Cache, CacheAPI
+
+# ################################################################################################################################
+
+class Worker(object):
+    """ Stands for a worker process with its own copy of a cache which is synchronized with that of other workers.
+    """
+    def __init__(self, name, max_size):
+        self.name = name
+        self.others = []
+        self.cache = Cache(Bunch({
+            'name': 'my.cache',
+            'after_state_changed_callback': self.on_state_changed,
+            'sync_method': CACHE.SYNC_METHOD.IN_BACKGROUND.id,
+            'eviction_policy': CACHE.EVICTION_POLICY.TINY_LFU.id,
+            'max_size': max_size,
+            'max_item_size': 0,
+            'extend_expiry_on_get': True,
+            'extend_expiry_on_set': True,
+        }))
+
+    def on_state_changed(self, op, cache_name, data):
+        for other in self.others:
+            getattr(other.cache, 'sync_after_{}'.format(op.lower()))(Bunch(data))
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+        # Let the synchronization greenlet run
+        sleep(0)
+
+    def set_many(self, data):
+        self.cache.set_many(data)
+        sleep(0)
+
+    def get_contents(self):
+        return {key: entry.value for key, entry in self.cache.impl.items()}
+
+# ################################################################################################################################
+
+class TinyLFUSyncTestCase(TestCase):
+
+    def get_workers(self, max_size=2):
+        worker1 = Worker('worker1', max_size)
+        worker2 = Worker('worker2', max_size)
+        worker1.others.append(worker2)
+        worker2.others.append(worker1)
+
+        return worker1, worker2
+
+    def test_set(self):
+        worker1, worker2 = self.get_workers()
+
+        worker1.set('a', 1)
+        worker1.set('b', 2)
+
+        # Keys read often in worker1 but not in worker2
+        for _ in range(3):
+            worker1.cache.get('a')
+            worker1.cache.get('b')
+
+        # A key worker2 would admit on its own because it was read there often
+        for _ in range(3):
+            worker2.cache.get('c')
+
+        # Worker1 rejects the key so worker2 does not receive it
+        worker1.set('c', 3)
+        self.assertEqual(worker1.cache.impl.rejected, 1)
+        self.assertDictEqual(worker1.get_contents(), {'a': 1, 'b': 2})
+        self.assertDictEqual(worker2.get_contents(), worker1.get_contents())
+
+        # Worker2 admits a key that worker1 would reject on its own, but worker1 takes it as it is
+        for _ in range(5):
+            worker2.cache.get('d')
+
+        worker2.set('d', 4)
+        self.assertDictEqual(worker2.get_contents(), {'b': 2, 'd': 4})
+        self.assertDictEqual(worker1.get_contents(), worker2.get_contents())
+
+    def test_set_many(self):
+        worker1, worker2 = self.get_workers()
+
+        worker1.set_many({'a': 1, 'b': 2})
+        for _ in range(3):
+            worker1.cache.get('a')
+            worker1.cache.get('b')
+
+        for _ in range(3):
+            worker2.cache.get('c')
+
+        worker1.set_many({'a': 11, 'c': 3})
+        self.assertDictEqual(worker1.get_contents(), {'a': 11, 'b': 2})
+        self.assertDictEqual(worker2.get_contents(), worker1.get_contents())
+
+# ################################################################################################################################
+
+class BrokerClient(object):
+    def __init__(self):
+        self.published = []
+
+    def publish(self, msg):
+        self.published.append(msg)
+
+# ################################################################################################################################
+
+class Server(object):
+    """ Has the attributes that CacheAPI expects of ParallelServer.
+    """
+    worker_id = 1
+    fs_server_config = Bunch({'main': Bunch({'token': 'abc'})})
+
+    def __init__(self):
+        self.broker_client = BrokerClient()
+
+# ################################################################################################################################
+
+class SyncBatchTestCase(TestCase):
+
+    def create(self, cache_api, name, sync_method):
+        cache_api.create(Bunch({
+            'id': len(cache_api.builtin) + 1,
+            'name': name,
+            'cache_type': CACHE.TYPE.BUILTIN,
+            'is_default': False,
+            'sync_method': sync_method,
+            'max_size': 100,
+            'max_item_size': 0,
+            'extend_expiry_on_get': True,
+            'extend_expiry_on_set': True,
+        }))
+
+    def test_batched(self):
+        server = Server()
+        cache_api = CacheAPI(server)
+
+        # Nothing is published in background unless a cache needs it
+        self.create(cache_api, 'my.cache1', CACHE.SYNC_METHOD.IN_BACKGROUND.id)
+        self.assertIsNone(cache_api._sync_batch_greenlet)
+
+        self.create(cache_api, 'my.cache2', CACHE.SYNC_METHOD.IN_BACKGROUND_BATCHED.id)
+        greenlet = cache_api._sync_batch_greenlet
+        self.assertIsNotNone(greenlet)
+
+        # Only one greenlet is started no matter how many caches use batches
+        self.create(cache_api, 'my.cache3', CACHE.SYNC_METHOD.IN_BACKGROUND_BATCHED.id)
+        self.assertIs(cache_api._sync_batch_greenlet, greenlet)
+
+        cache_api.builtin['my.cache2'].set('key1', 'value1')
+        cache_api.builtin['my.cache3'].set('key2', 'value2')
+        sleep(0)
+        self.assertListEqual(server.broker_client.published, [])
+
+        # Messages waiting for the next batch are published when the worker stops
+        cache_api.publish_sync_batch()
+
+        msg, = server.broker_client.published
+        self.assertListEqual([item['key'] for item in msg['items']], ['key1', 'key2'])
+        self.assertListEqual(cache_api.sync_batch, [])
+
+        greenlet.kill()
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    unittest_main()
+
+# ################################################################################################################################
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+import os
+from multiprocessing import get_context
+from time import sleep, time
+from unittest import main as unittest_main, TestCase
+from uuid import uuid4
+
+# posix-ipc
+import posix_ipc as ipc
+
+# Zato
+from zato.cache import KeyExpiredError
+from zato.server.connection import cache_shmem
+from zato.server.connection.cache_shmem import SharedMemoryCache
+
+# ################################################################################################################################
+
+deployment_key = 'test.deployment'
+
+# ################################################################################################################################
+
+def get_cache(shmem_name, max_size=100, max_item_size=1000, max_bytes=0):
+    return SharedMemoryCache(shmem_name, deployment_key, max_size, max_item_size, max_bytes=max_bytes)
+
+# ################################################################################################################################
+
+def _increment(shmem_name, total):
+    """ Increments a counter in cache as a read-modify-write sequence which is atomic only if the lock works.
+    """
+    cache = get_cache(shmem_name)
+
+    for _ in range(total):
+        with cache._lock:
+            value = cache._get('counter', 0, False)
+            cache._set('counter', value + 1, 0.0, False, None)
+
+    cache.close()
+
+# ################################################################################################################################
+
+def _set_and_close(shmem_name):
+    cache = get_cache(shmem_name)
+    cache.set('from.child', os.getpid(), 0.0, False)
+    cache.close()
+
+# ################################################################################################################################
+
+def _exit_holding_lock(shmem_name):
+    cache = get_cache(shmem_name)
+    cache._lock.__enter__()
+    os._exit(0)
+
+# ################################################################################################################################
+
+def _exit_without_owner(shmem_name):
+    # Exits after acquiring the semaphore but before storing its PID
+    cache = get_cache(shmem_name)
+    cache._lock.sem.acquire(0)
+    os._exit(0)
+
+# ################################################################################################################################
+
+def _exit_releasing_lock(shmem_name):
+    # Exits after clearing its PID but before releasing the semaphore
+    cache = get_cache(shmem_name)
+    cache._lock.__enter__()
+    cache._lock.set_owner(0)
+    os._exit(0)
+
+# ################################################################################################################################
+
+def _hold_lock(shmem_name, hold_for):
+    cache = get_cache(shmem_name)
+
+    with cache._lock:
+        sleep(hold_for)
+        cache._set('released_at', time(), 0.0, False, None)
+
+    cache.close()
+
+# ################################################################################################################################
+
+class _Base(TestCase):
+
+    def setUp(self):
+        self.shmem_name = 'test-{}'.format(uuid4().hex[:12])
+        self.cache = get_cache(self.shmem_name)
+
+    def tearDown(self):
+        self.cache.close()
+
+        # Processes that exited without closing the segment leave it behind
+        lock_name = '/zato-shmem-{}'.format(self.shmem_name)
+        for unlink, name in ((ipc.unlink_shared_memory, self.cache.shmem_name), (ipc.unlink_semaphore, lock_name),
+                (ipc.unlink_semaphore, lock_name + '-recovery')):
+            try:
+                unlink(name)
+            except ipc.ExistentialError:
+                pass
+
+    def run_in_process(self, func, *args):
+        process = get_context('fork').Process(target=func, args=(self.shmem_name,) + args)
+        process.start()
+        return process
+
+# ################################################################################################################################
+
+class SharedMemoryCacheTestCase(_Base):
+
+    def test_set_get_delete(self):
+        cache = self.cache
+
+        self.assertIsNone(cache.set('key1', 'value1', 0.0, False))
+        self.assertEqual(cache.set('key1', 'value2', 0.0, False), 'value1')
+        cache.set(123, {'a': [1, 2]}, 0.0, False)
+
+        self.assertEqual(cache.get('key1', cache.default_get, False), 'value2')
+        self.assertEqual(cache.get(123, cache.default_get, False), {'a': [1, 2]})
+        self.assertIsNone(cache.get('missing', cache.default_get, False))
+        self.assertEqual(cache.get('missing', 'abc', False), 'abc')
+        self.assertEqual(len(cache), 2)
+        self.assertIn('key1', cache)
+
+        entry = cache.get('key1', cache.default_get, True)
+        self.assertEqual(entry.value, 'value2')
+        self.assertEqual(entry.hits, 2)
+
+        self.assertEqual(cache.delete('key1'), 'value2')
+        self.assertIsNone(cache.delete('key1'))
+        self.assertNotIn('key1', cache)
+        self.assertEqual(len(cache), 1)
+
+    def test_many(self):
+        cache = self.cache
+
+        cache.set_many({'a': 1, 'b': 2, 'c': 3}, 0.0, False)
+        self.assertDictEqual(cache.get_many(['a', 'b', 'missing'], False), {'a': 1, 'b': 2})
+        self.assertDictEqual(cache.delete_many(['a', 'missing'], True), {'a': 1})
+        self.assertListEqual(sorted(cache.keys()), ['b', 'c'])
+
+    def test_value_too_big(self):
+        self.assertRaises(ValueError, self.cache.set, 'key', 'a' * 1001, 0.0, False)
+
+    def test_expiry(self):
+        cache = self.cache
+
+        cache.set('expires', 1, 0.05, False)
+        cache.set('stays', 2, 0.0, False)
+        sleep(0.1)
+
+        self.assertRaises(KeyExpiredError, cache.get, 'expires', cache.default_get, False)
+        self.assertListEqual(cache.delete_expired(), ['expires'])
+        self.assertListEqual(cache.keys(), ['stays'])
+
+        cache.set('expires2', 3, 0.05, False)
+        sleep(0.1)
+
+        self.assertListEqual(cache.delete_expired(), ['expires2'])
+        self.assertEqual(cache.get_next_expires_at(), 0.0)
+
+    def test_expire(self):
+        cache = self.cache
+
+        cache.set('key', 1, 0.0, False)
+        self.assertTrue(cache.expire('key', 0.05, None))
+        self.assertFalse(cache.expire('missing', 0.05, None))
+        sleep(0.1)
+
+        self.assertListEqual(cache.delete_expired(), ['key'])
+
+    def test_eviction(self):
+        self.cache.close()
+        cache = self.cache = get_cache(self.shmem_name, max_size=3)
+
+        for idx in range(10):
+            cache.set('key{}'.format(idx), idx, 0.0, False)
+            self.assertLessEqual(len(cache), 3)
+
+        # The most recently set entry is never evicted
+        self.assertEqual(len(cache), 3)
+        self.assertIn('key9', cache)
+
+        # All entries can still be found after others were moved to fill holes left by evicted ones
+        for key in cache.keys():
+            self.assertEqual(cache.get(key, cache.default_get, False), int(key[3:]))
+
+    def test_max_bytes(self):
+        self.cache.close()
+        cache = self.cache = get_cache(self.shmem_name, max_bytes=200)
+
+        for idx in range(10):
+            cache.set('key{}'.format(idx), 'a' * 50, 0.0, False)
+            self.assertLessEqual(cache.current_bytes, 200)
+
+        self.assertIn('key9', cache)
+
+    def test_by_pattern(self):
+        cache = self.cache
+
+        for key in ('customer.1', 'customer.2', 'order.1', 'order.22'):
+            cache.set(key, key, 0.0, False)
+
+        self.assertDictEqual(cache.get_by_regex(r'order\.\d$', False, 0), {'order.1': 'order.1'})
+        self.assertListEqual(sorted(cache.get_by_prefix('customer.', False, 0)), ['customer.1', 'customer.2'])
+
+        # As with builtin caches without a key index, limit is the number of keys visited
+        self.assertEqual(len(cache.get_by_prefix('', False, 2)), 2)
+
+        self.assertDictEqual(cache.set_by_suffix('.22', 'new', 0.0, False, None, True, 0), {'order.22': 'order.22'})
+        self.assertEqual(cache.get('order.22', cache.default_get, False), 'new')
+
+        self.assertDictEqual(cache.delete_by_regex(r'customer\.[12]', True, 0),
+            {'customer.1': 'customer.1', 'customer.2': 'customer.2'})
+        self.assertListEqual(sorted(cache.keys()), ['order.1', 'order.22'])
+
+        self.assertTrue(cache.expire_contains('.2', 0.05, 0))
+        sleep(0.1)
+        self.assertListEqual(cache.delete_expired(), ['order.22'])
+
+    def test_clear(self):
+        cache = self.cache
+
+        cache.set('key', 1, 0.0, False)
+        cache.clear()
+
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.current_bytes, 0)
+        self.assertNotIn('key', cache)
+
+# ################################################################################################################################
+
+class SharedMemoryCacheProcessesTestCase(_Base):
+
+    def setUp(self):
+        super(SharedMemoryCacheProcessesTestCase, self).setUp()
+        self.lock_timeout = cache_shmem._lock_timeout
+        cache_shmem._lock_timeout = 0.2
+
+    def tearDown(self):
+        cache_shmem._lock_timeout = self.lock_timeout
+        super(SharedMemoryCacheProcessesTestCase, self).tearDown()
+
+    def test_shared_segment(self):
+        process = self.run_in_process(_set_and_close)
+        process.join()
+
+        # The child's entry is visible here and the segment is still there after the child closed it
+        self.assertEqual(self.cache.get('from.child', self.cache.default_get, False), process.pid)
+
+        # The last process to close the segment removes it
+        shmem_name = self.cache.shmem_name
+        self.cache.close()
+        self.assertRaises(ipc.ExistentialError, ipc.SharedMemory, shmem_name)
+
+        self.cache = get_cache(self.shmem_name)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_mutual_exclusion(self):
+        total = 500
+        processes = [self.run_in_process(_increment, total) for _ in range(2)]
+        _increment(self.shmem_name, total)
+
+        for process in processes:
+            process.join()
+
+        self.assertEqual(self.cache.get('counter', 0, False), total * 3)
+
+    def test_holder_exited(self):
+        process = self.run_in_process(_exit_holding_lock)
+        process.join()
+
+        # The lock is taken over from the process that exited while holding it
+        self.cache.set('key', 'value', 0.0, False)
+        self.assertEqual(self.cache.get('key', self.cache.default_get, False), 'value')
+        self.assertEqual(self.cache._lock.get_owner(), 0)
+
+    def test_no_owner(self):
+        for func in _exit_without_owner, _exit_releasing_lock:
+            process = self.run_in_process(func)
+            process.join()
+            self.assertEqual(self.cache._lock.get_owner(), 0)
+
+            # The lock is taken over once it has been held by no process for a whole _lock_timeout
+            start = time()
+            self.cache.set(func.__name__, 'value', 0.0, False)
+            self.assertGreaterEqual(time() - start, cache_shmem._lock_timeout)
+
+            self.assertEqual(self.cache.get(func.__name__, self.cache.default_get, False), 'value')
+            self.assertEqual(self.cache._lock.get_owner(), 0)
+
+    def test_holder_running(self):
+        process = self.run_in_process(_hold_lock, 1.0)
+
+        # Wait until the child holds the lock
+        while not self.cache._lock.get_owner():
+            sleep(0.01)
+
+        # Even though the lock is held longer than _lock_timeout, it is not taken from a process that is still running
+        self.cache.set('key', 'value', 0.0, False)
+        acquired_at = time()
+
+        process.join()
+        self.assertLessEqual(self.cache.get('released_at', self.cache.default_get, False), acquired_at)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    unittest_main()
+
+# ################################################################################################################################
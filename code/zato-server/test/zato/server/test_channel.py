@@ -0,0 +1,603 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from gzip import decompress
+from http.client import FORBIDDEN, NOT_MODIFIED, OK
+from io import BytesIO, UnsupportedOperation
+from os import urandom
+from time import time
+from unittest import main as unittest_main, TestCase
+
+# Bunch
+from bunch import Bunch
+
+# gevent
+from gevent import joinall, sleep, spawn
+
+# Zato
+from zato.common import SEC_DEF_TYPE, URL_TYPE
+from zato.common.util.json_ import dumps
+from zato.server.connection.http_soap.channel import _CachedResponse, _close_after, _decode_cached_response, \
+     _encode_cached_response, _encode_stream, _gzip_stream, _soap_stream, RequestDispatcher, RequestHandler, RequestStream, \
+     soap_doc_stream_end, soap_doc_stream_start
+
+# ################################################################################################################################
+
+class FakeCache(object):
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, expiry):
+        self.data[key] = value
+        self.expiry = expiry
+
+# ################################################################################################################################
+
+class FakeServiceStore(object):
+    def __init__(self):
+        self.created = []
+        self.released = []
+
+    def new_instance(self, impl_name):
+        service = Bunch(get_request_hash=None)
+        self.created.append(service)
+        return service, True
+
+    def release_instance(self, service):
+        self.released.append(service)
+
+# ################################################################################################################################
+
+class FakeServer(object):
+    def __init__(self):
+        self.fs_server_config = Bunch(misc=Bunch(use_soap_envelope=True))
+        self.service_store = FakeServiceStore()
+        self.cache = FakeCache()
+
+    def get_cache(self, cache_type, cache_name):
+        return self.cache
+
+    def get_from_cache(self, cache_type, cache_name, key):
+        return self.cache.data.get(key)
+
+# ################################################################################################################################
+
+class _HandlerBase(TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.handler = RequestHandler(self.server)
+        self.handler._invoke_service = self.invoke_service
+        self.invoked = 0
+        self.invoke_delay = 0
+        self.invoke_error = None
+
+    def invoke_service(self, service, *ignored):
+        self.invoked += 1
+        invoked = self.invoked
+
+        if self.invoke_delay:
+            sleep(self.invoke_delay)
+
+        if self.invoke_error:
+            raise self.invoke_error
+
+        # Like RequestHandler._invoke_service, release the instance once it is no longer needed
+        self.server.service_store.release_instance(service)
+
+        return _CachedResponse('{"invoked":%d}' % invoked, 'application/json', {}, OK)
+
+    def get_channel_item(self, **kwargs):
+        channel_item = Bunch(id=1, name='my.channel', service_impl_name='my.service', merge_url_params_req=False,
+            cache_type='builtin', cache_name='my.cache', cache_expiry=0)
+        channel_item.update(kwargs)
+        return channel_item
+
+    def handle(self, channel_item, **wsgi_environ):
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/my/api', 'QUERY_STRING': ''}
+        environ.update(wsgi_environ)
+
+        return self.handler.handle('cid', {}, channel_item, environ, b'', None, None, None, '/my/api', None)
+
+    def handle_concurrently(self, channel_item, count):
+        greenlets = [spawn(self.handle, channel_item) for _ in range(count)]
+        joinall(greenlets)
+
+        return greenlets
+
+    def get_cached(self):
+        key, = self.server.cache.data
+        return _decode_cached_response(self.server.cache.data[key])
+
+# ################################################################################################################################
+
+class CachedResponseEncodingTestCase(TestCase):
+
+    def test_round_trip(self):
+        headers = {
+            'X-Multi-Line': 'abc\r\ndef',
+            'X-Separator': 'a: b',
+            'X-Empty': '',
+            'X-Unicode': 'zażółć',
+        }
+        value = _encode_cached_response(b'\x00{"a":1}', 'application/json', headers, 201, 123.5)
+        response, fresh_until = _decode_cached_response(value)
+
+        self.assertEqual(response.payload, b'\x00{"a":1}')
+        self.assertEqual(response.content_type, 'application/json')
+        self.assertDictEqual(response.headers, headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(fresh_until, 123.5)
+
+    def test_round_trip_empty(self):
+        response, fresh_until = _decode_cached_response(_encode_cached_response(b'', None, {}, 204, 0.0))
+
+        self.assertEqual(response.payload, b'')
+        self.assertEqual(response.content_type, '')
+        self.assertDictEqual(response.headers, {})
+        self.assertEqual(fresh_until, 0.0)
+
+    def test_unrecognised(self):
+        value = _encode_cached_response(b'abc', 'text/plain', {'X-A': 'b'}, 200, 0.0)
+
+        for invalid in (
+            dumps({'payload': 'abc', 'content_type': 'text/plain', 'headers': {}, 'status_code': 200}), # A previous format
+            dumps({'payload': 'abc'}).encode('utf8'),
+            b'',
+            b'abc',
+            value[:20],  # Truncated header
+            value[:-5],  # Truncated headers
+            b'ZCR0' + value[4:], # Another version
+            {'payload': 'abc'},
+            ):
+            self.assertEqual(_decode_cached_response(invalid), (None, 0.0))
+
+# ################################################################################################################################
+
+class NotModifiedTestCase(_HandlerBase):
+
+    def test_not_modified(self):
+        channel_item = self.get_channel_item()
+
+        response = self.handle(channel_item)
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('"'))
+
+        for if_none_match in (etag, 'W/' + etag, '"abc", ' + etag, '*'):
+            response = self.handle(channel_item, HTTP_IF_NONE_MATCH=if_none_match)
+
+            self.assertEqual(response.status_code, NOT_MODIFIED)
+            self.assertEqual(response.payload, b'')
+            self.assertDictEqual(response.headers, {'ETag': etag})
+
+        # Served from cache, with the full body, if the client has another version
+        response = self.handle(channel_item, HTTP_IF_NONE_MATCH='"abc"')
+
+        self.assertEqual(response.status_code, OK)
+        self.assertEqual(response.payload, b'{"invoked":1}')
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(self.invoked, 1)
+
+    def test_not_modified_methods(self):
+        channel_item = self.get_channel_item()
+
+        for method in ('HEAD', 'POST', 'PUT', 'DELETE', 'PATCH'):
+            etag = self.handle(channel_item, REQUEST_METHOD=method).headers['ETag']
+            response = self.handle(channel_item, HTTP_IF_NONE_MATCH=etag, REQUEST_METHOD=method)
+
+            # If-None-Match is ignored in requests other than GET and HEAD
+            if method == 'HEAD':
+                self.assertEqual(response.status_code, NOT_MODIFIED)
+            else:
+                self.assertEqual(response.status_code, OK, method)
+                self.assertNotEqual(response.payload, b'', method)
+                self.assertEqual(response.headers['ETag'], etag, method)
+
+    def test_unrecognised_cached_value(self):
+        channel_item = self.get_channel_item()
+
+        self.handle(channel_item)
+        key, = self.server.cache.data
+        self.server.cache.data[key] = dumps({'payload': 'abc'})
+
+        # A cached value that cannot be decoded is a cache miss and it is overwritten
+        response = self.handle(channel_item)
+
+        self.assertEqual(response.payload, '{"invoked":2}')
+        self.assertEqual(self.invoked, 2)
+        self.assertEqual(_decode_cached_response(self.server.cache.data[key])[0].payload, b'{"invoked":2}')
+
+# ################################################################################################################################
+
+class SingleFlightTestCase(_HandlerBase):
+
+    def test_single_flight(self):
+        channel_item = self.get_channel_item(cache_single_flight=True)
+        self.invoke_delay = 0.05
+
+        greenlets = self.handle_concurrently(channel_item, 5)
+
+        # The service is invoked once and all the requests return its response
+        self.assertEqual(self.invoked, 1)
+        for greenlet in greenlets:
+            self.assertEqual(greenlet.get().status_code, OK)
+            self.assertIn(greenlet.get().payload, ('{"invoked":1}', b'{"invoked":1}'))
+
+        self.assertDictEqual(self.handler.cache_in_flight, {})
+
+        # Each request releases its own service instance, including those that did not invoke it
+        self.assertEqual(len(self.server.service_store.created), 5)
+        self.assertListEqual(sorted(map(id, self.server.service_store.released)),
+            sorted(map(id, self.server.service_store.created)))
+
+    def test_no_single_flight(self):
+        self.invoke_delay = 0.05
+        self.handle_concurrently(self.get_channel_item(), 5)
+
+        self.assertEqual(self.invoked, 5)
+
+    def test_single_flight_error(self):
+        channel_item = self.get_channel_item(cache_single_flight=True)
+        self.invoke_delay = 0.05
+        self.invoke_error = Exception('Invocation error')
+
+        greenlets = self.handle_concurrently(channel_item, 3)
+
+        # Each request that was waiting invokes the service itself once the one it was waiting for fails
+        self.assertEqual(self.invoked, 3)
+        for greenlet in greenlets:
+            self.assertIs(greenlet.exception, self.invoke_error)
+
+        self.assertDictEqual(self.handler.cache_in_flight, {})
+
+    def test_single_flight_timeout(self):
+        channel_item = self.get_channel_item(cache_single_flight=True, timeout=0.05)
+        self.invoke_delay = 0.2
+
+        first = spawn(self.handle, channel_item)
+        sleep(0.01)
+        second = spawn(self.handle, channel_item)
+        joinall([first, second])
+
+        # The second request stops waiting for the first one after the channel's timeout and invokes the service itself
+        self.assertEqual(self.invoked, 2)
+        self.assertEqual(first.get().payload, '{"invoked":1}')
+        self.assertEqual(second.get().payload, '{"invoked":2}')
+        self.assertDictEqual(self.handler.cache_in_flight, {})
+
+# ################################################################################################################################
+
+class StaleWhileRevalidateTestCase(_HandlerBase):
+
+    def make_stale(self):
+        key, = self.server.cache.data
+        response, _ = _decode_cached_response(self.server.cache.data[key])
+        self.server.cache.data[key] = _encode_cached_response(response.payload, response.content_type, response.headers,
+            response.status_code, time() - 1)
+
+    def test_fresh_until(self):
+        now = time()
+
+        self.handle(self.get_channel_item(cache_expiry=2, cache_stale_while_revalidate=30))
+
+        # Responses are fresh for as long as the channel's cache_expiry and kept in cache for longer by the SWR window
+        _, fresh_until = self.get_cached()
+        self.assertGreaterEqual(fresh_until, now + 120)
+        self.assertLess(fresh_until, now + 130)
+        self.assertEqual(self.server.cache.expiry, 150)
+
+    def test_fresh_until_no_stale_while_revalidate(self):
+        self.handle(self.get_channel_item(cache_expiry=2))
+
+        self.assertEqual(self.get_cached()[1], 0.0)
+        self.assertEqual(self.server.cache.expiry, 120)
+
+        # No SWR window without an expiry time
+        self.server.cache.data.clear()
+        self.handle(self.get_channel_item(cache_expiry=0, cache_stale_while_revalidate=30))
+
+        self.assertEqual(self.get_cached()[1], 0.0)
+        self.assertEqual(self.server.cache.expiry, 0)
+
+    def test_fresh(self):
+        channel_item = self.get_channel_item(cache_expiry=2, cache_stale_while_revalidate=30)
+
+        self.handle(channel_item)
+        response = self.handle(channel_item)
+        sleep(0.01)
+
+        self.assertEqual(response.payload, b'{"invoked":1}')
+        self.assertEqual(self.invoked, 1)
+
+    def test_stale(self):
+        channel_item = self.get_channel_item(cache_expiry=2, cache_stale_while_revalidate=30)
+        self.handle(channel_item)
+        self.make_stale()
+
+        self.invoke_delay = 0.05
+
+        # Stale responses are returned as they are and only one of the requests revalidates them, in background
+        for _ in range(3):
+            response = self.handle(channel_item)
+            self.assertEqual(response.payload, b'{"invoked":1}')
+
+        self.assertEqual(self.invoked, 1)
+        sleep(0.1)
+        self.assertEqual(self.invoked, 2)
+
+        response, fresh_until = self.get_cached()
+        self.assertEqual(response.payload, b'{"invoked":2}')
+        self.assertGreater(fresh_until, time())
+
+        # The revalidated response is returned now
+        self.assertEqual(self.handle(channel_item).payload, b'{"invoked":2}')
+        self.assertDictEqual(self.handler.cache_in_flight, {})
+
+    def test_stale_revalidation_error(self):
+        channel_item = self.get_channel_item(cache_expiry=2, cache_stale_while_revalidate=30)
+        self.handle(channel_item)
+        self.make_stale()
+
+        self.invoke_error = Exception('Invocation error')
+        self.handle(channel_item)
+        sleep(0.01)
+
+        # The stale response is still in cache and it is revalidated again by the next request
+        self.assertEqual(self.invoked, 2)
+        self.assertEqual(self.handle(channel_item).payload, b'{"invoked":1}')
+        sleep(0.01)
+        self.assertEqual(self.invoked, 3)
+
+# ################################################################################################################################
+
+class RequestStreamTestCase(TestCase):
+
+    def get_stream(self, data, content_length=None, spool_threshold=0, chunk_size=65536):
+        return RequestStream(BytesIO(data), content_length, spool_threshold, chunk_size)
+
+    def test_read(self):
+        stream = self.get_stream(b'abcdef\nghi\njkl', '15')
+
+        self.assertEqual(stream.read(3), b'abc')
+        self.assertEqual(stream.readline(), b'def\n')
+        self.assertEqual(stream.readline(2), b'gh')
+        self.assertEqual(stream.read(), b'i\njkl')
+        self.assertEqual(stream.read(), b'')
+        self.assertEqual(stream.readline(), b'')
+
+    def test_read_content_length(self):
+
+        # Data past Content-Length is never read
+        stream = self.get_stream(b'abcdef', '4')
+        self.assertEqual(stream.read(100), b'abcd')
+        self.assertEqual(stream.read(), b'')
+
+        stream = self.get_stream(b'ab\ncd', '4')
+        self.assertEqual(stream.readline(), b'ab\n')
+        self.assertEqual(stream.readline(), b'c')
+
+        # Without Content-Length data is read until there is no more of it
+        stream = self.get_stream(b'abcdef')
+        self.assertEqual(stream.read(), b'abcdef')
+
+    def test_iter(self):
+        stream = self.get_stream(b'abcdefg', '7', chunk_size=3)
+        self.assertListEqual(list(stream), [b'abc', b'def', b'g'])
+
+    def test_not_seekable(self):
+        stream = self.get_stream(b'abc', '3')
+
+        self.assertFalse(stream.seekable())
+        self.assertRaises(UnsupportedOperation, stream.seek, 0)
+        self.assertRaises(UnsupportedOperation, stream.tell)
+
+    def test_spooled_in_memory(self):
+        stream = self.get_stream(b'abc\ndef', '7', spool_threshold=1024)
+
+        self.assertTrue(stream.seekable())
+        self.assertEqual(stream.readline(), b'abc\n')
+        self.assertEqual(stream.tell(), 4)
+        self.assertEqual(stream.read(2), b'de')
+
+        stream.seek(0)
+        self.assertEqual(stream.read(), b'abc\ndef')
+        self.assertFalse(stream._file._rolled)
+
+    def test_spooled_to_disk(self):
+        data = b''.join(b'line %d\n' % idx for idx in range(1000))
+        stream = self.get_stream(data, str(len(data)), spool_threshold=100, chunk_size=64)
+
+        self.assertEqual(stream.readline(), b'line 0\n')
+        self.assertTrue(stream._file._rolled)
+        self.assertEqual(stream.read(7), b'line 1\n')
+        self.assertEqual(stream.read(), data[14:])
+
+        stream.seek(0)
+        self.assertEqual(b''.join(stream), data)
+
+    def test_close(self):
+
+        # Nothing has been read so there is nothing to close
+        stream = self.get_stream(b'abc', '3', spool_threshold=1024)
+        stream.close()
+
+        stream = self.get_stream(b'abc', '3', spool_threshold=1)
+        stream.read(1)
+        stream.close()
+
+        self.assertTrue(stream._file.closed)
+        self.assertRaises(ValueError, stream.read)
+
+# ################################################################################################################################
+
+class FakeURLData(object):
+    def __init__(self, channel_item, sec_type):
+        self.channel_item = channel_item
+        self.url_sec = {channel_item['match_target']: Bunch(sec_use_rbac=False,
+            sec_def=Bunch(id=1, name='my.sec.def', sec_type=sec_type))}
+        self.security_checked = False
+
+    def match(self, *ignored):
+        return {}, self.channel_item
+
+    def check_security(self, *ignored):
+        self.security_checked = True
+
+# ################################################################################################################################
+
+class FakeRequestHandler(object):
+    def __init__(self):
+        self.payload = None
+
+    def handle(self, cid, url_match, channel_item, wsgi_environ, payload, *ignored):
+        self.payload = payload
+        return _CachedResponse('{}', 'application/json', {}, OK)
+
+# ################################################################################################################################
+
+class RequestStreamingSecurityTestCase(TestCase):
+
+    def dispatch(self, sec_type):
+        channel_item = Bunch(id=1, name='my.channel', is_active=True, match_target='my.target', transport='plain_http',
+            data_format='json', content_encoding=None, request_streaming=True, request_spool_threshold=0)
+
+        url_data = FakeURLData(channel_item, sec_type)
+        request_handler = FakeRequestHandler()
+        dispatcher = RequestDispatcher(Bunch(sso_api=None), url_data, request_handler=request_handler,
+            http_methods_allowed=['POST'])
+
+        wsgi_environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': '/my/api',
+            'CONTENT_LENGTH': '3',
+            'wsgi.input': BytesIO(b'abc'),
+            'zato.http.response.headers': {},
+        }
+        dispatcher.dispatch('cid', None, wsgi_environ, None)
+
+        return wsgi_environ, url_data, request_handler
+
+    def test_credentials_in_body(self):
+        for sec_type in (SEC_DEF_TYPE.OAUTH, SEC_DEF_TYPE.WSS, SEC_DEF_TYPE.XPATH_SEC):
+            wsgi_environ, url_data, request_handler = self.dispatch(sec_type)
+
+            # These credentials cannot be checked without reading the body first, which is what streaming is meant to avoid
+            self.assertTrue(wsgi_environ['zato.http.response.status'].startswith('{} '.format(FORBIDDEN)), sec_type)
+            self.assertFalse(url_data.security_checked)
+            self.assertIsNone(request_handler.payload)
+            self.assertEqual(wsgi_environ['wsgi.input'].tell(), 0)
+
+    def test_credentials_in_headers(self):
+        wsgi_environ, url_data, request_handler = self.dispatch(SEC_DEF_TYPE.BASIC_AUTH)
+
+        self.assertTrue(wsgi_environ['zato.http.response.status'].startswith('{} '.format(OK)))
+        self.assertTrue(url_data.security_checked)
+
+        # The body is still there for the service to read
+        self.assertEqual(wsgi_environ['wsgi.input'].tell(), 0)
+        self.assertEqual(wsgi_environ['zato.request.stream'].read(), b'abc')
+
+# ################################################################################################################################
+
+class Closeable(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+# ################################################################################################################################
+
+class StreamedResponseTestCase(TestCase):
+
+    def get_payload(self, chunks, closed):
+        """ Returns a generator that a service could produce, which lets us know whether it was closed.
+        """
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            closed.close()
+
+    def test_encode_stream(self):
+        self.assertListEqual(list(_encode_stream(iter(['abc', b'def', 'zażółć']))), [b'abc', b'def', 'zażółć'.encode('utf8')])
+
+    def test_soap_stream(self):
+        chunks = list(_soap_stream(iter([b'<a>', b'</a>'])))
+        self.assertListEqual(chunks, [soap_doc_stream_start + b'<a>', b'</a>', soap_doc_stream_end])
+
+        chunks = list(_soap_stream(iter([])))
+        self.assertListEqual(chunks, [soap_doc_stream_start, soap_doc_stream_end])
+
+    def test_gzip_stream(self):
+        data = urandom(100000) + b'a' * 100000
+        chunks = [data[idx:idx + 1000] for idx in range(0, len(data), 1000)]
+
+        compressed = list(_gzip_stream(iter(chunks)))
+
+        self.assertGreater(len(compressed), 1)
+        self.assertEqual(decompress(b''.join(compressed)), data)
+
+    def test_gzip_stream_empty(self):
+        self.assertEqual(decompress(b''.join(_gzip_stream(iter([])))), b'')
+
+    def test_close(self):
+        closed = Closeable()
+        request_stream = Closeable()
+
+        # The same wrappers as for a SOAP channel with both request streaming and gzip on
+        payload = self.get_payload([b'abc', b'def'], closed)
+        payload = _gzip_stream(_close_after(_soap_stream(_encode_stream(payload)), request_stream))
+
+        next(payload)
+        self.assertFalse(closed.closed)
+
+        # A WSGI server closes the response if a client disconnects, which closes the service's payload and the request
+        payload.close()
+
+        self.assertTrue(closed.closed)
+        self.assertTrue(request_stream.closed)
+
+    def test_close_after_error(self):
+        closed = Closeable()
+        request_stream = Closeable()
+
+        def get_payload():
+            yield b'abc'
+            raise ValueError('Payload error')
+
+        payload = _close_after(_encode_stream(get_payload()), request_stream)
+
+        self.assertEqual(next(payload), b'abc')
+        self.assertRaises(ValueError, next, payload)
+        self.assertTrue(request_stream.closed)
+
+        # Iterating over the payload until the end closes it as well
+        list(_close_after(_encode_stream(self.get_payload([b'abc'], closed)), request_stream))
+        self.assertTrue(closed.closed)
+
+    def test_set_payload_soap(self):
+        closed = Closeable()
+        handler = RequestHandler(FakeServer())
+        response = _CachedResponse(self.get_payload(['<a>', '</a>'], closed), None, {}, OK)
+
+        handler.set_payload(response, 'xml', URL_TYPE.SOAP, object())
+
+        self.assertEqual(next(response.payload), soap_doc_stream_start + b'<a>')
+        response.payload.close()
+        self.assertTrue(closed.closed)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    unittest_main()
+
+# ################################################################################################################################
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import main as unittest_main, TestCase
+
+# Zato
+from zato.server.base.parallel.http import HTTPHandler
+
+# ################################################################################################################################
+
+class MyHTTPHandler(HTTPHandler):
+    """ Has the attributes that HTTPHandler expects of ParallelServer.
+    """
+    client_address_headers = ['HTTP_X_FORWARDED_FOR', 'REMOTE_ADDR']
+    return_tracebacks = False
+    default_error_message = 'An error has occurred'
+    needs_access_log = True
+    worker_store = None
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.access_log = []
+
+    def request_dispatcher_dispatch(self, cid, req_timestamp, wsgi_environ, worker_store):
+        wsgi_environ['zato.http.response.status'] = '200 OK'
+        return self.payload
+
+    def access_logger_log(self, level, msg, args, exc_info, extra):
+        self.access_log.append(extra)
+
+# ################################################################################################################################
+
+class AccessLogTestCase(TestCase):
+
+    def handle(self, payload):
+        handler = MyHTTPHandler(payload)
+        wsgi_environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/my/api',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+        }
+        response = handler.on_wsgi_request(wsgi_environ, lambda status, headers: None)
+
+        return response, handler.access_log[0]
+
+    def test_response_size(self):
+        response, access_log = self.handle('zażółć')
+
+        self.assertListEqual(response, ['zażółć'.encode('utf8')])
+        self.assertEqual(access_log['response_size'], len('zażółć'.encode('utf8')))
+        self.assertEqual(access_log['status_code'], '200')
+
+    def test_response_size_streamed(self):
+
+        def get_payload():
+            yield b'abc'
+            yield b'def'
+
+        payload = get_payload()
+        response, access_log = self.handle(payload)
+
+        # The size of streamed responses is not known when they are logged
+        self.assertIs(response, payload)
+        self.assertEqual(access_log['response_size'], '-')
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    unittest_main()
+
+# ################################################################################################################################
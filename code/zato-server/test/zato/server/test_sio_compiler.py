@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from logging import getLogger
+from unittest import main as unittest_main, TestCase
+
+# lxml
+from lxml import etree
+from lxml.objectify import fromstring
+
+# Zato
+from zato.common import DATA_FORMAT
+from zato.server.service.reqresp import Request, Response
+from zato.server.service.reqresp.sio import AsIs, Boolean, Integer
+from zato.server.service.reqresp.sio_compiler import compile_sio
+
+# ################################################################################################################################
+
+logger = getLogger(__name__)
+
+# ################################################################################################################################
+
+cid = 'test.cid'
+
+simple_io_config = {
+    'bool_parameter_prefixes': ['by_', 'has_', 'is_', 'may_', 'should_'],
+    'int_parameters': ['id'],
+    'int_parameter_suffixes': ['_count', '_id', '_size', '_timeout'],
+    'bytes_to_str': {'encoding': None},
+}
+
+# ################################################################################################################################
+
+class MySimpleIO:
+    input_required = ('cust_id', 'name', Integer('age'), 'is_active')
+    input_optional = ('email', AsIs('ref_id'), Boolean('vip'), Integer('page_size', default=25), 'comment', 'has_account')
+    output_required = ('id', 'name', 'is_active')
+    output_optional = ('email', AsIs('ref_id'), 'order_count', 'comment', 'phone')
+
+# ################################################################################################################################
+
+class MySimpleIOSkipEmpty(MySimpleIO):
+    skip_empty_keys = True
+    force_empty_keys = ['comment']
+
+# ################################################################################################################################
+
+class MySimpleIODefault(MySimpleIO):
+    default_value = 'my.default'
+
+# ################################################################################################################################
+
+class MySimpleIONamespace(MySimpleIO):
+    response_elem = 'my_response'
+    namespace = 'https://example.com/ns'
+
+# ################################################################################################################################
+
+json_input = {
+    'cust_id': '123',
+    'name': 'Jane Doe',
+    'age': '42',
+    'is_active': 'true',
+    'email': 'jane.doe@example.com',
+    'ref_id': '000123',
+    'vip': 'false',
+}
+
+xml_input = """
+<request>
+  <cust_id>123</cust_id>
+  <name>Jane Doe</name>
+  <age>42</age>
+  <is_active>true</is_active>
+  <email>jane.doe@example.com</email>
+  <ref_id>000123</ref_id>
+  <vip>false</vip>
+  <page_size>50</page_size>
+  <has_account>false</has_account>
+</request>
+"""
+
+# ################################################################################################################################
+
+class SIOCompilerTestCase(TestCase):
+    """ Checks that SimpleIO definitions compiled when services are deployed give the same results as SimpleIO interpreted
+    by each request.
+    """
+    def get_input(self, sio, data_format, payload, sio_compiled, channel_params=None):
+        request = Request(logger, simple_io_config, data_format, 'plain_http')
+        request.payload = payload
+        request.channel_params = channel_params or {}
+        request.init(True, cid, sio, data_format, 'plain_http', {}, None, sio_compiled)
+
+        return dict(request.input)
+
+    def get_output(self, sio, data_format, set_payload, sio_compiled, serialize=True):
+        response = Response(logger, simple_io_config=simple_io_config)
+        response.init(cid, sio, data_format, sio_compiled)
+        set_payload(response)
+
+        return response.payload.getvalue(serialize)
+
+    def get_payload(self, data_format, payload):
+        return fromstring(payload) if data_format == DATA_FORMAT.XML else payload
+
+# ################################################################################################################################
+
+    def assert_same_input(self, sio, data_format, payload, channel_params=None):
+        sio_compiled = compile_sio(sio, simple_io_config)
+
+        expected = self.get_input(sio, data_format, self.get_payload(data_format, payload), None, channel_params)
+        compiled = self.get_input(sio, data_format, self.get_payload(data_format, payload), sio_compiled, channel_params)
+
+        self.assertDictEqual(compiled, expected)
+        for key, value in expected.items():
+            self.assertIs(type(compiled[key]), type(value), key)
+
+        return compiled
+
+    def assert_same_output(self, sio, data_format, set_payload):
+        sio_compiled = compile_sio(sio, simple_io_config)
+
+        expected = self.get_output(sio, data_format, set_payload, None)
+        compiled = self.get_output(sio, data_format, set_payload, sio_compiled)
+        self.assertEqual(compiled, expected)
+
+        if data_format == DATA_FORMAT.JSON:
+            expected = self.get_output(sio, data_format, set_payload, None, False)
+            compiled = self.get_output(sio, data_format, set_payload, sio_compiled, False)
+            self.assertEqual(compiled, expected)
+
+        return compiled
+
+    def assert_same_exception(self, func, *args):
+        with self.assertRaises(Exception) as expected:
+            func(*(args + (None,)))
+
+        with self.assertRaises(Exception) as compiled:
+            func(*(args + (compile_sio(args[0], simple_io_config),)))
+
+        self.assertIs(type(compiled.exception), type(expected.exception))
+
+# ################################################################################################################################
+
+    def test_input(self):
+        for data_format, payload in ((DATA_FORMAT.JSON, json_input), (DATA_FORMAT.XML, xml_input)):
+            for sio in (MySimpleIO, MySimpleIOSkipEmpty, MySimpleIODefault):
+                value = self.assert_same_input(sio, data_format, payload)
+
+                self.assertEqual(value['age'], 42)
+                self.assertIs(value['is_active'], True)
+                self.assertIs(value['vip'], False)
+                self.assertEqual(value['cust_id'], 123)
+
+        for sio in (MySimpleIO, MySimpleIODefault):
+            value = self.assert_same_input(sio, DATA_FORMAT.XML, xml_input)
+            self.assertEqual(value['page_size'], 50)
+            self.assertIs(value['has_account'], False)
+
+    def test_input_optional_not_given(self):
+        value = self.assert_same_input(MySimpleIO, DATA_FORMAT.JSON, json_input)
+        self.assertEqual(value['ref_id'], '000123')
+        self.assertEqual(value['page_size'], 25)
+        self.assertEqual(value['has_account'], '')
+
+        # SimpleIO's default value has priority over that of an element
+        value = self.assert_same_input(MySimpleIODefault, DATA_FORMAT.JSON, json_input)
+        self.assertEqual(value['page_size'], 'my.default')
+        self.assertEqual(value['has_account'], 'my.default')
+
+    def test_input_channel_params(self):
+        channel_params = {'cust_id': '456', 'extra': 'abc'}
+
+        for data_format, payload in ((DATA_FORMAT.JSON, json_input), (DATA_FORMAT.XML, xml_input)):
+            value = self.assert_same_input(MySimpleIO, data_format, payload, channel_params)
+            self.assertEqual(value['extra'], 'abc')
+
+        payload = dict(json_input)
+        del payload['cust_id']
+        value = self.assert_same_input(MySimpleIO, DATA_FORMAT.JSON, payload, channel_params)
+        self.assertEqual(value['cust_id'], 456)
+
+    def test_input_required_missing(self):
+        payload = dict(json_input)
+        del payload['name']
+
+        self.assert_same_exception(self.get_input, MySimpleIO, DATA_FORMAT.JSON, payload)
+        self.assert_same_exception(self.get_input, MySimpleIO, DATA_FORMAT.JSON, '')
+        self.assert_same_exception(self.get_input, MySimpleIO, DATA_FORMAT.XML,
+            fromstring('<request><cust_id>1</cust_id></request>'))
+
+        # Required elements can be missing if SimpleIO has a default value
+        value = self.assert_same_input(MySimpleIODefault, DATA_FORMAT.JSON, payload)
+        self.assertEqual(value['name'], 'my.default')
+
+    def test_input_invalid(self):
+        payload = dict(json_input)
+        payload['age'] = 'abc'
+
+        self.assert_same_exception(self.get_input, MySimpleIO, DATA_FORMAT.JSON, payload)
+
+# ################################################################################################################################
+
+    def test_output(self):
+
+        def set_payload(response):
+            response.payload.id = '1'
+            response.payload.name = 'Jane Doe'
+            response.payload.is_active = 'true'
+            response.payload.ref_id = b'000123'
+            response.payload.order_count = '10'
+
+        for data_format in (DATA_FORMAT.JSON, DATA_FORMAT.XML):
+            for sio in (MySimpleIO, MySimpleIOSkipEmpty, MySimpleIONamespace):
+                self.assert_same_output(sio, data_format, set_payload)
+
+        value = self.assert_same_output(MySimpleIOSkipEmpty, DATA_FORMAT.JSON, set_payload)
+
+        # Empty keys are skipped unless they are forced
+        self.assertDictEqual(value, {'response': {
+            'id': 1, 'name': 'Jane Doe', 'is_active': True, 'ref_id': '000123', 'order_count': 10, 'comment': ''}})
+
+        value = self.assert_same_output(MySimpleIONamespace, DATA_FORMAT.XML, set_payload)
+        self.assertEqual(etree.QName(fromstring(value)).namespace, 'https://example.com/ns')
+
+    def test_output_repeated(self):
+
+        def set_payload(response):
+            response.payload[:] = [
+                {'id': 1, 'name': 'Jane Doe', 'is_active': False, 'comment': ''},
+                {'id': '2', 'name': 'John Doe', 'is_active': 'true', 'order_count': 0},
+            ]
+
+        for data_format in (DATA_FORMAT.JSON, DATA_FORMAT.XML):
+            for sio in (MySimpleIO, MySimpleIOSkipEmpty):
+                self.assert_same_output(sio, data_format, set_payload)
+
+    def test_output_dict(self):
+
+        def set_payload(response):
+            response.payload = {'id': '1', 'name': 'Jane Doe', 'is_active': 'false', 'email': 'jane.doe@example.com'}
+
+        for data_format in (DATA_FORMAT.JSON, DATA_FORMAT.XML):
+            self.assert_same_output(MySimpleIO, data_format, set_payload)
+
+    def test_output_required_missing(self):
+
+        def set_payload(response):
+            response.payload.id = '1'
+
+        for data_format in (DATA_FORMAT.JSON, DATA_FORMAT.XML):
+            self.assert_same_exception(self.get_output, MySimpleIO, data_format, set_payload)
+
+# ################################################################################################################################
+
+    def test_payloads_independent(self):
+        sio_compiled = compile_sio(MySimpleIO, simple_io_config)
+
+        response1 = Response(logger, simple_io_config=simple_io_config)
+        response1.init(cid, MySimpleIO, DATA_FORMAT.JSON, sio_compiled)
+
+        response2 = Response(logger, simple_io_config=simple_io_config)
+        response2.init(cid, MySimpleIO, DATA_FORMAT.JSON, sio_compiled)
+
+        response1.payload.id = '1'
+        response1.payload.append({'id': 2})
+
+        self.assertEqual(response2.payload.id, '')
+        self.assertListEqual(response2.payload.zato_output, [])
+        self.assertFalse(response2.payload.zato_output_repeated)
+
+        # Attributes shared by all payloads cannot be changed by any of them
+        for name in ('zato_required', 'zato_optional', 'zato_all_attrs', 'zato_force_empty_keys', 'bool_parameter_prefixes',
+                'int_parameters', 'int_parameter_suffixes'):
+            self.assertIsInstance(getattr(response1.payload, name), (tuple, frozenset), name)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    unittest_main()
+
+# ################################################################################################################################
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from datetime import datetime
+from random import Random
+from unittest import main as unittest_main, TestCase
+
+# SciPy
+from scipy import stats as sp_stats
+
+# Zato
+from zato.common import KVDB
+from zato.common.util.json_ import dumps, loads
+from zato.server.stats import format_latency_metrics, LatencySketch, LatencyStats, merge_latency_stats, SampleStore, \
+     ServiceStats, TimeHistogram
+
+# ################################################################################################################################
+
+class Pipeline(object):
+    """ Records commands that ServiceStats runs against KVDB.
+    """
+    def __init__(self, needs_error=False):
+        self.commands = []
+        self.executed = False
+        self.needs_error = needs_error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ignored):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name,) + args)
+
+    def execute(self):
+        if self.needs_error:
+            raise IOError('Connection refused')
+        self.executed = True
+
+# ################################################################################################################################
+
+class KVDBConn(object):
+    def __init__(self):
+        self.pipelines = []
+        self.needs_error = False
+
+    def pipeline(self):
+        self.pipelines.append(Pipeline(self.needs_error))
+        return self.pipelines[-1]
+
+# ################################################################################################################################
+
+class KVDBStub(object):
+    def __init__(self):
+        self.conn = KVDBConn()
+
+# ################################################################################################################################
+
+class TimeHistogramTestCase(TestCase):
+
+    def test_get_stats_same_as_raw(self):
+        random = Random(1)
+        times = [random.randrange(256) for _ in range(1000)]
+
+        histogram = TimeHistogram()
+        for value in times:
+            histogram.record(value)
+
+        # Values below 256 ms are stored exactly so the results are the same as with a list of raw values
+        for mean_percentile in (0, 50, 90, 99, 100):
+            max_score = int(sp_stats.scoreatpercentile(times, mean_percentile))
+            min_, max_, mean, count = histogram.get_stats(mean_percentile)
+
+            self.assertEqual(min_, min(times))
+            self.assertEqual(max_, max(times))
+            self.assertAlmostEqual(mean, sp_stats.tmean(times, (None, max_score)))
+            self.assertEqual(count, len(times))
+
+    def test_precision(self):
+        histogram = TimeHistogram()
+
+        for value in (1000, 1001, 70000):
+            histogram.record(value)
+
+        self.assertDictEqual(histogram.buckets, {1000: 2, 69632: 1})
+
+        min_, max_, _, count = histogram.get_stats(100)
+        self.assertLess(abs(min_ - 1000) / 1000.0, 1 / 128.0)
+        self.assertLess(abs(max_ - 70000) / 70000.0, 1 / 128.0)
+        self.assertEqual(count, 3)
+
+    def test_from_kvdb(self):
+        histogram = TimeHistogram({'10': '2', '20': '1'})
+
+        self.assertDictEqual(histogram.buckets, {10: 2, 20: 1})
+        self.assertEqual(histogram.count, 3)
+        self.assertEqual(histogram.get_stats(100), (10, 20, 40 / 3.0, 3))
+
+    def test_empty(self):
+        self.assertEqual(TimeHistogram().get_stats(50), (0, 0, 0, 0))
+
+# ################################################################################################################################
+
+class ServiceStatsTestCase(TestCase):
+
+    def test_flush(self):
+        kvdb = KVDBStub()
+        service_stats = ServiceStats(kvdb)
+
+        self.assertEqual(service_stats.incr_usage('my.service'), 1)
+        self.assertEqual(service_stats.incr_usage('my.service'), 2)
+
+        service_stats.record('my.service', 10, datetime(2019, 10, 27, 1, 2, 3))
+        service_stats.record('my.service', 20, datetime(2019, 10, 27, 1, 3, 3))
+        service_stats.flush()
+
+        pipe, = kvdb.conn.pipelines
+        self.assertTrue(pipe.executed)
+        self.assertListEqual(sorted(pipe.commands), sorted([
+            ('incrby', KVDB.SERVICE_USAGE + 'my.service', 2),
+            ('hset', KVDB.SERVICE_TIME_BASIC + 'my.service', 'last', 20),
+            ('hincrby', KVDB.SERVICE_TIME_HIST + 'my.service', 10, 1),
+            ('hincrby', KVDB.SERVICE_TIME_HIST + 'my.service', 20, 1),
+            ('hincrby', KVDB.SERVICE_TIME_HIST_BY_MINUTE + 'my.service:2019:10:27:01:02', 10, 1),
+            ('expire', KVDB.SERVICE_TIME_HIST_BY_MINUTE + 'my.service:2019:10:27:01:02', 300),
+            ('hincrby', KVDB.SERVICE_TIME_HIST_BY_MINUTE + 'my.service:2019:10:27:01:03', 20, 1),
+            ('expire', KVDB.SERVICE_TIME_HIST_BY_MINUTE + 'my.service:2019:10:27:01:03', 300),
+        ]))
+
+        # Nothing new to flush so there is no round trip, but usage in this process is still kept
+        service_stats.flush()
+        self.assertEqual(len(kvdb.conn.pipelines), 1)
+        self.assertEqual(service_stats.incr_usage('my.service'), 3)
+
+    def test_flush_error(self):
+        kvdb = KVDBStub()
+        kvdb.conn.needs_error = True
+        service_stats = ServiceStats(kvdb)
+
+        service_stats.incr_usage('my.service')
+        service_stats.incr_usage('my.service2')
+        service_stats.record('my.service', 10, datetime(2019, 10, 27, 1, 2, 3))
+
+        self.assertRaises(IOError, service_stats.flush)
+
+        # More data is collected before the next flush
+        service_stats.incr_usage('my.service')
+        service_stats.record('my.service', 10, datetime(2019, 10, 27, 1, 2, 4))
+        service_stats.record('my.service', 30, datetime(2019, 10, 27, 1, 3, 3))
+
+        kvdb.conn.needs_error = False
+        service_stats.flush()
+
+        # Nothing from the failed flush is lost and nothing is written twice
+        pipe = kvdb.conn.pipelines[-1]
+        self.assertTrue(pipe.executed)
+        self.assertListEqual(sorted(pipe.commands), sorted([
+            ('incrby', KVDB.SERVICE_USAGE + 'my.service', 2),
+            ('incrby', KVDB.SERVICE_USAGE + 'my.service2', 1),
+            ('hset', KVDB.SERVICE_TIME_BASIC + 'my.service', 'last', 30),
+            ('hincrby', KVDB.SERVICE_TIME_HIST + 'my.service', 10, 2),
+            ('hincrby', KVDB.SERVICE_TIME_HIST + 'my.service', 30, 1),
+            ('hincrby', KVDB.SERVICE_TIME_HIST_BY_MINUTE + 'my.service:2019:10:27:01:02', 10, 2),
+            ('expire', KVDB.SERVICE_TIME_HIST_BY_MINUTE + 'my.service:2019:10:27:01:02', 300),
+            ('hincrby', KVDB.SERVICE_TIME_HIST_BY_MINUTE + 'my.service:2019:10:27:01:03', 30, 1),
+            ('expire', KVDB.SERVICE_TIME_HIST_BY_MINUTE + 'my.service:2019:10:27:01:03', 300),
+        ]))
+        self.assertDictEqual(service_stats.pending, {})
+
+    def test_stop_error(self):
+        kvdb = KVDBStub()
+        kvdb.conn.needs_error = True
+        service_stats = ServiceStats(kvdb)
+        service_stats.incr_usage('my.service')
+
+        # Shutting down goes on even if KVDB cannot be written to
+        service_stats.stop()
+        self.assertFalse(service_stats.keep_running)
+        self.assertEqual(service_stats.pending['my.service'].usage, 1)
+
+# ################################################################################################################################
+
+class Payload(object):
+    """ Stands for SimpleIOPayload, which is turned into a string only when a sample is flushed.
+    """
+    def __init__(self):
+        self.value = ''
+
+    def getvalue(self):
+        return self.value
+
+# ################################################################################################################################
+
+class SampleStoreTestCase(TestCase):
+
+    def test_needs_sample(self):
+        sample_store = SampleStore()
+
+        self.assertTrue(sample_store.needs_sample('my.service1', 1))
+
+        # Every fourth invocation of a service is sampled, each service is counted separately
+        needs_sample = [sample_store.needs_sample('my.service2', 4) for _ in range(8)]
+        self.assertListEqual(needs_sample, [False, False, False, True, False, False, False, True])
+        self.assertFalse(sample_store.needs_sample('my.service3', 4))
+
+    def test_flush(self):
+        kvdb = KVDBStub()
+        sample_store = SampleStore(kvdb)
+        req_ts = datetime(2019, 10, 27, 1, 2, 3)
+        resp_ts = datetime(2019, 10, 27, 1, 2, 4)
+
+        payload = Payload()
+        sample_store.add_sample('my.service', 'cid.1', '{"a":1}', payload, req_ts, resp_ts)
+        sample_store.add_slow_response('my.service', 'cid.2', None, iter([b'abc']), req_ts, resp_ts, 1000, 500)
+
+        # The response is produced after the sample was taken but before it is flushed
+        payload.value = '{"b":2}'
+        self.assertEqual(len(kvdb.conn.pipelines), 0)
+
+        sample_store.flush()
+
+        pipe, = kvdb.conn.pipelines
+        (hmset, key, sample), (lpush, slow_key, slow), (ltrim, _, _, _) = pipe.commands
+
+        self.assertEqual(hmset, 'hmset')
+        self.assertEqual(key, KVDB.REQ_RESP_SAMPLE + 'my.service')
+        self.assertDictEqual(sample, {
+            'cid': 'cid.1',
+            'req_ts': '2019-10-27T01:02:03',
+            'resp_ts': '2019-10-27T01:02:04',
+            'req': '{"a":1}',
+            'resp': '{"b":2}',
+        })
+
+        self.assertEqual(lpush, 'lpush')
+        self.assertEqual(ltrim, 'ltrim')
+        self.assertEqual(slow_key, KVDB.RESP_SLOW + 'my.service')
+
+        slow = loads(slow)
+        self.assertEqual(slow['cid'], 'cid.2')
+        self.assertEqual(slow['req'], '')
+        self.assertEqual(slow['proc_time'], 1000)
+        self.assertEqual(slow['slow_threshold'], 500)
+
+        # Streamed responses are not consumed
+        self.assertTrue(slow['resp'].startswith('<'))
+
+    def test_bounded(self):
+        kvdb = KVDBStub()
+        sample_store = SampleStore(kvdb, max_size=2)
+        now = datetime.utcnow()
+
+        for idx in range(3):
+            sample_store.add_sample('my.service', 'cid.{}'.format(idx), '', '', now, now)
+
+        self.assertEqual(sample_store.dropped, 1)
+
+        sample_store.flush()
+
+        pipe, = kvdb.conn.pipelines
+        self.assertListEqual([command[2]['cid'] for command in pipe.commands], ['cid.1', 'cid.2'])
+        self.assertEqual(sample_store.dropped, 0)
+
+    def test_flush_error(self):
+        kvdb = KVDBStub()
+        kvdb.conn.needs_error = True
+        sample_store = SampleStore(kvdb)
+        now = datetime.utcnow()
+
+        for idx in range(3):
+            sample_store.add_sample('my.service', 'cid.{}'.format(idx), '', '', now, now)
+
+        # Errors are not raised and lost samples are counted
+        sample_store.flush()
+        self.assertEqual(sample_store.lost, 3)
+
+        sample_store.add_sample('my.service', 'cid.3', '', '', now, now)
+        sample_store.stop()
+        self.assertEqual(sample_store.lost, 4)
+        self.assertEqual(len(sample_store.buffer), 0)
+
+# ################################################################################################################################
+
+class LatencyStatsTestCase(TestCase):
+
+    def test_rotate(self):
+        sketch = LatencySketch(0)
+
+        sketch.record(10, 1, 60)
+        sketch.record(20, 61, 60)
+        self.assertDictEqual(sketch.to_dict(61, 60), {'count': 2, 'sum': 30, 'buckets': {10: 1, 20: 1}})
+
+        # The first value is now older than two windows
+        self.assertDictEqual(sketch.to_dict(121, 60), {'count': 2, 'sum': 30, 'buckets': {20: 1}})
+
+        # Both of them are
+        self.assertDictEqual(sketch.to_dict(300, 60), {'count': 2, 'sum': 30, 'buckets': {}})
+
+    def test_merge(self):
+        stats1 = LatencyStats()
+        stats2 = LatencyStats()
+
+        for value in range(1, 51):
+            stats1.record('my.service', 'http_soap', 'my.channel', value)
+
+        for value in range(51, 101):
+            stats2.record('my.service', 'invoke', None, value)
+
+        # Data from each process goes through JSON when processes are invoked through IPC
+        merged = merge_latency_stats([loads(dumps(stats1.to_dict())), loads(dumps(stats2.to_dict()))])
+
+        service, = merged['services']
+        self.assertEqual(service['name'], 'my.service')
+        self.assertEqual(service['usage'], 100)
+        self.assertEqual(service['window_usage'], 100)
+        self.assertEqual(service['time'], 5050)
+        self.assertEqual(service['max'], 100)
+        self.assertAlmostEqual(service['p50'], 50.5)
+        self.assertAlmostEqual(service['p95'], 95.05)
+        self.assertAlmostEqual(service['p99'], 99.01)
+
+        channel, = merged['channels']
+        self.assertEqual(channel['type'], 'http_soap')
+        self.assertEqual(channel['name'], 'my.channel')
+        self.assertEqual(channel['usage'], 50)
+        self.assertEqual(channel['max'], 50)
+
+    def test_format_metrics(self):
+        stats = LatencyStats()
+        stats.record('my.service', 'http_soap', 'my "channel"', 10)
+
+        metrics = format_latency_metrics(merge_latency_stats([stats.to_dict()]))
+
+        self.assertIn('# TYPE zato_service_latency_ms summary', metrics)
+        self.assertIn('zato_service_latency_ms{service="my.service",quantile="0.99"} 10', metrics)
+        self.assertIn('zato_service_latency_ms_count{service="my.service"} 1', metrics)
+        self.assertIn('zato_channel_latency_ms_sum{channel_type="http_soap",channel="my \\"channel\\""} 10', metrics)
+        self.assertTrue(metrics.endswith('\n'))
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    unittest_main()
+
+# ################################################################################################################################
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (C) 2019, Zato Source s.r.o. https://zato.io
+
+Licensed under LGPLv3, see LICENSE.txt for terms and conditions.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# stdlib
+from unittest import main as unittest_main, TestCase
+
+# Zato
+from zato.server.service.store import ServiceStore
+
+# ################################################################################################################################
+
+class Response(object):
+    def __init__(self, payload=''):
+        self.payload = payload
+
+# ################################################################################################################################
+
+class MyService(object):
+    """ Has the attributes that ServiceStore needs to create and recycle instances.
+    """
+    name = 'my.service'
+    impl_name = 'my.module.MyService'
+    recycle_instances = True
+
+    def __init__(self):
+        self.response = Response()
+        self.reset_count = 0
+
+    def reset(self):
+        self.response = Response()
+        self.reset_count += 1
+
+# ################################################################################################################################
+
+class MyNonRecyclingService(MyService):
+    recycle_instances = False
+
+# ################################################################################################################################
+
+class InstancePoolTestCase(TestCase):
+
+    def get_store(self, service_class, instance_pool_size=2):
+        store = ServiceStore(services={})
+        store.instance_pool_size = instance_pool_size
+        store.services[service_class.impl_name] = {
+            'service_class': service_class,
+            'is_active': True,
+            'instance_pool': [],
+        }
+        return store
+
+    def test_recycled(self):
+        store = self.get_store(MyService)
+
+        service, is_active = store.new_instance(MyService.impl_name)
+        service.response.payload = 'abc'
+        store.release_instance(service)
+
+        # The same instance is returned, without any data from the previous invocation
+        service2, is_active = store.new_instance(MyService.impl_name)
+        self.assertIs(service2, service)
+        self.assertTrue(is_active)
+        self.assertEqual(service2.response.payload, '')
+        self.assertEqual(service2.reset_count, 1)
+
+        # The pool is empty now so a new instance is created
+        service3, _ = store.new_instance(MyService.impl_name)
+        self.assertIsNot(service3, service)
+
+    def test_not_recycled(self):
+        store = self.get_store(MyNonRecyclingService)
+
+        service, _ = store.new_instance(MyNonRecyclingService.impl_name)
+        store.release_instance(service)
+
+        self.assertListEqual(store.services[MyNonRecyclingService.impl_name]['instance_pool'], [])
+        self.assertEqual(service.reset_count, 0)
+        self.assertIsNot(store.new_instance(MyNonRecyclingService.impl_name)[0], service)
+
+    def test_pool_size(self):
+        store = self.get_store(MyService)
+
+        services = [store.new_instance(MyService.impl_name)[0] for _ in range(3)]
+        for service in services:
+            store.release_instance(service)
+
+        # Instances above the limit are left for the garbage collector
+        self.assertListEqual(store.services[MyService.impl_name]['instance_pool'], services[:2])
+        self.assertEqual(services[2].reset_count, 0)
+
+    def test_streamed_response(self):
+        store = self.get_store(MyService)
+
+        service, _ = store.new_instance(MyService.impl_name)
+        service.response.payload = iter(['a', 'b'])
+        store.release_instance(service)
+
+        self.assertListEqual(store.services[MyService.impl_name]['instance_pool'], [])
+
+    def test_redeployed(self):
+        store = self.get_store(MyService)
+        service, _ = store.new_instance(MyService.impl_name)
+
+        class MyRedeployedService(MyService):
+            pass
+
+        # Instances of a class that is no longer deployed are never reused
+        store.services[MyService.impl_name]['service_class'] = MyRedeployedService
+        store.release_instance(service)
+
+        self.assertListEqual(store.services[MyService.impl_name]['instance_pool'], [])
+
+        # The same if the service was deleted
+        del store.services[MyService.impl_name]
+        store.release_instance(service)
+
+# ################################################################################################################################
+
+if __name__ == '__main__':
+    unittest_main()
+
+# ################################################################################################################################
@@ -80,6 +80,8 @@ $.fn.zato.http_soap.data_table.new_row = function(item, data, include_tr) {
 
     var is_rate_limit_active = $.fn.zato.like_bool(data.is_rate_limit_active) == true;
     var rate_limit_check_parent_def = $.fn.zato.like_bool(data.rate_limit_check_parent_def) == true;
+    var cache_single_flight = $.fn.zato.like_bool(data.cache_single_flight) == true;
+    var request_streaming = $.fn.zato.like_bool(data.request_streaming) == true;
 
     var method_tr = '';
     var soap_action_tr = '';
@@ -212,12 +214,17 @@ $.fn.zato.http_soap.data_table.new_row = function(item, data, include_tr) {
         }
     }
 
-    /* 35,36,37,38 */
+    /* 35,36,37,38,39,40,41,42,43 */
     if(is_channel) {
         row += String.format("<td class='ignore'>{0}</td>", is_rate_limit_active);
         row += String.format("<td class='ignore'>{0}</td>", data.rate_limit_type);
         row += String.format("<td class='ignore'>{0}</td>", data.rate_limit_def);
         row += String.format("<td class='ignore'>{0}</td>", rate_limit_check_parent_def);
+        row += String.format("<td class='ignore'>{0}</td>", cache_single_flight);
+        row += String.format("<td class='ignore'>{0}</td>", data.cache_stale_while_revalidate || 0);
+        row += String.format("<td class='ignore'>{0}</td>", data.cache_key_components || '');
+        row += String.format("<td class='ignore'>{0}</td>", request_streaming);
+        row += String.format("<td class='ignore'>{0}</td>", data.request_spool_threshold || 0);
     }
 
     if(include_tr) {
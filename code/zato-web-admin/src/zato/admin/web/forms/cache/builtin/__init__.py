@@ -26,14 +26,19 @@ class CreateForm(forms.Form):
         initial=CACHE.DEFAULT.MAX_SIZE, widget=forms.TextInput(attrs={'class':'required', 'style':'width:15%'}))
     max_item_size = forms.CharField(
         initial=CACHE.DEFAULT.MAX_ITEM_SIZE, widget=forms.TextInput(attrs={'class':'required', 'style':'width:15%'}))
+    max_bytes = forms.CharField(initial=0, widget=forms.TextInput(attrs={'class':'required', 'style':'width:15%'}))
     extend_expiry_on_get = forms.BooleanField(required=False, widget=forms.CheckboxInput(attrs={'checked':'checked'}))
     extend_expiry_on_set = forms.BooleanField(required=False, widget=forms.CheckboxInput(attrs={'checked':'checked'}))
+    needs_key_index = forms.BooleanField(required=False, widget=forms.CheckboxInput())
+    use_shmem = forms.BooleanField(required=False, widget=forms.CheckboxInput())
+    eviction_policy = forms.ChoiceField(widget=forms.Select(attrs={'style':'width:30%'}))
     sync_method = forms.ChoiceField(widget=forms.Select(attrs={'style':'width:50%'}))
     persistent_storage = forms.ChoiceField(widget=forms.Select(attrs={'style':'width:50%'}))
     cache_id = forms.CharField(widget=forms.HiddenInput())
 
     def __init__(self, prefix=None, post_data=None, req=None):
         super(CreateForm, self).__init__(post_data, prefix=prefix)
+        add_select(self, 'eviction_policy', CACHE.EVICTION_POLICY(), needs_initial_select=False)
         add_select(self, 'sync_method', CACHE.SYNC_METHOD())
         add_select(self, 'persistent_storage', CACHE.PERSISTENT_STORAGE())
 
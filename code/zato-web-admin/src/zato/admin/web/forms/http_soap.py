@@ -16,6 +16,7 @@ from zato.admin.web.forms import add_security_select, add_select, add_services,
      DataFormatForm, INITIAL_CHOICES
 from zato.common import DEFAULT_HTTP_PING_METHOD, DEFAULT_HTTP_POOL_SIZE, HTTP_SOAP, HTTP_SOAP_SERIALIZATION_TYPE, \
      MISC, PARAMS_PRIORITY, RATE_LIMIT, SIMPLE_IO, SOAP_VERSIONS, URL_PARAMS_PRIORITY, ZATO_NONE
+from zato.common.util.http import default_cache_key_components
 
 # ################################################################################################################################
 
@@ -59,6 +60,12 @@ class CreateForm(DataFormatForm):
     transport = forms.CharField(widget=forms.HiddenInput())
     cache_id = forms.ChoiceField(widget=forms.Select())
     cache_expiry = forms.CharField(widget=forms.TextInput(attrs={'style':'width:20%'}), initial=0)
+    cache_single_flight = forms.BooleanField(required=False, widget=forms.CheckboxInput())
+    cache_stale_while_revalidate = forms.CharField(widget=forms.TextInput(attrs={'style':'width:10%'}), initial=0)
+    cache_key_components = forms.CharField(widget=forms.TextInput(attrs={'style':'width:100%'}),
+        initial=default_cache_key_components)
+    request_streaming = forms.BooleanField(required=False, widget=forms.CheckboxInput())
+    request_spool_threshold = forms.CharField(widget=forms.TextInput(attrs={'style':'width:10%'}), initial=0)
     content_encoding = forms.CharField(widget=forms.TextInput(attrs={'style':'width:20%'}))
     data_formats_allowed = SIMPLE_IO.HTTP_SOAP_FORMAT
     http_accept = forms.CharField(widget=forms.TextInput(attrs={'style':'width:100%'}), initial=HTTP_SOAP.ACCEPT.ANY)
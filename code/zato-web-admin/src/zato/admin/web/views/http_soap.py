@@ -93,6 +93,11 @@ def _get_edit_create_message(params, prefix=''):
         'rate_limit_type': params.get(prefix + 'rate_limit_type'),
         'rate_limit_def': params.get(prefix + 'rate_limit_def'),
         'rate_limit_check_parent_def': params.get(prefix + 'rate_limit_check_parent_def'),
+        'cache_single_flight': bool(params.get(prefix + 'cache_single_flight')),
+        'cache_stale_while_revalidate': params.get(prefix + 'cache_stale_while_revalidate'),
+        'cache_key_components': params.get(prefix + 'cache_key_components'),
+        'request_streaming': bool(params.get(prefix + 'request_streaming')),
+        'request_spool_threshold': params.get(prefix + 'request_spool_threshold'),
     }
 
 def _edit_create_response(req, id, verb, transport, connection, name):
@@ -221,7 +226,9 @@ def index(req):
                     cache_id=item.cache_id, cache_name=cache_name, cache_type=item.cache_type, cache_expiry=item.cache_expiry,
                     content_encoding=item.content_encoding, match_slash=match_slash, http_accept=http_accept)
 
-            for name in 'is_rate_limit_active', 'rate_limit_type', 'rate_limit_def', 'rate_limit_check_parent_def':
+            for name in 'is_rate_limit_active', 'rate_limit_type', 'rate_limit_def', 'rate_limit_check_parent_def', \
+                'cache_single_flight', 'cache_stale_while_revalidate', 'cache_key_components', 'request_streaming', \
+                'request_spool_threshold':
                 setattr(http_soap, name, item.get(name))
 
             items.append(http_soap)